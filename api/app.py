@@ -5,12 +5,23 @@ Provides endpoints for accessing property data and investment analysis.
 
 import os
 import logging
-from flask import Flask, jsonify, request, render_template, session
+import functools
+import itertools
+from flask import (Flask, jsonify, request, render_template, session, url_for, Response,
+                   stream_with_context, make_response)
 from flask_cors import CORS
 from api.models import Property, InvestmentOpportunity
 from api.services.property_service import PropertyService
-from api.services.analysis_service import AnalysisService
-from api.utils.db import get_db_connection
+from api.services.analysis_service import (AnalysisService, DEFAULT_ANALYSIS_WORKERS, DEFAULT_ANALYSIS_DEADLINE,
+                                           DEFAULT_BATCH_WORKERS, parse_analysis_batch)
+from api.services.map_tile_service import MapTileService
+from api.utils.db import get_db_connection, get_connection_manager
+from api.utils.indexes import ensure_indexes, check_query_plans
+from api.utils.geo import parse_geo_params
+from api.utils.cache import ResponseCache, DEFAULT_MAX_ENTRIES, DEFAULT_MAX_BYTES, DEFAULT_TTL
+from api.utils.data_version import DataVersionWatcher
+from api.utils.conditional import evaluate_conditional, finish_conditional
+from api.utils.http import wants_stream, next_page_headers, ndjson_line, NDJSON_MIMETYPE
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -20,12 +31,83 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET")
 
-# Enable CORS for all routes
-CORS(app)
+# Enable CORS for all routes, exposing the pagination headers
+CORS(app, expose_headers=['X-Next-Cursor', 'Link', 'ETag', 'Last-Modified'])
 
 # Initialize services
 property_service = PropertyService()
-analysis_service = AnalysisService()
+analysis_service = AnalysisService(
+    max_workers=int(os.environ.get('ANALYSIS_WORKERS', DEFAULT_ANALYSIS_WORKERS)),
+    deadline=float(os.environ.get('ANALYSIS_DEADLINE', DEFAULT_ANALYSIS_DEADLINE)),
+    batch_workers=int(os.environ.get('BATCH_ANALYSIS_WORKERS', DEFAULT_BATCH_WORKERS))
+)
+map_tile_service = MapTileService(property_service.db)
+
+# Cache read-only results until the scraper records a new data generation
+response_cache = ResponseCache(
+    property_service.db,
+    max_entries=int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL', DEFAULT_TTL))
+)
+
+# Data version of the properties collection, used for conditional requests
+data_version = DataVersionWatcher(property_service.db)
+
+# Create the indexes the service queries rely on, again if MongoDB only
+# becomes reachable after starting on the fake DB
+ensure_indexes(property_service.db)
+get_connection_manager().on_reconnect(lambda: ensure_indexes(property_service.db))
+
+# Optionally verify that no service query falls back to a collection scan
+if os.environ.get('CHECK_QUERY_PLANS', '').lower() in ('1', 'true', 'yes'):
+    check_query_plans(property_service.db)
+
+
+def conditional(view):
+    """
+    Support conditional GET requests on a read-only endpoint
+    
+    Responses carry a strong ETag derived from the data generation and the
+    requested URL and representation, and a Last-Modified date from the time
+    the generation was recorded. A request whose If-None-Match (or, without
+    it, If-Modified-Since) still matches is answered with 304 before the
+    view runs, so no query or serialization takes place.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag, last_modified, not_modified = evaluate_conditional(request, data_version.current())
+        response = Response(status=304) if not_modified else make_response(view(*args, **kwargs))
+        return finish_conditional(response, etag, last_modified, not_modified)
+    
+    return wrapper
+
+
+def paginated_response(items, next_cursor):
+    """Build a JSON list response with the continuation token for the next page"""
+    response = jsonify(items)
+    response.headers.update(next_page_headers(request, next_cursor, url_for))
+    return response
+
+
+def prefetch(documents):
+    """Start a generator so errors raised before the first document surface immediately"""
+    documents = iter(documents)
+    try:
+        first = next(documents)
+    except StopIteration:
+        return iter(())
+    
+    return itertools.chain([first], documents)
+
+
+def ndjson_response(documents):
+    """Stream documents as newline-delimited JSON as they are read from the database"""
+    def generate():
+        for document in documents:
+            yield ndjson_line(document)
+    
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
 
 
 @app.route('/')
@@ -39,6 +121,7 @@ def index():
 
 
 @app.route('/api/properties')
+@conditional
 def get_properties():
     """Get properties with optional filtering"""
     try:
@@ -52,6 +135,10 @@ def get_properties():
         min_size = request.args.get('min_size')
         max_size = request.args.get('max_size')
         min_rooms = request.args.get('min_rooms')
+        limit = request.args.get('limit', 100, type=int)
+        skip = request.args.get('skip', 0, type=int)
+        cursor = request.args.get('cursor')
+        geo_args = parse_geo_params(request.args)
         
         # Convert numeric parameters
         if min_price:
@@ -65,8 +152,28 @@ def get_properties():
         if min_rooms:
             min_rooms = int(min_rooms)
         
+        # Stream straight from the database cursor if requested (limit=0 streams everything)
+        if wants_stream(request):
+            properties = property_service.iter_properties(
+                city=city,
+                neighborhood=neighborhood,
+                min_price=min_price,
+                max_price=max_price,
+                property_type=property_type,
+                operation_type=operation_type,
+                min_size=min_size,
+                max_size=max_size,
+                min_rooms=min_rooms,
+                limit=limit,
+                page_cursor=cursor,
+                **geo_args
+            )
+            
+            # Pull the first document now so query errors are reported with a status code
+            return ndjson_response(prefetch(properties))
+        
         # Get properties from service
-        properties = property_service.get_properties(
+        properties, next_cursor = property_service.get_properties_page(
             city=city,
             neighborhood=neighborhood,
             min_price=min_price,
@@ -75,16 +182,23 @@ def get_properties():
             operation_type=operation_type,
             min_size=min_size,
             max_size=max_size,
-            min_rooms=min_rooms
+            min_rooms=min_rooms,
+            limit=limit,
+            skip=skip,
+            page_cursor=cursor,
+            **geo_args
         )
         
-        return jsonify(properties)
+        return paginated_response(properties, next_cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error in get_properties: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 
 @app.route('/api/properties/<property_id>')
+@conditional
 def get_property(property_id):
     """Get a specific property by ID"""
     try:
@@ -101,6 +215,7 @@ def get_property(property_id):
 
 
 @app.route('/api/properties/map')
+@conditional
 def get_properties_for_map():
     """Get properties with coordinates for map display"""
     try:
@@ -111,6 +226,8 @@ def get_properties_for_map():
         max_price = request.args.get('max_price')
         property_type = request.args.get('property_type')
         operation_type = request.args.get('operation_type')
+        limit = request.args.get('limit', 1000, type=int)
+        geo_args = parse_geo_params(request.args)
         
         # Convert numeric parameters
         if min_price:
@@ -118,6 +235,21 @@ def get_properties_for_map():
         if max_price:
             max_price = float(max_price)
         
+        # Stream straight from the database cursor if requested (limit=0 streams everything)
+        if wants_stream(request):
+            properties = property_service.iter_properties_with_coordinates(
+                city=city,
+                neighborhood=neighborhood,
+                min_price=min_price,
+                max_price=max_price,
+                property_type=property_type,
+                operation_type=operation_type,
+                limit=limit,
+                **geo_args
+            )
+            
+            return ndjson_response(prefetch(properties))
+        
         # Only get properties with coordinates
         properties = property_service.get_properties_with_coordinates(
             city=city,
@@ -125,20 +257,49 @@ def get_properties_for_map():
             min_price=min_price,
             max_price=max_price,
             property_type=property_type,
-            operation_type=operation_type
+            operation_type=operation_type,
+            limit=limit,
+            **geo_args
         )
         
         return jsonify(properties)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error in get_properties_for_map: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/properties/map/tiles/<int:z>/<int:x>/<int:y>')
+@conditional
+def get_map_tile(z, x, y):
+    """Get pre-aggregated property clusters for a map tile"""
+    try:
+        tile = map_tile_service.get_tile(
+            z, x, y,
+            city=request.args.get('city'),
+            property_type=request.args.get('property_type'),
+            operation_type=request.args.get('operation_type')
+        )
+        
+        response = jsonify(tile)
+        # Tiles served while a new data generation is indexed must not be revalidated against it
+        if tile.get('stale'):
+            response.headers['Cache-Control'] = 'no-store'
+        return response
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in get_map_tile: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/api/cities')
+@conditional
 def get_cities():
     """Get a list of all cities"""
     try:
-        cities = property_service.get_cities()
+        cities = response_cache.get_or_compute('cities', {}, property_service.get_cities)
         return jsonify(cities)
     except Exception as e:
         logger.error(f"Error in get_cities: {str(e)}")
@@ -146,14 +307,18 @@ def get_cities():
 
 
 @app.route('/api/neighborhoods')
+@conditional
 def get_neighborhoods():
     """Get neighborhoods for a city"""
     try:
         city = request.args.get('city')
         if not city:
             return jsonify({"error": "City parameter is required"}), 400
-            
-        neighborhoods = property_service.get_neighborhoods(city)
+        
+        neighborhoods = response_cache.get_or_compute(
+            'neighborhoods', {'city': city},
+            lambda: property_service.get_neighborhoods(city)
+        )
         return jsonify(neighborhoods)
     except Exception as e:
         logger.error(f"Error in get_neighborhoods: {str(e)}")
@@ -161,6 +326,7 @@ def get_neighborhoods():
 
 
 @app.route('/api/investment/opportunities')
+@conditional
 def get_investment_opportunities():
     """Get investment opportunities based on analysis"""
     try:
@@ -170,6 +336,8 @@ def get_investment_opportunities():
         min_score = request.args.get('min_score')
         property_type = request.args.get('property_type')
         operation_type = request.args.get('operation_type')
+        limit = request.args.get('limit', 50, type=int)
+        cursor = request.args.get('cursor')
         
         # Convert numeric parameters
         if min_score:
@@ -178,28 +346,47 @@ def get_investment_opportunities():
             min_score = 70  # Default to high score threshold
         
         # Get opportunities from service
-        opportunities = analysis_service.get_investment_opportunities(
-            city=city,
-            neighborhood=neighborhood,
-            min_score=min_score,
-            property_type=property_type,
-            operation_type=operation_type
+        params = {
+            'city': city,
+            'neighborhood': neighborhood,
+            'min_score': min_score,
+            'property_type': property_type,
+            'operation_type': operation_type,
+            'limit': limit,
+            'page_cursor': cursor
+        }
+        opportunities, next_cursor = response_cache.get_or_compute(
+            'investment_opportunities', params,
+            lambda: analysis_service.get_investment_opportunities_page(**params),
+            cache_if=lambda page: bool(page[0])
         )
         
-        return jsonify(opportunities)
+        return paginated_response(opportunities, next_cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error in get_investment_opportunities: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 
 @app.route('/api/investment/analysis/<property_id>')
+@conditional
 def get_property_analysis(property_id):
     """Get detailed investment analysis for a specific property"""
     try:
         source = request.args.get('source')
-        analysis = analysis_service.analyze_property(property_id, source)
+        analysis = response_cache.get_or_compute(
+            'property_analysis', {'property_id': property_id, 'source': source},
+            lambda: analysis_service.analyze_property(property_id, source),
+            # Analyses missing a lookup that timed out are recomputed on the next request
+            cache_if=lambda analysis: bool(analysis) and 'timed_out' not in analysis
+        )
         
-        if analysis:
+        if analysis and 'timed_out' in analysis:
+            response = jsonify(analysis)
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+        elif analysis:
             return jsonify(analysis)
         else:
             return jsonify({"error": "Property not found"}), 404
@@ -208,6 +395,41 @@ def get_property_analysis(property_id):
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/investment/analysis/batch', methods=['POST'])
+def get_batch_analysis():
+    """Get the investment analysis of a list of properties"""
+    try:
+        payload = request.get_json(silent=True)
+        pairs = parse_analysis_batch(payload)
+        analyses = analysis_service.iter_property_analyses(
+            pairs, include_similar=bool(payload.get('include_similar'))
+        )
+        
+        # Stream each chunk of analyses as soon as it is computed if requested
+        if wants_stream(request):
+            return ndjson_response(prefetch(analyses))
+        
+        return jsonify(list(analyses))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in get_batch_analysis: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/metrics')
+def get_metrics():
+    """Get runtime metrics of the API"""
+    try:
+        return jsonify({
+            'response_cache': response_cache.stats(),
+            'database': get_connection_manager().metrics()
+        })
+    except Exception as e:
+        logger.error(f"Error in get_metrics: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     """Handle 404 errors"""
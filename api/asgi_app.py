@@ -0,0 +1,364 @@
+"""
+ASGI application for the Real Estate Investment Analysis API.
+Serves the read-only JSON endpoints of api/app.py on an asyncio event loop,
+with Motor-backed services, so requests waiting on MongoDB don't hold a
+worker thread.
+"""
+
+import os
+import asyncio
+import logging
+import functools
+from quart import Quart, jsonify, request, url_for, Response
+from api.services.property_service import PropertyService
+from api.services.analysis_service import (AnalysisService, DEFAULT_ANALYSIS_WORKERS, DEFAULT_ANALYSIS_DEADLINE,
+                                           DEFAULT_BATCH_WORKERS, parse_analysis_batch)
+from api.services.map_tile_service import MapTileService
+from api.services.async_property_service import AsyncPropertyService
+from api.services.async_analysis_service import AsyncAnalysisService
+from api.utils.db import get_connection_manager
+from api.utils.async_db import get_async_db_connection
+from api.utils.indexes import ensure_indexes
+from api.utils.geo import parse_geo_params
+from api.utils.cache import ResponseCache, DEFAULT_MAX_ENTRIES, DEFAULT_MAX_BYTES, DEFAULT_TTL
+from api.utils.data_version import DataVersionWatcher
+from api.utils.conditional import evaluate_conditional, finish_conditional
+from api.utils.http import wants_stream, next_page_headers, ndjson_line, NDJSON_MIMETYPE
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Initialize Quart app
+app = Quart(__name__)
+
+# Synchronous services hold the in-memory indexes shared with the async services
+property_service = PropertyService()
+analysis_service = AnalysisService(
+    max_workers=int(os.environ.get('ANALYSIS_WORKERS', DEFAULT_ANALYSIS_WORKERS)),
+    deadline=float(os.environ.get('ANALYSIS_DEADLINE', DEFAULT_ANALYSIS_DEADLINE)),
+    batch_workers=int(os.environ.get('BATCH_ANALYSIS_WORKERS', DEFAULT_BATCH_WORKERS))
+)
+map_tile_service = MapTileService(property_service.db)
+
+# Async services are created on the serving event loop (see create_async_services)
+async_property_service = None
+async_analysis_service = None
+
+# Cache read-only results until the scraper records a new data generation
+response_cache = ResponseCache(
+    property_service.db,
+    max_entries=int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL', DEFAULT_TTL))
+)
+
+# Data version of the properties collection, used for conditional requests
+data_version = DataVersionWatcher(property_service.db)
+
+# Create the indexes the service queries rely on, again if MongoDB only
+# becomes reachable after starting on the fake DB
+ensure_indexes(property_service.db)
+get_connection_manager().on_reconnect(lambda: ensure_indexes(property_service.db))
+
+
+@app.before_serving
+async def create_async_services():
+    """Create the Motor-backed services on the serving event loop"""
+    global async_property_service, async_analysis_service
+    
+    db = get_async_db_connection()
+    async_property_service = AsyncPropertyService(db)
+    async_analysis_service = AsyncAnalysisService(db, analysis_service)
+
+
+@app.after_request
+async def add_cors_headers(response):
+    """Allow cross-origin requests, exposing the pagination and validator headers"""
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Expose-Headers'] = 'X-Next-Cursor, Link, ETag, Last-Modified'
+    return response
+
+
+def conditional(view):
+    """
+    Support conditional GET requests on a read-only endpoint
+    
+    A request whose validators still match the data generation is answered
+    with 304 before the view runs (see api/utils/conditional.py).
+    """
+    @functools.wraps(view)
+    async def wrapper(*args, **kwargs):
+        etag, last_modified, not_modified = evaluate_conditional(request, data_version.current())
+        if not_modified:
+            response = Response('', status=304)
+        else:
+            response = await app.make_response(await view(*args, **kwargs))
+        return finish_conditional(response, etag, last_modified, not_modified)
+    
+    return wrapper
+
+
+def paginated_response(items, next_cursor):
+    """Build a JSON list response with the continuation token for the next page"""
+    response = jsonify(items)
+    response.headers.update(next_page_headers(request, next_cursor, url_for))
+    return response
+
+
+async def prefetch(documents):
+    """Start an async generator so errors raised before the first document surface immediately"""
+    try:
+        first = await documents.__anext__()
+    except StopAsyncIteration:
+        first = None
+    
+    async def chained():
+        if first is None:
+            return
+        yield first
+        async for document in documents:
+            yield document
+    
+    return chained()
+
+
+def ndjson_response(documents):
+    """Stream documents as newline-delimited JSON as they are read from the database"""
+    async def generate():
+        async for document in documents:
+            yield ndjson_line(document).encode('utf-8')
+    
+    return Response(generate(), mimetype=NDJSON_MIMETYPE)
+
+
+def property_filters(with_size=True):
+    """Parse the property filter query parameters"""
+    filters = {
+        'city': request.args.get('city'),
+        'neighborhood': request.args.get('neighborhood'),
+        'min_price': request.args.get('min_price', type=float),
+        'max_price': request.args.get('max_price', type=float),
+        'property_type': request.args.get('property_type'),
+        'operation_type': request.args.get('operation_type')
+    }
+    
+    if with_size:
+        filters['min_size'] = request.args.get('min_size', type=float)
+        filters['max_size'] = request.args.get('max_size', type=float)
+        filters['min_rooms'] = request.args.get('min_rooms', type=int)
+    
+    filters.update(parse_geo_params(request.args))
+    return filters
+
+
+@app.route('/api/properties')
+@conditional
+async def get_properties():
+    """Get properties with optional filtering"""
+    try:
+        filters = property_filters()
+        limit = request.args.get('limit', 100, type=int)
+        skip = request.args.get('skip', 0, type=int)
+        cursor = request.args.get('cursor')
+        
+        # Stream straight from the database cursor if requested (limit=0 streams everything)
+        if wants_stream(request):
+            properties = async_property_service.iter_properties(limit=limit, page_cursor=cursor, **filters)
+            return ndjson_response(await prefetch(properties))
+        
+        properties, next_cursor = await async_property_service.get_properties_page(
+            limit=limit, skip=skip, page_cursor=cursor, **filters
+        )
+        
+        return paginated_response(properties, next_cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in get_properties: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/properties/<property_id>')
+@conditional
+async def get_property(property_id):
+    """Get a specific property by ID"""
+    try:
+        source = request.args.get('source')
+        property_data = await async_property_service.get_property_by_id(property_id, source)
+        
+        if property_data:
+            return jsonify(property_data)
+        else:
+            return jsonify({"error": "Property not found"}), 404
+    except Exception as e:
+        logger.error(f"Error in get_property: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/properties/map')
+@conditional
+async def get_properties_for_map():
+    """Get properties with coordinates for map display"""
+    try:
+        filters = property_filters(with_size=False)
+        limit = request.args.get('limit', 1000, type=int)
+        
+        if wants_stream(request):
+            properties = async_property_service.iter_properties_with_coordinates(limit=limit, **filters)
+            return ndjson_response(await prefetch(properties))
+        
+        properties = await async_property_service.get_properties_with_coordinates(limit=limit, **filters)
+        
+        return jsonify(properties)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in get_properties_for_map: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/properties/map/tiles/<int:z>/<int:x>/<int:y>')
+@conditional
+async def get_map_tile(z, x, y):
+    """Get pre-aggregated property clusters for a map tile"""
+    try:
+        # Served from the in-memory tile index, which may need to be (re)built
+        tile = await asyncio.to_thread(
+            map_tile_service.get_tile, z, x, y,
+            city=request.args.get('city'),
+            property_type=request.args.get('property_type'),
+            operation_type=request.args.get('operation_type')
+        )
+        
+        response = jsonify(tile)
+        # Tiles served while a new data generation is indexed must not be revalidated against it
+        if tile.get('stale'):
+            response.headers['Cache-Control'] = 'no-store'
+        return response
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in get_map_tile: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/cities')
+@conditional
+async def get_cities():
+    """Get a list of all cities"""
+    try:
+        cities = await response_cache.get_or_compute_async('cities', {}, async_property_service.get_cities)
+        return jsonify(cities)
+    except Exception as e:
+        logger.error(f"Error in get_cities: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/neighborhoods')
+@conditional
+async def get_neighborhoods():
+    """Get neighborhoods for a city"""
+    try:
+        city = request.args.get('city')
+        if not city:
+            return jsonify({"error": "City parameter is required"}), 400
+        
+        neighborhoods = await response_cache.get_or_compute_async(
+            'neighborhoods', {'city': city},
+            lambda: async_property_service.get_neighborhoods(city)
+        )
+        return jsonify(neighborhoods)
+    except Exception as e:
+        logger.error(f"Error in get_neighborhoods: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/investment/opportunities')
+@conditional
+async def get_investment_opportunities():
+    """Get investment opportunities based on analysis"""
+    try:
+        params = {
+            'city': request.args.get('city'),
+            'neighborhood': request.args.get('neighborhood'),
+            'min_score': request.args.get('min_score', 70, type=float),
+            'property_type': request.args.get('property_type'),
+            'operation_type': request.args.get('operation_type'),
+            'limit': request.args.get('limit', 50, type=int),
+            'page_cursor': request.args.get('cursor')
+        }
+        
+        opportunities, next_cursor = await response_cache.get_or_compute_async(
+            'investment_opportunities', params,
+            lambda: async_analysis_service.get_investment_opportunities_page(**params),
+            cache_if=lambda page: bool(page[0])
+        )
+        
+        return paginated_response(opportunities, next_cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in get_investment_opportunities: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/investment/analysis/<property_id>')
+@conditional
+async def get_property_analysis(property_id):
+    """Get detailed investment analysis for a specific property"""
+    try:
+        source = request.args.get('source')
+        analysis = await response_cache.get_or_compute_async(
+            'property_analysis', {'property_id': property_id, 'source': source},
+            lambda: async_analysis_service.analyze_property(property_id, source),
+            # Analyses missing a lookup that timed out are recomputed on the next request
+            cache_if=lambda analysis: bool(analysis) and 'timed_out' not in analysis
+        )
+        
+        if analysis and 'timed_out' in analysis:
+            response = jsonify(analysis)
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+        elif analysis:
+            return jsonify(analysis)
+        else:
+            return jsonify({"error": "Property not found"}), 404
+    except Exception as e:
+        logger.error(f"Error in get_property_analysis: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/investment/analysis/batch', methods=['POST'])
+async def get_batch_analysis():
+    """Get the investment analysis of a list of properties"""
+    try:
+        payload = await request.get_json(silent=True)
+        pairs = parse_analysis_batch(payload)
+        analyses = async_analysis_service.iter_property_analyses(
+            pairs, include_similar=bool(payload.get('include_similar'))
+        )
+        
+        # Stream each chunk of analyses as soon as it is computed if requested
+        if wants_stream(request):
+            return ndjson_response(await prefetch(analyses))
+        
+        return jsonify([analysis async for analysis in analyses])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in get_batch_analysis: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/metrics')
+async def get_metrics():
+    """Get runtime metrics of the API"""
+    try:
+        return jsonify({
+            'response_cache': response_cache.stats(),
+            'database': get_connection_manager().metrics()
+        })
+    except Exception as e:
+        logger.error(f"Error in get_metrics: {str(e)}")
+        return jsonify({"error": str(e)}), 500
@@ -2,30 +2,1234 @@
 Service for analyzing property data and identifying investment opportunities.
 """
 
+import time
 import logging
-from typing import List, Dict, Any, Optional, Tuple
-from bson.json_util import dumps, loads
-import json
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Optional, Tuple, Iterator, Set, Callable
 import numpy as np
+from pymongo import DESCENDING
+from pymongo.errors import OperationFailure
 from api.utils.db import get_db_connection
+from api.utils.encoding import encode_document
+from api.utils.pagination import apply_cursor, encode_cursor, check_page_size
+from api.utils.price_distribution import PriceDistribution
+from api.services.area_stats_service import AreaStatsService
+from api.services.columnar_service import ColumnarService, ColumnarSnapshot
+from api.services.similarity_service import SimilarityService, SIMILAR_PROJECTION
 
 logger = logging.getLogger(__name__)
 
+# Sort order for investment opportunities, ending with a unique field for pagination
+OPPORTUNITY_SORT = [('investment_score', DESCENDING), ('_id', DESCENDING)]
+
+# Fields needed to compute the area comparison facets in memory
+AREA_FACET_PROJECTION = {
+    'price_per_sqm': 1, 'days_listed': 1,
+    'property_type': 1, 'operation_type': 1
+}
+
+# Default number of threads shared by the sub-queries of concurrent property
+# analyses (0 runs the sub-queries one after another)
+DEFAULT_ANALYSIS_WORKERS = 8
+
+# Default time in seconds a property analysis waits for its sub-queries
+DEFAULT_ANALYSIS_DEADLINE = 5.0
+
+# Default number of threads shared by the area lookups of batch analyses, kept
+# apart from the sub-query threads so a large batch can't delay single
+# analyses past their deadline (0 runs the lookups one after another)
+DEFAULT_BATCH_WORKERS = 4
+
+# Maximum number of properties in a batch analysis request
+MAX_BATCH_SIZE = 2000
+
+# Number of properties fetched and analyzed together in a batch analysis
+BATCH_CHUNK_SIZE = 500
+
+# Result of each lookup of a property analysis when it fails or times out
+ANALYSIS_LOOKUP_DEFAULTS = {'area_data': ({}, None), 'rental_price': None, 'similar_properties': []}
+
+
+def parse_analysis_batch(payload: Any) -> List[Tuple[str, str]]:
+    """
+    Read the properties of a batch analysis request
+    
+    Args:
+        payload: Decoded JSON body, {"properties": [{"id": ..., "source": ...}, ...]}
+        
+    Returns:
+        Unique (property ID, source) pairs in request order
+        
+    Raises:
+        ValueError: If the body is malformed or lists too many properties
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('properties'), list):
+        raise ValueError("Request body must be a JSON object with a 'properties' list")
+    
+    pairs = []
+    for item in payload['properties']:
+        if not isinstance(item, dict) or not item.get('id') or not item.get('source'):
+            raise ValueError("Every property must be an object with 'id' and 'source'")
+        pairs.append((str(item['id']), str(item['source'])))
+    
+    pairs = list(dict.fromkeys(pairs))
+    if len(pairs) > MAX_BATCH_SIZE:
+        raise ValueError(f"A batch can analyze at most {MAX_BATCH_SIZE} properties")
+    
+    return pairs
+
+
+def _number_array(values) -> np.ndarray:
+    """Read values into a float array with NaN for missing or non-numeric values"""
+    return np.array([value if isinstance(value, (int, float)) else np.nan for value in values], dtype=float)
+
+
+def _truthy(values: np.ndarray) -> np.ndarray:
+    """Mask of the values that are present and non-zero"""
+    return np.isfinite(values) & (values != 0)
+
+
+def build_opportunity_filter(city=None, neighborhood=None, min_score=70,
+                             property_type=None, operation_type=None) -> Dict[str, Any]:
+    """
+    Build the query filter for investment opportunities
+    
+    Args:
+        city: Filter by city
+        neighborhood: Filter by neighborhood
+        min_score: Minimum investment score (0-100)
+        property_type: Type of property (apartment, house, etc.)
+        operation_type: Type of operation (sale, rent)
+        
+    Returns:
+        MongoDB query filter
+    """
+    query_filter = {
+        'investment_score': {'$exists': True, '$gte': min_score},
+        'price': {'$exists': True, '$ne': None},
+        'size': {'$exists': True, '$ne': None}
+    }
+    
+    if city:
+        query_filter['city'] = city
+    
+    if neighborhood:
+        query_filter['neighborhood'] = neighborhood
+    
+    if property_type:
+        query_filter['property_type'] = property_type
+    
+    if operation_type:
+        query_filter['operation_type'] = operation_type
+    
+    return query_filter
+
+
+def create_opportunity(property_dict: Dict[str, Any],
+                       area_price_table: Dict[Tuple, Tuple[float, int]]) -> Dict[str, Any]:
+    """
+    Create an investment opportunity object from a property dictionary
+    
+    Args:
+        property_dict: Property dictionary
+        area_price_table: Area price table covering the property's city and
+            operation type (see AnalysisService._build_area_price_table)
+            
+    Returns:
+        Investment opportunity dictionary
+    """
+    try:
+        # Basic property data
+        opportunity = {
+            'property_id': property_dict.get('id'),
+            'source': property_dict.get('source'),
+            'title': property_dict.get('title'),
+            'price': property_dict.get('price'),
+            'size': property_dict.get('size'),
+            'city': property_dict.get('city'),
+            'neighborhood': property_dict.get('neighborhood'),
+            'property_type': property_dict.get('property_type'),
+            'operation_type': property_dict.get('operation_type'),
+            'investment_score': property_dict.get('investment_score'),
+            'price_per_sqm': property_dict.get('price_per_sqm'),
+            'latitude': property_dict.get('latitude'),
+            'longitude': property_dict.get('longitude'),
+            'url': property_dict.get('url')
+        }
+        
+        # Get area average price per sqm
+        avg_price_per_sqm = lookup_area_avg_price_per_sqm(
+            area_price_table,
+            city=opportunity['city'],
+            neighborhood=opportunity['neighborhood'],
+            property_type=opportunity['property_type'],
+            operation_type=opportunity['operation_type']
+        )
+        
+        opportunity['avg_area_price_per_sqm'] = avg_price_per_sqm
+        
+        # Calculate price difference from area average
+        if opportunity['price_per_sqm'] and avg_price_per_sqm:
+            price_diff = ((avg_price_per_sqm - opportunity['price_per_sqm']) / avg_price_per_sqm) * 100
+            opportunity['price_difference'] = round(price_diff, 2)
+        
+        # Calculate estimated ROI (simple version)
+        if opportunity['operation_type'] == 'sale' and opportunity['price'] and avg_price_per_sqm:
+            # Estimate that price will eventually reach area average
+            estimated_future_price = opportunity['size'] * avg_price_per_sqm
+            
+            # Adjust if property needs renovation (estimated at 500€/m²)
+            renovation_cost = 0
+            if opportunity.get('condition') == 'needs_renovation':
+                renovation_cost = opportunity['size'] * 500
+            
+            # Calculate ROI
+            roi = ((estimated_future_price - opportunity['price'] - renovation_cost) / 
+                   (opportunity['price'] + renovation_cost)) * 100
+            opportunity['estimated_roi'] = round(roi, 2)
+        
+        # Get count of comparable properties
+        opportunity['comparable_count'] = len(property_dict.get('comparable_properties', []))
+        
+        return opportunity
+    except Exception as e:
+        logger.error(f"Error creating opportunity: {str(e)}")
+        # Return basic opportunity with error flag
+        return {
+            'property_id': property_dict.get('id'),
+            'source': property_dict.get('source'),
+            'title': property_dict.get('title'),
+            'price': property_dict.get('price'),
+            'investment_score': property_dict.get('investment_score'),
+            'error': str(e)
+        }
+
+
+def area_price_pipeline(cities, operation_types=None) -> List[Dict[str, Any]]:
+    """
+    Build the aggregation grouping price per square meter totals by area
+    
+    Args:
+        cities: Cities to include
+        operation_types: Operation types to include (optional). If any of
+            them is None, all operation types are included.
+            
+    Returns:
+        Aggregation pipeline
+    """
+    query_filter = {
+        'city': {'$in': list(cities)},
+        'price_per_sqm': {'$exists': True, '$ne': None}
+    }
+    
+    if operation_types and None not in operation_types:
+        query_filter['operation_type'] = {'$in': list(operation_types)}
+    
+    return [
+        {'$match': query_filter},
+        {'$group': {
+            '_id': {
+                'city': '$city',
+                'neighborhood': '$neighborhood',
+                'property_type': '$property_type',
+                'operation_type': '$operation_type'
+            },
+            'total_price_per_sqm': {'$sum': '$price_per_sqm'},
+            'count': {'$sum': 1}
+        }}
+    ]
+
+
+def area_price_table_from_groups(groups) -> Dict[Tuple, Tuple[float, int]]:
+    """
+    Roll up grouped price per square meter totals into the area price table
+    
+    Args:
+        groups: Result of the area_price_pipeline aggregation
+        
+    Returns:
+        Dictionary mapping area keys to (average price_per_sqm, count)
+    """
+    totals = {}
+    for group in groups:
+        group_id = group['_id']
+        city = group_id.get('city')
+        neighborhood = group_id.get('neighborhood') or None
+        property_type = group_id.get('property_type') or None
+        operation_type = group_id.get('operation_type') or None
+        
+        # Roll the group up into every level where a field is ignored
+        area_keys = {
+            (city, n, p, o)
+            for n in {neighborhood, None}
+            for p in {property_type, None}
+            for o in {operation_type, None}
+        }
+        
+        for area_key in area_keys:
+            total, count = totals.get(area_key, (0.0, 0))
+            totals[area_key] = (total + group['total_price_per_sqm'], count + group['count'])
+    
+    return {area_key: (total / count, count) for area_key, (total, count) in totals.items()}
+
+
+def lookup_area_avg_price_per_sqm(area_price_table: Dict[Tuple, Tuple[float, int]],
+                                  city: str, neighborhood: Optional[str] = None,
+                                  property_type: Optional[str] = None,
+                                  operation_type: Optional[str] = None) -> Optional[float]:
+    """
+    Look up the average price per square meter for an area in a precomputed table
+    
+    Args:
+        area_price_table: Table built by AnalysisService._build_area_price_table
+        city: The city
+        neighborhood: The neighborhood (optional)
+        property_type: Type of property (optional)
+        operation_type: Type of operation (optional)
+        
+    Returns:
+        Average price per square meter or None if not enough data
+    """
+    while True:
+        entry = area_price_table.get(
+            (city, neighborhood or None, property_type or None, operation_type or None)
+        )
+        
+        if not entry:
+            return None
+        
+        avg_price_per_sqm, count = entry
+        if count >= 5:  # Only use if we have enough data
+            return round(avg_price_per_sqm, 2)
+        
+        # Not enough data, widen the area
+        if neighborhood and property_type:
+            neighborhood = None
+        elif property_type:
+            neighborhood = None
+            property_type = None
+        else:
+            return None
+
+
+def rental_price_cities(property_dicts: List[Dict[str, Any]]) -> Set[str]:
+    """Cities whose rental prices are needed to estimate the rental yield of the properties for sale"""
+    return {p.get('city') for p in property_dicts
+            if p.get('operation_type') == 'sale' and p.get('price') and p.get('size')}
+
+
+def lookup_rental_price_per_sqm(area_price_table: Dict[Tuple, Tuple[float, int]],
+                                property_dict: Dict[str, Any]) -> Optional[float]:
+    """
+    Look up the rental price per square meter of a property in a precomputed table
+    
+    Args:
+        area_price_table: Table of rental prices built by
+            AnalysisService._build_area_price_table
+        property_dict: Property dictionary
+        
+    Returns:
+        Average monthly rent per square meter, or None (see AnalysisService._get_rental_price_per_sqm)
+    """
+    if property_dict.get('operation_type') != 'sale':
+        return None
+    if not property_dict.get('price') or not property_dict.get('size'):
+        return None
+    
+    return lookup_area_avg_price_per_sqm(
+        area_price_table,
+        city=property_dict.get('city'),
+        property_type=property_dict.get('property_type'),
+        operation_type='rent'
+    )
+
+
+def precomputed_area_price_table(columnar: ColumnarService,
+                                 area_stats: AreaStatsService) -> Optional[Dict[Tuple, Tuple[float, int]]]:
+    """
+    Get the area price table from the columnar snapshot or the precomputed area statistics
+    
+    The columnar snapshot is used when the scheduler has saved one, and the
+    precomputed area statistics when they have been built. Both cover every
+    city.
+    
+    Args:
+        columnar: Columnar snapshot service
+        area_stats: Area statistics service
+        
+    Returns:
+        Dictionary mapping area keys to (average price_per_sqm, count), or None
+        if neither has been built
+    """
+    if columnar.is_available():
+        return columnar.snapshot.price_table
+    
+    if area_stats.is_available():
+        return area_stats.price_table
+    
+    return None
+
+
+def precomputed_area_comparison(columnar: ColumnarService, area_stats: AreaStatsService,
+                                property_dict: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any],
+                                                                                 Optional[PriceDistribution]]]:
+    """
+    Get the area comparison of a property from the columnar snapshot or the precomputed area statistics
+    
+    The columnar snapshot is used when the scheduler has saved one, and the
+    precomputed area statistics when they have been built.
+    
+    Args:
+        columnar: Columnar snapshot service
+        area_stats: Area statistics service
+        property_dict: Property dictionary
+        
+    Returns:
+        Tuple of the area comparison data and the segment's price distribution
+        (see AnalysisService._get_area_comparison_data), or None if neither
+        has been built
+    """
+    if columnar.is_available():
+        return _area_comparison_from_snapshot(columnar.snapshot, *area_key(property_dict))
+    
+    if area_stats.is_available():
+        return _area_comparison_from_stats(area_stats, *area_key(property_dict))
+    
+    return None
+
+
+def _area_comparison_from_snapshot(snapshot: ColumnarSnapshot, city: str, neighborhood: Optional[str],
+                                   property_type: Optional[str],
+                                   operation_type: Optional[str]) -> Tuple[Dict[str, Any],
+                                                                           Optional[PriceDistribution]]:
+    """
+    Get comparison data for an area from the columnar snapshot
+    
+    Args:
+        snapshot: Columnar snapshot
+        city: The city
+        neighborhood: The neighborhood (optional)
+        property_type: Type of property (optional)
+        operation_type: Type of operation (optional)
+        
+    Returns:
+        Tuple of the area comparison data and the segment's price
+        distribution (see AnalysisService._get_area_comparison_data)
+    """
+    facets = snapshot.area_facets(city, neighborhood, property_type, operation_type)
+    distribution = snapshot.price_distribution(city, neighborhood, property_type, operation_type)
+    if not len(distribution):
+        distribution = None
+    return _format_area_data(city, neighborhood, facets, distribution), distribution
+
+
+def _area_comparison_from_stats(area_stats: AreaStatsService, city: str, neighborhood: Optional[str],
+                                property_type: Optional[str],
+                                operation_type: Optional[str]) -> Tuple[Dict[str, Any],
+                                                                        Optional[PriceDistribution]]:
+    """
+    Get comparison data for an area from the precomputed area statistics
+    
+    Args:
+        area_stats: Area statistics service
+        city: The city
+        neighborhood: The neighborhood (optional)
+        property_type: Type of property (optional)
+        operation_type: Type of operation (optional)
+        
+    Returns:
+        Tuple of the area comparison data and the segment's price
+        distribution (see AnalysisService._get_area_comparison_data)
+    """
+    segment_stats = area_stats.get_area_stats(city, neighborhood, property_type, operation_type) or {}
+    types_stats = area_stats.get_area_stats(city, neighborhood, None, operation_type) or {}
+    whole_area_stats = area_stats.get_area_stats(city, neighborhood) or {}
+    distribution = area_stats.get_price_distribution(city, neighborhood, property_type, operation_type)
+    
+    return {
+        'city': city,
+        'neighborhood': neighborhood,
+        'property_count': whole_area_stats.get('property_count', 0),
+        'price_per_sqm': segment_stats.get('price_per_sqm'),
+        'price_distribution': distribution.summary() if distribution is not None else None,
+        'time_on_market': segment_stats.get('time_on_market'),
+        'property_types': types_stats.get('property_types', [])
+    }, distribution
+
+
+def area_facet_query(property_dict: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Build the queries computing the area comparison of a property in the database
+    
+    Args:
+        property_dict: Property dictionary
+        
+    Returns:
+        Tuple of the query filter selecting the area's properties and the
+        aggregation computing the area comparison facets in a single pass
+    """
+    area_filter = {'city': property_dict.get('city')}
+    if property_dict.get('neighborhood'):
+        area_filter['neighborhood'] = property_dict.get('neighborhood')
+    
+    pipeline = _area_facet_pipeline(area_filter, property_dict.get('property_type'),
+                                    property_dict.get('operation_type'))
+    return area_filter, pipeline
+
+
+def facets_evaluated(facet_result: List[Dict[str, Any]]) -> bool:
+    """Check whether the database evaluated the $facet aggregation, which always returns one document"""
+    return bool(facet_result) and 'property_count' in facet_result[0]
+
+
+def _area_facet_pipeline(area_filter: Dict[str, Any], property_type: Optional[str],
+                         operation_type: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Build the aggregation computing the area comparison facets
+    
+    Args:
+        area_filter: Query filter selecting the area's properties
+        property_type: Type of property compared against
+        operation_type: Type of operation compared against
+        
+    Returns:
+        Aggregation pipeline returning a single document of facets
+    """
+    return [
+        {'$match': area_filter},
+        {'$facet': {
+            'property_count': [
+                {'$count': 'count'}
+            ],
+            'price_per_sqm': [
+                {'$match': {
+                    'price_per_sqm': {'$exists': True, '$ne': None},
+                    'property_type': property_type,
+                    'operation_type': operation_type
+                }},
+                {'$group': {
+                    '_id': None,
+                    'avg_price_per_sqm': {'$avg': '$price_per_sqm'},
+                    'min_price_per_sqm': {'$min': '$price_per_sqm'},
+                    'max_price_per_sqm': {'$max': '$price_per_sqm'},
+                    'count': {'$sum': 1}
+                }}
+            ],
+            'price_distribution': [
+                {'$match': {
+                    'price_per_sqm': {'$exists': True, '$ne': None},
+                    'property_type': property_type,
+                    'operation_type': operation_type
+                }},
+                {'$group': {
+                    '_id': None,
+                    'values': {'$push': '$price_per_sqm'}
+                }}
+            ],
+            'time_on_market': [
+                {'$match': {
+                    'days_listed': {'$exists': True, '$ne': None},
+                    'property_type': property_type,
+                    'operation_type': operation_type
+                }},
+                {'$group': {
+                    '_id': None,
+                    'avg_days_listed': {'$avg': '$days_listed'},
+                    'count': {'$sum': 1}
+                }}
+            ],
+            'property_types': [
+                {'$match': {
+                    'property_type': {'$exists': True, '$ne': None},
+                    'operation_type': operation_type
+                }},
+                {'$group': {
+                    '_id': '$property_type',
+                    'count': {'$sum': 1}
+                }},
+                {'$sort': {'count': -1}}
+            ]
+        }}
+    ]
+
+
+def compute_area_facets(documents: List[Dict[str, Any]], property_type: Optional[str],
+                        operation_type: Optional[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Compute the area comparison facets in one vectorized pass over the area's properties
+    
+    Used when the database does not support $facet. The result has the same
+    shape as the $facet aggregation in _get_area_comparison_data.
+    
+    Args:
+        documents: Properties in the area
+        property_type: Type of property to compare against
+        operation_type: Type of operation to compare against
+        
+    Returns:
+        Dictionary with property_count, price_per_sqm, price_distribution,
+        time_on_market and property_types facets
+    """
+    facets = {
+        'property_count': [{'count': len(documents)}] if documents else [],
+        'price_per_sqm': [],
+        'price_distribution': [],
+        'time_on_market': [],
+        'property_types': []
+    }
+    
+    if not documents:
+        return facets
+    
+    price_per_sqm = np.array([doc.get('price_per_sqm') for doc in documents], dtype=float)
+    days_listed = np.array([doc.get('days_listed') for doc in documents], dtype=float)
+    property_types = np.array([doc.get('property_type') for doc in documents], dtype=object)
+    operation_types = np.array([doc.get('operation_type') for doc in documents], dtype=object)
+    
+    same_operation = operation_types == operation_type
+    same_segment = same_operation & (property_types == property_type)
+    
+    price_mask = same_segment & ~np.isnan(price_per_sqm)
+    if price_mask.any():
+        values = price_per_sqm[price_mask]
+        facets['price_per_sqm'] = [{
+            '_id': None,
+            'avg_price_per_sqm': float(values.mean()),
+            'min_price_per_sqm': float(values.min()),
+            'max_price_per_sqm': float(values.max()),
+            'count': int(values.size)
+        }]
+        facets['price_distribution'] = [{'_id': None, 'values': values}]
+    
+    time_mask = same_segment & ~np.isnan(days_listed)
+    if time_mask.any():
+        values = days_listed[time_mask]
+        facets['time_on_market'] = [{
+            '_id': None,
+            'avg_days_listed': float(values.mean()),
+            'count': int(values.size)
+        }]
+    
+    type_mask = same_operation & np.not_equal(property_types, None)
+    if type_mask.any():
+        types, counts = np.unique(property_types[type_mask].astype(str), return_counts=True)
+        order = np.argsort(-counts, kind='stable')
+        facets['property_types'] = [
+            {'_id': str(types[i]), 'count': int(counts[i])} for i in order
+        ]
+    
+    return facets
+
+
+def area_comparison_from_facets(property_dict: Dict[str, Any],
+                                facets: Dict[str, List[Dict[str, Any]]]) -> Tuple[Dict[str, Any],
+                                                                                  Optional[PriceDistribution]]:
+    """
+    Build the area comparison of a property from the computed facets
+    
+    Args:
+        property_dict: Property dictionary
+        facets: Facets computed by the aggregation of area_facet_query or by
+            compute_area_facets
+            
+    Returns:
+        Tuple of the area comparison data and the segment's price
+        distribution (see AnalysisService._get_area_comparison_data)
+    """
+    distribution = _facet_price_distribution(facets)
+    area_data = _format_area_data(property_dict.get('city'), property_dict.get('neighborhood'),
+                                  facets, distribution)
+    return area_data, distribution
+
+
+def _facet_price_distribution(facets: Dict[str, List[Dict[str, Any]]]) -> Optional[PriceDistribution]:
+    """
+    Build the price distribution from the values collected by the price_distribution facet
+    
+    Args:
+        facets: Facets computed by _area_facet_pipeline or compute_area_facets
+        
+    Returns:
+        Price distribution, or None if the segment has no priced properties
+    """
+    distribution_result = facets.get('price_distribution')
+    if not distribution_result or not len(distribution_result[0]['values']):
+        return None
+    return PriceDistribution(np.asarray(distribution_result[0]['values'], dtype=float))
+
+
+def _format_area_data(city: str, neighborhood: Optional[str], facets: Dict[str, List[Dict[str, Any]]],
+                      distribution: Optional[PriceDistribution] = None) -> Dict[str, Any]:
+    """
+    Build the area comparison data from the computed facets
+    
+    Args:
+        city: The city
+        neighborhood: The neighborhood (optional)
+        facets: Facets computed by _area_facet_pipeline, compute_area_facets
+            or ColumnarSnapshot.area_facets
+        distribution: Price distribution of the compared segment (optional)
+        
+    Returns:
+        Dictionary with area comparison data
+    """
+    count_result = facets['property_count']
+    price_result = facets['price_per_sqm']
+    time_result = facets['time_on_market']
+    
+    return {
+        'city': city,
+        'neighborhood': neighborhood,
+        'property_count': count_result[0]['count'] if count_result else 0,
+        'price_per_sqm': price_result[0] if price_result else None,
+        'price_distribution': distribution.summary() if distribution is not None else None,
+        'time_on_market': time_result[0] if time_result else None,
+        'property_types': facets['property_types']
+    }
+
+
+def assemble_analysis(property_dict: Dict[str, Any], results: Dict[str, Any],
+                      timed_out: List[str]) -> Dict[str, Any]:
+    """
+    Put together the analysis of a property from the results of its lookups
+    
+    Args:
+        property_dict: Property dictionary
+        results: Result of each lookup named in ANALYSIS_LOOKUP_DEFAULTS
+        timed_out: Names of the lookups that didn't finish before the deadline
+        
+    Returns:
+        Dictionary with analysis results
+    """
+    area_data, price_distribution = results['area_data']
+    
+    analysis = {
+        'property': property_dict,
+        'area_data': area_data,
+        'price_insights': _calculate_price_insights(property_dict, area_data, price_distribution),
+        'investment_metrics': _calculate_investment_metrics(property_dict, area_data, results['rental_price']),
+        'similar_properties': results['similar_properties']
+    }
+    
+    if timed_out:
+        analysis['timed_out'] = timed_out
+    
+    return analysis
+
+
+def _calculate_price_insights(property_dict: Dict[str, Any], area_data: Dict[str, Any],
+                              price_distribution: Optional[PriceDistribution] = None) -> Dict[str, Any]:
+    """
+    Calculate price insights for a property
+    
+    Args:
+        property_dict: Property dictionary
+        area_data: Area comparison data
+        price_distribution: Price distribution of the property's segment
+            (optional, the percentile and rank are left out if not given)
+            
+    Returns:
+        Dictionary with price insights
+    """
+    try:
+        price_insights = {}
+        
+        # Get property data
+        size = property_dict.get('size')
+        price_per_sqm = property_dict.get('price_per_sqm')
+        
+        # Get area data
+        area_price_data = area_data.get('price_per_sqm', {})
+        if area_price_data:
+            avg_price_per_sqm = area_price_data.get('avg_price_per_sqm')
+            
+            if avg_price_per_sqm and price_per_sqm:
+                # Calculate price difference from area average
+                price_diff = ((avg_price_per_sqm - price_per_sqm) / avg_price_per_sqm) * 100
+                price_insights['price_difference'] = round(price_diff, 2)
+                price_insights['price_difference_label'] = (
+                    'below average' if price_diff > 0 else 'above average'
+                )
+                
+                # Rank the property among the listings of its segment
+                if price_distribution is not None and len(price_distribution):
+                    below, _ = price_distribution.rank(price_per_sqm)
+                    price_insights['price_percentile'] = round(price_distribution.percentile(price_per_sqm), 2)
+                    price_insights['price_rank'] = below + 1
+                    price_insights['price_rank_total'] = len(price_distribution)
+        
+        # Calculate price history insights if available
+        price_insights.update(_calculate_price_history_insights(property_dict))
+        
+        return price_insights
+    except Exception as e:
+        logger.error(f"Error calculating price insights: {str(e)}")
+        return {}
+
+
+def _calculate_price_history_insights(property_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Calculate how the price of a property has changed since it was first listed
+    
+    Args:
+        property_dict: Property dictionary
+        
+    Returns:
+        Dictionary with the price change and the number of recorded prices,
+        empty if there is no price history
+    """
+    price_insights = {}
+    price = property_dict.get('price')
+    
+    price_history = property_dict.get('price_history', [])
+    if price_history and price:
+        # Sort by date
+        price_history.sort(key=lambda x: x.get('date', ''))
+        
+        # Calculate price changes
+        initial_price = price_history[0].get('price') if price_history else price
+        price_change = ((price - initial_price) / initial_price) * 100 if initial_price else 0
+        price_insights['price_change'] = round(price_change, 2)
+        
+        # Calculate price change frequency
+        if len(price_history) > 1:
+            price_insights['price_changes_count'] = len(price_history)
+    
+    return price_insights
+
+
+def _calculate_investment_metrics(property_dict: Dict[str, Any],
+                                  area_data: Dict[str, Any],
+                                  rental_price_per_sqm: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Calculate investment metrics for a property
+    
+    Args:
+        property_dict: Property dictionary
+        area_data: Area comparison data
+        rental_price_per_sqm: Average rental price per square meter for the
+            property's city and type (see AnalysisService._get_rental_price_per_sqm)
+            
+    Returns:
+        Dictionary with investment metrics
+    """
+    try:
+        metrics = {}
+        
+        # Get property data
+        price = property_dict.get('price')
+        size = property_dict.get('size')
+        price_per_sqm = property_dict.get('price_per_sqm')
+        investment_score = property_dict.get('investment_score')
+        operation_type = property_dict.get('operation_type')
+        condition = property_dict.get('condition')
+        
+        # Basic metrics
+        metrics['investment_score'] = investment_score
+        
+        # Get area data
+        area_price_data = area_data.get('price_per_sqm', {})
+        area_time_data = area_data.get('time_on_market', {})
+        
+        if area_price_data and price and size and operation_type == 'sale':
+            avg_price_per_sqm = area_price_data.get('avg_price_per_sqm')
+            
+            # Calculate potential value after renovation
+            if condition == 'needs_renovation':
+                renovation_cost_per_sqm = 500  # Estimated renovation cost per sqm
+                renovation_cost = size * renovation_cost_per_sqm
+                
+                # Estimate market value after renovation
+                market_value = size * avg_price_per_sqm
+                
+                # Calculate ROI for renovation
+                if market_value > (price + renovation_cost):
+                    renovation_roi = ((market_value - price - renovation_cost) / 
+                                     (price + renovation_cost)) * 100
+                    metrics['renovation_roi'] = round(renovation_roi, 2)
+                    metrics['renovation_cost'] = renovation_cost
+                    metrics['estimated_market_value'] = market_value
+            
+            # Calculate general investment metrics
+            if avg_price_per_sqm:
+                # Estimate market value based on area average
+                market_value = size * avg_price_per_sqm
+                
+                # Price to market value ratio (lower is better)
+                price_to_value = price / market_value if market_value > 0 else 1
+                metrics['price_to_value_ratio'] = round(price_to_value, 2)
+                
+                # Potential appreciation
+                if price < market_value:
+                    potential_appreciation = ((market_value - price) / price) * 100
+                    metrics['potential_appreciation'] = round(potential_appreciation, 2)
+        
+        # Rental yield calculation (if operation_type is sale)
+        if operation_type == 'sale' and price and size:
+            # Estimate monthly rental price based on city averages
+            # This is a simplified calculation and should be refined with real data
+            if rental_price_per_sqm:
+                # Estimate monthly rental income
+                monthly_rent = size * rental_price_per_sqm
+                annual_rent = monthly_rent * 12
+                
+                # Calculate gross rental yield
+                rental_yield = (annual_rent / price) * 100
+                metrics['estimated_monthly_rent'] = round(monthly_rent, 2)
+                metrics['estimated_rental_yield'] = round(rental_yield, 2)
+        
+        # Liquidity metric based on average time on market
+        if area_time_data:
+            avg_days_listed = area_time_data.get('avg_days_listed')
+            if avg_days_listed:
+                # Liquidity score (0-100, higher is more liquid)
+                liquidity_score = 100 * (1 - min(1, avg_days_listed / 180))
+                metrics['liquidity_score'] = round(liquidity_score, 2)
+                metrics['avg_days_on_market'] = round(avg_days_listed, 2)
+        
+        return metrics
+    except Exception as e:
+        logger.error(f"Error calculating investment metrics: {str(e)}")
+        return {}
+
+
+def batch_filter(pairs: List[Tuple[str, str]]) -> Dict[str, Any]:
+    """
+    Build the query fetching the properties of a batch
+    
+    Args:
+        pairs: (property ID, source) pairs to fetch
+        
+    Returns:
+        Query filter matching at least those properties
+    """
+    return {
+        'id': {'$in': list({property_id for property_id, _ in pairs})},
+        'source': {'$in': list({source for _, source in pairs})}
+    }
+
+
+def match_batch(pairs: List[Tuple[str, str]], documents) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """
+    Pick the requested properties out of the documents fetched for a batch
+    
+    Args:
+        pairs: (property ID, source) pairs requested
+        documents: Documents matched by batch_filter
+        
+    Returns:
+        Dictionary mapping the pairs that were found to property dictionaries
+    """
+    wanted = set(pairs)
+    
+    property_dicts = {}
+    for document in documents:
+        pair = (document.get('id'), document.get('source'))
+        if pair in wanted and pair not in property_dicts:
+            property_dicts[pair] = encode_document(document)
+    
+    return property_dicts
+
+
+def area_key(property_dict: Dict[str, Any]) -> Tuple:
+    """Fields the area comparison data of a property depends on"""
+    return (property_dict.get('city'), property_dict.get('neighborhood'),
+            property_dict.get('property_type'), property_dict.get('operation_type'))
+
+
+def new_batch_areas(property_dicts: List[Dict[str, Any]],
+                    comparisons_by_key: Dict[Tuple, Tuple]) -> Dict[Tuple, Dict[str, Any]]:
+    """
+    Find the areas of a batch whose comparison data hasn't been looked up yet
+    
+    Args:
+        property_dicts: Property dictionaries
+        comparisons_by_key: Result of _get_area_comparison_data for the
+            areas already looked up, by area key
+            
+    Returns:
+        Dictionary mapping each new area key to a property in that area
+    """
+    new_areas = {}
+    for property_dict in property_dicts:
+        key = area_key(property_dict)
+        if key not in comparisons_by_key:
+            new_areas.setdefault(key, property_dict)
+    return new_areas
+
+
+def similar_batch_filter(neighbors: List[Tuple[List[Any], List[float]]]) -> Dict[str, Any]:
+    """
+    Build the query fetching the similar properties of a batch
+    
+    Args:
+        neighbors: Result of SimilarityService.find_similar for each property
+        
+    Returns:
+        Query filter matching every similar property
+    """
+    return {'_id': {'$in': list({object_id for object_ids, _ in neighbors for object_id in object_ids})}}
+
+
+def format_batch_similar(similarity: SimilarityService, neighbors: List[Tuple[List[Any], List[float]]],
+                         documents) -> List[List[Dict[str, Any]]]:
+    """
+    Format the similar properties of each property in a batch
+    
+    Args:
+        similarity: Similarity service that found the neighbors
+        neighbors: Result of SimilarityService.find_similar for each property
+        documents: Documents matched by similar_batch_filter
+        
+    Returns:
+        List of similar properties of each property, most similar first
+    """
+    documents = {doc['_id']: doc for doc in documents}
+    
+    return [
+        similarity.format_similar([documents[i] for i in object_ids if i in documents], object_ids, distances)
+        for object_ids, distances in neighbors
+    ]
+
+
+def analyze_batch(pairs: List[Tuple[str, str]], property_dicts: Dict[Tuple[str, str], Dict[str, Any]],
+                  comparisons_by_key: Dict[Tuple, Tuple], rental_price_table: Dict[Tuple, Tuple[float, int]],
+                  similar_properties: Optional[List[List[Dict[str, Any]]]] = None) -> List[Dict[str, Any]]:
+    """
+    Analyze a chunk of a batch once its lookups are done
+    
+    Args:
+        pairs: (property ID, source) pairs requested
+        property_dicts: Properties found, by pair (see match_batch)
+        comparisons_by_key: Result of AnalysisService._get_area_comparison_data
+            for the area of every property found, by area key
+        rental_price_table: Table of rental prices in the cities given by
+            rental_price_cities
+        similar_properties: Similar properties of each property found
+            (optional, left out of the analyses if not given)
+            
+    Returns:
+        List of analyses in request order, shaped like assemble_analysis, with
+        an error entry for the properties not found
+    """
+    found = list(property_dicts.values())
+    comparisons = [comparisons_by_key[area_key(property_dict)] for property_dict in found]
+    area_data = [data for data, _ in comparisons]
+    price_distributions = [distribution for _, distribution in comparisons]
+    rental_prices = [lookup_rental_price_per_sqm(rental_price_table, property_dict) for property_dict in found]
+    
+    price_insights, investment_metrics = _calculate_batch_insights(found, area_data, price_distributions,
+                                                                   rental_prices)
+    
+    return _assemble_batch(pairs, property_dicts, area_data, price_insights, investment_metrics,
+                           similar_properties)
+
+
+def _calculate_batch_insights(property_dicts: List[Dict[str, Any]], area_data: List[Dict[str, Any]],
+                              price_distributions: List[Optional[PriceDistribution]],
+                              rental_prices: List[Optional[float]]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Calculate the price insights and investment metrics of a batch of properties
+    
+    Gives the same results as _calculate_price_insights and
+    _calculate_investment_metrics for each property, with the arithmetic
+    done on arrays over the batch and the percentile ranks found with one
+    binary search per segment.
+    
+    Args:
+        property_dicts: Property dictionaries
+        area_data: Area comparison data of each property
+        price_distributions: Price distribution of the segment of each
+            property (see AnalysisService._get_area_comparison_data)
+        rental_prices: Rental price per square meter of each property (see
+            lookup_rental_price_per_sqm)
+            
+    Returns:
+        Tuple of the list of price insights and the list of investment metrics
+    """
+    area_prices = [data.get('price_per_sqm') or {} for data in area_data]
+    area_times = [data.get('time_on_market') or {} for data in area_data]
+    
+    price = _number_array([p.get('price') for p in property_dicts])
+    size = _number_array([p.get('size') for p in property_dicts])
+    price_per_sqm = _number_array([p.get('price_per_sqm') for p in property_dicts])
+    avg_price_per_sqm = _number_array([a.get('avg_price_per_sqm') for a in area_prices])
+    avg_days_listed = _number_array([a.get('avg_days_listed') for a in area_times])
+    rental_price_per_sqm = _number_array(rental_prices)
+    is_sale = np.array([p.get('operation_type') == 'sale' for p in property_dicts], dtype=bool)
+    needs_renovation = np.array([p.get('condition') == 'needs_renovation' for p in property_dicts], dtype=bool)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Price insights
+        compared = _truthy(avg_price_per_sqm) & _truthy(price_per_sqm)
+        price_difference = ((avg_price_per_sqm - price_per_sqm) / avg_price_per_sqm) * 100
+        ranked = np.zeros(len(property_dicts), dtype=bool)
+        below = np.zeros(len(property_dicts), dtype=int)
+        ranks_total = np.zeros(len(property_dicts), dtype=int)
+        percentile = np.full(len(property_dicts), np.nan)
+        
+        segments = {}
+        for row in np.nonzero(compared)[0]:
+            segments.setdefault(area_key(property_dicts[row]), []).append(row)
+        for rows in segments.values():
+            distribution = price_distributions[rows[0]]
+            if distribution is None or not len(distribution):
+                continue
+            rows = np.array(rows)
+            values = price_per_sqm[rows]
+            lower = np.searchsorted(distribution.values, values, side='left')
+            upper = np.searchsorted(distribution.values, values, side='right')
+            ranked[rows] = True
+            below[rows] = lower
+            ranks_total[rows] = len(distribution)
+            percentile[rows] = (lower + (upper - lower) / 2) / len(distribution) * 100
+        
+        # Investment metrics
+        valued = np.array([bool(a) for a in area_prices], dtype=bool) & _truthy(price) & _truthy(size) & is_sale
+        market_value = size * avg_price_per_sqm
+        renovation_cost = size * 500
+        renovation_roi = ((market_value - price - renovation_cost) / (price + renovation_cost)) * 100
+        renovated = valued & needs_renovation & (market_value > price + renovation_cost)
+        appraised = valued & _truthy(avg_price_per_sqm)
+        price_to_value = np.where(market_value > 0, price / market_value, 1)
+        potential_appreciation = ((market_value - price) / price) * 100
+        monthly_rent = size * rental_price_per_sqm
+        rental_yield = ((monthly_rent * 12) / price) * 100
+        rented = is_sale & _truthy(price) & _truthy(size) & _truthy(rental_price_per_sqm)
+        liquidity_score = 100 * (1 - np.minimum(1, avg_days_listed / 180))
+        liquid = _truthy(avg_days_listed)
+    
+    all_price_insights = []
+    all_investment_metrics = []
+    for row, property_dict in enumerate(property_dicts):
+        price_insights = {}
+        if compared[row]:
+            price_insights['price_difference'] = round(float(price_difference[row]), 2)
+            price_insights['price_difference_label'] = (
+                'below average' if price_difference[row] > 0 else 'above average'
+            )
+            if ranked[row]:
+                price_insights['price_percentile'] = round(float(percentile[row]), 2)
+                price_insights['price_rank'] = int(below[row]) + 1
+                price_insights['price_rank_total'] = int(ranks_total[row])
+        price_insights.update(_calculate_price_history_insights(property_dict))
+        all_price_insights.append(price_insights)
+        
+        metrics = {'investment_score': property_dict.get('investment_score')}
+        if renovated[row]:
+            metrics['renovation_roi'] = round(float(renovation_roi[row]), 2)
+            metrics['renovation_cost'] = property_dict.get('size') * 500
+            metrics['estimated_market_value'] = float(market_value[row])
+        if appraised[row]:
+            metrics['price_to_value_ratio'] = round(float(price_to_value[row]), 2)
+            if price[row] < market_value[row]:
+                metrics['potential_appreciation'] = round(float(potential_appreciation[row]), 2)
+        if rented[row]:
+            metrics['estimated_monthly_rent'] = round(float(monthly_rent[row]), 2)
+            metrics['estimated_rental_yield'] = round(float(rental_yield[row]), 2)
+        if liquid[row]:
+            metrics['liquidity_score'] = round(float(liquidity_score[row]), 2)
+            metrics['avg_days_on_market'] = round(float(avg_days_listed[row]), 2)
+        all_investment_metrics.append(metrics)
+    
+    return all_price_insights, all_investment_metrics
+
+
+def _assemble_batch(pairs: List[Tuple[str, str]], property_dicts: Dict[Tuple[str, str], Dict[str, Any]],
+                    area_data: List[Dict[str, Any]], price_insights: List[Dict[str, Any]],
+                    investment_metrics: List[Dict[str, Any]],
+                    similar_properties: Optional[List[List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+    """
+    Put together the analyses of a batch in request order
+    
+    Args:
+        pairs: (property ID, source) pairs requested
+        property_dicts: Properties found, by pair
+        area_data: Area comparison data of each property found
+        price_insights: Price insights of each property found
+        investment_metrics: Investment metrics of each property found
+        similar_properties: Similar properties of each property found
+            (optional, left out of the analyses if not given)
+            
+    Returns:
+        List of analyses, with an error entry for the properties not found
+    """
+    analyses = {}
+    for row, (pair, property_dict) in enumerate(property_dicts.items()):
+        analysis = {
+            'property': property_dict,
+            'area_data': area_data[row],
+            'price_insights': price_insights[row],
+            'investment_metrics': investment_metrics[row]
+        }
+        if similar_properties is not None:
+            analysis['similar_properties'] = similar_properties[row]
+        analyses[pair] = analysis
+    
+    return [
+        analyses.get(pair) or {'property_id': pair[0], 'source': pair[1], 'error': 'Property not found'}
+        for pair in pairs
+    ]
+
 
 class AnalysisService:
     """Service for analyzing property data and identifying investment opportunities"""
     
-    def __init__(self):
-        """Initialize the analysis service"""
+    def __init__(self, max_workers: int = DEFAULT_ANALYSIS_WORKERS,
+                 deadline: float = DEFAULT_ANALYSIS_DEADLINE,
+                 batch_workers: int = DEFAULT_BATCH_WORKERS):
+        """
+        Initialize the analysis service
+        
+        Args:
+            max_workers: Number of threads shared by the sub-queries of property
+                analyses (0 runs them one after another in the calling thread)
+            deadline: Time in seconds a property analysis waits for its sub-queries
+            batch_workers: Number of threads shared by the area lookups of batch
+                analyses (0 runs them one after another in the calling thread)
+        """
         self.db = get_db_connection()
         self.collection = self.db['properties']
+        self.area_stats = AreaStatsService(self.db)
+        self.columnar = ColumnarService(self.db)
+        self.similarity = SimilarityService(self.db)
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis') \
+            if max_workers > 0 else None
+        self.batch_workers = batch_workers
+        self.batch_executor = ThreadPoolExecutor(max_workers=batch_workers, thread_name_prefix='analysis-batch') \
+            if batch_workers > 0 else None
     
     def get_investment_opportunities(self, city=None, neighborhood=None, min_score=70,
                                     property_type=None, operation_type=None,
-                                    limit=50) -> List[Dict[str, Any]]:
+                                    limit=50, page_cursor=None) -> List[Dict[str, Any]]:
         """
         Get investment opportunities based on analysis
         
+        Args:
+            See get_investment_opportunities_page
+            
+        Returns:
+            List of investment opportunities
+        """
+        opportunities, _ = self.get_investment_opportunities_page(
+            city=city,
+            neighborhood=neighborhood,
+            min_score=min_score,
+            property_type=property_type,
+            operation_type=operation_type,
+            limit=limit,
+            page_cursor=page_cursor
+        )
+        
+        return opportunities
+    
+    def get_investment_opportunities_page(self, city=None, neighborhood=None, min_score=70,
+                                          property_type=None, operation_type=None, limit=50,
+                                          page_cursor=None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Get a page of investment opportunities based on analysis
+        
         Args:
             city: Filter by city
             neighborhood: Filter by neighborhood
@@ -33,62 +1237,84 @@ class AnalysisService:
             property_type: Type of property (apartment, house, etc.)
             operation_type: Type of operation (sale, rent)
             limit: Maximum number of properties to return
+            page_cursor: Continuation token returned with the previous page (optional)
             
         Returns:
-            List of investment opportunities
+            Tuple of the list of investment opportunities and the continuation
+            token for the next page (None if this is the last page)
+            
+        Raises:
+            ValueError: If the limit is out of range or the continuation token is invalid
         """
         try:
-            # Build query filter
-            query_filter = {
-                'investment_score': {'$exists': True, '$gte': min_score},
-                'price': {'$exists': True, '$ne': None},
-                'size': {'$exists': True, '$ne': None}
-            }
-            
-            if city:
-                query_filter['city'] = city
-            
-            if neighborhood:
-                query_filter['neighborhood'] = neighborhood
+            check_page_size(limit)
             
-            if property_type:
-                query_filter['property_type'] = property_type
+            # Build query filter
+            query_filter = build_opportunity_filter(
+                city=city,
+                neighborhood=neighborhood,
+                min_score=min_score,
+                property_type=property_type,
+                operation_type=operation_type
+            )
             
-            if operation_type:
-                query_filter['operation_type'] = operation_type
+            # Continue after the last opportunity of the previous page
+            query_filter = apply_cursor(query_filter, OPPORTUNITY_SORT, page_cursor)
             
             # Query database
+            next_cursor = None
             try:
-                cursor = self.collection.find(query_filter).sort('investment_score', -1).limit(limit)
-                # Convert to list of dictionaries
-                properties = loads(dumps(list(cursor)))
+                # Fetch one extra document to know whether there is a next page
+                cursor = self.collection.find(query_filter).sort(OPPORTUNITY_SORT).limit(limit + 1)
+                properties = list(cursor)
+                if len(properties) > limit:
+                    properties = properties[:limit]
+                    next_cursor = encode_cursor(OPPORTUNITY_SORT, properties[-1])
             except Exception as e:
                 logger.warning(f"Error querying database: {str(e)}, returning empty list")
                 properties = []
             
+            # Compute every area average these opportunities need in one round trip
+            area_price_table = self._build_area_price_table(
+                cities={prop.get('city') for prop in properties},
+                operation_types={prop.get('operation_type') for prop in properties}
+            )
+            
             # Enhance with additional analysis
             opportunities = []
             for prop in properties:
-                opportunity = self._create_opportunity(prop)
+                opportunity = create_opportunity(prop, area_price_table)
                 opportunities.append(opportunity)
             
-            return opportunities
+            return opportunities, next_cursor
+        except ValueError:
+            raise
         except Exception as e:
             logger.error(f"Error getting investment opportunities: {str(e)}")
-            return []
+            return [], None
     
-    def analyze_property(self, property_id: str, source: str) -> Optional[Dict[str, Any]]:
+    def analyze_property(self, property_id: str, source: str,
+                         deadline: Optional[float] = None) -> Optional[Dict[str, Any]]:
         """
         Perform detailed investment analysis on a specific property
         
+        The area comparison, rental price and similar property lookups are
+        independent, so they run concurrently on the shared thread pool. A
+        lookup that hasn't finished when the deadline expires is left out, and
+        the analysis lists it under 'timed_out'.
+        
         Args:
             property_id: The property ID
             source: The source website (e.g., 'idealista', 'fotocasa')
-            
+            deadline: Time in seconds to wait for the lookups (optional, the
+                service deadline is used if not given)
+                
         Returns:
             Dictionary with analysis results or None if property not found
         """
         try:
+            started = time.monotonic()
+            
             # Get the property
             property_data = self.collection.find_one({'id': property_id, 'source': source})
             
@@ -96,178 +1322,146 @@ class AnalysisService:
                 return None
             
             # Convert MongoDB document to dictionary
-            property_dict = loads(dumps(property_data))
+            property_dict = encode_document(property_data)
             
-            # Get comparison data for the area
-            area_data = self._get_area_comparison_data(property_dict)
+            # Get area comparison data, rental price and similar properties
+            results, timed_out = self._run_branches(property_dict, {
+                'area_data': self._get_area_comparison_data,
+                'rental_price': self._get_rental_price_per_sqm,
+                'similar_properties': self._get_similar_properties
+            }, started + (self.deadline if deadline is None else deadline))
             
-            # Calculate price insights
-            price_insights = self._calculate_price_insights(property_dict, area_data)
-            
-            # Calculate investment metrics
-            investment_metrics = self._calculate_investment_metrics(property_dict, area_data)
-            
-            # Get similar properties
-            similar_properties = self._get_similar_properties(property_dict)
-            
-            # Prepare analysis result
-            analysis = {
-                'property': property_dict,
-                'area_data': area_data,
-                'price_insights': price_insights,
-                'investment_metrics': investment_metrics,
-                'similar_properties': similar_properties
-            }
-            
-            return analysis
+            # Calculate price insights and investment metrics
+            return assemble_analysis(property_dict, results, timed_out)
         except Exception as e:
             logger.error(f"Error analyzing property: {str(e)}")
             return None
     
-    def _create_opportunity(self, property_dict: Dict[str, Any]) -> Dict[str, Any]:
+    def _run_branches(self, property_dict: Dict[str, Any], branches: Dict[str, Callable],
+                      deadline_at: float) -> Tuple[Dict[str, Any], List[str]]:
         """
-        Create an investment opportunity object from a property dictionary
+        Run independent analysis lookups on the shared thread pool
         
         Args:
-            property_dict: Property dictionary
-            
+            property_dict: Property dictionary passed to every lookup
+            branches: Dictionary mapping branch names to lookup functions
+            deadline_at: time.monotonic() value after which unfinished lookups
+                are abandoned
+                
         Returns:
-            Investment opportunity dictionary
+            Tuple of the dictionary mapping branch names to results, with the
+            value from ANALYSIS_LOOKUP_DEFAULTS for lookups that failed or
+            timed out, and the names of the branches that timed out
         """
-        try:
-            # Basic property data
-            opportunity = {
-                'property_id': property_dict.get('id'),
-                'source': property_dict.get('source'),
-                'title': property_dict.get('title'),
-                'price': property_dict.get('price'),
-                'size': property_dict.get('size'),
-                'city': property_dict.get('city'),
-                'neighborhood': property_dict.get('neighborhood'),
-                'property_type': property_dict.get('property_type'),
-                'operation_type': property_dict.get('operation_type'),
-                'investment_score': property_dict.get('investment_score'),
-                'price_per_sqm': property_dict.get('price_per_sqm'),
-                'latitude': property_dict.get('latitude'),
-                'longitude': property_dict.get('longitude'),
-                'url': property_dict.get('url')
-            }
-            
-            # Get area average price per sqm
-            avg_price_per_sqm = self._get_area_avg_price_per_sqm(
-                city=opportunity['city'],
-                neighborhood=opportunity['neighborhood'],
-                property_type=opportunity['property_type'],
-                operation_type=opportunity['operation_type']
-            )
-            
-            opportunity['avg_area_price_per_sqm'] = avg_price_per_sqm
-            
-            # Calculate price difference from area average
-            if opportunity['price_per_sqm'] and avg_price_per_sqm:
-                price_diff = ((avg_price_per_sqm - opportunity['price_per_sqm']) / avg_price_per_sqm) * 100
-                opportunity['price_difference'] = round(price_diff, 2)
+        if self.executor is None:
+            return {name: function(property_dict) for name, function in branches.items()}, []
+        
+        futures = {name: self.executor.submit(function, property_dict) for name, function in branches.items()}
+        wait(futures.values(), timeout=max(0.0, deadline_at - time.monotonic()))
+        
+        results = {}
+        timed_out = []
+        for name, future in futures.items():
+            default = ANALYSIS_LOOKUP_DEFAULTS[name]
+            if not future.done():
+                # A lookup that already started can't be interrupted, its result is discarded
+                future.cancel()
+                results[name] = default
+                timed_out.append(name)
+                continue
             
-            # Calculate estimated ROI (simple version)
-            if opportunity['operation_type'] == 'sale' and opportunity['price'] and avg_price_per_sqm:
-                # Estimate that price will eventually reach area average
-                estimated_future_price = opportunity['size'] * avg_price_per_sqm
-                
-                # Adjust if property needs renovation (estimated at 500€/m²)
-                renovation_cost = 0
-                if opportunity.get('condition') == 'needs_renovation':
-                    renovation_cost = opportunity['size'] * 500
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logger.error(f"Error in analysis lookup {name}: {str(e)}")
+                results[name] = default
+        
+        if timed_out:
+            logger.warning(f"Property analysis deadline expired before {', '.join(timed_out)} finished")
+        
+        return results, timed_out
+    
+    def iter_property_analyses(self, pairs: List[Tuple[str, str]],
+                               include_similar: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Analyze a batch of properties
+        
+        The properties are fetched with one query per chunk of BATCH_CHUNK_SIZE,
+        the area comparison data and rental prices are looked up once per
+        distinct area across the whole batch, and the price insights and
+        investment metrics are computed on arrays over each chunk.
+        
+        Args:
+            pairs: (property ID, source) pairs to analyze
+            include_similar: Whether to include the similar properties of each
+                property, fetched with one query per chunk
                 
-                # Calculate ROI
-                roi = ((estimated_future_price - opportunity['price'] - renovation_cost) / 
-                       (opportunity['price'] + renovation_cost)) * 100
-                opportunity['estimated_roi'] = round(roi, 2)
-            
-            # Get count of comparable properties
-            opportunity['comparable_count'] = len(property_dict.get('comparable_properties', []))
-            
-            return opportunity
-        except Exception as e:
-            logger.error(f"Error creating opportunity: {str(e)}")
-            # Return basic opportunity with error flag
-            return {
-                'property_id': property_dict.get('id'),
-                'source': property_dict.get('source'),
-                'title': property_dict.get('title'),
-                'price': property_dict.get('price'),
-                'investment_score': property_dict.get('investment_score'),
-                'error': str(e)
-            }
-    
-    def _get_area_avg_price_per_sqm(self, city: str, neighborhood: Optional[str] = None,
-                                  property_type: Optional[str] = None,
-                                  operation_type: Optional[str] = None) -> Optional[float]:
+        Yields:
+            Analysis of each property in request order, shaped like
+            analyze_property, or a dictionary with property_id, source and an
+            error for properties that were not found
         """
-        Calculate the average price per square meter for an area
+        comparisons_by_key = {}
+        
+        for start in range(0, len(pairs), BATCH_CHUNK_SIZE):
+            chunk = pairs[start:start + BATCH_CHUNK_SIZE]
+            property_dicts = match_batch(chunk, self.collection.find(batch_filter(chunk)))
+            found = list(property_dicts.values())
+            
+            # Look up each new area once, concurrently on the batch thread pool
+            new_areas = new_batch_areas(found, comparisons_by_key)
+            lookup = self.batch_executor.map if self.batch_executor is not None else map
+            comparisons_by_key.update(zip(new_areas, lookup(self._get_area_comparison_data, new_areas.values())))
+            
+            # One rental price table covers every sale in the chunk
+            rental_cities = rental_price_cities(found)
+            rental_price_table = self._build_area_price_table(rental_cities, {'rent'}) if rental_cities else {}
+            
+            similar_properties = None
+            if include_similar:
+                try:
+                    neighbors = [self.similarity.find_similar(property_dict, 10) for property_dict in found]
+                    documents = self.collection.find(similar_batch_filter(neighbors), SIMILAR_PROJECTION)
+                    similar_properties = format_batch_similar(self.similarity, neighbors, documents)
+                except Exception as e:
+                    logger.error(f"Error getting similar properties: {str(e)}")
+                    similar_properties = [[] for _ in found]
+            
+            yield from analyze_batch(chunk, property_dicts, comparisons_by_key, rental_price_table,
+                                     similar_properties)
+    
+    def _build_area_price_table(self, cities, operation_types=None) -> Dict[Tuple, Tuple[float, int]]:
+        """
+        Build a table of price per square meter totals for every area level
+        
+        The columnar snapshot or the precomputed area statistics are used when
+        they have been built (see precomputed_area_price_table). Otherwise a
+        single grouped aggregation is run over the given cities and the result
+        is rolled up in memory, so every (city, neighborhood, property_type,
+        operation_type) combination -- including the wider fallback levels,
+        where None means "any" -- can be looked up without further queries.
         
         Args:
-            city: The city
-            neighborhood: The neighborhood (optional)
-            property_type: Type of property (optional)
-            operation_type: Type of operation (optional)
-            
+            cities: Cities to include
+            operation_types: Operation types to include (optional). If any of
+                them is None, all operation types are included.
+                
         Returns:
-            Average price per square meter or None if not enough data
+            Dictionary mapping area keys to (average price_per_sqm, count)
         """
         try:
-            # Build query filter
-            query_filter = {
-                'city': city,
-                'price_per_sqm': {'$exists': True, '$ne': None}
-            }
-            
-            if neighborhood:
-                query_filter['neighborhood'] = neighborhood
-            
-            if property_type:
-                query_filter['property_type'] = property_type
-            
-            if operation_type:
-                query_filter['operation_type'] = operation_type
+            area_price_table = precomputed_area_price_table(self.columnar, self.area_stats)
+            if area_price_table is not None:
+                return area_price_table
             
-            # Query database
-            pipeline = [
-                {'$match': query_filter},
-                {'$group': {
-                    '_id': None,
-                    'avg_price_per_sqm': {'$avg': '$price_per_sqm'},
-                    'count': {'$sum': 1}
-                }}
-            ]
-            
-            result = list(self.collection.aggregate(pipeline))
-            
-            if result and result[0]['count'] >= 5:  # Only use if we have enough data
-                return round(result[0]['avg_price_per_sqm'], 2)
-            elif result:  # Not enough data, try without neighborhood
-                if neighborhood and property_type:
-                    return self._get_area_avg_price_per_sqm(
-                        city=city,
-                        neighborhood=None,
-                        property_type=property_type,
-                        operation_type=operation_type
-                    )
-                elif property_type:
-                    return self._get_area_avg_price_per_sqm(
-                        city=city,
-                        neighborhood=None,
-                        property_type=None,
-                        operation_type=operation_type
-                    )
-                else:
-                    return None
-            else:
-                return None
+            groups = self.collection.aggregate(area_price_pipeline(cities, operation_types))
+            return area_price_table_from_groups(groups)
         except Exception as e:
-            logger.error(f"Error calculating area average price: {str(e)}")
-            return None
+            logger.error(f"Error building area price table: {str(e)}")
+            return {}
     
-    def _get_area_comparison_data(self, property_dict: Dict[str, Any]) -> Dict[str, Any]:
+    def _get_area_comparison_data(self, property_dict: Dict[str, Any]) -> Tuple[Dict[str, Any],
+                                                                                 Optional[PriceDistribution]]:
         """
         Get comparison data for the area where the property is located
         
@@ -275,317 +1469,72 @@ class AnalysisService:
             property_dict: Property dictionary
             
         Returns:
-            Dictionary with area comparison data
+            Tuple of the dictionary with area comparison data and the price per
+            square meter distribution of the property's segment (None if it has
+            no priced properties)
         """
         try:
-            city = property_dict.get('city')
-            neighborhood = property_dict.get('neighborhood')
-            property_type = property_dict.get('property_type')
-            operation_type = property_dict.get('operation_type')
-            
-            # Build query filter for the area
-            area_filter = {'city': city}
-            if neighborhood:
-                area_filter['neighborhood'] = neighborhood
-            
-            # Calculate average price per sqm in the area
-            price_per_sqm_pipeline = [
-                {'$match': {
-                    **area_filter,
-                    'price_per_sqm': {'$exists': True, '$ne': None},
-                    'property_type': property_type,
-                    'operation_type': operation_type
-                }},
-                {'$group': {
-                    '_id': None,
-                    'avg_price_per_sqm': {'$avg': '$price_per_sqm'},
-                    'min_price_per_sqm': {'$min': '$price_per_sqm'},
-                    'max_price_per_sqm': {'$max': '$price_per_sqm'},
-                    'count': {'$sum': 1}
-                }}
-            ]
-            
-            price_result = list(self.collection.aggregate(price_per_sqm_pipeline))
-            
-            # Calculate average time on market
-            time_pipeline = [
-                {'$match': {
-                    **area_filter,
-                    'days_listed': {'$exists': True, '$ne': None},
-                    'property_type': property_type,
-                    'operation_type': operation_type
-                }},
-                {'$group': {
-                    '_id': None,
-                    'avg_days_listed': {'$avg': '$days_listed'},
-                    'count': {'$sum': 1}
-                }}
-            ]
+            # Serve from the columnar snapshot when the scheduler has saved
+            # one, or from the precomputed area statistics
+            comparison = precomputed_area_comparison(self.columnar, self.area_stats, property_dict)
+            if comparison is not None:
+                return comparison
             
-            time_result = list(self.collection.aggregate(time_pipeline))
+            # Calculate price, time on market and type distribution in a single pass
+            area_filter, facet_pipeline = area_facet_query(property_dict)
             
-            # Calculate property type distribution
-            type_pipeline = [
-                {'$match': {
-                    **area_filter,
-                    'property_type': {'$exists': True, '$ne': None},
-                    'operation_type': operation_type
-                }},
-                {'$group': {
-                    '_id': '$property_type',
-                    'count': {'$sum': 1}
-                }},
-                {'$sort': {'count': -1}}
-            ]
-            
-            type_result = list(self.collection.aggregate(type_pipeline))
+            try:
+                facet_result = list(self.collection.aggregate(facet_pipeline))
+            except OperationFailure as e:
+                logger.warning(f"$facet aggregation not supported: {str(e)}")
+                facet_result = []
             
-            # Prepare result
-            area_data = {
-                'city': city,
-                'neighborhood': neighborhood,
-                'property_count': self.collection.count_documents(area_filter),
-                'price_per_sqm': price_result[0] if price_result else None,
-                'time_on_market': time_result[0] if time_result else None,
-                'property_types': type_result
-            }
+            if facets_evaluated(facet_result):
+                facets = facet_result[0]
+            else:
+                documents = self.collection.find(area_filter, AREA_FACET_PROJECTION)
+                facets = compute_area_facets(list(documents), property_dict.get('property_type'),
+                                             property_dict.get('operation_type'))
             
-            return area_data
+            return area_comparison_from_facets(property_dict, facets)
         except Exception as e:
             logger.error(f"Error getting area comparison data: {str(e)}")
-            return {}
+            return {}, None
     
-    def _calculate_price_insights(self, property_dict: Dict[str, Any], 
-                                area_data: Dict[str, Any]) -> Dict[str, Any]:
+    def _get_rental_price_per_sqm(self, property_dict: Dict[str, Any]) -> Optional[float]:
         """
-        Calculate price insights for a property
+        Get the average rental price per square meter used to estimate a sale's rental yield
         
         Args:
             property_dict: Property dictionary
-            area_data: Area comparison data
             
         Returns:
-            Dictionary with price insights
-        """
-        try:
-            price_insights = {}
-            
-            # Get property data
-            price = property_dict.get('price')
-            size = property_dict.get('size')
-            price_per_sqm = property_dict.get('price_per_sqm')
-            
-            # Get area data
-            area_price_data = area_data.get('price_per_sqm', {})
-            if area_price_data:
-                avg_price_per_sqm = area_price_data.get('avg_price_per_sqm')
-                min_price_per_sqm = area_price_data.get('min_price_per_sqm')
-                max_price_per_sqm = area_price_data.get('max_price_per_sqm')
-                
-                if avg_price_per_sqm and price_per_sqm:
-                    # Calculate price difference from area average
-                    price_diff = ((avg_price_per_sqm - price_per_sqm) / avg_price_per_sqm) * 100
-                    price_insights['price_difference'] = round(price_diff, 2)
-                    price_insights['price_difference_label'] = (
-                        'below average' if price_diff > 0 else 'above average'
-                    )
-                    
-                    # Calculate where this property sits in the price range
-                    price_range = max_price_per_sqm - min_price_per_sqm
-                    if price_range > 0:
-                        percentile = ((price_per_sqm - min_price_per_sqm) / price_range) * 100
-                        price_insights['price_percentile'] = round(percentile, 2)
-            
-            # Calculate price history insights if available
-            price_history = property_dict.get('price_history', [])
-            if price_history and price:
-                # Sort by date
-                price_history.sort(key=lambda x: x.get('date', ''))
-                
-                # Calculate price changes
-                initial_price = price_history[0].get('price') if price_history else price
-                price_change = ((price - initial_price) / initial_price) * 100 if initial_price else 0
-                price_insights['price_change'] = round(price_change, 2)
-                
-                # Calculate price change frequency
-                if len(price_history) > 1:
-                    price_insights['price_changes_count'] = len(price_history)
-            
-            return price_insights
-        except Exception as e:
-            logger.error(f"Error calculating price insights: {str(e)}")
-            return {}
-    
-    def _calculate_investment_metrics(self, property_dict: Dict[str, Any],
-                                     area_data: Dict[str, Any]) -> Dict[str, Any]:
+            Average monthly rent per square meter in the same city and property
+            type, or None if the property is not for sale or there is not
+            enough data
         """
-        Calculate investment metrics for a property
+        cities = rental_price_cities([property_dict])
+        if not cities:
+            return None
         
-        Args:
-            property_dict: Property dictionary
-            area_data: Area comparison data
-            
-        Returns:
-            Dictionary with investment metrics
-        """
-        try:
-            metrics = {}
-            
-            # Get property data
-            price = property_dict.get('price')
-            size = property_dict.get('size')
-            price_per_sqm = property_dict.get('price_per_sqm')
-            investment_score = property_dict.get('investment_score')
-            operation_type = property_dict.get('operation_type')
-            condition = property_dict.get('condition')
-            
-            # Basic metrics
-            metrics['investment_score'] = investment_score
-            
-            # Get area data
-            area_price_data = area_data.get('price_per_sqm', {})
-            area_time_data = area_data.get('time_on_market', {})
-            
-            if area_price_data and price and size and operation_type == 'sale':
-                avg_price_per_sqm = area_price_data.get('avg_price_per_sqm')
-                
-                # Calculate potential value after renovation
-                if condition == 'needs_renovation':
-                    renovation_cost_per_sqm = 500  # Estimated renovation cost per sqm
-                    renovation_cost = size * renovation_cost_per_sqm
-                    
-                    # Estimate market value after renovation
-                    market_value = size * avg_price_per_sqm
-                    
-                    # Calculate ROI for renovation
-                    if market_value > (price + renovation_cost):
-                        renovation_roi = ((market_value - price - renovation_cost) / 
-                                         (price + renovation_cost)) * 100
-                        metrics['renovation_roi'] = round(renovation_roi, 2)
-                        metrics['renovation_cost'] = renovation_cost
-                        metrics['estimated_market_value'] = market_value
-                
-                # Calculate general investment metrics
-                if avg_price_per_sqm:
-                    # Estimate market value based on area average
-                    market_value = size * avg_price_per_sqm
-                    
-                    # Price to market value ratio (lower is better)
-                    price_to_value = price / market_value if market_value > 0 else 1
-                    metrics['price_to_value_ratio'] = round(price_to_value, 2)
-                    
-                    # Potential appreciation
-                    if price < market_value:
-                        potential_appreciation = ((market_value - price) / price) * 100
-                        metrics['potential_appreciation'] = round(potential_appreciation, 2)
-            
-            # Rental yield calculation (if operation_type is sale)
-            if operation_type == 'sale' and price and size:
-                # Estimate monthly rental price based on city averages
-                # This is a simplified calculation and should be refined with real data
-                city = property_dict.get('city')
-                property_type = property_dict.get('property_type')
-                
-                # Get average rental price per sqm in the same city
-                rental_price_per_sqm = self._get_area_avg_price_per_sqm(
-                    city=city,
-                    property_type=property_type,
-                    operation_type='rent'
-                )
-                
-                if rental_price_per_sqm:
-                    # Estimate monthly rental income
-                    monthly_rent = size * rental_price_per_sqm
-                    annual_rent = monthly_rent * 12
-                    
-                    # Calculate gross rental yield
-                    rental_yield = (annual_rent / price) * 100
-                    metrics['estimated_monthly_rent'] = round(monthly_rent, 2)
-                    metrics['estimated_rental_yield'] = round(rental_yield, 2)
-            
-            # Liquidity metric based on average time on market
-            if area_time_data:
-                avg_days_listed = area_time_data.get('avg_days_listed')
-                if avg_days_listed:
-                    # Liquidity score (0-100, higher is more liquid)
-                    liquidity_score = 100 * (1 - min(1, avg_days_listed / 180))
-                    metrics['liquidity_score'] = round(liquidity_score, 2)
-                    metrics['avg_days_on_market'] = round(avg_days_listed, 2)
-            
-            return metrics
-        except Exception as e:
-            logger.error(f"Error calculating investment metrics: {str(e)}")
-            return {}
+        return lookup_rental_price_per_sqm(self._build_area_price_table(cities, {'rent'}), property_dict)
     
     def _get_similar_properties(self, property_dict: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         Get similar properties to the given property
         
+        Returns the 10 nearest properties by price, size, rooms, bathrooms,
+        floor and position among those within 20% of its price and size (see
+        SimilarityService).
+        
         Args:
             property_dict: Property dictionary
             
         Returns:
-            List of similar properties
+            List of similar properties, most similar first
         """
         try:
-            # Get property data
-            city = property_dict.get('city')
-            neighborhood = property_dict.get('neighborhood')
-            property_type = property_dict.get('property_type')
-            operation_type = property_dict.get('operation_type')
-            size = property_dict.get('size')
-            price = property_dict.get('price')
-            property_id = property_dict.get('id')
-            source = property_dict.get('source')
-            
-            if not city or not size or not price:
-                return []
-            
-            # Define size and price ranges
-            size_range = (size * 0.8, size * 1.2)
-            price_range = (price * 0.8, price * 1.2)
-            
-            # Build query filter
-            query_filter = {
-                'city': city,
-                'size': {'$gte': size_range[0], '$lte': size_range[1]},
-                'price': {'$gte': price_range[0], '$lte': price_range[1]},
-                'id': {'$ne': property_id},  # Exclude the current property
-                'source': {'$ne': source},  # Different source
-                'operation_type': operation_type
-            }
-            
-            if neighborhood:
-                query_filter['neighborhood'] = neighborhood
-            
-            if property_type:
-                query_filter['property_type'] = property_type
-            
-            # Query database
-            cursor = self.collection.find(query_filter, {
-                'id': 1, 'source': 1, 'title': 1, 'price': 1, 'size': 1,
-                'price_per_sqm': 1, 'url': 1, 'days_listed': 1,
-                'neighborhood': 1, 'investment_score': 1
-            }).limit(10)
-            
-            # Convert to list of dictionaries
-            similar_properties = loads(dumps(list(cursor)))
-            
-            # Sort by similarity (using Euclidean distance of normalized price and size)
-            if similar_properties:
-                for prop in similar_properties:
-                    # Calculate similarity score (0-100, higher is more similar)
-                    size_diff = abs(prop.get('size', 0) - size) / size if size > 0 else 1
-                    price_diff = abs(prop.get('price', 0) - price) / price if price > 0 else 1
-                    
-                    # Convert to similarity score (inverse of difference)
-                    similarity = 100 * (1 - (size_diff * 0.5 + price_diff * 0.5))
-                    prop['similarity_score'] = round(max(0, similarity), 2)
-                
-                # Sort by similarity score
-                similar_properties.sort(key=lambda x: x.get('similarity_score', 0), reverse=True)
-            
-            return similar_properties
+            return self.similarity.get_similar_properties(property_dict, limit=10)
         except Exception as e:
             logger.error(f"Error getting similar properties: {str(e)}")
             return []
@@ -0,0 +1,335 @@
+"""
+Service for building and reading precomputed area statistics.
+
+Area statistics only change when the spiders write new data, so they are
+materialized into the `area_stats` collection after each scrape and served
+from memory by the API. Segments with a property type and operation type also
+store their sorted price per square meter values, so listings can be ranked
+against them.
+"""
+
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+import numpy as np
+from pymongo import ReplaceOne
+from api.utils.db import get_db_connection
+from api.utils.data_version import DataVersionWatcher
+from api.utils.price_distribution import PriceDistribution
+
+logger = logging.getLogger(__name__)
+
+# Fields that make up the area hierarchy, from widest to narrowest
+AREA_FIELDS = ('city', 'neighborhood', 'property_type', 'operation_type')
+
+
+def area_stats_key(city: Optional[str], neighborhood: Optional[str] = None,
+                   property_type: Optional[str] = None,
+                   operation_type: Optional[str] = None) -> Tuple:
+    """
+    Build the lookup key for an area, where None means "any"
+    
+    Args:
+        city: The city
+        neighborhood: The neighborhood (optional)
+        property_type: Type of property (optional)
+        operation_type: Type of operation (optional)
+        
+    Returns:
+        Area key tuple
+    """
+    return (city, neighborhood or None, property_type or None, operation_type or None)
+
+
+class AreaStatsService:
+    """Service for building and reading precomputed area statistics"""
+    
+    def __init__(self, db=None):
+        """
+        Initialize the area statistics service
+        
+        Args:
+            db: Database object (optional, a new connection is opened if not given)
+        """
+        self.db = db if db is not None else get_db_connection()
+        self.collection = self.db['properties']
+        self.stats_collection = self.db['area_stats']
+        self.data_version = DataVersionWatcher(self.db)
+        self._stats = {}
+        self._price_table = {}
+        self._distributions = {}
+        self._loaded_generation = None
+        self._lock = threading.Lock()
+    
+    def rebuild(self, since: Optional[datetime] = None) -> int:
+        """
+        Rebuild the area statistics collection
+        
+        Args:
+            since: Only rebuild cities with properties updated after this time
+                (optional, all cities are rebuilt if not given)
+                
+        Returns:
+            Number of area statistics documents written
+        """
+        try:
+            if since:
+                cities = self.collection.distinct('city', {'last_updated': {'$gte': since}})
+                if not cities:
+                    logger.info("No cities updated since last scrape, area statistics unchanged")
+                    return 0
+                query_filter = {'city': {'$in': cities}}
+            else:
+                cities = None
+                query_filter = {}
+            
+            built_at = datetime.now()
+            stats = self._compute_area_stats(query_filter)
+            
+            operations = []
+            for area_key, area_stats in stats.items():
+                document = dict(zip(AREA_FIELDS, area_key))
+                document.update(area_stats)
+                document['updated_at'] = built_at
+                operations.append(ReplaceOne({'_id': self._document_id(area_key)}, document, upsert=True))
+            
+            if operations:
+                self.stats_collection.bulk_write(operations, ordered=False)
+            
+            # Drop areas that no longer have any properties
+            stale_filter = {'updated_at': {'$lt': built_at}}
+            if cities is not None:
+                stale_filter['city'] = {'$in': cities}
+            self.stats_collection.delete_many(stale_filter)
+            
+            logger.info(f"Rebuilt {len(operations)} area statistics for "
+                        f"{len(cities) if cities is not None else 'all'} cities")
+            
+            return len(operations)
+        except Exception as e:
+            logger.error(f"Error rebuilding area statistics: {str(e)}")
+            return 0
+    
+    def is_available(self) -> bool:
+        """
+        Check whether precomputed area statistics have been built
+        
+        Returns:
+            True if statistics can be served from memory
+        """
+        self._ensure_loaded()
+        return bool(self._stats)
+    
+    def get_area_stats(self, city: Optional[str], neighborhood: Optional[str] = None,
+                       property_type: Optional[str] = None,
+                       operation_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get precomputed statistics for an area
+        
+        Args:
+            city: The city
+            neighborhood: The neighborhood (optional)
+            property_type: Type of property (optional)
+            operation_type: Type of operation (optional)
+            
+        Returns:
+            Area statistics dictionary or None if the area has no properties
+        """
+        self._ensure_loaded()
+        return self._stats.get(area_stats_key(city, neighborhood, property_type, operation_type))
+    
+    def get_price_distribution(self, city: Optional[str], neighborhood: Optional[str],
+                               property_type: Optional[str],
+                               operation_type: Optional[str]) -> Optional[PriceDistribution]:
+        """
+        Get the price per square meter distribution of a segment
+        
+        Args:
+            city: The city
+            neighborhood: The neighborhood (optional, the whole city if not given)
+            property_type: Type of property
+            operation_type: Type of operation
+            
+        Returns:
+            Price distribution, or None if the segment has no priced properties
+            or lacks a property type or operation type
+        """
+        self._ensure_loaded()
+        return self._distributions.get(area_stats_key(city, neighborhood, property_type, operation_type))
+    
+    @property
+    def price_table(self) -> Dict[Tuple, Tuple[float, int]]:
+        """Average price per square meter and listing count for every area key"""
+        self._ensure_loaded()
+        return self._price_table
+    
+    def _ensure_loaded(self):
+        """Load the statistics into memory if a new data generation has been recorded"""
+        generation = self.data_version.generation
+        if self._loaded_generation == generation:
+            return
+        
+        with self._lock:
+            if self._loaded_generation == generation:
+                return
+            
+            try:
+                stats = {}
+                price_table = {}
+                distributions = {}
+                for document in self.stats_collection.find():
+                    area_key = area_stats_key(*(document.get(field) for field in AREA_FIELDS))
+                    values = document.pop('price_per_sqm_values', None)
+                    if values:
+                        distributions[area_key] = PriceDistribution(np.array(values, dtype=float))
+                    stats[area_key] = document
+                    
+                    price_data = document.get('price_per_sqm')
+                    if price_data:
+                        price_table[area_key] = (price_data['avg_price_per_sqm'], price_data['count'])
+                
+                self._stats = stats
+                self._price_table = price_table
+                self._distributions = distributions
+                self._loaded_generation = generation
+                logger.info(f"Loaded {len(stats)} area statistics for generation {generation}")
+            except Exception as e:
+                logger.warning(f"Error loading area statistics: {str(e)}")
+    
+    def _compute_area_stats(self, query_filter: Dict[str, Any]) -> Dict[Tuple, Dict[str, Any]]:
+        """
+        Compute statistics for every level of the area hierarchy
+        
+        A single grouped aggregation is run at the narrowest level and rolled up
+        in memory to every combination where neighborhood, property type or
+        operation type is ignored. The price per square meter values are only
+        kept for the levels with both a property type and an operation type,
+        which are the segments listings are ranked against.
+        
+        Args:
+            query_filter: Filter selecting the properties to include
+            
+        Returns:
+            Dictionary mapping area keys to statistics dictionaries
+        """
+        pipeline = [
+            {'$match': query_filter},
+            {'$group': {
+                '_id': {field: f'${field}' for field in AREA_FIELDS},
+                'property_count': {'$sum': 1},
+                'price_per_sqm_total': {'$sum': '$price_per_sqm'},
+                'price_per_sqm_count': {'$sum': {'$cond': [{'$gt': ['$price_per_sqm', None]}, 1, 0]}},
+                'min_price_per_sqm': {'$min': '$price_per_sqm'},
+                'max_price_per_sqm': {'$max': '$price_per_sqm'},
+                'price_per_sqm_values': {'$push': '$price_per_sqm'},
+                'days_listed_total': {'$sum': '$days_listed'},
+                'days_listed_count': {'$sum': {'$cond': [{'$gt': ['$days_listed', None]}, 1, 0]}}
+            }}
+        ]
+        
+        totals = {}
+        for group in self.collection.aggregate(pipeline):
+            group_id = group['_id']
+            city, neighborhood, property_type, operation_type = area_stats_key(
+                *(group_id.get(field) for field in AREA_FIELDS)
+            )
+            
+            area_keys = {
+                (city, n, p, o)
+                for n in {neighborhood, None}
+                for p in {property_type, None}
+                for o in {operation_type, None}
+            }
+            
+            for area_key in area_keys:
+                total = totals.setdefault(area_key, {
+                    'property_count': 0,
+                    'price_per_sqm_total': 0.0,
+                    'price_per_sqm_count': 0,
+                    'min_price_per_sqm': None,
+                    'max_price_per_sqm': None,
+                    'days_listed_total': 0.0,
+                    'days_listed_count': 0,
+                    'price_per_sqm_values': [] if area_key[2] and area_key[3] else None,
+                    'property_types': {}
+                })
+                total['property_count'] += group['property_count']
+                total['price_per_sqm_total'] += group['price_per_sqm_total'] or 0
+                total['price_per_sqm_count'] += group['price_per_sqm_count']
+                total['days_listed_total'] += group['days_listed_total'] or 0
+                total['days_listed_count'] += group['days_listed_count']
+                if total['price_per_sqm_values'] is not None:
+                    total['price_per_sqm_values'].extend(
+                        value for value in group['price_per_sqm_values']
+                        if isinstance(value, (int, float)) and not isinstance(value, bool)
+                    )
+                
+                if group['min_price_per_sqm'] is not None:
+                    if total['min_price_per_sqm'] is None or group['min_price_per_sqm'] < total['min_price_per_sqm']:
+                        total['min_price_per_sqm'] = group['min_price_per_sqm']
+                if group['max_price_per_sqm'] is not None:
+                    if total['max_price_per_sqm'] is None or group['max_price_per_sqm'] > total['max_price_per_sqm']:
+                        total['max_price_per_sqm'] = group['max_price_per_sqm']
+                
+                if property_type:
+                    type_counts = total['property_types']
+                    type_counts[property_type] = type_counts.get(property_type, 0) + group['property_count']
+        
+        return {area_key: self._finalize_stats(total) for area_key, total in totals.items()}
+    
+    def _finalize_stats(self, total: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Convert accumulated totals into the stored statistics format
+        
+        Args:
+            total: Accumulated totals for an area
+            
+        Returns:
+            Area statistics dictionary
+        """
+        price_per_sqm = None
+        if total['price_per_sqm_count']:
+            price_per_sqm = {
+                'avg_price_per_sqm': total['price_per_sqm_total'] / total['price_per_sqm_count'],
+                'min_price_per_sqm': total['min_price_per_sqm'],
+                'max_price_per_sqm': total['max_price_per_sqm'],
+                'count': total['price_per_sqm_count']
+            }
+        
+        time_on_market = None
+        if total['days_listed_count']:
+            time_on_market = {
+                'avg_days_listed': total['days_listed_total'] / total['days_listed_count'],
+                'count': total['days_listed_count']
+            }
+        
+        property_types = [
+            {'_id': property_type, 'count': count}
+            for property_type, count in sorted(total['property_types'].items(),
+                                               key=lambda x: x[1], reverse=True)
+        ]
+        
+        stats = {
+            'property_count': total['property_count'],
+            'price_per_sqm': price_per_sqm,
+            'time_on_market': time_on_market,
+            'property_types': property_types
+        }
+        
+        if total['price_per_sqm_values']:
+            stats['price_per_sqm_values'] = sorted(total['price_per_sqm_values'])
+        
+        return stats
+    
+    def _document_id(self, area_key: Tuple) -> str:
+        """
+        Build the document ID for an area key
+        
+        Args:
+            area_key: Area key tuple
+            
+        Returns:
+            Document ID string, with '*' standing for "any"
+        """
+        return '|'.join('*' if value is None else str(value) for value in area_key)
@@ -0,0 +1,311 @@
+"""
+Async service for analyzing property data and identifying investment opportunities.
+
+Mirrors AnalysisService for the ASGI server mode. Database queries run on the
+Motor driver, and the independent sub-queries of a property analysis (area
+comparison, rental price and similar properties) run concurrently. In-memory
+indexes are shared with AnalysisService, and the queries and calculations
+between the database round trips are the module functions of
+api.services.analysis_service. Index loads, which block on the synchronous
+driver, and the in-memory lookups run in worker threads.
+"""
+
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+from pymongo.errors import OperationFailure
+from api.services.analysis_service import (AnalysisService, OPPORTUNITY_SORT, AREA_FACET_PROJECTION,
+                                           BATCH_CHUNK_SIZE, ANALYSIS_LOOKUP_DEFAULTS, build_opportunity_filter,
+                                           create_opportunity, assemble_analysis, batch_filter, match_batch,
+                                           new_batch_areas, rental_price_cities, similar_batch_filter,
+                                           format_batch_similar, analyze_batch, precomputed_area_price_table,
+                                           area_price_pipeline, area_price_table_from_groups,
+                                           lookup_rental_price_per_sqm, precomputed_area_comparison,
+                                           area_facet_query, facets_evaluated, compute_area_facets,
+                                           area_comparison_from_facets)
+from api.services.similarity_service import SIMILAR_PROJECTION
+from api.utils.async_db import get_async_db_connection
+from api.utils.encoding import encode_document
+from api.utils.pagination import apply_cursor, encode_cursor, check_page_size
+from api.utils.price_distribution import PriceDistribution
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAnalysisService:
+    """Async service for analyzing property data and identifying investment opportunities"""
+    
+    def __init__(self, db=None, analysis_service: Optional[AnalysisService] = None):
+        """
+        Initialize the async analysis service
+        
+        Args:
+            db: Motor database object (optional, a new client is created if not given)
+            analysis_service: Synchronous service whose indexes and settings
+                are reused (optional, a new one is created if not given)
+        """
+        self.db = db if db is not None else get_async_db_connection()
+        self.collection = self.db['properties']
+        self.analysis = analysis_service or AnalysisService()
+    
+    async def get_investment_opportunities_page(self, city=None, neighborhood=None, min_score=70,
+                                                property_type=None, operation_type=None, limit=50,
+                                                page_cursor=None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Get a page of investment opportunities based on analysis
+        
+        Args:
+            See AnalysisService.get_investment_opportunities_page
+            
+        Returns:
+            Tuple of the list of investment opportunities and the continuation
+            token for the next page (None if this is the last page)
+            
+        Raises:
+            ValueError: If the limit is out of range or the continuation token is invalid
+        """
+        check_page_size(limit)
+        query_filter = build_opportunity_filter(
+            city=city,
+            neighborhood=neighborhood,
+            min_score=min_score,
+            property_type=property_type,
+            operation_type=operation_type
+        )
+        query_filter = apply_cursor(query_filter, OPPORTUNITY_SORT, page_cursor)
+        
+        try:
+            next_cursor = None
+            try:
+                # Fetch one extra document to know whether there is a next page
+                cursor = self.collection.find(query_filter).sort(OPPORTUNITY_SORT).limit(limit + 1)
+                properties = await cursor.to_list(limit + 1)
+                if len(properties) > limit:
+                    properties = properties[:limit]
+                    next_cursor = encode_cursor(OPPORTUNITY_SORT, properties[-1])
+            except Exception as e:
+                logger.warning(f"Error querying database: {str(e)}, returning empty list")
+                properties = []
+            
+            area_price_table = await self._build_area_price_table(
+                cities={prop.get('city') for prop in properties},
+                operation_types={prop.get('operation_type') for prop in properties}
+            )
+            
+            opportunities = [create_opportunity(prop, area_price_table) for prop in properties]
+            
+            return opportunities, next_cursor
+        except Exception as e:
+            logger.error(f"Error getting investment opportunities: {str(e)}")
+            return [], None
+    
+    async def analyze_property(self, property_id: str, source: str,
+                               deadline: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Perform detailed investment analysis on a specific property
+        
+        Args:
+            property_id: The property ID
+            source: The source website (e.g., 'idealista', 'fotocasa')
+            deadline: Time in seconds to wait for the area, rent and similar
+                property lookups (optional, the AnalysisService deadline is used
+                if not given). Lookups still running are cancelled and listed
+                under 'timed_out'.
+                
+        Returns:
+            Dictionary with analysis results or None if property not found
+        """
+        try:
+            loop = asyncio.get_running_loop()
+            deadline_at = loop.time() + (self.analysis.deadline if deadline is None else deadline)
+            
+            property_data = await self.collection.find_one({'id': property_id, 'source': source})
+            
+            if not property_data:
+                return None
+            
+            property_dict = encode_document(property_data)
+            
+            # The area, rent and similar property lookups don't depend on each other
+            lookups = {
+                'area_data': self._get_area_comparison_data(property_dict),
+                'rental_price': self._get_rental_price_per_sqm(property_dict),
+                'similar_properties': self._get_similar_properties(property_dict)
+            }
+            tasks = {name: asyncio.ensure_future(coroutine) for name, coroutine in lookups.items()}
+            await asyncio.wait(tasks.values(), timeout=max(0.0, deadline_at - loop.time()))
+            
+            results = {}
+            timed_out = []
+            for name, task in tasks.items():
+                if task.done():
+                    results[name] = task.result()
+                else:
+                    task.cancel()
+                    results[name] = ANALYSIS_LOOKUP_DEFAULTS[name]
+                    timed_out.append(name)
+            
+            if timed_out:
+                logger.warning(f"Property analysis deadline expired before {', '.join(timed_out)} finished")
+            
+            return await asyncio.to_thread(assemble_analysis, property_dict, results, timed_out)
+        except Exception as e:
+            logger.error(f"Error analyzing property: {str(e)}")
+            return None
+    
+    async def iter_property_analyses(self, pairs: List[Tuple[str, str]],
+                                     include_similar: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Analyze a batch of properties
+        
+        Args:
+            See AnalysisService.iter_property_analyses
+            
+        Yields:
+            Analysis of each property in request order, or a dictionary with
+            property_id, source and an error for properties that were not found
+        """
+        similarity = self.analysis.similarity
+        comparisons_by_key = {}
+        lookup_slots = asyncio.Semaphore(max(self.analysis.batch_workers, 1))
+        
+        for start in range(0, len(pairs), BATCH_CHUNK_SIZE):
+            chunk = pairs[start:start + BATCH_CHUNK_SIZE]
+            documents = await self.collection.find(batch_filter(chunk)).to_list(None)
+            property_dicts = match_batch(chunk, documents)
+            found = list(property_dicts.values())
+            
+            # Look up each new area once, at most batch_workers at a time
+            new_areas = new_batch_areas(found, comparisons_by_key)
+            results = await asyncio.gather(*(self._bounded(lookup_slots, self._get_area_comparison_data(p))
+                                             for p in new_areas.values()))
+            comparisons_by_key.update(zip(new_areas, results))
+            
+            # One rental price table covers every sale in the chunk
+            rental_cities = rental_price_cities(found)
+            rental_price_table = await self._build_area_price_table(rental_cities, {'rent'}) if rental_cities else {}
+            
+            similar_properties = None
+            if include_similar:
+                try:
+                    neighbors = await asyncio.to_thread(
+                        lambda: [similarity.find_similar(property_dict, 10) for property_dict in found]
+                    )
+                    similar_documents = await self.collection.find(
+                        similar_batch_filter(neighbors), SIMILAR_PROJECTION
+                    ).to_list(None)
+                    similar_properties = format_batch_similar(similarity, neighbors, similar_documents)
+                except Exception as e:
+                    logger.error(f"Error getting similar properties: {str(e)}")
+                    similar_properties = [[] for _ in found]
+            
+            for result in await asyncio.to_thread(analyze_batch, chunk, property_dicts, comparisons_by_key,
+                                                  rental_price_table, similar_properties):
+                yield result
+    
+    async def _build_area_price_table(self, cities, operation_types=None) -> Dict[Tuple, Tuple[float, int]]:
+        """
+        Build a table of price per square meter totals for every area level
+        
+        Args:
+            See AnalysisService._build_area_price_table
+            
+        Returns:
+            Dictionary mapping area keys to (average price_per_sqm, count)
+        """
+        try:
+            area_price_table = await asyncio.to_thread(precomputed_area_price_table,
+                                                       self.analysis.columnar, self.analysis.area_stats)
+            if area_price_table is not None:
+                return area_price_table
+            
+            groups = await self.collection.aggregate(area_price_pipeline(cities, operation_types)).to_list(None)
+            return area_price_table_from_groups(groups)
+        except Exception as e:
+            logger.error(f"Error building area price table: {str(e)}")
+            return {}
+    
+    async def _get_rental_price_per_sqm(self, property_dict: Dict[str, Any]) -> Optional[float]:
+        """
+        Get the average rental price per square meter used to estimate a sale's rental yield
+        
+        Args:
+            property_dict: Property dictionary
+            
+        Returns:
+            Average monthly rent per square meter, or None (see
+            AnalysisService._get_rental_price_per_sqm)
+        """
+        cities = rental_price_cities([property_dict])
+        if not cities:
+            return None
+        
+        return lookup_rental_price_per_sqm(await self._build_area_price_table(cities, {'rent'}), property_dict)
+    
+    @staticmethod
+    async def _bounded(slots: asyncio.Semaphore, awaitable):
+        """Await a coroutine once one of the slots is free"""
+        async with slots:
+            return await awaitable
+    
+    async def _get_area_comparison_data(self, property_dict: Dict[str, Any]) -> Tuple[Dict[str, Any],
+                                                                                       Optional[PriceDistribution]]:
+        """
+        Get comparison data for the area where the property is located
+        
+        Args:
+            property_dict: Property dictionary
+            
+        Returns:
+            Tuple of the area comparison data and the segment's price
+            distribution (see AnalysisService._get_area_comparison_data)
+        """
+        try:
+            comparison = await asyncio.to_thread(precomputed_area_comparison, self.analysis.columnar,
+                                                 self.analysis.area_stats, property_dict)
+            if comparison is not None:
+                return comparison
+            
+            area_filter, pipeline = area_facet_query(property_dict)
+            try:
+                facet_result = await self.collection.aggregate(pipeline).to_list(None)
+            except OperationFailure as e:
+                logger.warning(f"$facet aggregation not supported: {str(e)}")
+                facet_result = []
+            
+            if facets_evaluated(facet_result):
+                facets = facet_result[0]
+            else:
+                documents = await self.collection.find(area_filter, AREA_FACET_PROJECTION).to_list(None)
+                facets = compute_area_facets(documents, property_dict.get('property_type'),
+                                             property_dict.get('operation_type'))
+            
+            return area_comparison_from_facets(property_dict, facets)
+        except Exception as e:
+            logger.error(f"Error getting area comparison data: {str(e)}")
+            return {}, None
+    
+    async def _get_similar_properties(self, property_dict: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Get similar properties to the given property
+        
+        The nearest neighbors are found in the in-memory segment index in a
+        worker thread, and their documents are fetched with Motor.
+        
+        Args:
+            property_dict: Property dictionary
+            
+        Returns:
+            List of similar properties, most similar first
+        """
+        try:
+            similarity = self.analysis.similarity
+            object_ids, distances = await asyncio.to_thread(similarity.find_similar, property_dict, 10)
+            if not object_ids:
+                return []
+            
+            documents = await self.collection.find({'_id': {'$in': object_ids}}, SIMILAR_PROJECTION).to_list(None)
+            return similarity.format_similar(documents, object_ids, distances)
+        except Exception as e:
+            logger.error(f"Error getting similar properties: {str(e)}")
+            return []
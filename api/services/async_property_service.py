@@ -0,0 +1,210 @@
+"""
+Async service for retrieving property data from MongoDB.
+
+Mirrors PropertyService for the ASGI server mode: queries run on the Motor
+driver so a request waiting on MongoDB does not hold a worker thread, while
+the query filters are built by the same build_query_filter as PropertyService.
+"""
+
+import logging
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+from api.services.property_service import build_query_filter, PROPERTY_SORT, MAP_PROJECTION, STREAM_BATCH_SIZE
+from api.utils.async_db import get_async_db_connection
+from api.utils.encoding import encode_document
+from api.utils.pagination import apply_cursor, encode_cursor, check_page_size
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPropertyService:
+    """Async service for retrieving property data"""
+    
+    def __init__(self, db=None):
+        """
+        Initialize the async property service
+        
+        Args:
+            db: Motor database object (optional, a new client is created if not given)
+        """
+        self.db = db if db is not None else get_async_db_connection()
+        self.collection = self.db['properties']
+    
+    async def get_properties_page(self, limit=100, skip=0, page_cursor=None,
+                                  **filters) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Get a page of properties with optional filtering
+        
+        Args:
+            limit: Maximum number of properties to return
+            skip: Number of properties to skip (legacy pagination, prefer page_cursor)
+            page_cursor: Continuation token returned with the previous page (optional)
+            **filters: Filters accepted by PropertyService.get_properties_page
+            
+        Returns:
+            Tuple of the list of property dictionaries and the continuation
+            token for the next page (None if this is the last page)
+            
+        Raises:
+            ValueError: If the limit is out of range or the continuation token is invalid
+        """
+        check_page_size(limit)
+        query_filter = apply_cursor(build_query_filter(**filters), PROPERTY_SORT, page_cursor)
+        
+        next_cursor = None
+        try:
+            cursor = self.collection.find(query_filter).sort(PROPERTY_SORT)
+            if skip:
+                cursor = cursor.skip(skip)
+            # Fetch one extra document to know whether there is a next page
+            properties = await cursor.limit(limit + 1).to_list(limit + 1)
+            if len(properties) > limit:
+                properties = properties[:limit]
+                next_cursor = encode_cursor(PROPERTY_SORT, properties[-1])
+            properties = [encode_document(prop) for prop in properties]
+        except Exception as e:
+            logger.warning(f"Error querying database: {str(e)}, returning empty list")
+            properties = []
+        
+        return properties, next_cursor
+    
+    async def get_property_by_id(self, property_id: str, source: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a property by its ID and source
+        
+        Args:
+            property_id: The property ID
+            source: The source website (e.g., 'idealista', 'fotocasa')
+            
+        Returns:
+            Property dictionary or None if not found
+        """
+        try:
+            property_data = await self.collection.find_one({'id': property_id, 'source': source})
+            return encode_document(property_data) if property_data else None
+        except Exception as e:
+            logger.error(f"Error getting property by ID: {str(e)}")
+            return None
+    
+    async def iter_properties(self, limit=None, page_cursor=None, **filters) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream properties with optional filtering straight from the database cursor
+        
+        Args:
+            limit: Maximum number of properties to return (optional, no limit if not given)
+            page_cursor: Continuation token to start after (optional)
+            **filters: Filters accepted by PropertyService.iter_properties
+            
+        Yields:
+            Property dictionaries
+            
+        Raises:
+            ValueError: If the limit is negative or the continuation token is invalid
+        """
+        check_page_size(limit, streaming=True)
+        query_filter = apply_cursor(build_query_filter(**filters), PROPERTY_SORT, page_cursor)
+        
+        cursor = self.collection.find(query_filter).sort(PROPERTY_SORT).batch_size(STREAM_BATCH_SIZE)
+        if limit:
+            cursor = cursor.limit(limit)
+        
+        async for document in self._iter_formatted(cursor):
+            yield document
+    
+    async def get_properties_with_coordinates(self, limit=1000, **filters) -> List[Dict[str, Any]]:
+        """
+        Get properties with coordinates for map display
+        
+        Args:
+            limit: Maximum number of properties to return
+            **filters: Filters accepted by PropertyService.get_properties_with_coordinates
+            
+        Returns:
+            List of property dictionaries with coordinates
+            
+        Raises:
+            ValueError: If the limit is negative
+        """
+        try:
+            return [document async for document in self.iter_properties_with_coordinates(limit=limit, **filters)]
+        except ValueError:
+            raise
+        except Exception as e:
+            logger.error(f"Error getting properties with coordinates: {str(e)}")
+            return []
+    
+    async def iter_properties_with_coordinates(self, limit=1000, **filters) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream properties with coordinates for map display straight from the database cursor
+        
+        Args:
+            limit: Maximum number of properties to return (no limit if None or 0)
+            **filters: Filters accepted by PropertyService.iter_properties_with_coordinates
+            
+        Yields:
+            Property dictionaries with coordinates
+            
+        Raises:
+            ValueError: If the limit is negative
+        """
+        check_page_size(limit, streaming=True)
+        query_filter = build_query_filter(with_coordinates=True, **filters)
+        
+        cursor = self.collection.find(query_filter, MAP_PROJECTION).batch_size(STREAM_BATCH_SIZE)
+        if limit:
+            cursor = cursor.limit(limit)
+        
+        async for document in self._iter_formatted(cursor):
+            yield document
+    
+    async def get_cities(self) -> List[str]:
+        """
+        Get a list of all cities in the database
+        
+        Returns:
+            List of city names
+        """
+        try:
+            cities = await self.collection.distinct('city')
+            return sorted(city for city in cities if city)
+        except Exception as e:
+            logger.error(f"Error getting cities: {str(e)}")
+            return []
+    
+    async def get_neighborhoods(self, city: str) -> List[str]:
+        """
+        Get neighborhoods for a specific city
+        
+        Args:
+            city: The city name
+            
+        Returns:
+            List of neighborhood names
+        """
+        try:
+            neighborhoods = await self.collection.distinct('neighborhood', {'city': city})
+            return sorted(n for n in neighborhoods if n)
+        except Exception as e:
+            logger.error(f"Error getting neighborhoods: {str(e)}")
+            return []
+    
+    async def _iter_formatted(self, cursor) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Format documents from a Motor cursor one at a time
+        
+        See PropertyService._iter_formatted for how errors are reported.
+        
+        Args:
+            cursor: Motor cursor
+            
+        Yields:
+            Formatted property dictionaries
+        """
+        streamed = 0
+        try:
+            async for document in cursor:
+                yield encode_document(document)
+                streamed += 1
+        except Exception as e:
+            if streamed:
+                logger.error(f"Error reading from database after {streamed} documents: {str(e)}, aborting stream")
+            raise
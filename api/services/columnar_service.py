@@ -0,0 +1,545 @@
+"""
+Service for the columnar snapshot of the property corpus used by the analytics.
+
+The area analytics only need a few numeric columns grouped by a few
+categorical ones, so the `properties` collection is loaded once per data
+generation into float arrays and dictionary-encoded category codes. Group-bys
+and area comparisons then run as vectorized NumPy operations without database
+round trips.
+
+The scheduler saves the snapshot after each scrape as .npy files next to a
+JSON manifest, before it records the new data generation. API workers
+memory-map it once the generation it was saved for is current and keep
+serving the previous one until then. Workers never build it from the
+database, so without a saved snapshot the analytics use the precomputed area
+statistics.
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from api.utils.db import get_db_connection
+from api.utils.data_version import DataVersionWatcher, get_data_version
+from api.services.area_stats_service import AREA_FIELDS
+from api.utils.price_distribution import PriceDistribution
+
+logger = logging.getLogger(__name__)
+
+# Numeric columns, stored as floats with NaN for missing values
+NUMERIC_COLUMNS = ('price', 'size', 'price_per_sqm', 'days_listed', 'investment_score')
+
+# Categorical columns, stored as codes into their sorted categories (-1 for missing values)
+CATEGORICAL_COLUMNS = AREA_FIELDS
+
+# Fields loaded into the snapshot
+SNAPSHOT_PROJECTION = {'_id': 0, **{column: 1 for column in NUMERIC_COLUMNS + CATEGORICAL_COLUMNS}}
+
+# Name of the file describing the saved snapshot
+MANIFEST_FILE = 'manifest.json'
+
+# Seconds before a worker looks for a saved snapshot again after not finding
+# the one of the current generation
+MANIFEST_RETRY_INTERVAL = 30
+
+
+class ColumnarSnapshot:
+    """Numeric and dictionary-encoded categorical columns of the properties at one data generation"""
+    
+    def __init__(self, numeric: Dict[str, np.ndarray], codes: Dict[str, np.ndarray],
+                 categories: Dict[str, List[str]], generation: int):
+        """
+        Initialize the snapshot
+        
+        Args:
+            numeric: Float array of each numeric column
+            codes: Category code array of each categorical column
+            categories: Sorted category labels of each categorical column
+            generation: Data generation the snapshot was built from
+        """
+        self.numeric = numeric
+        self.codes = codes
+        self.categories = categories
+        self.generation = generation
+        self._labels = {column: {label: code for code, label in enumerate(labels)}
+                        for column, labels in categories.items()}
+        self._price_table = None
+        self._distributions = {}
+    
+    @classmethod
+    def from_documents(cls, documents, generation: int) -> 'ColumnarSnapshot':
+        """
+        Build a snapshot from property documents
+        
+        Args:
+            documents: Iterable of property documents
+            generation: Data generation the documents belong to
+            
+        Returns:
+            Columnar snapshot
+        """
+        numeric_values = {column: [] for column in NUMERIC_COLUMNS}
+        categorical_values = {column: [] for column in CATEGORICAL_COLUMNS}
+        
+        for document in documents:
+            for column, values in numeric_values.items():
+                value = document.get(column)
+                values.append(value if isinstance(value, (int, float)) else np.nan)
+            for column, values in categorical_values.items():
+                value = document.get(column)
+                values.append(value if isinstance(value, str) else None)
+        
+        numeric = {column: np.array(values, dtype=float) for column, values in numeric_values.items()}
+        
+        codes = {}
+        categories = {}
+        for column, values in categorical_values.items():
+            labels = sorted({value for value in values if value is not None})
+            lookup = {label: code for code, label in enumerate(labels)}
+            codes[column] = np.array([lookup.get(value, -1) for value in values], dtype=np.int32)
+            categories[column] = labels
+        
+        return cls(numeric, codes, categories, generation)
+    
+    @staticmethod
+    def read_manifest(directory: str) -> Optional[Dict[str, Any]]:
+        """
+        Read the manifest of the snapshot saved in a directory
+        
+        Args:
+            directory: Snapshot directory
+            
+        Returns:
+            Manifest dictionary or None if no snapshot has been saved
+        """
+        try:
+            with open(os.path.join(directory, MANIFEST_FILE), encoding='utf-8') as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return None
+    
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> Optional['ColumnarSnapshot']:
+        """
+        Load the snapshot saved in a directory
+        
+        Args:
+            directory: Snapshot directory
+            mmap: Whether to memory-map the column files instead of reading them
+            
+        Returns:
+            Columnar snapshot or None if no snapshot has been saved
+        """
+        manifest = cls.read_manifest(directory)
+        if manifest is None:
+            return None
+        
+        path = os.path.join(directory, manifest['path'])
+        mmap_mode = 'r' if mmap else None
+        numeric = {column: np.load(os.path.join(path, f'{column}.npy'), mmap_mode=mmap_mode)
+                   for column in NUMERIC_COLUMNS}
+        codes = {column: np.load(os.path.join(path, f'{column}.codes.npy'), mmap_mode=mmap_mode)
+                 for column in CATEGORICAL_COLUMNS}
+        
+        return cls(numeric, codes, manifest['categories'], manifest['generation'])
+    
+    def save(self, directory: str):
+        """
+        Save the snapshot to a directory
+        
+        The columns are written to a new subdirectory for the generation and
+        the manifest is then replaced atomically, so readers always see a
+        complete snapshot. Older generations are removed; workers that still
+        have them memory-mapped keep reading the unlinked files.
+        
+        Args:
+            directory: Snapshot directory
+        """
+        os.makedirs(directory, exist_ok=True)
+        name = f'g{self.generation}'
+        path = os.path.join(directory, name)
+        temporary_path = os.path.join(directory, f'.{name}.{os.getpid()}')
+        
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        os.makedirs(temporary_path)
+        for column, values in self.numeric.items():
+            np.save(os.path.join(temporary_path, f'{column}.npy'), np.asarray(values))
+        for column, values in self.codes.items():
+            np.save(os.path.join(temporary_path, f'{column}.codes.npy'), np.asarray(values))
+        
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temporary_path, path)
+        
+        manifest = {
+            'generation': self.generation,
+            'path': name,
+            'rows': len(self),
+            'built_at': datetime.now().isoformat(),
+            'categories': self.categories
+        }
+        temporary_manifest = os.path.join(directory, f'.{MANIFEST_FILE}.{os.getpid()}')
+        with open(temporary_manifest, 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, ensure_ascii=False)
+        os.replace(temporary_manifest, os.path.join(directory, MANIFEST_FILE))
+        
+        for entry in os.listdir(directory):
+            if entry.startswith('g') and entry != name and os.path.isdir(os.path.join(directory, entry)):
+                shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    
+    def __len__(self):
+        """Number of properties in the snapshot"""
+        return len(self.codes[CATEGORICAL_COLUMNS[0]])
+    
+    def code(self, column: str, value: Optional[str]) -> int:
+        """
+        Get the category code of a value
+        
+        Args:
+            column: Categorical column name
+            value: Value to encode, None for missing values
+            
+        Returns:
+            Category code, -1 for None and -2 for values not in the snapshot
+        """
+        if value is None:
+            return -1
+        return self._labels[column].get(value, -2)
+    
+    def mask(self, **conditions) -> np.ndarray:
+        """
+        Build the mask of the rows whose categorical columns equal the given values
+        
+        Args:
+            **conditions: Value of each categorical column to match, where
+                None matches missing values
+                
+        Returns:
+            Boolean mask over the snapshot
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for column, value in conditions.items():
+            mask &= self.codes[column] == self.code(column, value)
+        return mask
+    
+    def area_facets(self, city: str, neighborhood: Optional[str], property_type: Optional[str],
+                    operation_type: Optional[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Compute the area comparison facets
+        
+        The result has the same shape as the $facet aggregation in
+        AnalysisService._get_area_comparison_data, without the values of the
+        price_distribution facet, which price_distribution keeps sorted.
+        
+        Args:
+            city: The city
+            neighborhood: The neighborhood (optional, the whole city if not given)
+            property_type: Type of property to compare against
+            operation_type: Type of operation to compare against
+            
+        Returns:
+            Dictionary with property_count, price_per_sqm, time_on_market and
+            property_types facets
+        """
+        area = self._area_mask(city, neighborhood)
+        same_operation = area & self.mask(operation_type=operation_type)
+        same_segment = same_operation & self.mask(property_type=property_type)
+        
+        property_count = int(area.sum())
+        facets = {
+            'property_count': [{'count': property_count}] if property_count else [],
+            'price_per_sqm': [],
+            'time_on_market': [],
+            'property_types': []
+        }
+        
+        values = self.numeric['price_per_sqm'][same_segment]
+        values = values[~np.isnan(values)]
+        if values.size:
+            facets['price_per_sqm'] = [{
+                '_id': None,
+                'avg_price_per_sqm': float(values.mean()),
+                'min_price_per_sqm': float(values.min()),
+                'max_price_per_sqm': float(values.max()),
+                'count': int(values.size)
+            }]
+        
+        values = self.numeric['days_listed'][same_segment]
+        values = values[~np.isnan(values)]
+        if values.size:
+            facets['time_on_market'] = [{
+                '_id': None,
+                'avg_days_listed': float(values.mean()),
+                'count': int(values.size)
+            }]
+        
+        type_codes = self.codes['property_type'][same_operation]
+        type_codes = type_codes[type_codes >= 0]
+        if type_codes.size:
+            counts = np.bincount(type_codes, minlength=len(self.categories['property_type']))
+            present = np.nonzero(counts)[0]
+            order = present[np.argsort(-counts[present], kind='stable')]
+            facets['property_types'] = [
+                {'_id': self.categories['property_type'][code], 'count': int(counts[code])} for code in order
+            ]
+        
+        return facets
+    
+    def price_distribution(self, city: str, neighborhood: Optional[str], property_type: Optional[str],
+                           operation_type: Optional[str]) -> PriceDistribution:
+        """
+        Get the price per square meter distribution of the segment compared in area_facets
+        
+        Each segment is sorted once per snapshot, so later rank and quantile
+        lookups are binary searches and index reads.
+        
+        Args:
+            city: The city
+            neighborhood: The neighborhood (optional, the whole city if not given)
+            property_type: Type of property
+            operation_type: Type of operation
+            
+        Returns:
+            Price distribution of the segment
+        """
+        key = (city, neighborhood or None, property_type, operation_type)
+        distribution = self._distributions.get(key)
+        if distribution is None:
+            mask = self._area_mask(city, neighborhood) & self.mask(property_type=property_type,
+                                                                   operation_type=operation_type)
+            values = self.numeric['price_per_sqm'][mask]
+            distribution = PriceDistribution(values[~np.isnan(values)])
+            self._distributions[key] = distribution
+        return distribution
+    
+    def _area_mask(self, city: str, neighborhood: Optional[str]) -> np.ndarray:
+        """
+        Build the mask of the properties in an area
+        
+        Args:
+            city: The city
+            neighborhood: The neighborhood (optional, the whole city if not given)
+            
+        Returns:
+            Boolean mask over the snapshot
+        """
+        if neighborhood:
+            return self.mask(city=city, neighborhood=neighborhood)
+        return self.mask(city=city)
+    
+    @property
+    def price_table(self) -> Dict[Tuple, Tuple[float, int]]:
+        """
+        Average price per square meter and listing count for every area key
+        
+        Keys follow area_stats_key, where None means "any", like the table
+        built by AnalysisService._build_area_price_table.
+        """
+        if self._price_table is None:
+            self._price_table = self._compute_price_table()
+        return self._price_table
+    
+    def key_codes(self, column: str) -> np.ndarray:
+        """
+        Get the codes of a column with empty labels folded into missing values, as in area keys
+        
+        Args:
+            column: Categorical column name
+            
+        Returns:
+            Category code array
+        """
+        codes = self.codes[column]
+        empty = self._labels[column].get('')
+        if empty is None or column == 'city':
+            return codes
+        return np.where(codes == empty, -1, codes)
+    
+    def _compute_price_table(self) -> Dict[Tuple, Tuple[float, int]]:
+        """
+        Roll up price per square meter totals into every area level
+        
+        Returns:
+            Dictionary mapping area keys to (average price_per_sqm, count)
+        """
+        price_per_sqm = self.numeric['price_per_sqm']
+        rows = ~np.isnan(price_per_sqm)
+        values = price_per_sqm[rows]
+        codes = [self.key_codes(column)[rows] for column in CATEGORICAL_COLUMNS]
+        shape = tuple(len(self.categories[column]) + 1 for column in CATEGORICAL_COLUMNS)
+        
+        # Every combination of ignored fields below the city, narrowest first, so
+        # a key reached by a narrower level is overwritten by the level it belongs to
+        levels = sorted(
+            ((n, p, o) for n in (False, True) for p in (False, True) for o in (False, True)),
+            key=sum
+        )
+        
+        table = {}
+        for ignored in levels:
+            level_codes = [codes[0]] + [
+                np.full(len(values), -1, dtype=np.int32) if ignore else column_codes
+                for ignore, column_codes in zip(ignored, codes[1:])
+            ]
+            keys = np.ravel_multi_index([column_codes + 1 for column_codes in level_codes], shape)
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            totals = np.bincount(inverse, weights=values)
+            counts = np.bincount(inverse)
+            
+            for key_codes, total, count in zip(zip(*np.unravel_index(unique_keys, shape)), totals, counts):
+                area_key = tuple(
+                    self.categories[column][code - 1] if code else None
+                    for column, code in zip(CATEGORICAL_COLUMNS, key_codes)
+                )
+                table[area_key] = (float(total / count), int(count))
+        
+        return table
+
+
+class ColumnarService:
+    """Service for building, saving and loading the columnar snapshot of the properties"""
+    
+    def __init__(self, db=None, directory: Optional[str] = None):
+        """
+        Initialize the columnar service
+        
+        Args:
+            db: Database object (optional, a new connection is opened if not given)
+            directory: Directory the snapshot is saved to and loaded from
+                (optional, the COLUMNAR_SNAPSHOT_DIR environment variable if not
+                given; the snapshot is only kept in memory if neither is set)
+        """
+        self.db = db if db is not None else get_db_connection()
+        self.collection = self.db['properties']
+        self.directory = directory or os.environ.get('COLUMNAR_SNAPSHOT_DIR') or None
+        self.data_version = DataVersionWatcher(self.db)
+        self._snapshot = None
+        self._loaded_generation = None
+        # Future of the load in progress, shared by the requests waiting for it
+        self._loading = None
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+    
+    def rebuild(self, generation: Optional[int] = None) -> int:
+        """
+        Build the snapshot of a data generation and save it
+        
+        The scheduler builds it for the generation it is about to record, so
+        the snapshot is in place by the time API workers see that generation.
+        
+        Args:
+            generation: Data generation the snapshot is saved for (optional,
+                the current one if not given)
+                
+        Returns:
+            Number of properties in the snapshot
+        """
+        try:
+            if generation is None:
+                generation = get_data_version(self.db)['generation']
+            snapshot = self._build(generation)
+            
+            if self.directory:
+                snapshot.save(self.directory)
+                logger.info(f"Saved columnar snapshot of generation {generation} to {self.directory}")
+            
+            with self._lock:
+                self._snapshot = snapshot
+                self._loaded_generation = generation
+            
+            return len(snapshot)
+        except Exception as e:
+            logger.error(f"Error rebuilding columnar snapshot: {str(e)}")
+            return 0
+    
+    def is_available(self) -> bool:
+        """
+        Check whether a snapshot holding any properties has been loaded
+        
+        Returns:
+            True if the analytics can be served from the snapshot
+        """
+        self._ensure_loaded()
+        return self._snapshot is not None and len(self._snapshot) > 0
+    
+    @property
+    def snapshot(self) -> Optional[ColumnarSnapshot]:
+        """Latest snapshot loaded, which may be of the previous data generation"""
+        self._ensure_loaded()
+        return self._snapshot
+    
+    def _build(self, generation: int) -> ColumnarSnapshot:
+        """
+        Build the snapshot from the database
+        
+        Args:
+            generation: Data generation being read
+            
+        Returns:
+            Columnar snapshot
+        """
+        snapshot = ColumnarSnapshot.from_documents(self.collection.find({}, SNAPSHOT_PROJECTION), generation)
+        logger.info(f"Built columnar snapshot with {len(snapshot)} properties for generation {generation}")
+        return snapshot
+    
+    def _ensure_loaded(self):
+        """
+        Load the saved snapshot once the one of the current data generation appears
+        
+        The previous snapshot is served until the scheduler has saved the one
+        of the current generation, and the manifest is read again at most every
+        MANIFEST_RETRY_INTERVAL seconds in the meantime.
+        """
+        generation = self.data_version.generation
+        if self._loaded_generation == generation or not self.directory:
+            return
+        if time.monotonic() < self._retry_at:
+            return
+        
+        # The lock only guards the shared future, the snapshot is loaded by the
+        # first request that needs it while the others wait for it
+        with self._lock:
+            if self._loaded_generation == generation:
+                return
+            
+            loading = self._loading
+            is_loader = loading is None
+            if is_loader:
+                loading = Future()
+                self._loading = loading
+        
+        if not is_loader:
+            loading.result()
+            return
+        
+        snapshot = None
+        try:
+            manifest = ColumnarSnapshot.read_manifest(self.directory)
+            saved_generation = manifest.get('generation') if manifest else None
+            current = self._snapshot
+            if saved_generation is not None and saved_generation <= generation and \
+                    (current is None or current.generation != saved_generation):
+                snapshot = ColumnarSnapshot.load(self.directory)
+                logger.info(f"Loaded columnar snapshot with {len(snapshot)} properties "
+                            f"for generation {snapshot.generation}")
+        except Exception as e:
+            logger.warning(f"Error loading columnar snapshot: {str(e)}")
+        
+        with self._lock:
+            # A snapshot saved for a generation that hasn't been recorded yet
+            # is picked up once it has
+            if snapshot is not None and snapshot.generation <= generation:
+                self._snapshot = snapshot
+            
+            if self._snapshot is not None and self._snapshot.generation == generation:
+                self._loaded_generation = generation
+            else:
+                self._retry_at = time.monotonic() + MANIFEST_RETRY_INTERVAL
+            self._loading = None
+        
+        loading.set_result(None)
@@ -0,0 +1,524 @@
+"""
+Service for serving pre-aggregated map clusters by tile.
+
+Properties with coordinates are kept in an in-memory spatial index sorted by
+the Morton code of their Web Mercator tile at INDEX_ZOOM. Every map tile at or
+above that zoom covers a contiguous range of codes. When the index is built,
+the property totals of every cluster cell are added up by category for each
+zoom level up to MAX_AGGREGATED_ZOOM, so a low-zoom tile request only reads
+the pre-aggregated cells inside the viewport instead of all their properties.
+"""
+
+import math
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from api.utils.db import get_db_connection
+from api.utils.data_version import DataVersionWatcher
+
+logger = logging.getLogger(__name__)
+
+# Zoom level at which property positions are indexed
+INDEX_ZOOM = 16
+
+# Each tile is split into a grid of 2^CLUSTER_GRID_BITS x 2^CLUSTER_GRID_BITS cells
+CLUSTER_GRID_BITS = 3
+
+# Highest zoom level accepted by the tile endpoint
+MAX_ZOOM = 22
+
+# Highest zoom level served from pre-aggregated cells, whose cells are the tiles at INDEX_ZOOM
+MAX_AGGREGATED_ZOOM = INDEX_ZOOM - CLUSTER_GRID_BITS
+
+# Categorical filters of the tile endpoint
+CATEGORY_FIELDS = ('city', 'property_type', 'operation_type')
+
+# Totals pre-aggregated for every cell: property count, coordinate sums, and
+# sums and counts of the known prices and investment scores
+CELL_TOTALS = ('count', 'latitude', 'longitude', 'price_sum', 'price_count', 'score_sum', 'score_count')
+
+# Web Mercator latitude limit
+MAX_LATITUDE = 85.05112878
+
+# Fields loaded into the spatial index
+TILE_INDEX_PROJECTION = {
+    '_id': 0, 'id': 1, 'source': 1, 'latitude': 1, 'longitude': 1, 'price': 1,
+    'investment_score': 1, 'city': 1, 'property_type': 1, 'operation_type': 1
+}
+
+
+def _spread_bits(values: np.ndarray) -> np.ndarray:
+    """
+    Interleave zeros between the lower 16 bits of each value
+    
+    Args:
+        values: Unsigned integer array
+        
+    Returns:
+        Array with bit i of each value moved to bit 2i
+    """
+    values = values.astype(np.uint64) & np.uint64(0x0000FFFF)
+    values = (values | (values << np.uint64(8))) & np.uint64(0x00FF00FF)
+    values = (values | (values << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+    values = (values | (values << np.uint64(2))) & np.uint64(0x33333333)
+    values = (values | (values << np.uint64(1))) & np.uint64(0x55555555)
+    return values
+
+
+def morton_code(x, y) -> np.ndarray:
+    """
+    Compute the Morton (Z-order) code of tile coordinates
+    
+    Args:
+        x: Tile column(s)
+        y: Tile row(s)
+        
+    Returns:
+        Morton code(s) with x in the even bits and y in the odd bits
+    """
+    return _spread_bits(np.asarray(x)) | (_spread_bits(np.asarray(y)) << np.uint64(1))
+
+
+def mercator_position(latitude: np.ndarray, longitude: np.ndarray):
+    """
+    Project coordinates to normalized Web Mercator positions
+    
+    Args:
+        latitude: Latitudes in degrees
+        longitude: Longitudes in degrees
+        
+    Returns:
+        Tuple of x and y arrays in [0, 1), with y growing southwards
+    """
+    latitude = np.radians(np.clip(latitude, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (longitude + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(latitude) + 1.0 / np.cos(latitude)) / math.pi) / 2.0
+    limit = np.nextafter(1.0, 0.0)
+    return np.clip(x, 0.0, limit), np.clip(y, 0.0, limit)
+
+
+def tile_bounds(z: int, x: int, y: int) -> Dict[str, float]:
+    """
+    Get the geographic bounding box of a tile
+    
+    Args:
+        z: Zoom level
+        x: Tile column
+        y: Tile row
+        
+    Returns:
+        Dictionary with north, south, east and west bounds in degrees
+    """
+    n = 2 ** z
+    
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    
+    return {
+        'north': latitude(y),
+        'south': latitude(y + 1),
+        'west': x / n * 360.0 - 180.0,
+        'east': (x + 1) / n * 360.0 - 180.0
+    }
+
+
+class CellAggregates:
+    """Totals of the properties of each category in every non-empty cell of one zoom level"""
+    
+    def __init__(self, codes: np.ndarray, cell_x: np.ndarray, cell_y: np.ndarray, category_keys: np.ndarray,
+                 totals: Dict[str, np.ndarray], first_rows: np.ndarray):
+        """
+        Initialize the cell aggregates
+        
+        Args:
+            codes: Morton code of the cell of each group, sorted
+            cell_x: Column of the cell of each group
+            cell_y: Row of the cell of each group
+            category_keys: Combined category key of each group (see TileIndex.category_mask)
+            totals: CELL_TOTALS of each group
+            first_rows: Row of the tile index of one property of each group
+        """
+        self.codes = codes
+        self.cell_x = cell_x
+        self.cell_y = cell_y
+        self.category_keys = category_keys
+        self.totals = totals
+        self.first_rows = first_rows
+    
+    def __len__(self):
+        """Number of groups"""
+        return len(self.codes)
+    
+    @classmethod
+    def group(cls, codes: np.ndarray, cell_x: np.ndarray, cell_y: np.ndarray, category_keys: np.ndarray,
+              totals: Dict[str, np.ndarray], first_rows: np.ndarray) -> 'CellAggregates':
+        """
+        Add up the totals of the entries with the same cell and category key
+        
+        Args:
+            See __init__, with one entry per property or per finer group
+            
+        Returns:
+            Cell aggregates with one group per cell and category key
+        """
+        if not len(codes):
+            return cls(codes, cell_x, cell_y, category_keys, totals, first_rows)
+        
+        order = np.lexsort((category_keys, codes))
+        codes = codes[order]
+        category_keys = category_keys[order]
+        changes = (codes[1:] != codes[:-1]) | (category_keys[1:] != category_keys[:-1])
+        starts = np.concatenate(([0], np.nonzero(changes)[0] + 1))
+        
+        return cls(codes[starts], cell_x[order][starts], cell_y[order][starts], category_keys[starts],
+                   {name: np.add.reduceat(values[order], starts) for name, values in totals.items()},
+                   first_rows[order][starts])
+    
+    def coarser(self) -> 'CellAggregates':
+        """Aggregate the groups into the cells of the zoom level above, each made of four cells of this one"""
+        return CellAggregates.group(self.codes >> np.uint64(2), self.cell_x >> 1, self.cell_y >> 1,
+                                    self.category_keys, self.totals, self.first_rows)
+    
+    def tile_range(self, x: int, y: int) -> slice:
+        """
+        Get the groups of the cells inside a tile
+        
+        Args:
+            x: Tile column, at CLUSTER_GRID_BITS levels above this one
+            y: Tile row, at CLUSTER_GRID_BITS levels above this one
+            
+        Returns:
+            Slice of the groups
+        """
+        span = np.uint64(2 * CLUSTER_GRID_BITS)
+        start = morton_code(x, y) << span
+        end = (morton_code(x, y) + np.uint64(1)) << span
+        
+        return slice(int(np.searchsorted(self.codes, start, side='left')),
+                     int(np.searchsorted(self.codes, end, side='left')))
+
+
+class TileIndex:
+    """Properties with coordinates, sorted by Morton code, with their totals pre-aggregated by cell"""
+    
+    def __init__(self, documents: List[Dict[str, Any]]):
+        """
+        Build the index
+        
+        Args:
+            documents: Property documents with latitude and longitude
+        """
+        latitude = np.array([doc.get('latitude') for doc in documents], dtype=float)
+        longitude = np.array([doc.get('longitude') for doc in documents], dtype=float)
+        valid = np.isfinite(latitude) & np.isfinite(longitude)
+        
+        mx, my = mercator_position(latitude[valid], longitude[valid])
+        scale = 2 ** INDEX_ZOOM
+        tile_x = (mx * scale).astype(np.uint64)
+        tile_y = (my * scale).astype(np.uint64)
+        codes = morton_code(tile_x, tile_y)
+        order = np.argsort(codes, kind='stable')
+        
+        documents = [doc for doc, is_valid in zip(documents, valid) if is_valid]
+        self.codes = codes[order]
+        self.mx = mx[order]
+        self.my = my[order]
+        self.latitude = latitude[valid][order]
+        self.longitude = longitude[valid][order]
+        self.price = np.array([documents[i].get('price') for i in order], dtype=float)
+        self.investment_score = np.array([documents[i].get('investment_score') for i in order], dtype=float)
+        self.ids = [documents[i].get('id') for i in order]
+        self.sources = [documents[i].get('source') for i in order]
+        
+        # Dictionary-encode the categorical filters into one combined key per property
+        self.labels = {}
+        self.category_keys = np.zeros(len(order), dtype=np.int64)
+        for field in CATEGORY_FIELDS:
+            labels = {}
+            field_codes = [labels.setdefault(documents[i].get(field), len(labels)) for i in order]
+            self.labels[field] = labels
+            self.category_keys = self.category_keys * max(len(labels), 1) + np.array(field_codes, dtype=np.int64)
+        
+        # Pre-aggregate the clusters of every zoom level up to MAX_AGGREGATED_ZOOM
+        price_present = np.isfinite(self.price)
+        score_present = np.isfinite(self.investment_score)
+        points = CellAggregates.group(self.codes, tile_x[order].astype(np.int64), tile_y[order].astype(np.int64),
+                                      self.category_keys, {
+                                          'count': np.ones(len(order), dtype=np.int64),
+                                          'latitude': self.latitude,
+                                          'longitude': self.longitude,
+                                          'price_sum': np.where(price_present, self.price, 0.0),
+                                          'price_count': price_present.astype(np.int64),
+                                          'score_sum': np.where(score_present, self.investment_score, 0.0),
+                                          'score_count': score_present.astype(np.int64)
+                                      }, np.arange(len(order)))
+        
+        # The cells of a tile at zoom z are the tiles at zoom z + CLUSTER_GRID_BITS
+        levels = {INDEX_ZOOM: points}
+        for level in range(INDEX_ZOOM - 1, CLUSTER_GRID_BITS - 1, -1):
+            levels[level] = levels[level + 1].coarser()
+        self.levels = [levels[z + CLUSTER_GRID_BITS] for z in range(MAX_AGGREGATED_ZOOM + 1)]
+    
+    def __len__(self):
+        """Number of indexed properties"""
+        return len(self.codes)
+    
+    def tile_range(self, z: int, x: int, y: int) -> slice:
+        """
+        Get the index range covering a tile
+        
+        For tiles deeper than INDEX_ZOOM, the range of the enclosing indexed
+        tile is returned.
+        
+        Args:
+            z: Zoom level
+            x: Tile column
+            y: Tile row
+            
+        Returns:
+            Slice of the sorted arrays
+        """
+        if z > INDEX_ZOOM:
+            shift = z - INDEX_ZOOM
+            z, x, y = INDEX_ZOOM, x >> shift, y >> shift
+        
+        span = np.uint64(2 * (INDEX_ZOOM - z))
+        start = morton_code(x, y) << span
+        end = (morton_code(x, y) + np.uint64(1)) << span
+        
+        return slice(int(np.searchsorted(self.codes, start, side='left')),
+                     int(np.searchsorted(self.codes, end, side='left')))
+    
+    def category_mask(self, category_keys: np.ndarray, **filters) -> np.ndarray:
+        """
+        Build the mask of the combined category keys matching categorical filters
+        
+        Args:
+            category_keys: Combined category keys of properties or cell groups
+            **filters: Field values to match (None values are ignored)
+            
+        Returns:
+            Boolean mask over the keys
+        """
+        mask = np.ones(len(category_keys), dtype=bool)
+        divisor = 1
+        for field in reversed(CATEGORY_FIELDS):
+            labels = self.labels[field]
+            value = filters.get(field)
+            if value is not None:
+                if value not in labels:
+                    return np.zeros_like(mask)
+                mask &= (category_keys // divisor) % len(labels) == labels[value]
+            divisor *= max(len(labels), 1)
+        return mask
+
+
+class MapTileService:
+    """Service for serving pre-aggregated map clusters by tile"""
+    
+    def __init__(self, db=None):
+        """
+        Initialize the map tile service
+        
+        Args:
+            db: Database object (optional, a new connection is opened if not given)
+        """
+        self.db = db if db is not None else get_db_connection()
+        self.collection = self.db['properties']
+        self.data_version = DataVersionWatcher(self.db)
+        # Index and the data generation it was built from, replaced together
+        self._current = None
+        self._rebuilding = None
+        self._lock = threading.Lock()
+    
+    def get_tile(self, z: int, x: int, y: int, city: Optional[str] = None,
+                 property_type: Optional[str] = None,
+                 operation_type: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Get the property clusters inside a map tile
+        
+        The tile is split into a grid of cells, and every non-empty cell is
+        returned with its property count, centroid, average price and average
+        investment score. Up to MAX_AGGREGATED_ZOOM the cells are read from
+        the totals pre-aggregated when the index was built, deeper tiles are
+        aggregated from the few properties they hold.
+        
+        Args:
+            z: Zoom level
+            x: Tile column
+            y: Tile row
+            city: Filter by city (optional)
+            property_type: Type of property (optional)
+            operation_type: Type of operation (optional)
+            
+        Returns:
+            Dictionary with the tile bounds, total count and clusters, and
+            'stale' set if a new data generation is still being indexed
+            
+        Raises:
+            ValueError: If the tile coordinates are out of range
+        """
+        if not 0 <= z <= MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+            raise ValueError(f"Invalid tile {z}/{x}/{y}")
+        
+        index, stale = self._get_index()
+        filters = {'city': city, 'property_type': property_type, 'operation_type': operation_type}
+        grid = 2 ** CLUSTER_GRID_BITS
+        
+        if z <= MAX_AGGREGATED_ZOOM:
+            level = index.levels[z]
+            groups = level.tile_range(x, y)
+            selected = np.nonzero(index.category_mask(level.category_keys[groups], **filters))[0] + groups.start
+            cells = (level.cell_y[selected] - y * grid) * grid + (level.cell_x[selected] - x * grid)
+            totals = {name: values[selected] for name, values in level.totals.items()}
+            first_rows = level.first_rows[selected]
+        else:
+            rows = index.tile_range(z, x, y)
+            mask = index.category_mask(index.category_keys[rows], **filters)
+            
+            # Locate each property in the tile's cell grid
+            scale = 2 ** (z + CLUSTER_GRID_BITS)
+            cell_x = np.floor(index.mx[rows] * scale).astype(np.int64) - x * grid
+            cell_y = np.floor(index.my[rows] * scale).astype(np.int64) - y * grid
+            
+            # Tiles deeper than the index zoom share a range with their neighbors
+            mask &= (cell_x >= 0) & (cell_x < grid) & (cell_y >= 0) & (cell_y < grid)
+            positions = np.nonzero(mask)[0]
+            cells = cell_y[positions] * grid + cell_x[positions]
+            first_rows = positions + rows.start
+            
+            price = index.price[first_rows]
+            score = index.investment_score[first_rows]
+            totals = {
+                'count': np.ones(len(positions), dtype=np.int64),
+                'latitude': index.latitude[first_rows],
+                'longitude': index.longitude[first_rows],
+                'price_sum': np.nan_to_num(price),
+                'price_count': np.isfinite(price).astype(np.int64),
+                'score_sum': np.nan_to_num(score),
+                'score_count': np.isfinite(score).astype(np.int64)
+            }
+        
+        tile = {
+            'tile': {'z': z, 'x': x, 'y': y},
+            'bounds': tile_bounds(z, x, y),
+            'grid_size': grid,
+            'count': int(totals['count'].sum()),
+            'clusters': self._clusters(index, cells, totals, first_rows, grid * grid)
+        }
+        
+        if stale:
+            tile['stale'] = True
+        
+        return tile
+    
+    def _clusters(self, index: TileIndex, cells: np.ndarray, totals: Dict[str, np.ndarray],
+                  first_rows: np.ndarray, size: int) -> List[Dict[str, Any]]:
+        """
+        Add up the totals of each cell of a tile into its cluster
+        
+        Args:
+            index: Tile index the totals come from
+            cells: Cell of each entry, row-major in the tile's grid
+            totals: CELL_TOTALS of each entry
+            first_rows: Row of the tile index of one property of each entry
+            size: Number of cells in the grid
+            
+        Returns:
+            Clusters of the non-empty cells
+        """
+        if not len(cells):
+            return []
+        
+        grid = int(math.isqrt(size))
+        sums = {name: np.bincount(cells, weights=values, minlength=size) for name, values in totals.items()}
+        count = sums['count']
+        
+        clusters = []
+        for cell in np.nonzero(count)[0]:
+            cell_count = int(count[cell])
+            price_count = sums['price_count'][cell]
+            score_count = sums['score_count'][cell]
+            cluster = {
+                'cell': [int(cell % grid), int(cell // grid)],
+                'count': cell_count,
+                'latitude': round(float(sums['latitude'][cell] / cell_count), 6),
+                'longitude': round(float(sums['longitude'][cell] / cell_count), 6),
+                'avg_price': round(float(sums['price_sum'][cell] / price_count), 2) if price_count else None,
+                'avg_investment_score': (round(float(sums['score_sum'][cell] / score_count), 2)
+                                         if score_count else None)
+            }
+            
+            # Single properties can be opened directly from the map
+            if cell_count == 1:
+                row = first_rows[cells == cell][0]
+                cluster['id'] = index.ids[row]
+                cluster['source'] = index.sources[row]
+            
+            clusters.append(cluster)
+        
+        return clusters
+    
+    def _get_index(self) -> Tuple[TileIndex, bool]:
+        """
+        Get the spatial index, rebuilding it if a new data generation has been recorded
+        
+        Only the first index is built on the request thread. Later ones are
+        built in a background thread, while requests keep being served from
+        the previous index.
+        
+        Returns:
+            Tuple of the index and whether it is from an older generation
+        """
+        generation = self.data_version.generation
+        current = self._current
+        if current is not None and current[0] == generation:
+            return current[1], False
+        
+        if current is None:
+            with self._lock:
+                if self._current is None:
+                    self._current = (generation, self._build_index(generation))
+            return self._current[1], self._current[0] != generation
+        
+        with self._lock:
+            if self._rebuilding is None:
+                self._rebuilding = threading.Thread(target=self._rebuild, args=(generation,),
+                                                    name='tile-index', daemon=True)
+                self._rebuilding.start()
+        
+        return current[1], True
+    
+    def _rebuild(self, generation: int):
+        """
+        Replace the index with one of a new data generation, in the background thread
+        
+        Args:
+            generation: Data generation to index
+        """
+        try:
+            self._current = (generation, self._build_index(generation))
+        except Exception as e:
+            logger.error(f"Error rebuilding map tile index: {str(e)}")
+        finally:
+            with self._lock:
+                self._rebuilding = None
+    
+    def _build_index(self, generation: int) -> TileIndex:
+        """
+        Load the properties with coordinates into a new index
+        
+        Args:
+            generation: Data generation being indexed
+            
+        Returns:
+            Tile index
+        """
+        documents = list(self.collection.find({
+            'latitude': {'$exists': True, '$ne': None},
+            'longitude': {'$exists': True, '$ne': None}
+        }, TILE_INDEX_PROJECTION))
+        index = TileIndex(documents)
+        logger.info(f"Built map tile index with {len(index)} properties for generation {generation}")
+        return index
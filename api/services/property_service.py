@@ -3,14 +3,101 @@ Service for retrieving and managing property data from MongoDB.
 """
 
 import logging
-from typing import List, Dict, Any, Optional
-from bson.json_util import dumps, loads
-import json
-from datetime import datetime
-from api.utils.db import get_db_connection
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+from pymongo import ASCENDING
+from api.utils.db import get_db_connection, is_fake_db
+from api.utils.data_version import DataVersionWatcher
+from api.utils.encoding import encode_document
+from api.utils.geo import GeoKDTree, geo_filter
+from api.utils.pagination import apply_cursor, encode_cursor, check_page_size
 
 logger = logging.getLogger(__name__)
 
+# Stable sort order for paginated property listings
+PROPERTY_SORT = [('_id', ASCENDING)]
+
+# Fields returned for map display
+MAP_PROJECTION = {
+    'id': 1, 'source': 1, 'title': 1, 'price': 1, 'size': 1,
+    'latitude': 1, 'longitude': 1, 'property_type': 1,
+    'investment_score': 1, 'url': 1, 'city': 1, 'neighborhood': 1
+}
+
+# Documents fetched per round trip when streaming results
+STREAM_BATCH_SIZE = 500
+
+
+def build_query_filter(city=None, neighborhood=None, min_price=None, max_price=None,
+                       property_type=None, operation_type=None, min_size=None, max_size=None,
+                       min_rooms=None, bbox=None, near=None, radius_km=None,
+                       with_coordinates=False) -> Dict[str, Any]:
+    """
+    Build the query filter for property searches
+    
+    Geographic constraints are matched against the 2dsphere index on
+    location (see PropertyService._build_query_filter for the in-memory
+    database).
+    
+    Args:
+        city: Filter by city
+        neighborhood: Filter by neighborhood
+        min_price: Minimum price
+        max_price: Maximum price
+        property_type: Type of property (apartment, house, etc.)
+        operation_type: Type of operation (sale, rent)
+        min_size: Minimum size in square meters
+        max_size: Maximum size in square meters
+        min_rooms: Minimum number of rooms
+        bbox: Bounding box as (west, south, east, north) (optional)
+        near: Center point as (latitude, longitude) for radius searches (optional)
+        radius_km: Radius around the center point in kilometers (optional)
+        with_coordinates: Only include properties with coordinates
+        
+    Returns:
+        MongoDB query filter
+    """
+    query_filter = {}
+    
+    if with_coordinates:
+        query_filter['latitude'] = {'$exists': True, '$ne': None}
+        query_filter['longitude'] = {'$exists': True, '$ne': None}
+    
+    if city:
+        query_filter['city'] = city
+    
+    if neighborhood:
+        query_filter['neighborhood'] = neighborhood
+    
+    if property_type:
+        query_filter['property_type'] = property_type
+    
+    if operation_type:
+        query_filter['operation_type'] = operation_type
+    
+    price_filter = {}
+    if min_price is not None:
+        price_filter['$gte'] = min_price
+    if max_price is not None:
+        price_filter['$lte'] = max_price
+    if price_filter:
+        query_filter['price'] = price_filter
+    
+    size_filter = {}
+    if min_size is not None:
+        size_filter['$gte'] = min_size
+    if max_size is not None:
+        size_filter['$lte'] = max_size
+    if size_filter:
+        query_filter['size'] = size_filter
+    
+    if min_rooms is not None:
+        query_filter['rooms'] = {'$gte': min_rooms}
+    
+    query_filter.update(geo_filter(bbox=bbox, near=near, radius_km=radius_km))
+    
+    return query_filter
+
 
 class PropertyService:
     """Service for retrieving and managing property data"""
@@ -19,13 +106,51 @@ class PropertyService:
         """Initialize the property service"""
         self.db = get_db_connection()
         self.collection = self.db['properties']
+        self.data_version = DataVersionWatcher(self.db)
+        self._geo_index = None
+        self._geo_index_generation = None
+        self._geo_lock = threading.Lock()
     
     def get_properties(self, city=None, neighborhood=None, min_price=None, max_price=None,
                       property_type=None, operation_type=None, min_size=None, max_size=None, min_rooms=None,
-                      limit=100, skip=0) -> List[Dict[str, Any]]:
+                      bbox=None, near=None, radius_km=None,
+                      limit=100, skip=0, page_cursor=None) -> List[Dict[str, Any]]:
         """
         Get properties with optional filtering
         
+        Args:
+            See get_properties_page
+            
+        Returns:
+            List of property dictionaries
+        """
+        properties, _ = self.get_properties_page(
+            city=city,
+            neighborhood=neighborhood,
+            min_price=min_price,
+            max_price=max_price,
+            property_type=property_type,
+            operation_type=operation_type,
+            min_size=min_size,
+            max_size=max_size,
+            min_rooms=min_rooms,
+            bbox=bbox,
+            near=near,
+            radius_km=radius_km,
+            limit=limit,
+            skip=skip,
+            page_cursor=page_cursor
+        )
+        
+        return properties
+    
+    def get_properties_page(self, city=None, neighborhood=None, min_price=None, max_price=None,
+                            property_type=None, operation_type=None, min_size=None, max_size=None,
+                            min_rooms=None, bbox=None, near=None, radius_km=None, limit=100, skip=0,
+                            page_cursor=None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Get a page of properties with optional filtering
+        
         Args:
             city: Filter by city
             neighborhood: Filter by neighborhood
@@ -36,62 +161,66 @@ class PropertyService:
             min_size: Minimum size in square meters
             max_size: Maximum size in square meters
             min_rooms: Minimum number of rooms
+            bbox: Bounding box as (west, south, east, north) (optional)
+            near: Center point as (latitude, longitude) for radius searches (optional)
+            radius_km: Radius around the center point in kilometers (optional)
             limit: Maximum number of properties to return
-            skip: Number of properties to skip (for pagination)
+            skip: Number of properties to skip (legacy pagination, prefer page_cursor)
+            page_cursor: Continuation token returned with the previous page (optional)
             
         Returns:
-            List of property dictionaries
+            Tuple of the list of property dictionaries and the continuation
+            token for the next page (None if this is the last page)
+            
+        Raises:
+            ValueError: If the limit is out of range or the continuation token is invalid
         """
         try:
-            # Build query filter
-            query_filter = {}
-            
-            if city:
-                query_filter['city'] = city
+            check_page_size(limit)
             
-            if neighborhood:
-                query_filter['neighborhood'] = neighborhood
-            
-            if property_type:
-                query_filter['property_type'] = property_type
-            
-            if operation_type:
-                query_filter['operation_type'] = operation_type
-            
-            price_filter = {}
-            if min_price is not None:
-                price_filter['$gte'] = min_price
-            if max_price is not None:
-                price_filter['$lte'] = max_price
-            if price_filter:
-                query_filter['price'] = price_filter
-            
-            size_filter = {}
-            if min_size is not None:
-                size_filter['$gte'] = min_size
-            if max_size is not None:
-                size_filter['$lte'] = max_size
-            if size_filter:
-                query_filter['size'] = size_filter
+            # Build query filter
+            query_filter = self._build_query_filter(
+                city=city,
+                neighborhood=neighborhood,
+                min_price=min_price,
+                max_price=max_price,
+                property_type=property_type,
+                operation_type=operation_type,
+                min_size=min_size,
+                max_size=max_size,
+                min_rooms=min_rooms,
+                bbox=bbox,
+                near=near,
+                radius_km=radius_km
+            )
             
-            if min_rooms is not None:
-                query_filter['rooms'] = {'$gte': min_rooms}
+            # Continue after the last property of the previous page
+            query_filter = apply_cursor(query_filter, PROPERTY_SORT, page_cursor)
             
             # Query database
+            next_cursor = None
             try:
-                cursor = self.collection.find(query_filter).limit(limit).skip(skip)
-                # Convert to list of dictionaries
-                properties = loads(dumps(list(cursor)))
-                # Convert MongoDB dates to string
+                cursor = self.collection.find(query_filter).sort(PROPERTY_SORT)
+                if skip:
+                    cursor = cursor.skip(skip)
+                # Fetch one extra document to know whether there is a next page
+                cursor = cursor.limit(limit + 1)
+                properties = list(cursor)
+                if len(properties) > limit:
+                    properties = properties[:limit]
+                    next_cursor = encode_cursor(PROPERTY_SORT, properties[-1])
+                # Convert MongoDB documents to response dictionaries
                 properties = self._format_properties(properties)
             except Exception as e:
                 logger.warning(f"Error querying database: {str(e)}, returning empty list")
                 properties = []
             
-            return properties
+            return properties, next_cursor
+        except ValueError:
+            raise
         except Exception as e:
             logger.error(f"Error getting properties: {str(e)}")
-            return []
+            return [], None
     
     def get_property_by_id(self, property_id: str, source: str) -> Optional[Dict[str, Any]]:
         """
@@ -109,21 +238,73 @@ class PropertyService:
             property_data = self.collection.find_one({'id': property_id, 'source': source})
             
             if property_data:
-                # Convert MongoDB document to dictionary
-                property_dict = loads(dumps(property_data))
-                
-                # Convert MongoDB dates to string
-                property_dict = self._format_property(property_dict)
-                
-                return property_dict
+                # Convert MongoDB document to response dictionary
+                return self._format_property(property_data)
             else:
                 return None
         except Exception as e:
             logger.error(f"Error getting property by ID: {str(e)}")
             return None
     
+    def iter_properties(self, city=None, neighborhood=None, min_price=None, max_price=None,
+                        property_type=None, operation_type=None, min_size=None, max_size=None,
+                        min_rooms=None, bbox=None, near=None, radius_km=None, limit=None,
+                        page_cursor=None) -> Iterator[Dict[str, Any]]:
+        """
+        Stream properties with optional filtering straight from the database cursor
+        
+        Documents are encoded one at a time as they arrive, so memory use does
+        not grow with the number of results.
+        
+        Args:
+            city: Filter by city
+            neighborhood: Filter by neighborhood
+            min_price: Minimum price
+            max_price: Maximum price
+            property_type: Type of property (apartment, house, etc.)
+            operation_type: Type of operation (sale, rent)
+            min_size: Minimum size in square meters
+            max_size: Maximum size in square meters
+            min_rooms: Minimum number of rooms
+            bbox: Bounding box as (west, south, east, north) (optional)
+            near: Center point as (latitude, longitude) for radius searches (optional)
+            radius_km: Radius around the center point in kilometers (optional)
+            limit: Maximum number of properties to return (optional, no limit if not given)
+            page_cursor: Continuation token to start after (optional)
+            
+        Yields:
+            Property dictionaries
+            
+        Raises:
+            ValueError: If the limit is negative or the continuation token is invalid
+        """
+        check_page_size(limit, streaming=True)
+        
+        query_filter = self._build_query_filter(
+            city=city,
+            neighborhood=neighborhood,
+            min_price=min_price,
+            max_price=max_price,
+            property_type=property_type,
+            operation_type=operation_type,
+            min_size=min_size,
+            max_size=max_size,
+            min_rooms=min_rooms,
+            bbox=bbox,
+            near=near,
+            radius_km=radius_km
+        )
+        query_filter = apply_cursor(query_filter, PROPERTY_SORT, page_cursor)
+        
+        cursor = self.collection.find(query_filter).sort(PROPERTY_SORT).batch_size(STREAM_BATCH_SIZE)
+        if limit:
+            cursor = cursor.limit(limit)
+        
+        yield from self._iter_formatted(cursor)
+    
     def get_properties_with_coordinates(self, city=None, neighborhood=None, min_price=None,
                                        max_price=None, property_type=None, operation_type=None,
+                                       bbox=None, near=None, radius_km=None,
                                        limit=1000) -> List[Dict[str, Any]]:
         """
         Get properties with coordinates for map display
@@ -135,60 +316,82 @@ class PropertyService:
             max_price: Maximum price
             property_type: Type of property (apartment, house, etc.)
             operation_type: Type of operation (sale, rent)
+            bbox: Bounding box as (west, south, east, north) (optional)
+            near: Center point as (latitude, longitude) for radius searches (optional)
+            radius_km: Radius around the center point in kilometers (optional)
             limit: Maximum number of properties to return
             
         Returns:
             List of property dictionaries with coordinates
+            
+        Raises:
+            ValueError: If the limit is negative
         """
         try:
-            # Build query filter
-            query_filter = {
-                'latitude': {'$exists': True, '$ne': None},
-                'longitude': {'$exists': True, '$ne': None}
-            }
-            
-            if city:
-                query_filter['city'] = city
-            
-            if neighborhood:
-                query_filter['neighborhood'] = neighborhood
-            
-            if property_type:
-                query_filter['property_type'] = property_type
-            
-            if operation_type:
-                query_filter['operation_type'] = operation_type
-            
-            price_filter = {}
-            if min_price is not None:
-                price_filter['$gte'] = min_price
-            if max_price is not None:
-                price_filter['$lte'] = max_price
-            if price_filter:
-                query_filter['price'] = price_filter
-            
-            # Query database
-            try:
-                cursor = self.collection.find(
-                    query_filter,
-                    {
-                        'id': 1, 'source': 1, 'title': 1, 'price': 1, 'size': 1,
-                        'latitude': 1, 'longitude': 1, 'property_type': 1,
-                        'investment_score': 1, 'url': 1, 'city': 1, 'neighborhood': 1
-                    }
-                ).limit(limit)
-                
-                # Convert to list of dictionaries
-                properties = loads(dumps(list(cursor)))
-            except Exception as e:
-                logger.warning(f"Error querying database: {str(e)}, returning empty list")
-                properties = []
-            
-            return properties
+            return list(self.iter_properties_with_coordinates(
+                city=city,
+                neighborhood=neighborhood,
+                min_price=min_price,
+                max_price=max_price,
+                property_type=property_type,
+                operation_type=operation_type,
+                bbox=bbox,
+                near=near,
+                radius_km=radius_km,
+                limit=limit
+            ))
+        except ValueError:
+            raise
         except Exception as e:
             logger.error(f"Error getting properties with coordinates: {str(e)}")
             return []
     
+    def iter_properties_with_coordinates(self, city=None, neighborhood=None, min_price=None,
+                                         max_price=None, property_type=None, operation_type=None,
+                                         bbox=None, near=None, radius_km=None,
+                                         limit=1000) -> Iterator[Dict[str, Any]]:
+        """
+        Stream properties with coordinates for map display straight from the database cursor
+        
+        Args:
+            city: Filter by city
+            neighborhood: Filter by neighborhood
+            min_price: Minimum price
+            max_price: Maximum price
+            property_type: Type of property (apartment, house, etc.)
+            operation_type: Type of operation (sale, rent)
+            bbox: Bounding box as (west, south, east, north) (optional)
+            near: Center point as (latitude, longitude) for radius searches (optional)
+            radius_km: Radius around the center point in kilometers (optional)
+            limit: Maximum number of properties to return (no limit if None or 0)
+            
+        Yields:
+            Property dictionaries with coordinates
+            
+        Raises:
+            ValueError: If the limit is negative
+        """
+        check_page_size(limit, streaming=True)
+        
+        query_filter = self._build_query_filter(
+            city=city,
+            neighborhood=neighborhood,
+            min_price=min_price,
+            max_price=max_price,
+            property_type=property_type,
+            operation_type=operation_type,
+            bbox=bbox,
+            near=near,
+            radius_km=radius_km,
+            with_coordinates=True
+        )
+        
+        cursor = self.collection.find(query_filter, MAP_PROJECTION).batch_size(STREAM_BATCH_SIZE)
+        if limit:
+            cursor = cursor.limit(limit)
+        
+        yield from self._iter_formatted(cursor)
+    
     def get_cities(self) -> List[str]:
         """
         Get a list of all cities in the database
@@ -232,6 +435,101 @@ class PropertyService:
             logger.error(f"Error getting neighborhoods: {str(e)}")
             return []
     
+    def _build_query_filter(self, bbox=None, near=None, radius_km=None, **filters) -> Dict[str, Any]:
+        """
+        Build the query filter for property searches
+        
+        Args:
+            bbox: Bounding box as (west, south, east, north) (optional)
+            near: Center point as (latitude, longitude) for radius searches (optional)
+            radius_km: Radius around the center point in kilometers (optional)
+            **filters: Other filters accepted by build_query_filter
+            
+        Returns:
+            MongoDB query filter
+        """
+        query_filter = build_query_filter(**filters)
+        query_filter.update(self._build_geo_filter(bbox=bbox, near=near, radius_km=radius_km))
+        return query_filter
+    
+    def _build_geo_filter(self, bbox=None, near=None, radius_km=None) -> Dict[str, Any]:
+        """
+        Build the query filter for bounding-box and radius searches
+        
+        With MongoDB the filter runs against the 2dsphere index on location.
+        Without it, the in-process KD-tree resolves the area to property IDs.
+        
+        Args:
+            bbox: Bounding box as (west, south, east, north) (optional)
+            near: Center point as (latitude, longitude) (optional)
+            radius_km: Radius around the center point in kilometers (optional)
+            
+        Returns:
+            MongoDB query filter, empty if no geographic constraint is given
+        """
+        if not bbox and not (near and radius_km):
+            return {}
+        
+        if not is_fake_db(self.db):
+            return geo_filter(bbox=bbox, near=near, radius_km=radius_km)
+        
+        index = self._get_geo_index()
+        ids = None
+        if bbox:
+            ids = set(index.within_bbox(*bbox))
+        if near and radius_km:
+            within = set(index.within_radius(near[0], near[1], radius_km))
+            ids = within if ids is None else ids & within
+        
+        return {'_id': {'$in': list(ids)}}
+    
+    def _get_geo_index(self) -> GeoKDTree:
+        """Get the in-process geographic index, rebuilding it if a new data generation has been recorded"""
+        generation = self.data_version.generation
+        if self._geo_index is not None and self._geo_index_generation == generation:
+            return self._geo_index
+        
+        with self._geo_lock:
+            if self._geo_index is None or self._geo_index_generation != generation:
+                documents = list(self.collection.find({
+                    'latitude': {'$exists': True, '$ne': None},
+                    'longitude': {'$exists': True, '$ne': None}
+                }, {'_id': 1, 'latitude': 1, 'longitude': 1}))
+                self._geo_index = GeoKDTree(
+                    [doc.get('latitude') for doc in documents],
+                    [doc.get('longitude') for doc in documents],
+                    [doc['_id'] for doc in documents]
+                )
+                self._geo_index_generation = generation
+                logger.info(f"Built geographic index with {len(self._geo_index)} properties "
+                            f"for generation {generation}")
+        
+        return self._geo_index
+    
+    def _iter_formatted(self, cursor) -> Iterator[Dict[str, Any]]:
+        """
+        Format documents from a database cursor one at a time
+        
+        Errors before the first document propagate, so the endpoint can still
+        answer with an error status. Errors after it abort the stream, so a
+        truncated response can't pass for a complete one.
+        
+        Args:
+            cursor: Database cursor
+            
+        Yields:
+            Formatted property dictionaries
+        """
+        streamed = 0
+        try:
+            for document in cursor:
+                yield self._format_property(document)
+                streamed += 1
+        except Exception as e:
+            if streamed:
+                logger.error(f"Error reading from database after {streamed} documents: {str(e)}, aborting stream")
+            raise
+    
     def _format_properties(self, properties: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         Format a list of property dictionaries
@@ -248,42 +546,13 @@ class PropertyService:
         """
         Format a property dictionary for output
         
+        Converts ObjectIds to strings and dates, including price history
+        dates, to ISO 8601 strings in a single pass.
+        
         Args:
-            property_dict: Property dictionary
+            property_dict: Property document
             
         Returns:
             Formatted property dictionary
         """
-        # Convert MongoDB ObjectId to string
-        if '_id' in property_dict:
-            property_dict['_id'] = str(property_dict['_id'])
-        
-        # Convert date fields to strings
-        date_fields = ['first_detected', 'last_updated']
-        for field in date_fields:
-            if field in property_dict and property_dict[field]:
-                # Handle both datetime objects and string dates
-                if isinstance(property_dict[field], dict) and '$date' in property_dict[field]:
-                    # Handle MongoDB date format
-                    property_dict[field] = property_dict[field]['$date']
-                    
-                    # If it's a timestamp, convert to ISO format
-                    if isinstance(property_dict[field], int):
-                        property_dict[field] = datetime.fromtimestamp(
-                            property_dict[field] / 1000
-                        ).isoformat()
-        
-        # Format price history dates
-        if 'price_history' in property_dict and property_dict['price_history']:
-            for entry in property_dict['price_history']:
-                if 'date' in entry and entry['date']:
-                    if isinstance(entry['date'], dict) and '$date' in entry['date']:
-                        entry['date'] = entry['date']['$date']
-                        
-                        # If it's a timestamp, convert to ISO format
-                        if isinstance(entry['date'], int):
-                            entry['date'] = datetime.fromtimestamp(
-                                entry['date'] / 1000
-                            ).isoformat()
-        
-        return property_dict
+        return encode_document(property_dict)
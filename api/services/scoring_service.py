@@ -0,0 +1,314 @@
+"""
+Service for computing the investment score of every property.
+
+Scores are computed one city at a time on the columnar features of its
+properties, comparing each listing with the averages of its segment, and
+written back with batched bulk updates. After a scrape only the segments
+(city and property type) with new or updated listings are re-scored.
+"""
+
+import logging
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Set
+import numpy as np
+from pymongo import UpdateOne
+from api.utils.db import get_db_connection
+from api.utils.data_version import get_data_version
+from api.services.columnar_service import ColumnarSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Score components and their relative weights
+SCORE_WEIGHTS = {
+    'price_gap': 0.40,
+    'rental_yield': 0.25,
+    'price_drop': 0.15,
+    'time_on_market': 0.10,
+    'condition': 0.10
+}
+
+# Value of each property condition for the condition component
+CONDITION_SCORES = {
+    'new': 1.0,
+    'good': 0.75,
+    'unknown': 0.5,
+    'needs_renovation': 0.25
+}
+
+# Price per square meter discount to the segment average that scores full marks
+FULL_PRICE_GAP = 0.3
+
+# Gross rental yields scoring zero and full marks
+MIN_RENTAL_YIELD = 0.02
+FULL_RENTAL_YIELD = 0.08
+
+# Drop from the highest listed price that scores full marks
+FULL_PRICE_DROP = 0.15
+
+# Days listed after which the time on market component scores zero
+MAX_DAYS_LISTED = 180
+
+# Minimum number of listings for a segment average to be used
+MIN_SEGMENT_COUNT = 5
+
+# Fields loaded to score a property
+SCORING_PROJECTION = {
+    '_id': 1, 'city': 1, 'neighborhood': 1, 'property_type': 1, 'operation_type': 1,
+    'price': 1, 'size': 1, 'price_per_sqm': 1, 'days_listed': 1, 'condition': 1,
+    'price_history': 1, 'investment_score': 1
+}
+
+# Number of updates sent in one bulk write
+WRITE_BATCH_SIZE = 1000
+
+
+def _segment_means(keys: np.ndarray, values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    Average the values of the masked rows sharing each row's key
+    
+    Args:
+        keys: Integer segment key of each row
+        values: Values to average, NaN where missing
+        mask: Rows included in the averages
+        
+    Returns:
+        Segment average for each row, NaN if the segment has fewer than
+        MIN_SEGMENT_COUNT values
+    """
+    valid = mask & ~np.isnan(values)
+    unique, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse, weights=np.where(valid, values, 0.0), minlength=len(unique))
+    counts = np.bincount(inverse, weights=valid.astype(float), minlength=len(unique))
+    means = np.where(counts >= MIN_SEGMENT_COUNT, sums / np.maximum(counts, 1), np.nan)
+    return means[inverse]
+
+
+def _highest_listed_price(price_history: Any) -> float:
+    """
+    Get the highest price in a property's price history
+    
+    Args:
+        price_history: List of {'price', 'date'} entries
+        
+    Returns:
+        Highest price, NaN if the history holds none
+    """
+    if not isinstance(price_history, list):
+        return np.nan
+    prices = [entry.get('price') for entry in price_history if isinstance(entry, dict)]
+    prices = [price for price in prices if isinstance(price, (int, float))]
+    return max(prices) if prices else np.nan
+
+
+class ScoringService:
+    """Service for computing and storing investment scores"""
+    
+    def __init__(self, db=None):
+        """
+        Initialize the scoring service
+        
+        Args:
+            db: Database object (optional, a new connection is opened if not given)
+        """
+        self.db = db if db is not None else get_db_connection()
+        self.collection = self.db['properties']
+    
+    def rescore(self, since: Optional[datetime] = None, cities: Optional[List[str]] = None) -> int:
+        """
+        Compute and store the investment scores of the properties
+        
+        Args:
+            since: Only re-score the segments (city and property type) with
+                properties updated after this time (optional)
+            cities: Only re-score these cities (optional, every city is
+                re-scored if neither this nor since is given)
+                
+        Returns:
+            Number of properties whose score changed
+        """
+        try:
+            segments = self._touched_segments(since) if since else None
+            if segments is not None and not segments:
+                logger.info("No segments updated since last scrape, investment scores unchanged")
+                return 0
+            
+            if segments is not None:
+                cities = sorted(segments, key=str)
+            elif cities is None:
+                cities = self.collection.distinct('city')
+            
+            generation = get_data_version(self.db)['generation']
+            updated = 0
+            for city in cities:
+                property_types = segments[city] if segments is not None else None
+                updated += self._rescore_city(city, property_types, generation)
+            
+            logger.info(f"Re-scored {len(cities)} cities, {updated} investment scores changed")
+            
+            return updated
+        except Exception as e:
+            logger.error(f"Error computing investment scores: {str(e)}")
+            return 0
+    
+    def _touched_segments(self, since: datetime) -> Dict[str, Set[str]]:
+        """
+        Find the segments with properties updated after a time
+        
+        Args:
+            since: Time of the last scrape
+            
+        Returns:
+            Dictionary mapping each city to its updated property types
+        """
+        segments = {}
+        groups = self.collection.aggregate([
+            {'$match': {'last_updated': {'$gte': since}}},
+            {'$group': {'_id': {'city': '$city', 'property_type': '$property_type'}}}
+        ])
+        for group in groups:
+            segments.setdefault(group['_id'].get('city'), set()).add(group['_id'].get('property_type'))
+        return segments
+    
+    def _rescore_city(self, city: str, property_types: Optional[Set[str]], generation: int) -> int:
+        """
+        Compute and store the investment scores of a city
+        
+        The whole city is loaded because its segment averages depend on every
+        listing, but only the given property types are written.
+        
+        Args:
+            city: City to score
+            property_types: Property types to write (optional, all if not given)
+            generation: Data generation being scored
+            
+        Returns:
+            Number of properties whose score changed
+        """
+        documents = list(self.collection.find({'city': city}, SCORING_PROJECTION))
+        if not documents:
+            return 0
+        
+        scores = self.compute_scores(documents, generation)
+        
+        current = np.array([doc.get('investment_score') if isinstance(doc.get('investment_score'), (int, float))
+                            else np.nan for doc in documents], dtype=float)
+        changed = np.isfinite(scores) & ~np.isclose(scores, current, rtol=0, atol=0.005)
+        if property_types is not None:
+            changed &= np.array([doc.get('property_type') in property_types for doc in documents], dtype=bool)
+        
+        operations = [
+            UpdateOne({'_id': documents[row]['_id']}, {'$set': {'investment_score': float(scores[row])}})
+            for row in np.nonzero(changed)[0]
+        ]
+        for start in range(0, len(operations), WRITE_BATCH_SIZE):
+            self.collection.bulk_write(operations[start:start + WRITE_BATCH_SIZE], ordered=False)
+        
+        logger.info(f"Scored {len(documents)} properties in {city}, {len(operations)} scores changed")
+        
+        return len(operations)
+    
+    def compute_scores(self, documents: List[Dict[str, Any]], generation: int = 0) -> np.ndarray:
+        """
+        Compute the investment scores of the properties of one city
+        
+        Each component is scaled between 0 and 1 and the score is their
+        weighted average, between 0 and 100, over the components that apply
+        to the property. Properties without a price gap to their segment get
+        no score.
+        
+        Args:
+            documents: Property documents of the city
+            generation: Data generation the documents belong to
+            
+        Returns:
+            Score of each property, NaN if it can't be scored
+        """
+        features = ColumnarSnapshot.from_documents(documents, generation)
+        price = features.numeric['price']
+        size = features.numeric['size']
+        price_per_sqm = features.numeric['price_per_sqm']
+        days_listed = features.numeric['days_listed']
+        
+        is_sale = features.mask(operation_type='sale')
+        is_rent = features.mask(operation_type='rent')
+        has_neighborhood = features.key_codes('neighborhood') >= 0
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Average price per square meter of the neighborhood segment,
+            # falling back to the city segment and then the city
+            area_price = self._fallback_means(features, price_per_sqm, np.ones(len(features), dtype=bool),
+                                              has_neighborhood, with_operation=True)
+            price_gap = (area_price - price_per_sqm) / area_price
+            price_gap_score = np.clip((price_gap / FULL_PRICE_GAP + 1) / 2, 0, 1)
+            
+            # Gross yield of renting out a sale at the average rent of its segment
+            rent_price = self._fallback_means(features, price_per_sqm, is_rent, has_neighborhood,
+                                              with_operation=False)
+            rental_yield = size * rent_price * 12 / price
+            rental_yield_score = np.where(
+                is_sale,
+                np.clip((rental_yield - MIN_RENTAL_YIELD) / (FULL_RENTAL_YIELD - MIN_RENTAL_YIELD), 0, 1),
+                np.nan
+            )
+            
+            highest_price = np.array([_highest_listed_price(doc.get('price_history')) for doc in documents])
+            price_drop = np.where(highest_price > 0, (highest_price - price) / highest_price, np.nan)
+            price_drop_score = np.clip(price_drop / FULL_PRICE_DROP, 0, 1)
+            
+            time_on_market_score = 1 - np.minimum(1, days_listed / MAX_DAYS_LISTED)
+            
+            condition_score = np.array([CONDITION_SCORES.get(doc.get('condition'), np.nan) for doc in documents])
+        
+        components = np.column_stack([
+            price_gap_score, rental_yield_score, price_drop_score, time_on_market_score, condition_score
+        ])
+        weights = np.array(list(SCORE_WEIGHTS.values()))
+        available = ~np.isnan(components)
+        
+        total = (np.where(available, components, 0.0) * weights).sum(axis=1)
+        weight = (available * weights).sum(axis=1)
+        scores = np.round(total / np.where(weight > 0, weight, 1) * 100, 2)
+        
+        return np.where(np.isnan(price_gap_score), np.nan, scores)
+    
+    def _fallback_means(self, features: ColumnarSnapshot, values: np.ndarray, mask: np.ndarray,
+                        has_neighborhood: np.ndarray, with_operation: bool) -> np.ndarray:
+        """
+        Average the values of the masked rows in each row's segment, widening it when it is too small
+        
+        The segments are, from narrowest to widest, the neighborhood and
+        property type, the property type and the whole city.
+        
+        Args:
+            features: Columnar features of one city
+            values: Values to average
+            mask: Rows included in the averages
+            has_neighborhood: Rows whose neighborhood is known
+            with_operation: Whether segments are split by operation type
+            
+        Returns:
+            Segment average for each row, NaN if even the city has too few values
+        """
+        neighborhood = features.key_codes('neighborhood') + 1
+        property_type = features.key_codes('property_type') + 1
+        any_value = np.zeros(len(features), dtype=np.int32)
+        operation_type = features.key_codes('operation_type') + 1 if with_operation else any_value
+        shape = (len(features.categories['neighborhood']) + 1,
+                 len(features.categories['property_type']) + 1,
+                 len(features.categories['operation_type']) + 1)
+        
+        levels = (
+            (neighborhood, property_type, operation_type),
+            (any_value, property_type, operation_type),
+            (any_value, any_value, operation_type)
+        )
+        
+        means = np.full(len(features), np.nan)
+        for level, codes in enumerate(levels):
+            keys = np.ravel_multi_index(codes, shape)
+            level_means = _segment_means(keys, values, mask)
+            if level == 0:
+                level_means = np.where(has_neighborhood, level_means, np.nan)
+            means = np.where(np.isnan(means), level_means, means)
+        
+        return means
@@ -0,0 +1,374 @@
+"""
+Service for finding the properties most similar to a given property.
+
+Properties are grouped into segments by city, property type and operation
+type. Each segment is loaded once into a NumPy feature matrix (price, size,
+rooms, bathrooms, floor and position) scaled by its standard deviation, so a
+similarity search is a single weighted distance computation over the segment
+followed by an argpartition for the top k.
+"""
+
+import logging
+import threading
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from api.utils.db import get_db_connection
+from api.utils.data_version import DataVersionWatcher
+from api.utils.encoding import encode_document
+
+logger = logging.getLogger(__name__)
+
+# Features compared between properties and their relative weights
+FEATURE_WEIGHTS = {
+    'price': 1.0,
+    'size': 1.0,
+    'rooms': 0.5,
+    'bathrooms': 0.5,
+    'floor': 0.25,
+    'position_y': 0.5,
+    'position_x': 0.5
+}
+
+# Property fields the features are derived from
+RAW_FIELDS = ('price', 'size', 'rooms', 'bathrooms', 'floor', 'latitude', 'longitude')
+
+# Kilometers per degree of latitude
+KM_PER_DEGREE = 111.195
+
+# Fields loaded into a segment index
+SEGMENT_PROJECTION = {
+    '_id': 1, 'id': 1, 'source': 1, 'neighborhood': 1, 'price': 1, 'size': 1,
+    'rooms': 1, 'bathrooms': 1, 'floor': 1, 'latitude': 1, 'longitude': 1
+}
+
+# Fields returned for each similar property
+SIMILAR_PROJECTION = {
+    'id': 1, 'source': 1, 'title': 1, 'price': 1, 'size': 1,
+    'price_per_sqm': 1, 'url': 1, 'days_listed': 1,
+    'neighborhood': 1, 'investment_score': 1
+}
+
+
+def _float_array(documents: List[Dict[str, Any]], field: str) -> np.ndarray:
+    """
+    Read a numeric field from documents into a float array
+    
+    Args:
+        documents: Documents to read
+        field: Field name
+        
+    Returns:
+        Float array with NaN for missing or non-numeric values
+    """
+    values = [doc.get(field) for doc in documents]
+    return np.array([value if isinstance(value, (int, float)) else np.nan for value in values], dtype=float)
+
+
+class SegmentIndex:
+    """Scaled feature matrix of the properties in one segment"""
+    
+    def __init__(self, documents: List[Dict[str, Any]]):
+        """
+        Build the index
+        
+        Args:
+            documents: Property documents of the segment
+        """
+        self.object_ids = [doc.get('_id') for doc in documents]
+        self.rows = {(doc.get('id'), doc.get('source')): row for row, doc in enumerate(documents)}
+        
+        values = {field: _float_array(documents, field) for field in RAW_FIELDS}
+        latitude = values['latitude']
+        self.reference_latitude = float(np.nanmean(latitude)) if np.isfinite(latitude).any() else 0.0
+        
+        features = self._raw_features(values)
+        self.price = features['price']
+        self.size = features['size']
+        
+        # Scale every feature by its spread so they contribute comparably
+        self.scales = {}
+        for field, values in features.items():
+            scale = np.nanstd(values) if np.isfinite(values).any() else 0.0
+            self.scales[field] = scale if scale > 0 else 1.0
+        
+        # Use a common scale for both position axes to keep distances isotropic
+        position_scale = float(np.hypot(self.scales['position_y'], self.scales['position_x']) / np.sqrt(2))
+        self.scales['position_y'] = self.scales['position_x'] = position_scale
+        
+        # Missing values are imputed with the segment median
+        columns = []
+        for field in FEATURE_WEIGHTS:
+            values = features[field] / self.scales[field]
+            median = np.nanmedian(values) if np.isfinite(values).any() else 0.0
+            columns.append(np.where(np.isfinite(values), values, median))
+        self.matrix = np.column_stack(columns).astype(np.float32)
+        
+        # Dictionary-encode the fields used for exclusion masks
+        self.categories = {}
+        for field in ('neighborhood', 'source'):
+            labels = {}
+            codes = np.array([labels.setdefault(doc.get(field), len(labels)) for doc in documents], dtype=np.int32)
+            self.categories[field] = (labels, codes)
+    
+    def __len__(self):
+        """Number of indexed properties"""
+        return len(self.object_ids)
+    
+    def _raw_features(self, values: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        Derive the compared features from raw property values
+        
+        Positions are projected to kilometers around the segment's mean latitude.
+        
+        Args:
+            values: Raw values by field name
+            
+        Returns:
+            Feature values by feature name
+        """
+        return {
+            'price': values['price'],
+            'size': values['size'],
+            'rooms': values['rooms'],
+            'bathrooms': values['bathrooms'],
+            'floor': values['floor'],
+            'position_y': values['latitude'] * KM_PER_DEGREE,
+            'position_x': values['longitude'] * KM_PER_DEGREE * np.cos(np.radians(self.reference_latitude))
+        }
+    
+    def query_vector(self, property_dict: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Scale the features of a property like the segment
+        
+        Args:
+            property_dict: Property dictionary
+            
+        Returns:
+            Tuple of the scaled feature vector and the feature weights, with a
+            zero weight for the features the property is missing
+        """
+        features = self._raw_features({field: _float_array([property_dict], field) for field in RAW_FIELDS})
+        
+        vector = np.array([features[field][0] / self.scales[field] for field in FEATURE_WEIGHTS])
+        weights = np.array(list(FEATURE_WEIGHTS.values()))
+        weights[~np.isfinite(vector)] = 0.0
+        
+        return np.nan_to_num(vector).astype(np.float32), weights.astype(np.float32)
+    
+    def nearest(self, property_dict: Dict[str, Any], k: int, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k nearest properties among the masked rows
+        
+        Args:
+            property_dict: Property dictionary
+            k: Number of properties to return
+            mask: Boolean mask of the candidate rows
+            
+        Returns:
+            Tuple of row indexes and distances, nearest first
+        """
+        candidates = np.nonzero(mask)[0]
+        if len(candidates) == 0:
+            return candidates, np.empty(0)
+        
+        vector, weights = self.query_vector(property_dict)
+        differences = self.matrix[candidates] - vector
+        distances = np.sqrt((differences * differences) @ weights)
+        
+        # Partial sort: only the k best candidates are ordered
+        if len(candidates) > k:
+            best = np.argpartition(distances, k - 1)[:k]
+        else:
+            best = np.arange(len(candidates))
+        best = best[np.argsort(distances[best], kind='stable')]
+        
+        return candidates[best], distances[best]
+
+
+class SimilarityService:
+    """Service for finding similar properties with a per-segment kNN index"""
+    
+    def __init__(self, db=None):
+        """
+        Initialize the similarity service
+        
+        Args:
+            db: Database object (optional, a new connection is opened if not given)
+        """
+        self.db = db if db is not None else get_db_connection()
+        self.collection = self.db['properties']
+        self.data_version = DataVersionWatcher(self.db)
+        # Future of the index of each segment, set once it has been loaded
+        self._segments = {}
+        self._segments_generation = None
+        self._lock = threading.Lock()
+    
+    def get_similar_properties(self, property_dict: Dict[str, Any], limit: int = 10,
+                               price_tolerance: float = 0.2,
+                               size_tolerance: float = 0.2) -> List[Dict[str, Any]]:
+        """
+        Get the properties most similar to a property
+        
+        Candidates are the properties in the same city, property type and
+        operation type, from another source, within the price and size
+        tolerance and in the same neighborhood if known. The closest ones by
+        weighted feature distance are returned.
+        
+        Args:
+            property_dict: Property dictionary
+            limit: Maximum number of similar properties to return
+            price_tolerance: Maximum relative price difference
+            size_tolerance: Maximum relative size difference
+            
+        Returns:
+            List of similar properties, most similar first, with a
+            similarity_score between 0 and 100
+        """
+        object_ids, distances = self.find_similar(property_dict, limit=limit, price_tolerance=price_tolerance,
+                                                  size_tolerance=size_tolerance)
+        if not object_ids:
+            return []
+        
+        documents = self.collection.find({'_id': {'$in': object_ids}}, SIMILAR_PROJECTION)
+        return self.format_similar(documents, object_ids, distances)
+    
+    def find_similar(self, property_dict: Dict[str, Any], limit: int = 10, price_tolerance: float = 0.2,
+                     size_tolerance: float = 0.2) -> Tuple[List[Any], List[float]]:
+        """
+        Find the properties most similar to a property in the segment index
+        
+        Args:
+            See get_similar_properties
+            
+        Returns:
+            Tuple of the _ids of the similar properties, most similar first,
+            and their feature distances
+        """
+        city = property_dict.get('city')
+        size = property_dict.get('size')
+        price = property_dict.get('price')
+        
+        if not city or not size or not price:
+            return [], []
+        
+        index = self._get_segment(city, property_dict.get('property_type'), property_dict.get('operation_type'))
+        if not len(index):
+            return [], []
+        
+        mask = ((index.price >= price * (1 - price_tolerance)) & (index.price <= price * (1 + price_tolerance)) &
+                (index.size >= size * (1 - size_tolerance)) & (index.size <= size * (1 + size_tolerance)))
+        
+        # Exclude the property itself and listings from the same source
+        mask &= ~self._category_mask(index, 'source', property_dict.get('source'))
+        row = index.rows.get((property_dict.get('id'), property_dict.get('source')))
+        if row is not None:
+            mask[row] = False
+        
+        neighborhood = property_dict.get('neighborhood')
+        if neighborhood:
+            mask &= self._category_mask(index, 'neighborhood', neighborhood)
+        
+        rows, distances = index.nearest(property_dict, limit, mask)
+        
+        return [index.object_ids[row] for row in rows], distances.tolist()
+    
+    def format_similar(self, documents, object_ids: List[Any], distances: List[float]) -> List[Dict[str, Any]]:
+        """
+        Format the fetched similar properties in similarity order
+        
+        Args:
+            documents: Similar property documents, in any order
+            object_ids: _ids of the similar properties, most similar first
+            distances: Feature distance of each similar property
+            
+        Returns:
+            List of similar properties with a similarity_score between 0 and 100
+        """
+        documents = {doc['_id']: doc for doc in documents}
+        
+        similar_properties = []
+        for object_id, distance in zip(object_ids, distances):
+            document = documents.get(object_id)
+            if document is None:
+                continue
+            
+            similar_property = encode_document(document)
+            similar_property['similarity_score'] = round(float(100 / (1 + distance)), 2)
+            similar_properties.append(similar_property)
+        
+        return similar_properties
+    
+    def _category_mask(self, index: SegmentIndex, field: str, value: Any) -> np.ndarray:
+        """
+        Build the mask of the rows whose field equals a value
+        
+        Args:
+            index: Segment index
+            field: Dictionary-encoded field name
+            value: Value to match
+            
+        Returns:
+            Boolean mask over the segment
+        """
+        labels, codes = index.categories[field]
+        if value not in labels:
+            return np.zeros(len(codes), dtype=bool)
+        return codes == labels[value]
+    
+    def _get_segment(self, city: str, property_type: Optional[str],
+                     operation_type: Optional[str]) -> SegmentIndex:
+        """
+        Get the index of a segment, loading it on first use
+        
+        All segments are dropped when a new data generation has been recorded.
+        
+        Args:
+            city: City name
+            property_type: Type of property (optional, any type if not given)
+            operation_type: Type of operation (optional, any operation if not given)
+            
+        Returns:
+            Segment index
+        """
+        key = (city, property_type, operation_type)
+        generation = self.data_version.generation
+        
+        # The lock only guards the table of segments, each segment is loaded
+        # by the first request that needs it while the others wait for it
+        with self._lock:
+            if self._segments_generation != generation:
+                self._segments = {}
+                self._segments_generation = generation
+            
+            segments = self._segments
+            loading = segments.get(key)
+            is_loader = loading is None
+            if is_loader:
+                loading = Future()
+                segments[key] = loading
+        
+        if not is_loader:
+            return loading.result()
+        
+        try:
+            query_filter = {'city': city}
+            if property_type:
+                query_filter['property_type'] = property_type
+            if operation_type:
+                query_filter['operation_type'] = operation_type
+            
+            index = SegmentIndex(list(self.collection.find(query_filter, SEGMENT_PROJECTION)))
+            logger.info(f"Built similarity index for {key} with {len(index)} properties "
+                        f"for generation {generation}")
+        except Exception as e:
+            # Let the next request try again
+            with self._lock:
+                if segments.get(key) is loading:
+                    del segments[key]
+            loading.set_exception(e)
+            raise
+        
+        loading.set_result(index)
+        
+        return index
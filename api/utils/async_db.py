@@ -0,0 +1,43 @@
+"""
+Async database connection utilities for the ASGI server mode.
+
+The in-memory database has no asyncio interface, so the ASGI server mode
+needs a MongoDB server.
+"""
+
+import os
+import logging
+from motor.motor_asyncio import AsyncIOMotorClient
+from api.utils.db import mongodb_client_options, IN_MEMORY_URI
+
+logger = logging.getLogger(__name__)
+
+
+def get_async_db_connection():
+    """
+    Get an asyncio connection to the database
+    
+    The client connects lazily, so this must be called from the event loop
+    that will use it.
+    
+    Returns:
+        Motor database object
+        
+    Raises:
+        ValueError: If MONGODB_URI selects the in-memory database
+    """
+    # Get MongoDB connection string from environment variable, or use default
+    mongodb_uri = os.environ.get('MONGODB_URI', 'mongodb://localhost:27017')
+    
+    if mongodb_uri == IN_MEMORY_URI:
+        raise ValueError(f"MONGODB_URI={IN_MEMORY_URI} is not supported by the ASGI server mode, "
+                         "which needs a MongoDB server; use the WSGI app (main.py) instead")
+    
+    # Get database name from environment variable, or use default
+    db_name = os.environ.get('MONGODB_DATABASE', 'realestate')
+    
+    # Same pool and timeout settings as the synchronous client
+    client = AsyncIOMotorClient(mongodb_uri, **mongodb_client_options())
+    logger.info(f"Created async MongoDB client: {mongodb_uri}, DB: {db_name}")
+    
+    return client[db_name]
@@ -0,0 +1,247 @@
+"""
+Response cache for read-only API queries.
+
+Results are kept in a bounded LRU cache with a time-to-live, capped both by
+number of entries and by their approximate serialized size. Since the data
+only changes when the scraper records a new data generation, the whole cache
+is dropped at once when the generation changes.
+"""
+
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Optional, Tuple, Awaitable
+from api.utils.data_version import DataVersionWatcher
+
+logger = logging.getLogger(__name__)
+
+# Default maximum number of cached results
+DEFAULT_MAX_ENTRIES = 1024
+
+# Default maximum total size of cached results in bytes
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Default seconds a cached result stays valid
+DEFAULT_TTL = 3600
+
+
+def make_key(namespace: str, params: Dict[str, Any]) -> Tuple:
+    """
+    Build a cache key from a namespace and query parameters
+    
+    Parameters that are None are dropped and the rest are sorted by name, so
+    equivalent queries share a key regardless of argument order.
+    
+    Args:
+        namespace: Name of the cached query
+        params: Query parameters
+        
+    Returns:
+        Hashable cache key
+    """
+    return (namespace,) + tuple(sorted((name, value) for name, value in params.items() if value is not None))
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Estimate the memory cost of a cached result
+    
+    Args:
+        value: JSON-serializable result
+        
+    Returns:
+        Size of the JSON encoding of the value in bytes
+    """
+    return len(json.dumps(value, default=str, separators=(',', ':')))
+
+
+class ResponseCache:
+    """Thread-safe TTL + LRU cache invalidated by data generation"""
+    
+    def __init__(self, db, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl: float = DEFAULT_TTL):
+        """
+        Initialize the cache
+        
+        Args:
+            db: Database object whose data version invalidates the cache
+            max_entries: Maximum number of cached results
+            max_bytes: Maximum total size of cached results in bytes
+            ttl: Seconds a cached result stays valid
+        """
+        self.data_version = DataVersionWatcher(db)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = None
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+    
+    def get_or_compute(self, namespace: str, params: Dict[str, Any], compute: Callable[[], Any],
+                       cache_if: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        Get a cached result, computing and storing it on a miss
+        
+        Args:
+            namespace: Name of the cached query
+            params: Query parameters
+            compute: Function computing the result
+            cache_if: Predicate deciding whether a computed result is stored
+                (optional, defaults to storing truthy results so errors
+                reported as empty results are not cached)
+                
+        Returns:
+            The cached or computed result
+        """
+        key, generation, found, value = self._lookup(namespace, params)
+        if found:
+            return value
+        
+        value = compute()
+        
+        if (cache_if or bool)(value):
+            self._store(key, value, generation)
+        
+        return value
+    
+    async def get_or_compute_async(self, namespace: str, params: Dict[str, Any],
+                                   compute: Callable[[], Awaitable[Any]],
+                                   cache_if: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        Get a cached result, awaiting a coroutine function to compute it on a miss
+        
+        Args:
+            See get_or_compute
+            
+        Returns:
+            The cached or computed result
+        """
+        key, generation, found, value = self._lookup(namespace, params)
+        if found:
+            return value
+        
+        value = await compute()
+        
+        if (cache_if or bool)(value):
+            self._store(key, value, generation)
+        
+        return value
+    
+    def clear(self):
+        """Drop every cached result"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the cache counters
+        
+        Returns:
+            Dictionary with hit, miss, eviction, expiration and invalidation
+            counts, the hit ratio and the current number and size of entries
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else None
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            stats['max_entries'] = self.max_entries
+            stats['max_bytes'] = self.max_bytes
+            stats['generation'] = self._generation
+            return stats
+    
+    def _lookup(self, namespace: str, params: Dict[str, Any]) -> Tuple[Tuple, int, bool, Any]:
+        """
+        Look up a result and update the hit, miss and expiration counters
+        
+        Args:
+            namespace: Name of the cached query
+            params: Query parameters
+            
+        Returns:
+            Tuple of the cache key, the current data generation, whether a
+            valid result was found and the result
+        """
+        key = make_key(namespace, params)
+        generation = self._check_generation()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    return key, generation, True, value
+                self._remove(key)
+                self._counters['expirations'] += 1
+            self._counters['misses'] += 1
+        
+        return key, generation, False, None
+    
+    def _check_generation(self) -> int:
+        """
+        Drop every cached result if a new data generation has been recorded
+        
+        Returns:
+            The current data generation
+        """
+        generation = self.data_version.generation
+        
+        with self._lock:
+            if generation == self._generation:
+                return generation
+            
+            if self._generation is not None:
+                logger.info(f"Data generation changed to {generation}, dropping {len(self._entries)} cached results")
+                self._counters['invalidations'] += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._generation = generation
+        
+        return generation
+    
+    def _store(self, key: Tuple, value: Any, generation: int):
+        """
+        Store a result, evicting the least recently used ones to stay within the limits
+        
+        Args:
+            key: Cache key
+            value: Result to store
+            generation: Data generation the result was computed from
+        """
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            # Results computed while the data generation changed are stale
+            if generation != self._generation:
+                return
+            
+            if key in self._entries:
+                self._remove(key)
+            
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._counters['evictions'] += 1
+    
+    def _remove(self, key: Tuple):
+        """
+        Remove an entry, the lock must be held
+        
+        Args:
+            key: Cache key
+        """
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
@@ -0,0 +1,102 @@
+"""
+Conditional request utilities for the API.
+
+Read-only responses only change when a new data generation is recorded, so
+their validators are derived from the data version: a strong ETag from the
+generation and the requested resource, and Last-Modified from the time the
+generation was recorded.
+"""
+
+import hashlib
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+from api.utils.http import wants_stream
+
+
+def resource_etag(generation: int, full_path: str, representation: str) -> str:
+    """
+    Build the entity tag of a resource for a data generation
+    
+    Args:
+        generation: Data generation number
+        full_path: Requested path including the query string
+        representation: Negotiated representation (e.g. 'json' or 'ndjson')
+        
+    Returns:
+        Entity tag value, without quotes
+    """
+    digest = hashlib.sha1(f"{full_path}|{representation}".encode('utf-8')).hexdigest()[:16]
+    return f"g{generation}-{digest}"
+
+
+def evaluate_conditional(request, version: Dict[str, Any]) -> Tuple[str, Optional[datetime], bool]:
+    """
+    Evaluate the conditional headers of a request against the data version
+    
+    If-None-Match takes precedence; If-Modified-Since is only used when the
+    request carries no entity tags. Streamed and JSON representations of a
+    resource get different entity tags.
+    
+    Args:
+        request: Flask or Quart request
+        version: Data version as returned by DataVersionWatcher.current
+        
+    Returns:
+        Tuple of the entity tag, the Last-Modified date (None if unknown) and
+        whether the client's copy is still current
+    """
+    representation = 'ndjson' if wants_stream(request) else 'json'
+    etag = resource_etag(version['generation'], request.full_path, representation)
+    last_modified = version['updated_at']
+    if last_modified:
+        last_modified = last_modified.replace(microsecond=0)
+    
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = bool(last_modified and request.if_modified_since and
+                            last_modified <= request.if_modified_since)
+    
+    return etag, last_modified, not_modified
+
+
+def set_validators(response, etag: str, last_modified: Optional[datetime]):
+    """
+    Set the validator headers on a response
+    
+    Args:
+        response: Flask or Quart response
+        etag: Entity tag value
+        last_modified: Last-Modified date (optional)
+    """
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept')
+
+
+def finish_conditional(response, etag: str, last_modified: Optional[datetime], not_modified: bool):
+    """
+    Set the validators on the response of a conditional request
+    
+    Errors and partial results (sent with Cache-Control: no-store) must not
+    be revalidated against the data generation, so they are left without
+    validators.
+    
+    Args:
+        response: Flask or Quart response, the 304 response if not_modified
+        etag: Entity tag value
+        last_modified: Last-Modified date (optional)
+        not_modified: Whether the client's copy is still current
+        
+    Returns:
+        The response
+    """
+    if not not_modified and (response.status_code != 200 or
+                             'no-store' in response.headers.get('Cache-Control', '')):
+        return response
+    
+    set_validators(response, etag, last_modified)
+    
+    return response
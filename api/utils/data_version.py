@@ -0,0 +1,131 @@
+"""
+Data version utilities for the API.
+
+The scraper bumps a per-collection generation number every time it finishes
+writing new data, so readers can tell cheaply whether anything derived from
+that collection needs to be recomputed.
+"""
+
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Any
+from api.utils.db import is_fake_db
+
+logger = logging.getLogger(__name__)
+
+# Collection holding one version document per tracked collection
+DATA_VERSIONS_COLLECTION = 'data_versions'
+
+# Seconds between checks of the stored version
+DEFAULT_CHECK_INTERVAL = 30
+
+
+def get_data_version(db, name: str = 'properties') -> Dict[str, Any]:
+    """
+    Get the current data version of a collection
+    
+    Args:
+        db: Database object
+        name: Name of the tracked collection
+        
+    Returns:
+        Dictionary with the generation number and the time it was recorded (UTC),
+        generation 0 (-1 for FakeDB) if no generation has been recorded
+    """
+    try:
+        version = db[DATA_VERSIONS_COLLECTION].find_one({'_id': name})
+        if version:
+            # MongoDB returns naive datetimes in UTC
+            updated_at = version.get('updated_at')
+            if updated_at and updated_at.tzinfo is None:
+                updated_at = updated_at.replace(tzinfo=timezone.utc)
+            
+            return {
+                'generation': version.get('generation', 0),
+                'updated_at': updated_at
+            }
+    except Exception as e:
+        logger.warning(f"Error reading data version for {name}: {str(e)}")
+    
+    # The empty fallback database must not share a generation with MongoDB, so
+    # in-memory indexes built while it was in use are dropped after reconnecting
+    return {'generation': -1 if is_fake_db(db) else 0, 'updated_at': None}
+
+
+def bump_data_version(db, name: str = 'properties') -> int:
+    """
+    Record a new data generation for a collection
+    
+    Args:
+        db: Database object
+        name: Name of the tracked collection
+        
+    Returns:
+        The new generation number
+    """
+    db[DATA_VERSIONS_COLLECTION].update_one(
+        {'_id': name},
+        {'$inc': {'generation': 1}, '$set': {'updated_at': datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    
+    generation = get_data_version(db, name)['generation']
+    logger.info(f"Data version for {name} bumped to generation {generation}")
+    
+    return generation
+
+
+def next_data_generation(db, name: str = 'properties') -> int:
+    """
+    Get the generation number the next bump_data_version call will record
+    
+    Lets derived data be saved for a generation before it is recorded.
+    
+    Args:
+        db: Database object
+        name: Name of the tracked collection
+        
+    Returns:
+        The next generation number
+    """
+    version = db[DATA_VERSIONS_COLLECTION].find_one({'_id': name}) or {}
+    return version.get('generation', 0) + 1
+
+
+class DataVersionWatcher:
+    """Cached view of a collection's data version, refreshed at most every check_interval seconds"""
+    
+    def __init__(self, db, name: str = 'properties', check_interval: float = DEFAULT_CHECK_INTERVAL):
+        """
+        Initialize the watcher
+        
+        Args:
+            db: Database object
+            name: Name of the tracked collection
+            check_interval: Seconds between reads of the stored version
+        """
+        self.db = db
+        self.name = name
+        self.check_interval = check_interval
+        self._version = None
+        self._checked_at = 0.0
+    
+    def current(self) -> Dict[str, Any]:
+        """
+        Get the data version, reading it from the database if the cached copy is too old
+        
+        Returns:
+            Dictionary with the generation number and the time it was recorded
+        """
+        now = time.monotonic()
+        if self._version is None or now - self._checked_at >= self.check_interval:
+            self._version = get_data_version(self.db, self.name)
+            self._checked_at = now
+        
+        return self._version
+    
+    @property
+    def generation(self) -> int:
+        """Current generation number"""
+        return self.current()['generation']
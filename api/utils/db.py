@@ -4,102 +4,397 @@ Database connection utilities for the API.
 
 import os
 import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Callable
 import pymongo
 from pymongo import MongoClient
+from pymongo.monitoring import ConnectionPoolListener
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from collections import defaultdict
+from api.utils.fake_db import FakeDB, FakeCollection, FakeCursor
 
 logger = logging.getLogger(__name__)
 
-# Mock DB implementation that returns empty data
-class FakeCursor:
-    def __init__(self, items=None):
-        self.items = items or []
-        
-    def limit(self, n):
-        return self
-        
-    def skip(self, n):
-        return self
-        
-    def sort(self, field, direction=1):
-        return self
+# Default connection pool and timeout settings, overridable with environment variables
+DEFAULT_MAX_POOL_SIZE = 50
+DEFAULT_MIN_POOL_SIZE = 0
+DEFAULT_SERVER_SELECTION_TIMEOUT_MS = 2000
+DEFAULT_CONNECT_TIMEOUT_MS = 2000
+DEFAULT_SOCKET_TIMEOUT_MS = 30000
+DEFAULT_WAIT_QUEUE_TIMEOUT_MS = 5000
+
+# Default seconds between health checks of the MongoDB connection
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+
+# MONGODB_URI value selecting the in-memory database without trying MongoDB
+IN_MEMORY_URI = 'memory://'
+
+
+def is_fake_db(db):
+    """
+    Check whether a database object is the in-memory fallback
+    
+    Args:
+        db: Database object
         
-    def __iter__(self):
-        return iter(self.items)
+    Returns:
+        True if MongoDB was not available and FakeDB is in use
+    """
+    if isinstance(db, DatabaseProxy):
+        db = db.target
+    return isinstance(db, FakeDB)
+
+
+def mongodb_client_options() -> Dict[str, Any]:
+    """
+    Get the MongoDB client pool and timeout options from the environment
+    
+    Returns:
+        Keyword arguments for MongoClient (also accepted by Motor's client)
+    """
+    return {
+        'maxPoolSize': int(os.environ.get('MONGODB_MAX_POOL_SIZE', DEFAULT_MAX_POOL_SIZE)),
+        'minPoolSize': int(os.environ.get('MONGODB_MIN_POOL_SIZE', DEFAULT_MIN_POOL_SIZE)),
+        'serverSelectionTimeoutMS': int(os.environ.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS',
+                                                       DEFAULT_SERVER_SELECTION_TIMEOUT_MS)),
+        'connectTimeoutMS': int(os.environ.get('MONGODB_CONNECT_TIMEOUT_MS', DEFAULT_CONNECT_TIMEOUT_MS)),
+        'socketTimeoutMS': int(os.environ.get('MONGODB_SOCKET_TIMEOUT_MS', DEFAULT_SOCKET_TIMEOUT_MS)),
+        'waitQueueTimeoutMS': int(os.environ.get('MONGODB_WAIT_QUEUE_TIMEOUT_MS', DEFAULT_WAIT_QUEUE_TIMEOUT_MS))
+    }
+
+
+class PoolMetrics(ConnectionPoolListener):
+    """Connection pool listener keeping counters of connection and checkout activity"""
+    
+    def __init__(self):
+        """Initialize the counters"""
+        self._lock = threading.Lock()
+        self.pools = 0
+        self.pool_clears = 0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.checkout_failures = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+    
+    def pool_created(self, event):
+        with self._lock:
+            self.pools += 1
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+    
+    def pool_closed(self, event):
+        with self._lock:
+            self.pools -= 1
+    
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+    
+    def connection_check_out_started(self, event):
+        pass
+    
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+    
+    def connection_checked_out(self, event):
+        # Time spent waiting for a connection, including establishing a new one
+        duration = getattr(event, 'duration', None) or 0.0
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_total += duration
+            self.checkout_wait_max = max(self.checkout_wait_max, duration)
+    
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checkins += 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get the current pool metrics
         
-    def __list__(self):
-        return self.items
+        Returns:
+            Dictionary with connection and checkout counters
+        """
+        with self._lock:
+            return {
+                'pools': self.pools,
+                'connections_open': self.connections_created - self.connections_closed,
+                'connections_in_use': self.checkouts - self.checkins,
+                'connections_created': self.connections_created,
+                'pool_clears': self.pool_clears,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'avg_checkout_wait_ms': round(self.checkout_wait_total / self.checkouts * 1000, 3)
+                if self.checkouts else 0.0,
+                'max_checkout_wait_ms': round(self.checkout_wait_max * 1000, 3)
+            }
 
 
-class FakeCollection:
-    def __init__(self, name):
+class CollectionProxy:
+    """Collection handle that follows the connection manager's current database"""
+    
+    def __init__(self, manager: 'ConnectionManager', name: str):
+        self._manager = manager
         self.name = name
+        self._target = None
+        self._collection = None
+    
+    def __getattr__(self, attr):
+        target = self._manager.target
+        if self._target is not target:
+            self._collection = target[self.name]
+            self._target = target
+        return getattr(self._collection, attr)
+
+
+class DatabaseProxy:
+    """
+    Database handle that follows the connection manager's current database
+    
+    Services keep collection handles for their whole lifetime, so handles
+    taken from the proxy switch to MongoDB when it becomes reachable after a
+    FakeDB fallback.
+    """
+    
+    def __init__(self, manager: 'ConnectionManager'):
+        self._manager = manager
+        self._collections = {}
+    
+    @property
+    def target(self):
+        """The database currently in use (MongoDB or FakeDB)"""
+        return self._manager.target
+    
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections.setdefault(name, CollectionProxy(self._manager, name))
+        return collection
+    
+    def __getattr__(self, attr):
+        return getattr(self._manager.target, attr)
+
+
+class ConnectionManager:
+    """Process-wide MongoDB client with a FakeDB fallback and background health checks"""
+    
+    def __init__(self, uri: Optional[str] = None, db_name: Optional[str] = None,
+                 client_options: Optional[Dict[str, Any]] = None,
+                 health_check_interval: Optional[float] = None):
+        """
+        Initialize the connection manager
+        
+        Nothing connects until the database is first used.
+        
+        Args:
+            uri: MongoDB connection string (optional, MONGODB_URI or localhost if not given)
+            db_name: Database name (optional, MONGODB_DATABASE or 'realestate' if not given)
+            client_options: MongoClient pool and timeout options (optional, see
+                mongodb_client_options)
+            health_check_interval: Seconds between health checks (optional,
+                MONGODB_HEALTH_CHECK_INTERVAL or 30 if not given, 0 disables them)
+        """
+        self.uri = uri or os.environ.get('MONGODB_URI', 'mongodb://localhost:27017')
+        self.db_name = db_name or os.environ.get('MONGODB_DATABASE', 'realestate')
+        self.client_options = client_options or mongodb_client_options()
+        if health_check_interval is None:
+            health_check_interval = float(os.environ.get('MONGODB_HEALTH_CHECK_INTERVAL',
+                                                         DEFAULT_HEALTH_CHECK_INTERVAL))
+        self.health_check_interval = health_check_interval
+        self.pool_metrics = PoolMetrics()
+        self.database = DatabaseProxy(self)
+        self.healthy = False
+        self.last_health_check = None
+        self.reconnections = 0
+        self._client = None
+        self._target = None
+        self._reconnect_callbacks = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread = None
+    
+    @property
+    def target(self):
+        """The database currently in use, connecting on first use"""
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._connect()
+        return self._target
+    
+    def on_reconnect(self, callback: Callable[[], None]):
+        """
+        Register a function to call after switching from FakeDB to MongoDB
+        
+        Args:
+            callback: Function without arguments, e.g. creating indexes
+        """
+        self._reconnect_callbacks.append(callback)
+    
+    def check_health(self) -> bool:
+        """
+        Ping MongoDB, switching from FakeDB to it if it has become reachable
         
-    def find(self, query=None, projection=None):
-        logger.debug(f"Find called on {self.name} with {query}")
-        return FakeCursor()
+        Returns:
+            True if MongoDB answered
+        """
+        try:
+            database = self._get_client()[self.db_name]
+            database.command('ping')
+            self.healthy = True
+        except Exception as e:
+            if self.healthy or not is_fake_db(self._target):
+                logger.warning(f"MongoDB health check failed: {str(e)}")
+            self.healthy = False
+        self.last_health_check = datetime.now(timezone.utc)
         
-    def find_one(self, query=None):
-        logger.debug(f"Find one called on {self.name} with {query}")
-        return None
+        if self.healthy and is_fake_db(self._target):
+            with self._lock:
+                self._target = database
+                self.reconnections += 1
+            logger.info(f"MongoDB is reachable again, switched from fake DB: {self.uri}, DB: {self.db_name}")
+            
+            for callback in self._reconnect_callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Error in reconnect callback: {str(e)}")
         
-    def count_documents(self, query=None):
-        return 0
+        return self.healthy
+    
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Get connection and pool metrics
+        
+        Returns:
+            Dictionary with the backend in use, health check state and pool counters
+        """
+        return {
+            'backend': 'fake' if is_fake_db(self._target) else 'mongodb',
+            'healthy': self.healthy,
+            'last_health_check': self.last_health_check.isoformat() if self.last_health_check else None,
+            'reconnections': self.reconnections,
+            'max_pool_size': self.client_options.get('maxPoolSize'),
+            'pool': self.pool_metrics.snapshot()
+        }
+    
+    def close(self):
+        """Stop the health checks and close the client"""
+        self._stop.set()
+        if self._client is not None:
+            self._client.close()
+    
+    def _get_client(self) -> MongoClient:
+        """Get the shared client, creating it on first use (creating it doesn't connect)"""
+        if self._client is None:
+            self._client = MongoClient(self.uri, event_listeners=[self.pool_metrics], **self.client_options)
+        return self._client
+    
+    def _connect(self):
+        """Connect to MongoDB, falling back to FakeDB, and start the health checks"""
+        if self.uri == IN_MEMORY_URI:
+            logger.info("Using the in-memory database")
+            self._target = create_fake_db()
+            return
         
-    def distinct(self, field, query=None):
-        return []
+        try:
+            database = self._get_client()[self.db_name]
+            
+            # Test connection
+            database.command('ping')
+            logger.info(f"Connected to MongoDB: {self.uri}, DB: {self.db_name}")
+            
+            self.healthy = True
+            self._target = database
+        except Exception as mongo_e:
+            logger.warning(f"Could not connect to MongoDB: {str(mongo_e)}")
+            logger.info("MongoDB not available, using fake DB implementation")
+            
+            self.healthy = False
+            self._target = create_fake_db()
+        self.last_health_check = datetime.now(timezone.utc)
         
-    def aggregate(self, pipeline):
-        return []
+        if self.health_check_interval > 0 and self._health_thread is None:
+            self._health_thread = threading.Thread(target=self._run_health_checks,
+                                                   name='mongodb-health-check', daemon=True)
+            self._health_thread.start()
+    
+    def _run_health_checks(self):
+        """Check the connection every health_check_interval seconds until closed"""
+        while not self._stop.wait(self.health_check_interval):
+            self.check_health()
 
 
-class FakeDB:
-    """Mock database for when MongoDB is not available"""
-    def __init__(self):
-        self.collections = defaultdict(lambda: FakeCollection("unknown"))
-        
-    def __getitem__(self, name):
-        logger.debug(f"Getting collection {name}")
-        return self.collections[name]
+def create_fake_db() -> FakeDB:
+    """
+    Create the in-memory fallback database
     
-    def command(self, cmd):
-        logger.debug(f"Command {cmd} called")
-        return {"ok": 1.0}
+    If FAKE_DB_SNAPSHOT is set, the collections are loaded from that JSONL
+    snapshot (see FakeDB.load_snapshot). Setting MONGODB_URI to memory://
+    uses this database without trying MongoDB.
     
+    Returns:
+        FakeDB object
+    """
+    fake_db = FakeDB(os.environ.get('MONGODB_DATABASE', 'realestate'))
+    
+    snapshot = os.environ.get('FAKE_DB_SNAPSHOT')
+    if snapshot:
+        try:
+            count = fake_db.load_snapshot(snapshot)
+            logger.info(f"Loaded {count} documents into the fake DB from {snapshot}")
+        except Exception as e:
+            logger.error(f"Error loading fake DB snapshot {snapshot}: {str(e)}")
+    
+    return fake_db
+
+
+_connection_manager = None
+_connection_manager_lock = threading.Lock()
+
+
+def get_connection_manager() -> ConnectionManager:
+    """
+    Get the process-wide connection manager
+    
+    Returns:
+        ConnectionManager shared by every service in the process
+    """
+    global _connection_manager
+    
+    if _connection_manager is None:
+        with _connection_manager_lock:
+            if _connection_manager is None:
+                _connection_manager = ConnectionManager()
+    return _connection_manager
+
 
 def get_db_connection():
     """
     Get a connection to the database
     
+    Every call shares one MongoClient and its connection pool. If MongoDB is
+    not available the database falls back to FakeDB until a health check
+    finds it reachable again.
+    
     Returns:
         Database object
     """
-    # First try MongoDB
-    try:
-        # Get MongoDB connection string from environment variable, or use default
-        mongodb_uri = os.environ.get('MONGODB_URI', 'mongodb://localhost:27017')
-        
-        # Get database name from environment variable, or use default
-        db_name = os.environ.get('MONGODB_DATABASE', 'realestate')
-        
-        # Connect to MongoDB with a short timeout
-        client = MongoClient(mongodb_uri, serverSelectionTimeoutMS=2000)
-        db = client[db_name]
-        
-        # Test connection
-        db.command('ping')
-        logger.info(f"Connected to MongoDB: {mongodb_uri}, DB: {db_name}")
-        
-        return db
-    except Exception as mongo_e:
-        logger.warning(f"Could not connect to MongoDB: {str(mongo_e)}")
-        
-        # Fall back to PostgreSQL or return a fake DB
-        if os.environ.get('DATABASE_URL'):
-            logger.info("MongoDB not available, using fake DB implementation")
-            return FakeDB()
-        else:
-            logger.error("No database available")
-            return FakeDB()
+    return get_connection_manager().database
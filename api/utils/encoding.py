@@ -0,0 +1,62 @@
+"""
+Encoding utilities for turning MongoDB documents into API responses.
+"""
+
+from datetime import datetime, date
+from decimal import Decimal
+from typing import List, Dict, Any
+from bson import ObjectId, Decimal128
+
+
+def encode_value(value: Any) -> Any:
+    """
+    Convert a BSON value into a JSON-serializable value
+    
+    ObjectIds become strings, dates become ISO 8601 strings and decimals
+    become floats. Nested documents and lists are converted recursively.
+    
+    Args:
+        value: Value read from MongoDB
+        
+    Returns:
+        JSON-serializable value
+    """
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [encode_value(item) for item in value]
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def encode_document(document: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert a MongoDB document into a JSON-serializable dictionary in one pass
+    
+    Args:
+        document: Document read from MongoDB
+        
+    Returns:
+        JSON-serializable dictionary
+    """
+    return {key: encode_value(value) for key, value in document.items()}
+
+
+def encode_documents(documents) -> List[Dict[str, Any]]:
+    """
+    Convert MongoDB documents into JSON-serializable dictionaries
+    
+    Args:
+        documents: Iterable of documents, such as a cursor
+        
+    Returns:
+        List of JSON-serializable dictionaries
+    """
+    return [encode_document(document) for document in documents]
@@ -0,0 +1,1453 @@
+"""
+In-memory document store used when MongoDB is not available.
+
+FakeDB evaluates the subset of the MongoDB query language used by the
+services, so the API can run (and be benchmarked) without a database server:
+
+- Query filters with equality, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin/$exists/
+  $type/$regex/$not and $and/$or/$nor, on dotted paths and arrays
+- Inclusion and exclusion projections, sort/skip/limit
+- distinct, count_documents and the $match/$group/$sort/$skip/$limit/
+  $count/$facet/$project/$addFields/$unwind aggregation stages
+- Inserts, updates with $set/$unset/$inc/$min/$max/$push/$setOnInsert,
+  replacements, deletes and bulk_write
+
+Fields covered by a created index get a hash index, used to select the
+candidate documents of equality and $in conditions. Collections can be
+loaded from a JSONL snapshot (one Extended JSON document per line, the
+format written by mongoexport).
+"""
+
+import os
+import re
+import heapq
+import logging
+import threading
+from datetime import datetime, timezone
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Callable, Tuple, Iterator
+from bson import ObjectId
+from bson.json_util import loads, dumps, RELAXED_JSON_OPTIONS
+from pymongo.errors import OperationFailure, DuplicateKeyError
+from pymongo.operations import InsertOne, ReplaceOne, UpdateOne, UpdateMany, DeleteOne, DeleteMany
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+
+logger = logging.getLogger(__name__)
+
+# Marker for a path that doesn't exist in a document
+MISSING = object()
+
+# Index key types that can't be served by a hash index
+NON_HASHABLE_INDEX_TYPES = ('2dsphere', '2d', 'text', 'geoHaystack')
+
+# Query operators that can be served by a geo index
+GEO_OPERATORS = ('$geoWithin', '$geoIntersects', '$near', '$nearSphere')
+
+# Extension of the JSONL files in a snapshot directory
+SNAPSHOT_EXTENSION = '.jsonl'
+
+# $type aliases and the Python types they match
+TYPE_ALIASES = {
+    'double': (float,),
+    'int': (int,),
+    'long': (int,),
+    'number': (int, float),
+    'string': (str,),
+    'object': (dict,),
+    'array': (list,),
+    'objectId': (ObjectId,),
+    'bool': (bool,),
+    'date': (datetime,),
+    'null': (type(None),)
+}
+
+
+# BSON comparison order of the types stored in documents
+TYPE_RANKS = {
+    type(None): 1,
+    int: 2,
+    float: 2,
+    str: 3,
+    dict: 4,
+    list: 5,
+    bytes: 6,
+    ObjectId: 7,
+    bool: 8,
+    datetime: 9
+}
+
+
+def _type_rank(value) -> int:
+    """Position of a value's type in the BSON comparison order"""
+    rank = TYPE_RANKS.get(type(value))
+    if rank is not None:
+        return rank
+    if value is MISSING:
+        return 0
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def sort_key(value) -> Tuple:
+    """
+    Key ordering values of any type like MongoDB does
+    
+    Args:
+        value: Document value (MISSING sorts like null)
+        
+    Returns:
+        Tuple comparable with the key of any other value
+    """
+    value_type = type(value)
+    if value_type is float or value_type is int:
+        return (2, value)
+    if value_type is str:
+        return (3, value)
+    
+    rank = _type_rank(value)
+    if rank <= 1:
+        return (1, 0)
+    if rank == 4:
+        return (rank, tuple((k, sort_key(v)) for k, v in value.items()))
+    if rank == 5:
+        return (rank, tuple(sort_key(v) for v in value))
+    if rank == 10:
+        return (rank, str(value))
+    return (rank, value)
+
+
+def _compare(a, b) -> int:
+    """Compare two values in BSON order, with missing values before null (-1, 0 or 1)"""
+    rank_a, rank_b = _type_rank(a), _type_rank(b)
+    if rank_a != rank_b:
+        return -1 if rank_a < rank_b else 1
+    if rank_a <= 1:
+        return 0
+    key_a, key_b = sort_key(a), sort_key(b)
+    return (key_a > key_b) - (key_a < key_b)
+
+
+def _equals(a, b) -> bool:
+    """Check whether two values are equal without matching booleans to numbers"""
+    return _type_rank(a) == _type_rank(b) and a == b
+
+
+def _freeze(value):
+    """Hashable representation of a value, used for index keys and grouping"""
+    if isinstance(value, dict):
+        return ('__dict__',) + tuple((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return ('__list__',) + tuple(_freeze(v) for v in value)
+    if isinstance(value, bool):
+        return ('__bool__', value)
+    return value
+
+
+def _normalize(value):
+    """
+    Copy a value as MongoDB would store it
+    
+    Datetimes become naive UTC (as returned by pymongo) and tuples become lists.
+    """
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _copy(value):
+    """Copy a stored value so callers can't modify the store"""
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def resolve_path(document: Dict[str, Any], path: str) -> List[Any]:
+    """
+    Get the values at a dotted path, descending into arrays
+    
+    Args:
+        document: Document
+        path: Field name or dotted path
+        
+    Returns:
+        Values found at the path (empty if the path doesn't exist)
+    """
+    if '.' not in path:
+        return [document[path]] if path in document else []
+    
+    values = [document]
+    for part in path.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    found.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit() and int(part) < len(value):
+                    found.append(value[int(part)])
+                else:
+                    found.extend(element[part] for element in value
+                                 if isinstance(element, dict) and part in element)
+        values = found
+    return values
+
+
+def _get_path(document: Dict[str, Any], path: str):
+    """Get the value at a dotted path as an aggregation expression sees it (MISSING if absent)"""
+    value = document
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list):
+            value = [element.get(part) for element in value if isinstance(element, dict) and part in element]
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def _set_path(document: Dict[str, Any], path: str, value):
+    """Set the value at a dotted path, creating intermediate documents"""
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def _unset_path(document: Dict[str, Any], path: str):
+    """Remove the value at a dotted path if it exists"""
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+def _is_operator_document(value) -> bool:
+    """Check whether a filter value is a document of query operators"""
+    return isinstance(value, dict) and bool(value) and all(key.startswith('$') for key in value)
+
+
+def _candidates(values: List[Any]) -> List[Any]:
+    """Values a query condition is tested against: the values and the elements of array values"""
+    candidates = list(values)
+    for value in values:
+        if isinstance(value, list):
+            candidates.extend(value)
+    return candidates
+
+
+class _PathValues(list):
+    """Several values found at a dotted path through an array of documents"""
+
+
+def _path_value(document: Dict[str, Any], path: str):
+    """Value a query condition on a dotted path is tested against (MISSING if absent)"""
+    values = resolve_path(document, path)
+    if not values:
+        return MISSING
+    if len(values) == 1:
+        return values[0]
+    return _PathValues(values)
+
+
+def _elements(value: list) -> List[Any]:
+    """Candidates of an array value: the array itself and its elements"""
+    if type(value) is _PathValues:
+        return _candidates(value)
+    return [value] + value
+
+
+def _compile_equality(expected) -> Callable[[Any], bool]:
+    """Compile an equality condition, where null also matches missing fields"""
+    expected = _normalize(expected)
+    
+    if expected is None:
+        def test(value):
+            if value is MISSING or value is None:
+                return True
+            return isinstance(value, list) and any(candidate is None for candidate in _elements(value))
+        
+        return test
+    
+    expected_type = type(expected)
+    
+    def test(value):
+        if type(value) is expected_type and expected_type is not list:
+            return value == expected
+        if isinstance(value, list):
+            return any(_equals(candidate, expected) for candidate in _elements(value))
+        return _equals(value, expected)
+    
+    return test
+
+
+def _compile_range(operator: str, operand) -> Callable[[Any], bool]:
+    """Compile a comparison that only matches values of the same type as the operand"""
+    operand = _normalize(operand)
+    rank = _type_rank(operand)
+    key = sort_key(operand)
+    compare = {
+        '$gt': lambda a, b: a > b,
+        '$gte': lambda a, b: a >= b,
+        '$lt': lambda a, b: a < b,
+        '$lte': lambda a, b: a <= b
+    }[operator]
+    
+    def scalar(value):
+        value_type = type(value)
+        if rank == 2 and (value_type is float or value_type is int):
+            return compare(value, operand)
+        return _type_rank(value) == rank and compare(sort_key(value), key)
+    
+    def test(value):
+        if value is MISSING:
+            return rank == 1 and operator in ('$gte', '$lte')
+        if isinstance(value, list):
+            return any(scalar(candidate) for candidate in _elements(value))
+        return scalar(value)
+    
+    return test
+
+
+def _any_candidate(value, test: Callable[[Any], bool]) -> bool:
+    """Check whether a field value or any of its elements passes a test"""
+    if value is MISSING:
+        return False
+    if isinstance(value, list):
+        return any(test(candidate) for candidate in _elements(value))
+    return test(value)
+
+
+def _compile_operators(operators: Dict[str, Any]) -> Callable[[Any], bool]:
+    """Compile a document of query operators applied to the value of one path"""
+    tests = []
+    for operator, operand in operators.items():
+        if operator == '$eq':
+            tests.append(_compile_equality(operand))
+        elif operator == '$ne':
+            equality = _compile_equality(operand)
+            tests.append(lambda value, equality=equality: not equality(value))
+        elif operator in ('$gt', '$gte', '$lt', '$lte'):
+            tests.append(_compile_range(operator, operand))
+        elif operator in ('$in', '$nin'):
+            equalities = [_compile_equality(item) for item in operand]
+            if operator == '$in':
+                tests.append(lambda value, equalities=equalities: any(eq(value) for eq in equalities))
+            else:
+                tests.append(lambda value, equalities=equalities: not any(eq(value) for eq in equalities))
+        elif operator == '$exists':
+            tests.append(lambda value, exists=bool(operand): (value is not MISSING) == exists)
+        elif operator == '$type':
+            aliases = operand if isinstance(operand, list) else [operand]
+            types = tuple(t for alias in aliases for t in TYPE_ALIASES.get(alias, ()))
+            excludes_bool = bool not in types
+            tests.append(lambda value, types=types, excludes_bool=excludes_bool: _any_candidate(
+                value, lambda candidate: isinstance(candidate, types)
+                and not (excludes_bool and isinstance(candidate, bool))
+            ))
+        elif operator == '$regex':
+            flags = 0
+            for option in operators.get('$options', ''):
+                flags |= {'i': re.IGNORECASE, 'm': re.MULTILINE, 's': re.DOTALL, 'x': re.VERBOSE}.get(option, 0)
+            pattern = re.compile(operand, flags) if isinstance(operand, str) else operand
+            tests.append(lambda value, pattern=pattern: _any_candidate(
+                value, lambda candidate: isinstance(candidate, str) and pattern.search(candidate) is not None
+            ))
+        elif operator == '$options':
+            continue
+        elif operator == '$not':
+            inner = _compile_operators(operand) if _is_operator_document(operand) \
+                else _compile_operators({'$regex': operand})
+            tests.append(lambda value, inner=inner: not inner(value))
+        else:
+            raise OperationFailure(f"unsupported query operator in the in-memory database: {operator}")
+    
+    if len(tests) == 1:
+        return tests[0]
+    return lambda value: all(test(value) for test in tests)
+
+
+def compile_filter(query: Optional[Dict[str, Any]]) -> Callable[[Dict[str, Any]], bool]:
+    """
+    Compile a query filter into a predicate
+    
+    Args:
+        query: MongoDB query filter (optional, matches every document if not given)
+        
+    Returns:
+        Function taking a document and returning whether it matches
+        
+    Raises:
+        OperationFailure: If the filter uses an unsupported operator
+    """
+    if not query:
+        return lambda document: True
+    
+    predicates = []
+    for key, condition in query.items():
+        if key in ('$and', '$or', '$nor'):
+            clauses = [compile_filter(clause) for clause in condition]
+            if key == '$and':
+                predicates.append(lambda document, clauses=clauses: all(c(document) for c in clauses))
+            elif key == '$or':
+                predicates.append(lambda document, clauses=clauses: any(c(document) for c in clauses))
+            else:
+                predicates.append(lambda document, clauses=clauses: not any(c(document) for c in clauses))
+        elif key.startswith('$'):
+            raise OperationFailure(f"unsupported query operator in the in-memory database: {key}")
+        else:
+            test = _compile_operators(condition) if _is_operator_document(condition) \
+                else _compile_equality(condition)
+            if '.' in key:
+                predicates.append(lambda document, path=key, test=test: test(_path_value(document, path)))
+            else:
+                predicates.append(lambda document, field=key, test=test: test(document.get(field, MISSING)))
+    
+    if len(predicates) == 1:
+        return predicates[0]
+    return lambda document: all(predicate(document) for predicate in predicates)
+
+
+def compile_projection(projection) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Compile a projection into a function copying the projected fields of a document
+    
+    Args:
+        projection: Inclusion or exclusion projection, or a list of field names
+            (optional, the whole document is copied if not given)
+            
+    Returns:
+        Function taking a stored document and returning the projected copy
+    """
+    if not projection:
+        return _copy
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    
+    include_id = bool(projection.get('_id', 1))
+    fields = {field: bool(value) for field, value in projection.items() if field != '_id'}
+    
+    if not fields or not any(fields.values()):
+        # Exclusion projection
+        excluded = [field for field, included in fields.items() if not included]
+        if not include_id:
+            excluded.append('_id')
+        
+        def exclude(document):
+            result = _copy(document)
+            for field in excluded:
+                _unset_path(result, field)
+            return result
+        
+        return exclude
+    
+    if not all(fields.values()):
+        raise OperationFailure("Cannot do exclusion in an inclusion projection")
+    
+    def include(document):
+        result = {}
+        if include_id and '_id' in document:
+            result['_id'] = _copy(document['_id'])
+        for field in fields:
+            if '.' not in field:
+                if field in document:
+                    result[field] = _copy(document[field])
+            else:
+                value = _get_path(document, field)
+                if value is not MISSING:
+                    _set_path(result, field, _copy(value))
+        return result
+    
+    return include
+
+
+def _normalize_sort(key_or_list, direction=None) -> List[Tuple[str, int]]:
+    """Normalize the sort arguments accepted by pymongo into a list of (field, direction)"""
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(key, value) for key, value in key_or_list]
+
+
+def _index_sorts(keys: List[Tuple[str, Any]], sort: Optional[List[Tuple[str, int]]], equality: set) -> bool:
+    """
+    Check whether an index returns documents in sort order
+    
+    Args:
+        keys: Keys of the index
+        sort: Sort specification
+        equality: Fields with an equality condition, which don't change the order
+        
+    Returns:
+        True if the sort follows the index keys after the leading equality
+        fields, in the index direction or the reverse one
+    """
+    if not sort:
+        return False
+    
+    keys = list(keys)
+    while keys and keys[0][0] in equality and keys[0][0] not in dict(sort):
+        keys.pop(0)
+    if len(keys) < len(sort) or any(field != key_field for (field, _), (key_field, _) in zip(sort, keys)):
+        return False
+    
+    same = [direction == key_direction for (_, direction), (_, key_direction) in zip(sort, keys)]
+    return all(same) or not any(same)
+
+
+class _Descending:
+    """Sort key wrapper inverting the order of the wrapped key"""
+    
+    __slots__ = ('key',)
+    
+    def __init__(self, key):
+        self.key = key
+    
+    def __lt__(self, other):
+        return other.key < self.key
+    
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def sort_documents(documents: List[Dict[str, Any]], sort: List[Tuple[str, int]],
+                   limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Sort documents by several fields like MongoDB does
+    
+    Args:
+        documents: Documents to sort
+        sort: List of (field, direction) pairs
+        limit: Number of leading documents needed (optional, all documents
+            are sorted if not given)
+            
+    Returns:
+        New sorted list (of at most limit documents)
+    """
+    getters = [
+        (lambda document, field=field: _get_path(document, field)) if '.' in field
+        else (lambda document, field=field: document.get(field))
+        for field, _ in sort
+    ]
+    ascending = [direction > 0 for _, direction in sort]
+    
+    if len(set(ascending)) == 1:
+        # A single direction sorts on plain keys, in reverse if descending
+        reverse = not ascending[0]
+        key = lambda document: tuple(sort_key(get(document)) for get in getters)
+    else:
+        reverse = False
+        key = lambda document: tuple(sort_key(get(document)) if up else _Descending(sort_key(get(document)))
+                                     for get, up in zip(getters, ascending))
+    
+    if limit and limit < len(documents):
+        return (heapq.nlargest if reverse else heapq.nsmallest)(limit, documents, key=key)
+    return sorted(documents, key=key, reverse=reverse)
+
+
+def evaluate(expression, document: Dict[str, Any]):
+    """
+    Evaluate an aggregation expression against a document
+    
+    Args:
+        expression: Field path ('$field'), operator expression, expression
+            object or literal
+        document: Document
+        
+    Returns:
+        Value of the expression (MISSING for a path that doesn't exist)
+        
+    Raises:
+        OperationFailure: If the expression uses an unsupported operator
+    """
+    if isinstance(expression, str):
+        if expression == '$$ROOT':
+            return document
+        if expression.startswith('$$'):
+            raise OperationFailure(f"unsupported variable in the in-memory database: {expression}")
+        if expression.startswith('$'):
+            return _get_path(document, expression[1:])
+        return expression
+    
+    if isinstance(expression, list):
+        return [_value(evaluate(item, document)) for item in expression]
+    
+    if not isinstance(expression, dict):
+        return expression
+    
+    if len(expression) == 1:
+        operator, operand = next(iter(expression.items()))
+        if operator.startswith('$'):
+            return _evaluate_operator(operator, operand, document)
+    
+    result = {}
+    for key, item in expression.items():
+        value = evaluate(item, document)
+        if value is not MISSING:
+            result[key] = value
+    return result
+
+
+def _value(value):
+    """Turn a missing value into null"""
+    return None if value is MISSING else value
+
+
+def _evaluate_operator(operator: str, operand, document: Dict[str, Any]):
+    """Evaluate an aggregation operator expression"""
+    if operator == '$literal':
+        return operand
+    
+    arguments = operand if isinstance(operand, list) else [operand]
+    
+    if operator == '$cond':
+        if isinstance(operand, dict):
+            arguments = [operand['if'], operand['then'], operand['else']]
+        condition = _truthy(evaluate(arguments[0], document))
+        return evaluate(arguments[1] if condition else arguments[2], document)
+    
+    if operator == '$ifNull':
+        for argument in arguments:
+            value = evaluate(argument, document)
+            if value is not MISSING and value is not None:
+                return value
+        return None
+    
+    values = [evaluate(argument, document) for argument in arguments]
+    
+    comparisons = {
+        '$eq': lambda c: c == 0, '$ne': lambda c: c != 0,
+        '$gt': lambda c: c > 0, '$gte': lambda c: c >= 0,
+        '$lt': lambda c: c < 0, '$lte': lambda c: c <= 0
+    }
+    if operator in comparisons:
+        return comparisons[operator](_compare(values[0], values[1]))
+    if operator == '$cmp':
+        return _compare(values[0], values[1])
+    
+    if operator == '$and':
+        return all(_truthy(value) for value in values)
+    if operator == '$or':
+        return any(_truthy(value) for value in values)
+    if operator == '$not':
+        return not _truthy(values[0])
+    
+    if operator in ('$add', '$subtract', '$multiply', '$divide'):
+        values = [_value(value) for value in values]
+        if any(value is None for value in values):
+            return None
+        if operator == '$add':
+            return sum(values)
+        if operator == '$subtract':
+            return values[0] - values[1]
+        if operator == '$multiply':
+            result = 1
+            for value in values:
+                result *= value
+            return result
+        if values[1] == 0:
+            raise OperationFailure("can't $divide by zero")
+        return values[0] / values[1]
+    
+    if operator == '$size':
+        if not isinstance(values[0], list):
+            raise OperationFailure("The argument to $size must be an array")
+        return len(values[0])
+    
+    raise OperationFailure(f"unsupported expression operator in the in-memory database: {operator}")
+
+
+def _truthy(value) -> bool:
+    """Truth value of an aggregation expression result"""
+    if value is MISSING or value is None or value is False:
+        return False
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value != 0
+    return True
+
+
+class _Accumulator:
+    """State of one $group accumulator for one group"""
+    
+    __slots__ = ('operator', 'expression', 'total', 'count', 'value', 'values', 'seen', 'all_ints')
+    
+    def __init__(self, operator: str, expression):
+        if operator not in ('$sum', '$avg', '$min', '$max', '$first', '$last', '$push', '$addToSet', '$count'):
+            raise OperationFailure(f"unsupported accumulator in the in-memory database: {operator}")
+        self.operator = operator
+        self.expression = expression
+        self.total = 0
+        self.count = 0
+        self.value = MISSING
+        self.values = []
+        self.seen = set()
+        self.all_ints = True
+    
+    def add(self, document: Dict[str, Any]):
+        """Accumulate a document"""
+        operator = self.operator
+        if operator == '$count':
+            self.total += 1
+            return
+        
+        value = evaluate(self.expression, document)
+        if operator in ('$sum', '$avg'):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.total += value
+                self.count += 1
+                self.all_ints = self.all_ints and isinstance(value, int)
+        elif operator in ('$min', '$max'):
+            if value is not MISSING and value is not None:
+                if self.value is MISSING:
+                    self.value = value
+                else:
+                    order = _compare(value, self.value)
+                    if (order < 0) if operator == '$min' else (order > 0):
+                        self.value = value
+        elif operator == '$first':
+            if self.count == 0:
+                self.value = _value(value)
+            self.count += 1
+        elif operator == '$last':
+            self.value = _value(value)
+        elif value is not MISSING:
+            if operator == '$push':
+                self.values.append(value)
+            elif _freeze(value) not in self.seen:
+                self.seen.add(_freeze(value))
+                self.values.append(value)
+    
+    def result(self):
+        """Final value of the accumulator"""
+        operator = self.operator
+        if operator in ('$sum', '$count'):
+            return self.total
+        if operator == '$avg':
+            return self.total / self.count if self.count else None
+        if operator in ('$push', '$addToSet'):
+            return self.values
+        return _value(self.value)
+
+
+def _group(documents: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Run a $group stage"""
+    if '_id' not in spec:
+        raise OperationFailure("a group specification must include an _id")
+    
+    id_expression = spec['_id']
+    fields = []
+    for name, accumulator in spec.items():
+        if name == '_id':
+            continue
+        (operator, expression), = accumulator.items()
+        fields.append((name, operator, expression))
+    
+    groups = {}
+    for document in documents:
+        group_id = _value(evaluate(id_expression, document))
+        key = _freeze(group_id)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = (group_id, [_Accumulator(op, expr) for _, op, expr in fields])
+        for accumulator in group[1]:
+            accumulator.add(document)
+    
+    results = []
+    for group_id, accumulators in groups.values():
+        result = {'_id': group_id}
+        for (name, _, _), accumulator in zip(fields, accumulators):
+            result[name] = accumulator.result()
+        results.append(result)
+    return results
+
+
+def _project(documents: List[Dict[str, Any]], spec: Dict[str, Any], add_fields: bool) -> List[Dict[str, Any]]:
+    """Run a $project or $addFields stage"""
+    if not add_fields and all(value in (0, 1, True, False) for value in spec.values()):
+        projection = compile_projection(spec)
+        return [projection(document) for document in documents]
+    
+    include_id = spec.get('_id', 1) not in (0, False)
+    results = []
+    for document in documents:
+        result = _copy(document) if add_fields else ({'_id': document['_id']}
+                                                    if include_id and '_id' in document else {})
+        for field, expression in spec.items():
+            if field == '_id' and not add_fields and expression in (0, 1, True, False):
+                continue
+            if expression in (1, True) and not add_fields:
+                value = _get_path(document, field)
+            else:
+                value = evaluate(expression, document)
+            if value is not MISSING:
+                _set_path(result, field, value)
+        results.append(result)
+    return results
+
+
+def _unwind(documents: List[Dict[str, Any]], spec) -> List[Dict[str, Any]]:
+    """Run an $unwind stage"""
+    if isinstance(spec, dict):
+        path = spec['path']
+        preserve = spec.get('preserveNullAndEmptyArrays', False)
+    else:
+        path, preserve = spec, False
+    field = path[1:]
+    
+    results = []
+    for document in documents:
+        value = _get_path(document, field)
+        if isinstance(value, list) and value:
+            for element in value:
+                result = _copy(document)
+                _set_path(result, field, element)
+                results.append(result)
+        elif isinstance(value, list) or value is MISSING or value is None:
+            if preserve:
+                results.append(document)
+        else:
+            results.append(document)
+    return results
+
+
+def run_pipeline(documents: List[Dict[str, Any]], pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Run aggregation stages over a list of documents
+    
+    Stages don't modify their input documents.
+    
+    Args:
+        documents: Input documents
+        pipeline: Aggregation stages
+        
+    Returns:
+        Output documents
+        
+    Raises:
+        OperationFailure: If a stage is not supported
+    """
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == '$match':
+            predicate = compile_filter(spec)
+            documents = [document for document in documents if predicate(document)]
+        elif name == '$group':
+            documents = _group(documents, spec)
+        elif name == '$sort':
+            documents = sort_documents(documents, _normalize_sort(spec))
+        elif name == '$skip':
+            documents = documents[spec:]
+        elif name == '$limit':
+            documents = documents[:spec]
+        elif name == '$count':
+            documents = [{spec: len(documents)}] if documents else []
+        elif name == '$facet':
+            documents = [{facet: run_pipeline(documents, stages) for facet, stages in spec.items()}]
+        elif name in ('$project', '$addFields', '$set'):
+            documents = _project(documents, spec, add_fields=name != '$project')
+        elif name == '$unwind':
+            documents = _unwind(documents, spec)
+        else:
+            raise OperationFailure(f"Unrecognized pipeline stage name: '{name}'")
+    return documents
+
+
+class FakeCursor:
+    """Cursor over the documents of a FakeCollection matching a query"""
+    
+    def __init__(self, collection: 'FakeCollection', query=None, projection=None):
+        self.collection = collection
+        self.query = query or {}
+        self.projection = projection
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+        self._iterator = None
+    
+    def limit(self, n):
+        self._limit = n
+        return self
+    
+    def skip(self, n):
+        self._skip = n
+        return self
+    
+    def sort(self, key_or_list, direction=None):
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+    
+    def batch_size(self, n):
+        return self
+    
+    def close(self):
+        self._iterator = iter(())
+    
+    def explain(self) -> Dict[str, Any]:
+        """
+        Describe how MongoDB would execute the query with the created indexes
+        
+        Returns:
+            Explain output shaped like MongoDB's, with an IXSCAN stage if an
+            index can serve the query (see FakeCollection._choose_index) and
+            COLLSCAN otherwise, under a SORT stage if the index doesn't
+            return the documents in sort order
+        """
+        index_name, sorted_by_index = self.collection._choose_index(self.query, self._sort)
+        stage = {'stage': 'IXSCAN', 'indexName': index_name} if index_name else {'stage': 'COLLSCAN'}
+        plan = {'stage': 'FETCH', 'inputStage': stage}
+        if self._sort and not sorted_by_index:
+            plan = {'stage': 'SORT', 'inputStage': plan}
+        return {'queryPlanner': {'winningPlan': plan}}
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if self._iterator is None:
+            self._iterator = self._execute()
+        return next(self._iterator)
+    
+    def _execute(self) -> Iterator[Dict[str, Any]]:
+        """Run the query, applying sort, skip and limit before projecting"""
+        end = self._skip + self._limit if self._limit else None
+        if self._sort:
+            documents = sort_documents(self.collection._select(self.query), self._sort, limit=end)
+        else:
+            # Without a sort the scan can stop as soon as enough documents match
+            documents = self.collection._select(self.query, limit=end)
+        documents = documents[self._skip:end]
+        
+        projection = compile_projection(self.projection)
+        return (projection(document) for document in documents)
+
+
+class FakeCollection:
+    """In-memory collection with hash indexes on indexed fields"""
+    
+    def __init__(self, name):
+        self.name = name
+        self._documents = {}
+        self._indexes = {'_id_': {'key': [('_id', 1)]}}
+        self._hash_indexes = {}
+        self._sequence = {}
+        self._next_sequence = 0
+        self._lock = threading.RLock()
+    
+    def find(self, query=None, projection=None, **kwargs):
+        cursor = FakeCursor(self, query, projection)
+        if kwargs.get('sort'):
+            cursor.sort(kwargs['sort'])
+        if kwargs.get('skip'):
+            cursor.skip(kwargs['skip'])
+        if kwargs.get('limit'):
+            cursor.limit(kwargs['limit'])
+        return cursor
+    
+    def find_one(self, query=None, projection=None, **kwargs):
+        if query is not None and not isinstance(query, dict):
+            query = {'_id': query}
+        return next(self.find(query, projection, **kwargs).limit(1), None)
+    
+    def count_documents(self, query=None, skip=0, limit=0, **kwargs):
+        count = max(0, len(self._select(query or {}, limit=skip + limit if limit else None)) - skip)
+        return min(count, limit) if limit else count
+    
+    def estimated_document_count(self, **kwargs):
+        return len(self._documents)
+    
+    def distinct(self, field, query=None, **kwargs):
+        values = []
+        seen = set()
+        for document in self._select(query or {}):
+            for value in _candidates(resolve_path(document, field)):
+                if isinstance(value, list):
+                    continue
+                key = _freeze(value)
+                if key not in seen:
+                    seen.add(key)
+                    values.append(_copy(value))
+        return values
+    
+    def aggregate(self, pipeline, **kwargs):
+        pipeline = list(pipeline)
+        # An initial $match can use the hash indexes
+        if pipeline and '$match' in pipeline[0]:
+            documents = self._select(pipeline.pop(0)['$match'])
+        else:
+            documents = self._select({})
+        return [_copy(document) for document in run_pipeline(documents, pipeline)]
+    
+    def insert_one(self, document, **kwargs):
+        with self._lock:
+            self._insert(document)
+        return InsertOneResult(document['_id'], True)
+    
+    def insert_many(self, documents, ordered=True, **kwargs):
+        inserted_ids = []
+        with self._lock:
+            for document in documents:
+                self._insert(document)
+                inserted_ids.append(document['_id'])
+        return InsertManyResult(inserted_ids, True)
+    
+    def replace_one(self, query, replacement, upsert=False, **kwargs):
+        with self._lock:
+            return UpdateResult(self._update(query, replacement, upsert, multi=False, replace=True), True)
+    
+    def update_one(self, query, update, upsert=False, **kwargs):
+        with self._lock:
+            return UpdateResult(self._update(query, update, upsert, multi=False), True)
+    
+    def update_many(self, query, update, upsert=False, **kwargs):
+        with self._lock:
+            return UpdateResult(self._update(query, update, upsert, multi=True), True)
+    
+    def delete_one(self, query, **kwargs):
+        with self._lock:
+            return DeleteResult({'n': self._delete(query, multi=False)}, True)
+    
+    def delete_many(self, query, **kwargs):
+        with self._lock:
+            return DeleteResult({'n': self._delete(query, multi=True)}, True)
+    
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        result = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []}
+        with self._lock:
+            for position, request in enumerate(requests):
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    result['nInserted'] += 1
+                elif isinstance(request, (ReplaceOne, UpdateOne, UpdateMany)):
+                    update = self._update(request._filter, request._doc, request._upsert,
+                                          multi=isinstance(request, UpdateMany),
+                                          replace=isinstance(request, ReplaceOne))
+                    if 'upserted' in update:
+                        result['nUpserted'] += 1
+                        result['upserted'].append({'index': position, '_id': update['upserted']})
+                    else:
+                        result['nMatched'] += update['n']
+                        result['nModified'] += update['nModified']
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    result['nRemoved'] += self._delete(request._filter, multi=isinstance(request, DeleteMany))
+                else:
+                    raise OperationFailure(f"unsupported bulk write operation: {type(request).__name__}")
+        return BulkWriteResult(result, True)
+    
+    def create_index(self, keys, **kwargs):
+        keys = _normalize_sort(keys)
+        name = kwargs.get('name') or '_'.join(f'{field}_{direction}' for field, direction in keys)
+        with self._lock:
+            self._indexes[name] = {'key': keys}
+            for field, direction in keys:
+                if direction not in NON_HASHABLE_INDEX_TYPES and field != '_id' \
+                        and field not in self._hash_indexes:
+                    self._build_hash_index(field)
+        return name
+    
+    def index_information(self):
+        return {name: dict(index) for name, index in self._indexes.items()}
+    
+    def drop(self):
+        with self._lock:
+            self._documents = {}
+            self._sequence = {}
+            for index in self._hash_indexes.values():
+                index.clear()
+    
+    def _plan(self, query: Dict[str, Any]) -> Tuple[Optional[set], Optional[str]]:
+        """
+        Select the candidate documents of a query with the hash indexes
+        
+        Equality and $in conditions at the top level of the filter (or of a
+        top-level $and) on indexed fields are intersected, smallest first.
+        
+        Returns:
+            Tuple of the candidate document keys (None to scan the collection)
+            and the indexed field with the fewest candidates
+        """
+        selections = []
+        for field, keys in self._equality_conditions(query):
+            if field == '_id':
+                ids = {key for key in keys if key in self._documents}
+            elif field in self._hash_indexes:
+                index = self._hash_indexes[field]
+                if len(keys) == 1:
+                    ids = index.get(keys[0], set())
+                else:
+                    ids = set()
+                    for key in keys:
+                        ids.update(index.get(key, ()))
+            else:
+                continue
+            selections.append((len(ids), field, ids))
+        
+        if not selections:
+            return None, None
+        
+        selections.sort(key=lambda selection: selection[0])
+        _, field, ids = selections[0]
+        if len(selections) > 1:
+            ids = ids.intersection(*(selection[2] for selection in selections[1:]))
+        return ids, field
+    
+    def _choose_index(self, query: Dict[str, Any],
+                      sort: Optional[List[Tuple[str, int]]] = None) -> Tuple[Optional[str], bool]:
+        """
+        Choose the index MongoDB's planner could serve a query with
+        
+        An index is usable if the query has a condition on its leading field
+        (a geo condition for a geo index) or the sort starts with its keys.
+        The one with the most leading fields under conditions is chosen, and
+        between those one that returns the documents in sort order.
+        
+        Args:
+            query: Query filter
+            sort: Sort specification (optional)
+            
+        Returns:
+            Tuple of the index name (None for a collection scan) and whether
+            the index returns the documents in sort order
+        """
+        conditions = dict(self._field_conditions(query))
+        equality = {field for field, _ in self._equality_conditions(query)}
+        
+        best = None
+        for name, index in self._indexes.items():
+            prefix = 0
+            for key_field, direction in index['key']:
+                condition = conditions.get(key_field, MISSING)
+                if condition is MISSING or (direction in NON_HASHABLE_INDEX_TYPES and not (
+                        _is_operator_document(condition) and any(op in GEO_OPERATORS for op in condition))):
+                    break
+                prefix += 1
+            
+            sorts = _index_sorts(index['key'], sort, equality)
+            if (prefix or sorts) and (best is None or (prefix, sorts) > best[:2]):
+                best = (prefix, sorts, name)
+        
+        return (best[2], best[1]) if best else (None, False)
+    
+    def _field_conditions(self, query: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+        """Yield (field, condition) for the conditions at the top level of a filter or of a top-level $and"""
+        for field, condition in (query or {}).items():
+            if field == '$and':
+                for clause in condition:
+                    yield from self._field_conditions(clause)
+            elif not field.startswith('$'):
+                yield field, condition
+    
+    def _equality_conditions(self, query: Dict[str, Any]) -> Iterator[Tuple[str, List[Any]]]:
+        """Yield (field, index keys) for the equality and $in conditions of a filter"""
+        for field, condition in (query or {}).items():
+            if field == '$and':
+                for clause in condition:
+                    yield from self._equality_conditions(clause)
+            elif field.startswith('$'):
+                continue
+            elif not _is_operator_document(condition):
+                yield field, [_freeze(_normalize(condition))]
+            elif '$eq' in condition:
+                yield field, [_freeze(_normalize(condition['$eq']))]
+            elif '$in' in condition:
+                yield field, [_freeze(_normalize(value)) for value in condition['$in']]
+    
+    def _select(self, query: Dict[str, Any], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Stored documents matching a query (the first limit of them if given), in insertion order"""
+        predicate = compile_filter(query)
+        with self._lock:
+            ids, _ = self._plan(query)
+            if ids is None:
+                candidates = list(self._documents.values())
+            elif len(ids) * 8 > len(self._documents):
+                candidates = [document for key, document in self._documents.items() if key in ids]
+            else:
+                candidates = [self._documents[key] for key in sorted(ids, key=self._sequence.__getitem__)]
+        
+        if limit is None:
+            return [document for document in candidates if predicate(document)]
+        
+        matches = []
+        for document in candidates:
+            if predicate(document):
+                matches.append(document)
+                if len(matches) >= limit:
+                    break
+        return matches
+    
+    def _insert(self, document: Dict[str, Any]):
+        """Store a copy of a document, assigning an ObjectId if it has no _id"""
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+        stored = _normalize(document)
+        key = _freeze(stored['_id'])
+        if key in self._documents:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} "
+                                    f"index: _id_ dup key: {stored['_id']!r}")
+        self._documents[key] = stored
+        self._sequence[key] = self._next_sequence
+        self._next_sequence += 1
+        self._index_document(key, stored)
+    
+    def _update(self, query: Dict[str, Any], update, upsert: bool, multi: bool,
+                replace: bool = False) -> Dict[str, Any]:
+        """
+        Update or replace the documents matching a query
+        
+        Returns:
+            Raw update result with the matched ('n') and modified counts and
+            the upserted _id if a document was inserted
+        """
+        if isinstance(update, list):
+            raise OperationFailure("pipeline updates are not supported by the in-memory database")
+        if replace and any(key.startswith('$') for key in update):
+            raise ValueError("replacement can not include $ operators")
+        if not replace and not (update and all(key.startswith('$') for key in update)):
+            raise ValueError("update only works with $ operators")
+        
+        matches = self._select(query)
+        if not multi:
+            matches = matches[:1]
+        
+        modified = 0
+        for document in matches:
+            if replace:
+                updated = _normalize(update)
+                updated['_id'] = document['_id']
+            else:
+                updated = _apply_update(document, update)
+            if updated != document:
+                key = _freeze(document['_id'])
+                self._unindex_document(key, document)
+                self._documents[key] = updated
+                self._index_document(key, updated)
+                modified += 1
+        
+        if matches:
+            return {'n': len(matches), 'nModified': modified}
+        
+        if not upsert:
+            return {'n': 0, 'nModified': 0}
+        
+        document = {}
+        for field, keys in self._equality_conditions(query):
+            condition = self._equality_value(query, field)
+            if len(keys) == 1 and condition is not MISSING:
+                _set_path(document, field, condition)
+        if replace:
+            document = dict(update, **({'_id': document['_id']} if '_id' in document else {}))
+        else:
+            document = _apply_update(document, update, inserting=True)
+        self._insert(document)
+        return {'n': 1, 'nModified': 0, 'upserted': document['_id']}
+    
+    def _equality_value(self, query: Dict[str, Any], field: str):
+        """Value a filter requires a field to be equal to, used to seed an upserted document"""
+        for key, condition in query.items():
+            if key == '$and':
+                for clause in condition:
+                    value = self._equality_value(clause, field)
+                    if value is not MISSING:
+                        return value
+            elif key == field:
+                if not _is_operator_document(condition):
+                    return condition
+                if '$eq' in condition:
+                    return condition['$eq']
+        return MISSING
+    
+    def _delete(self, query: Dict[str, Any], multi: bool) -> int:
+        """Delete the documents matching a query, returning how many were deleted"""
+        matches = self._select(query)
+        if not multi:
+            matches = matches[:1]
+        
+        for document in matches:
+            key = _freeze(document['_id'])
+            self._unindex_document(key, document)
+            del self._documents[key]
+            del self._sequence[key]
+        return len(matches)
+    
+    def _build_hash_index(self, field: str):
+        """Create the hash index of a field over the stored documents"""
+        self._hash_indexes[field] = defaultdict(set)
+        for key, document in self._documents.items():
+            self._index_field(field, key, document)
+    
+    def _index_keys(self, field: str, document: Dict[str, Any]) -> set:
+        """Hash index keys of a document's values for a field (null if the field is missing)"""
+        values = resolve_path(document, field)
+        if not values:
+            return {None}
+        return {_freeze(value) for value in _candidates(values)}
+    
+    def _index_field(self, field: str, key, document: Dict[str, Any]):
+        """Add a document to the hash index of one field"""
+        index = self._hash_indexes[field]
+        for index_key in self._index_keys(field, document):
+            index[index_key].add(key)
+    
+    def _index_document(self, key, document: Dict[str, Any]):
+        """Add a document to every hash index"""
+        for field in self._hash_indexes:
+            self._index_field(field, key, document)
+    
+    def _unindex_document(self, key, document: Dict[str, Any]):
+        """Remove a document from every hash index"""
+        for field, index in self._hash_indexes.items():
+            for index_key in self._index_keys(field, document):
+                entries = index.get(index_key)
+                if entries is not None:
+                    entries.discard(key)
+                    if not entries:
+                        del index[index_key]
+
+
+def _apply_update(document: Dict[str, Any], update: Dict[str, Any], inserting: bool = False) -> Dict[str, Any]:
+    """
+    Apply update operators to a copy of a document
+    
+    Args:
+        document: Stored document
+        update: Update document of $ operators
+        inserting: Whether the document is being inserted by an upsert
+        
+    Returns:
+        Updated copy of the document
+        
+    Raises:
+        OperationFailure: If the update uses an unsupported operator
+    """
+    result = _copy(document)
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if path == '_id' and operator != '$setOnInsert' and '_id' in result:
+                continue
+            value = _normalize(value)
+            current = _get_path(result, path)
+            
+            if operator == '$set' or (operator == '$setOnInsert' and inserting):
+                _set_path(result, path, value)
+            elif operator == '$setOnInsert':
+                continue
+            elif operator == '$unset':
+                _unset_path(result, path)
+            elif operator == '$inc':
+                _set_path(result, path, value if current is MISSING or current is None else current + value)
+            elif operator in ('$min', '$max'):
+                order = _compare(value, current)
+                if current is MISSING or (order < 0 if operator == '$min' else order > 0):
+                    _set_path(result, path, value)
+            elif operator in ('$push', '$addToSet'):
+                items = list(current) if isinstance(current, list) else []
+                new_items = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                for item in new_items:
+                    if operator == '$push' or not any(_equals(item, existing) for existing in items):
+                        items.append(item)
+                _set_path(result, path, items)
+            elif operator == '$currentDate':
+                _set_path(result, path, datetime.now(timezone.utc).replace(tzinfo=None))
+            else:
+                raise OperationFailure(f"unsupported update operator in the in-memory database: {operator}")
+    return result
+
+
+class FakeDB:
+    """In-memory database for when MongoDB is not available"""
+    
+    def __init__(self, name: str = 'realestate'):
+        self.name = name
+        self.collections = {}
+        self._lock = threading.Lock()
+    
+    def __getitem__(self, name):
+        collection = self.collections.get(name)
+        if collection is None:
+            with self._lock:
+                collection = self.collections.setdefault(name, FakeCollection(name))
+        return collection
+    
+    def get_collection(self, name, **kwargs):
+        return self[name]
+    
+    def list_collection_names(self, **kwargs):
+        return list(self.collections)
+    
+    def drop_collection(self, name, **kwargs):
+        self.collections.pop(name, None)
+    
+    def command(self, cmd, **kwargs):
+        logger.debug(f"Command {cmd} called")
+        return {"ok": 1.0}
+    
+    def load_snapshot(self, path: str) -> int:
+        """
+        Load collections from a JSONL snapshot
+        
+        Args:
+            path: Directory with one <collection>.jsonl file per collection, or
+                a single JSONL file loaded into the collection named after it
+                
+        Returns:
+            Number of documents loaded
+        """
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, name) for name in os.listdir(path)
+                           if name.endswith(SNAPSHOT_EXTENSION))
+        else:
+            files = [path]
+        
+        total = 0
+        for file_path in files:
+            name = os.path.basename(file_path)[:-len(SNAPSHOT_EXTENSION)] \
+                if file_path.endswith(SNAPSHOT_EXTENSION) else os.path.basename(file_path)
+            with open(file_path, encoding='utf-8') as snapshot:
+                documents = [loads(line) for line in snapshot if line.strip()]
+            self[name].insert_many(documents)
+            total += len(documents)
+            logger.info(f"Loaded {len(documents)} documents into in-memory collection {name}")
+        
+        return total
+    
+    def save_snapshot(self, directory: str) -> int:
+        """
+        Write every collection to a JSONL snapshot
+        
+        Args:
+            directory: Directory to write one <collection>.jsonl file per collection to
+            
+        Returns:
+            Number of documents written
+        """
+        os.makedirs(directory, exist_ok=True)
+        
+        total = 0
+        for name, collection in list(self.collections.items()):
+            documents = collection._select({})
+            with open(os.path.join(directory, name + SNAPSHOT_EXTENSION), 'w', encoding='utf-8') as snapshot:
+                for document in documents:
+                    snapshot.write(dumps(document, json_options=RELAXED_JSON_OPTIONS) + '\n')
+            total += len(documents)
+        
+        return total
@@ -0,0 +1,313 @@
+"""
+Geospatial utilities for property queries.
+
+Properties carry a GeoJSON `location` point built from their latitude and
+longitude, indexed with a 2dsphere index for bounding-box and radius
+queries. GeoKDTree answers the same queries in process when MongoDB is not
+available.
+"""
+
+import math
+import logging
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Mean Earth radius in kilometers
+EARTH_RADIUS_KM = 6371.0088
+
+# Kilometers per degree of latitude
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def parse_bbox(text: str) -> Tuple[float, float, float, float]:
+    """
+    Parse a bounding box given as "west,south,east,north"
+    
+    Boxes crossing the antimeridian (west greater than east) are not
+    supported, as the listings are all far from it.
+    
+    Args:
+        text: Comma-separated longitudes and latitudes in degrees
+        
+    Returns:
+        Tuple of west, south, east and north bounds
+        
+    Raises:
+        ValueError: If the bounding box is malformed, out of range or crosses the antimeridian
+    """
+    try:
+        west, south, east, north = (float(value) for value in text.split(','))
+    except (TypeError, ValueError):
+        raise ValueError("bbox must be 'west,south,east,north'")
+    
+    if not (-180 <= west <= 180 and -180 <= east <= 180 and -90 <= south < north <= 90):
+        raise ValueError("bbox is out of range")
+    if west >= east:
+        raise ValueError("bbox west must be less than east, boxes crossing the antimeridian are not supported")
+    
+    return west, south, east, north
+
+
+def parse_geo_params(args) -> Dict[str, Any]:
+    """
+    Parse the bounding-box and radius query parameters of a request
+    
+    bbox is given as "west,south,east,north" and the radius search as lat,
+    lon and radius_km.
+    
+    Args:
+        args: Request query arguments
+        
+    Returns:
+        Dictionary with bbox, near and radius_km keyword arguments for the
+        property services
+        
+    Raises:
+        ValueError: If the parameters are malformed or incomplete
+    """
+    bbox = args.get('bbox')
+    latitude = args.get('lat', type=float)
+    longitude = args.get('lon', type=float)
+    radius_km = args.get('radius_km', type=float)
+    
+    near = None
+    if latitude is not None or longitude is not None or radius_km is not None:
+        if latitude is None or longitude is None or radius_km is None:
+            raise ValueError("lat, lon and radius_km must be given together")
+        if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            raise ValueError("lat or lon is out of range")
+        if radius_km <= 0:
+            raise ValueError("radius_km must be positive")
+        near = (latitude, longitude)
+    
+    return {
+        'bbox': parse_bbox(bbox) if bbox else None,
+        'near': near,
+        'radius_km': radius_km
+    }
+
+
+def location_point(latitude: float, longitude: float) -> Dict[str, Any]:
+    """
+    Build a GeoJSON point
+    
+    Args:
+        latitude: Latitude in degrees
+        longitude: Longitude in degrees
+        
+    Returns:
+        GeoJSON point dictionary
+    """
+    return {'type': 'Point', 'coordinates': [longitude, latitude]}
+
+
+def geo_filter(bbox: Optional[Tuple[float, float, float, float]] = None,
+               near: Optional[Tuple[float, float]] = None,
+               radius_km: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Build a MongoDB filter on the location field
+    
+    Args:
+        bbox: Bounding box as (west, south, east, north) (optional)
+        near: Center point as (latitude, longitude) (optional)
+        radius_km: Radius around the center point in kilometers
+        
+    Returns:
+        MongoDB query filter, empty if no geographic constraint is given
+    """
+    clauses = []
+    
+    if bbox:
+        west, south, east, north = bbox
+        clauses.append({'location': {'$geoWithin': {'$geometry': {
+            'type': 'Polygon',
+            'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]]
+        }}}})
+    
+    if near and radius_km:
+        latitude, longitude = near
+        clauses.append({'location': {'$geoWithin': {
+            '$centerSphere': [[longitude, latitude], radius_km / EARTH_RADIUS_KM]
+        }}})
+    
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+def haversine_km(latitude: float, longitude: float, latitudes: np.ndarray,
+                 longitudes: np.ndarray) -> np.ndarray:
+    """
+    Great-circle distance from a point to many points
+    
+    Args:
+        latitude: Latitude of the reference point in degrees
+        longitude: Longitude of the reference point in degrees
+        latitudes: Latitudes in degrees
+        longitudes: Longitudes in degrees
+        
+    Returns:
+        Distances in kilometers
+    """
+    lat1 = math.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlon = np.radians(longitudes) - math.radians(longitude)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def sync_locations(db, since: Optional[datetime] = None) -> int:
+    """
+    Set the GeoJSON location field from latitude and longitude
+    
+    Args:
+        db: Database object
+        since: Only update properties modified after this time (optional,
+            otherwise only properties without a location are updated)
+            
+    Returns:
+        Number of properties updated
+    """
+    query_filter = {
+        'latitude': {'$type': 'number'},
+        'longitude': {'$type': 'number'}
+    }
+    if since:
+        query_filter['last_updated'] = {'$gte': since}
+    else:
+        query_filter['location'] = {'$exists': False}
+    
+    result = db['properties'].update_many(query_filter, [
+        {'$set': {'location': {'type': 'Point', 'coordinates': ['$longitude', '$latitude']}}}
+    ])
+    
+    logger.info(f"Updated location of {result.modified_count} properties")
+    
+    return result.modified_count
+
+
+class GeoKDTree:
+    """Static 2-d tree over latitude and longitude for in-process geographic queries"""
+    
+    # Maximum number of points checked by brute force at a leaf
+    LEAF_SIZE = 32
+    
+    def __init__(self, latitudes, longitudes, keys: List[Any]):
+        """
+        Build the tree
+        
+        Args:
+            latitudes: Latitudes in degrees
+            longitudes: Longitudes in degrees
+            keys: Key returned for each point (e.g. the document _id)
+        """
+        points = np.column_stack([
+            np.asarray(latitudes, dtype=float),
+            np.asarray(longitudes, dtype=float)
+        ]) if len(keys) else np.empty((0, 2))
+        valid = np.isfinite(points).all(axis=1)
+        
+        self.points = points[valid]
+        self.keys = [key for key, is_valid in zip(keys, valid) if is_valid]
+        self.order = np.arange(len(self.points))
+        self._build()
+    
+    def __len__(self):
+        """Number of indexed points"""
+        return len(self.points)
+    
+    def _build(self):
+        """Arrange the point order into an implicit balanced tree"""
+        stack = [(0, len(self.order), 0)]
+        while stack:
+            start, end, depth = stack.pop()
+            if end - start <= self.LEAF_SIZE:
+                continue
+            
+            axis = depth % 2
+            mid = (start + end) // 2
+            segment = self.order[start:end]
+            partition = np.argpartition(self.points[segment, axis], mid - start)
+            self.order[start:end] = segment[partition]
+            
+            stack.append((start, mid, depth + 1))
+            stack.append((mid + 1, end, depth + 1))
+    
+    def _range(self, low: Tuple[float, float], high: Tuple[float, float]) -> np.ndarray:
+        """
+        Find the points inside an axis-aligned latitude/longitude box
+        
+        Args:
+            low: Minimum (latitude, longitude)
+            high: Maximum (latitude, longitude)
+            
+        Returns:
+            Indexes of the matching points
+        """
+        low = np.asarray(low)
+        high = np.asarray(high)
+        matches = []
+        
+        stack = [(0, len(self.order), 0)]
+        while stack:
+            start, end, depth = stack.pop()
+            if end - start <= self.LEAF_SIZE:
+                candidates = self.order[start:end]
+                inside = ((self.points[candidates] >= low) & (self.points[candidates] <= high)).all(axis=1)
+                matches.append(candidates[inside])
+                continue
+            
+            axis = depth % 2
+            mid = (start + end) // 2
+            median = self.order[mid]
+            split = self.points[median, axis]
+            
+            if ((self.points[median] >= low) & (self.points[median] <= high)).all():
+                matches.append(np.array([median]))
+            if low[axis] <= split:
+                stack.append((start, mid, depth + 1))
+            if high[axis] >= split:
+                stack.append((mid + 1, end, depth + 1))
+        
+        return np.concatenate(matches) if matches else np.array([], dtype=int)
+    
+    def within_bbox(self, west: float, south: float, east: float, north: float) -> List[Any]:
+        """
+        Find the points inside a bounding box
+        
+        Args:
+            west: Western longitude
+            south: Southern latitude
+            east: Eastern longitude
+            north: Northern latitude
+            
+        Returns:
+            Keys of the matching points
+        """
+        return [self.keys[i] for i in self._range((south, west), (north, east))]
+    
+    def within_radius(self, latitude: float, longitude: float, radius_km: float) -> List[Any]:
+        """
+        Find the points within a distance of a center point
+        
+        Args:
+            latitude: Latitude of the center in degrees
+            longitude: Longitude of the center in degrees
+            radius_km: Radius in kilometers
+            
+        Returns:
+            Keys of the matching points
+        """
+        dlat = radius_km / KM_PER_DEGREE
+        dlon = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6))
+        candidates = self._range((latitude - dlat, longitude - dlon), (latitude + dlat, longitude + dlon))
+        
+        if len(candidates) == 0:
+            return []
+        
+        distances = haversine_km(latitude, longitude, self.points[candidates, 0], self.points[candidates, 1])
+        return [self.keys[i] for i in candidates[distances <= radius_km]]
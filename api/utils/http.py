@@ -0,0 +1,66 @@
+"""
+Request and response helpers shared by the Flask and ASGI applications.
+
+Flask and Quart requests expose the same werkzeug interfaces (args,
+accept_mimetypes, endpoint and view_args), so content negotiation and the
+pagination headers are computed here once for both applications.
+"""
+
+import json
+from typing import Any, Callable, Dict, Optional
+
+# MIME type of streamed newline-delimited JSON responses
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_stream(request) -> bool:
+    """
+    Check whether the client asked for a streamed NDJSON response
+    
+    Args:
+        request: Flask or Quart request
+        
+    Returns:
+        True if the request has stream=1 or prefers NDJSON over JSON
+    """
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def next_page_headers(request, next_cursor: Optional[str], url_for: Callable[..., str]) -> Dict[str, str]:
+    """
+    Build the headers pointing to the next page of a paginated response
+    
+    Args:
+        request: Flask or Quart request
+        next_cursor: Continuation token of the next page (None if this is the last page)
+        url_for: url_for function of the application's framework
+        
+    Returns:
+        X-Next-Cursor and Link headers, empty if there is no next page
+    """
+    if not next_cursor:
+        return {}
+    
+    next_args = request.args.to_dict()
+    next_args.pop('skip', None)
+    next_args['cursor'] = next_cursor
+    next_url = url_for(request.endpoint, _external=True, **request.view_args, **next_args)
+    
+    return {'X-Next-Cursor': next_cursor, 'Link': f'<{next_url}>; rel="next"'}
+
+
+def ndjson_line(document: Any) -> str:
+    """
+    Encode a document as one line of an NDJSON response
+    
+    Args:
+        document: JSON-serializable document
+        
+    Returns:
+        Compact JSON followed by a newline
+    """
+    return json.dumps(document, separators=(',', ':')) + '\n'
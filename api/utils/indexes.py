@@ -0,0 +1,230 @@
+"""
+Index management utilities for the properties collection.
+
+Declares the indexes needed by the query shapes used in PropertyService and
+AnalysisService, and provides an explain()-based check that reports queries
+falling back to a collection scan.
+"""
+
+import logging
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE
+
+logger = logging.getLogger(__name__)
+
+# Indexes for the properties collection, following the equality-sort-range rule
+PROPERTY_INDEXES = [
+    {
+        # get_property_by_id, analyze_property
+        'name': 'id_source',
+        'keys': [('id', ASCENDING), ('source', ASCENDING)]
+    },
+    {
+        # Area filters and aggregates by city and neighborhood, get_neighborhoods
+        'name': 'city_neighborhood_type_operation_price',
+        'keys': [('city', ASCENDING), ('neighborhood', ASCENDING), ('property_type', ASCENDING),
+                 ('operation_type', ASCENDING), ('price', ASCENDING)]
+    },
+    {
+        # City-wide filters and aggregates by operation and property type, similarity segments
+        'name': 'city_operation_type_price',
+        'keys': [('city', ASCENDING), ('operation_type', ASCENDING), ('property_type', ASCENDING),
+                 ('price', ASCENDING)]
+    },
+    {
+        # Investment opportunities within a city, sorted and paginated by score
+        'name': 'city_investment_score_id',
+        'keys': [('city', ASCENDING), ('investment_score', DESCENDING), ('_id', DESCENDING)]
+    },
+    {
+        # Investment opportunities across all cities, sorted and paginated by score
+        'name': 'investment_score_id',
+        'keys': [('investment_score', DESCENDING), ('_id', DESCENDING)]
+    },
+    {
+        # Area statistics refresh after a scrape
+        'name': 'last_updated',
+        'keys': [('last_updated', ASCENDING)]
+    },
+    {
+        # Bounding-box and radius queries on the GeoJSON location
+        'name': 'location_2dsphere',
+        'keys': [('location', GEOSPHERE)]
+    },
+]
+
+# Representative query shapes issued by the services, used to verify query plans
+SERVICE_QUERIES = [
+    {
+        'name': 'get_property_by_id',
+        'filter': {'id': '0', 'source': 'idealista'}
+    },
+    {
+        'name': 'get_properties',
+        'filter': {'city': 'madrid', 'neighborhood': 'centro', 'property_type': 'apartment',
+                   'operation_type': 'sale', 'price': {'$gte': 0, '$lte': 1000000},
+                   'size': {'$gte': 0, '$lte': 1000}},
+        'sort': [('_id', ASCENDING)]
+    },
+    {
+        'name': 'get_properties_with_coordinates',
+        'filter': {'city': 'madrid', 'operation_type': 'sale',
+                   'latitude': {'$exists': True, '$ne': None},
+                   'longitude': {'$exists': True, '$ne': None}}
+    },
+    {
+        'name': 'get_properties_in_bbox',
+        'filter': {'location': {'$geoWithin': {'$geometry': {
+            'type': 'Polygon',
+            'coordinates': [[[-3.72, 40.40], [-3.68, 40.40], [-3.68, 40.43], [-3.72, 40.43], [-3.72, 40.40]]]
+        }}}}
+    },
+    {
+        'name': 'get_properties_within_radius',
+        'filter': {'location': {'$geoWithin': {'$centerSphere': [[-3.70, 40.42], 1 / 6371.0088]}}}
+    },
+    {
+        'name': 'get_neighborhoods',
+        'filter': {'city': 'madrid'}
+    },
+    {
+        'name': 'get_investment_opportunities',
+        'filter': {'investment_score': {'$exists': True, '$gte': 70},
+                   'price': {'$exists': True, '$ne': None},
+                   'size': {'$exists': True, '$ne': None}},
+        'sort': [('investment_score', DESCENDING), ('_id', DESCENDING)]
+    },
+    {
+        'name': 'get_investment_opportunities_by_city',
+        'filter': {'investment_score': {'$exists': True, '$gte': 70},
+                   'price': {'$exists': True, '$ne': None},
+                   'size': {'$exists': True, '$ne': None},
+                   'city': 'madrid'},
+        'sort': [('investment_score', DESCENDING), ('_id', DESCENDING)]
+    },
+    {
+        'name': 'area_price_table',
+        'filter': {'city': {'$in': ['madrid']}, 'price_per_sqm': {'$exists': True, '$ne': None},
+                   'operation_type': {'$in': ['sale']}}
+    },
+    {
+        'name': 'area_comparison_data',
+        'filter': {'city': 'madrid', 'neighborhood': 'centro'}
+    },
+    {
+        'name': 'similarity_segment',
+        'filter': {'city': 'madrid', 'property_type': 'apartment', 'operation_type': 'sale'}
+    },
+    {
+        'name': 'area_stats_refresh',
+        'filter': {'last_updated': {'$gte': datetime(2000, 1, 1)}}
+    },
+]
+
+
+def ensure_indexes(db) -> List[str]:
+    """
+    Create the indexes needed by the service query shapes
+    
+    Creating an index that already exists is a no-op, so this is safe to call
+    on every startup.
+    
+    Args:
+        db: Database object
+        
+    Returns:
+        Names of the indexes that are in place
+    """
+    collection = db['properties']
+    created = []
+    
+    for index in PROPERTY_INDEXES:
+        try:
+            collection.create_index(index['keys'], name=index['name'])
+            created.append(index['name'])
+        except Exception as e:
+            logger.warning(f"Could not create index {index['name']}: {str(e)}")
+    
+    logger.info(f"Ensured {len(created)} indexes on properties collection")
+    
+    return created
+
+
+def explain_query(collection, query_filter: Dict[str, Any],
+                  sort: Optional[List[Tuple[str, int]]] = None) -> Dict[str, Any]:
+    """
+    Get the winning query plan for a find query
+    
+    Args:
+        collection: Collection to query
+        query_filter: Query filter
+        sort: Sort specification (optional)
+        
+    Returns:
+        Winning plan dictionary
+    """
+    cursor = collection.find(query_filter)
+    if sort:
+        cursor = cursor.sort(sort)
+    
+    explanation = cursor.explain()
+    return explanation.get('queryPlanner', {}).get('winningPlan', {})
+
+
+def plan_stages(plan: Dict[str, Any]) -> List[str]:
+    """
+    List every stage in a query plan
+    
+    Args:
+        plan: Query plan dictionary
+        
+    Returns:
+        Stage names, from the root of the plan down
+    """
+    stages = []
+    if 'stage' in plan:
+        stages.append(plan['stage'])
+    
+    # Newer servers wrap the classic plan in queryPlan
+    if 'queryPlan' in plan:
+        stages.extend(plan_stages(plan['queryPlan']))
+    if 'inputStage' in plan:
+        stages.extend(plan_stages(plan['inputStage']))
+    for input_stage in plan.get('inputStages', []):
+        stages.extend(plan_stages(input_stage))
+    
+    return stages
+
+
+def check_query_plans(db, queries: Optional[List[Dict[str, Any]]] = None) -> List[str]:
+    """
+    Check that the service query shapes are served by an index
+    
+    A warning is logged for every query whose winning plan contains a
+    collection scan.
+    
+    Args:
+        db: Database object
+        queries: Query shapes to check (optional, defaults to SERVICE_QUERIES)
+        
+    Returns:
+        Names of the queries that fall back to COLLSCAN
+    """
+    collection = db['properties']
+    collscans = []
+    
+    for query in queries or SERVICE_QUERIES:
+        try:
+            plan = explain_query(collection, query['filter'], query.get('sort'))
+            stages = plan_stages(plan)
+            
+            if 'COLLSCAN' in stages:
+                logger.warning(f"Query {query['name']} falls back to COLLSCAN: {query['filter']}")
+                collscans.append(query['name'])
+            else:
+                logger.debug(f"Query {query['name']} plan: {' <- '.join(stages)}")
+        except Exception as e:
+            logger.warning(f"Could not explain query {query['name']}: {str(e)}")
+    
+    return collscans
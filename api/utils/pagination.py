@@ -0,0 +1,123 @@
+"""
+Keyset pagination utilities for the API.
+
+Pages are addressed with an opaque continuation token holding the sort key of
+the last document returned, so every page is fetched with an index seek
+instead of skipping over all the previous documents.
+"""
+
+import base64
+from typing import List, Dict, Any, Tuple
+from bson import json_util
+
+# Maximum number of documents in one page of a paginated endpoint
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(sort: List[Tuple[str, int]], document: Dict[str, Any]) -> str:
+    """
+    Build a continuation token pointing after a document
+    
+    Args:
+        sort: Sort specification of the query, ending with a unique field
+        document: Last document of the current page
+        
+    Returns:
+        Opaque URL-safe continuation token
+    """
+    values = [document.get(field) for field, _ in sort]
+    payload = json_util.dumps(values).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(sort: List[Tuple[str, int]], token: str) -> List[Any]:
+    """
+    Read the sort key values stored in a continuation token
+    
+    Args:
+        sort: Sort specification of the query
+        token: Continuation token
+        
+    Returns:
+        Sort key values of the last document of the previous page
+        
+    Raises:
+        ValueError: If the token is malformed or doesn't match the sort
+    """
+    try:
+        padding = '=' * (-len(token) % 4)
+        payload = base64.urlsafe_b64decode(token + padding)
+        values = json_util.loads(payload.decode('utf-8'))
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+    
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise ValueError("Invalid pagination cursor")
+    
+    return values
+
+
+def check_page_size(limit: int, streaming: bool = False) -> int:
+    """
+    Validate the number of documents requested in a page
+    
+    Args:
+        limit: Requested number of documents (None or 0 when streaming every document)
+        streaming: Whether the documents are streamed, where 0 streams every
+            document and there is no maximum
+            
+    Returns:
+        The validated limit
+        
+    Raises:
+        ValueError: If the limit is out of range
+    """
+    if streaming:
+        if limit and limit < 0:
+            raise ValueError("limit must be 0 (no limit) or a positive number")
+    elif not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    
+    return limit
+
+
+def keyset_filter(sort: List[Tuple[str, int]], values: List[Any]) -> Dict[str, Any]:
+    """
+    Build the query filter selecting documents after the given sort key
+    
+    For a sort on (a, b) this is: a after v_a, or a equal to v_a and b after v_b.
+    
+    Args:
+        sort: Sort specification of the query, ending with a unique field
+        values: Sort key values of the last document of the previous page
+        
+    Returns:
+        MongoDB query filter
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {sort[j][0]: values[j] for j in range(i)}
+        clause[field] = {'$gt' if direction > 0 else '$lt': values[i]}
+        clauses.append(clause)
+    
+    return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+
+def apply_cursor(query_filter: Dict[str, Any], sort: List[Tuple[str, int]],
+                 token: str) -> Dict[str, Any]:
+    """
+    Restrict a query filter to the documents after a continuation token
+    
+    Args:
+        query_filter: Query filter
+        sort: Sort specification of the query
+        token: Continuation token (optional)
+        
+    Returns:
+        Query filter for the next page
+    """
+    if not token:
+        return query_filter
+    
+    after = keyset_filter(sort, decode_cursor(sort, token))
+    return {'$and': [query_filter, after]} if query_filter else after
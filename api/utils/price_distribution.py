@@ -0,0 +1,88 @@
+"""
+Price distribution utilities for the area analytics.
+
+A segment's price per square meter values are sorted once, so the rank of a
+listing is a binary search and quantiles are index reads.
+"""
+
+from typing import Dict, Any, Tuple
+import numpy as np
+
+
+class PriceDistribution:
+    """Sorted price per square meter values of the listings in one segment"""
+    
+    def __init__(self, values: np.ndarray):
+        """
+        Build the distribution
+        
+        Args:
+            values: Price per square meter of each listing, without missing values
+        """
+        self.values = np.sort(np.asarray(values, dtype=float))
+    
+    def __len__(self):
+        """Number of listings in the distribution"""
+        return len(self.values)
+    
+    def quantile(self, q: float) -> float:
+        """
+        Get a quantile, interpolating linearly between the closest listings
+        
+        Args:
+            q: Quantile between 0 and 1
+            
+        Returns:
+            Price per square meter at the quantile
+        """
+        position = q * (len(self.values) - 1)
+        lower = int(np.floor(position))
+        upper = min(lower + 1, len(self.values) - 1)
+        return float(self.values[lower] + (self.values[upper] - self.values[lower]) * (position - lower))
+    
+    def rank(self, value: float) -> Tuple[int, int]:
+        """
+        Find where a price per square meter falls in the distribution with a binary search
+        
+        Args:
+            value: Price per square meter
+            
+        Returns:
+            Tuple of the number of listings priced below the value and the
+            number of listings priced exactly at it
+        """
+        below = int(np.searchsorted(self.values, value, side='left'))
+        return below, int(np.searchsorted(self.values, value, side='right')) - below
+    
+    def percentile(self, value: float) -> float:
+        """
+        Get the percentile rank of a price per square meter, counting ties as half below
+        
+        Args:
+            value: Price per square meter
+            
+        Returns:
+            Percentage of the listings priced below the value, between 0 and 100
+        """
+        below, equal = self.rank(value)
+        return (below + equal / 2) / len(self.values) * 100
+    
+    def summary(self) -> Dict[str, Any]:
+        """
+        Summarize the distribution with statistics that are robust to outliers
+        
+        Returns:
+            Dictionary with the median, quartiles, interquartile range, 10th and
+            90th percentiles and count
+        """
+        q1 = self.quantile(0.25)
+        q3 = self.quantile(0.75)
+        return {
+            'median_price_per_sqm': self.quantile(0.5),
+            'q1_price_per_sqm': q1,
+            'q3_price_per_sqm': q3,
+            'iqr_price_per_sqm': q3 - q1,
+            'p10_price_per_sqm': self.quantile(0.1),
+            'p90_price_per_sqm': self.quantile(0.9),
+            'count': len(self.values)
+        }
@@ -0,0 +1,13 @@
+"""
+ASGI entry point for the Real Estate Investment Analysis API.
+This file imports the async Quart app from the api module.
+The ASGI mode needs a MongoDB server: MONGODB_URI=memory:// is rejected at startup.
+
+Run with an ASGI server, e.g.:
+    hypercorn asgi:app --bind 0.0.0.0:5000
+"""
+
+from api.asgi_app import app
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,99 @@
+"""
+Benchmark for converting MongoDB documents into API responses.
+
+Compares the previous Extended JSON round trip (bson.json_util dumps/loads)
+with the direct single-pass encoder used by the services.
+
+Run from the repository root:
+    python -m benchmarks.bench_encoding
+"""
+
+import random
+import timeit
+import tracemalloc
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.json_util import dumps, loads
+from api.utils.encoding import encode_documents
+
+SIZES = [100, 1000, 10000]
+
+
+def make_documents(count):
+    """Generate property documents shaped like the scraped listings"""
+    random.seed(42)
+    now = datetime.now()
+    documents = []
+    for i in range(count):
+        price = random.randint(80, 900) * 1000
+        size = random.randint(40, 200)
+        documents.append({
+            '_id': ObjectId(),
+            'id': str(90000000 + i),
+            'source': random.choice(['idealista', 'fotocasa']),
+            'url': f'https://www.idealista.com/inmueble/{90000000 + i}/',
+            'title': f'Piso en venta en calle {i}, Madrid',
+            'description': 'Luminoso piso exterior reformado con ascensor. ' * 5,
+            'price': float(price),
+            'price_history': [
+                {'price': float(price + 10000 * j), 'date': now - timedelta(days=30 * j)}
+                for j in range(random.randint(1, 4))
+            ],
+            'property_type': 'apartment',
+            'operation_type': 'sale',
+            'size': float(size),
+            'rooms': random.randint(1, 5),
+            'bathrooms': random.randint(1, 3),
+            'features': ['Ascensor', 'Terraza', 'Calefacción central'],
+            'city': 'madrid',
+            'neighborhood': random.choice(['Centro', 'Salamanca', 'Chamberí']),
+            'latitude': 40.4 + random.random() / 10,
+            'longitude': -3.7 + random.random() / 10,
+            'first_detected': now - timedelta(days=random.randint(1, 300)),
+            'last_updated': now,
+            'days_listed': random.randint(1, 300),
+            'price_per_sqm': price / size,
+            'investment_score': random.uniform(0, 100),
+        })
+    return documents
+
+
+def round_trip(documents):
+    """Previous conversion: Extended JSON round trip plus ObjectId formatting"""
+    properties = loads(dumps(documents))
+    for prop in properties:
+        prop['_id'] = str(prop['_id'])
+    return properties
+
+
+def direct(documents):
+    """Current conversion: single-pass encoder"""
+    return encode_documents(documents)
+
+
+def measure(func, documents, repeat=5):
+    """Return the best wall time in milliseconds and the peak allocation in KiB"""
+    number = max(1, 10000 // len(documents))
+    best = min(timeit.repeat(lambda: func(documents), number=number, repeat=repeat)) / number
+    
+    tracemalloc.start()
+    func(documents)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    return best * 1000, peak / 1024
+
+
+def main():
+    print(f"{'documents':>10} {'method':>12} {'time (ms)':>12} {'peak (KiB)':>12}")
+    for size in SIZES:
+        documents = make_documents(size)
+        before = measure(round_trip, documents)
+        after = measure(direct, documents)
+        print(f"{size:>10} {'dumps/loads':>12} {before[0]:>12.2f} {before[1]:>12.0f}")
+        print(f"{size:>10} {'direct':>12} {after[0]:>12.2f} {after[1]:>12.0f}")
+        print(f"{'':>10} {'speedup':>12} {before[0] / after[0]:>11.1f}x {before[1] / after[1]:>11.1f}x")
+
+
+if __name__ == '__main__':
+    main()
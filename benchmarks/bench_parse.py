@@ -0,0 +1,153 @@
+"""
+Benchmark for extracting the details of idealista.com listing pages.
+
+Compares the previous per-field extraction, which queried the detail list
+of the page again for every field and searched with inline patterns, with
+the single-pass extractor used by IdealistaSpider, over the saved listing
+pages in benchmarks/fixtures/idealista. Both must extract the same details.
+
+Run from the repository root:
+    python -m benchmarks.bench_parse [iterations]
+"""
+
+import os
+import re
+import sys
+import glob
+import time
+from scrapy.http import HtmlResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scraper'))
+
+from realestate.idealista_extractor import extract_details
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'idealista')
+
+DEFAULT_ITERATIONS = 500
+
+
+def load_fixtures():
+    """Load the saved listing pages as Scrapy responses"""
+    responses = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES, '*.html'))):
+        with open(path, 'rb') as file:
+            body = file.read()
+        url = f"https://www.idealista.com/inmueble/{os.path.basename(path)}/"
+        responses.append(HtmlResponse(url=url, body=body, encoding='utf-8'))
+    return responses
+
+
+def previous_extract_details(response):
+    """Extract the details like IdealistaSpider did before, one query of the page per field"""
+    breadcrumbs = ' '.join(response.css('ol.breadcrumb li::text').getall()).lower()
+    detail_text = ' '.join(response.css('div.details-property li::text').getall()).lower()
+    if 'piso' in breadcrumbs or 'piso' in detail_text:
+        property_type = 'apartment'
+    elif 'casa' in breadcrumbs or 'casa' in detail_text or 'chalet' in breadcrumbs or 'chalet' in detail_text:
+        property_type = 'house'
+    elif 'ático' in breadcrumbs or 'ático' in detail_text:
+        property_type = 'penthouse'
+    elif 'estudio' in breadcrumbs or 'estudio' in detail_text:
+        property_type = 'studio'
+    else:
+        property_type = 'other'
+    
+    floor = None
+    floor_text = None
+    for item in response.css('div.details-property li::text').getall():
+        if 'planta' in item.lower():
+            floor_text = item
+            break
+    if floor_text:
+        match = re.search(r'([0-9]+)[ºª]?\s*planta', floor_text.lower())
+        if match:
+            floor = int(match.group(1))
+        elif 'bajo' in floor_text.lower():
+            floor = 0
+        elif 'sótano' in floor_text.lower():
+            floor = -1
+        elif 'entreplanta' in floor_text.lower():
+            floor = 0
+    
+    has_elevator = 'ascensor' in ' '.join(response.css('div.details-property li::text').getall()).lower()
+    
+    detail_items = ' '.join(response.css('div.details-property li::text').getall()).lower()
+    if 'nuevo' in detail_items or 'a estrenar' in detail_items:
+        condition = 'new'
+    elif 'buen estado' in detail_items:
+        condition = 'good'
+    elif 'para reformar' in detail_items or 'necesita reforma' in detail_items:
+        condition = 'needs_renovation'
+    else:
+        condition = 'unknown'
+    
+    year_built = None
+    for item in response.css('div.details-property li::text').getall():
+        if 'año' in item.lower() and 'construc' in item.lower():
+            match = re.search(r'(\d{4})', item)
+            if match:
+                year_built = int(match.group(1))
+                break
+    
+    features = []
+    for section in response.css('div.details-property-feature, div.details-property'):
+        items = section.css('li::text').getall()
+        features.extend([item.strip() for item in items if item.strip()])
+    
+    energy_cert = None
+    energy_text = None
+    for item in response.css('div.details-property li::text').getall():
+        if 'energética' in item.lower():
+            energy_text = item
+            break
+    if energy_text:
+        match = re.search(r'([A-G])', energy_text.upper())
+        if match:
+            energy_cert = match.group(1)
+    
+    return {
+        'property_type': property_type,
+        'floor': floor,
+        'has_elevator': has_elevator,
+        'condition': condition,
+        'year_built': year_built,
+        'features': features,
+        'energy_cert': energy_cert
+    }
+
+
+def measure(extract, responses, iterations):
+    """Return the pages parsed per second, starting from a fresh response each time"""
+    bodies = [(response.url, response.body) for response in responses]
+    elapsed = 0.0
+    for _ in range(iterations):
+        for url, body in bodies:
+            # A new response per page, so the parsed document isn't reused between runs
+            response = HtmlResponse(url=url, body=body, encoding='utf-8')
+            start = time.perf_counter()
+            extract(response)
+            elapsed += time.perf_counter() - start
+    return iterations * len(bodies) / elapsed
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ITERATIONS
+    responses = load_fixtures()
+    
+    for response in responses:
+        previous = previous_extract_details(response)
+        current = extract_details(response)
+        assert previous == current, f"Different details for {response.url}: {previous} != {current}"
+    print(f"Checked {len(responses)} fixtures: same details with both extractors")
+    
+    previous_rate = measure(previous_extract_details, responses, iterations)
+    current_rate = measure(extract_details, responses, iterations)
+    
+    print(f"{'extractor':>12} {'pages/s':>10}")
+    print(f"{'previous':>12} {previous_rate:>10.0f}")
+    print(f"{'single-pass':>12} {current_rate:>10.0f}")
+    print(f"Speedup: {current_rate / previous_rate:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
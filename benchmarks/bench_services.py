@@ -0,0 +1,127 @@
+"""
+Benchmark for the service layer on the in-memory database.
+
+Loads synthetic listings into FakeDB (MONGODB_URI=memory://) and times the
+read paths behind the API endpoints, so service changes can be measured
+without a MongoDB server.
+
+Run from the repository root:
+    python -m benchmarks.bench_services [documents]
+"""
+
+import os
+import sys
+import time
+import random
+import statistics
+from datetime import datetime, timedelta
+
+os.environ['MONGODB_URI'] = 'memory://'
+
+from api.utils.db import get_db_connection
+from api.utils.indexes import ensure_indexes
+from api.utils.data_version import bump_data_version
+from api.services.property_service import PropertyService
+from api.services.analysis_service import AnalysisService
+from api.services.area_stats_service import AreaStatsService
+from api.services.scoring_service import ScoringService
+
+DEFAULT_DOCUMENTS = 20000
+
+CITIES = {
+    'madrid': ['Centro', 'Salamanca', 'Chamberí', 'Retiro', 'Tetuán'],
+    'barcelona': ['Eixample', 'Gràcia', 'Sants', 'Sant Martí'],
+    'valencia': ['Ruzafa', 'El Carmen', 'Benimaclet']
+}
+
+
+def make_documents(count):
+    """Generate property documents shaped like the scraped listings, for sale and for rent"""
+    random.seed(42)
+    now = datetime.now()
+    documents = []
+    for i in range(count):
+        city = random.choice(list(CITIES))
+        operation_type = random.choice(['sale', 'sale', 'rent'])
+        size = random.randint(40, 200)
+        price_per_sqm = random.uniform(2000, 6000) if operation_type == 'sale' else random.uniform(10, 25)
+        price = round(size * price_per_sqm, -2 if operation_type == 'sale' else 0)
+        documents.append({
+            'id': str(90000000 + i),
+            'source': random.choice(['idealista', 'fotocasa']),
+            'title': f'Piso en calle {i}, {city}',
+            'price': float(price),
+            'price_history': [{'price': float(price), 'date': now - timedelta(days=random.randint(1, 90))}],
+            'property_type': random.choice(['apartment', 'apartment', 'house']),
+            'operation_type': operation_type,
+            'size': float(size),
+            'rooms': random.randint(1, 5),
+            'bathrooms': random.randint(1, 3),
+            'floor': random.randint(0, 10),
+            'city': city,
+            'neighborhood': random.choice(CITIES[city]),
+            'latitude': 40.4 + random.random() / 10,
+            'longitude': -3.7 + random.random() / 10,
+            'condition': random.choice(['good', 'needs_renovation', 'new']),
+            'first_detected': now - timedelta(days=random.randint(1, 300)),
+            'last_updated': now,
+            'days_listed': random.randint(1, 300),
+            'price_per_sqm': price / size,
+            'investment_score': random.uniform(0, 100),
+        })
+    return documents
+
+
+def measure(func, repeat=5):
+    """Return the cold (first call) and median warm wall time in milliseconds"""
+    start = time.perf_counter()
+    func()
+    cold = (time.perf_counter() - start) * 1000
+    
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        warm.append((time.perf_counter() - start) * 1000)
+    
+    return cold, statistics.median(warm)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DOCUMENTS
+    
+    db = get_db_connection()
+    documents = make_documents(count)
+    
+    start = time.perf_counter()
+    db['properties'].insert_many(documents)
+    ensure_indexes(db)
+    bump_data_version(db)
+    AreaStatsService(db).rebuild()
+    print(f"Loaded {count} documents in {time.perf_counter() - start:.2f} s")
+    
+    property_service = PropertyService()
+    analysis_service = AnalysisService()
+    sample = documents[count // 2]
+    
+    cases = [
+        ('cities', lambda: property_service.get_cities()),
+        ('neighborhoods', lambda: property_service.get_neighborhoods('madrid')),
+        ('properties page', lambda: property_service.get_properties_page(
+            city='madrid', min_price=200000, max_price=600000, limit=100)),
+        ('properties map', lambda: property_service.get_properties_with_coordinates(
+            city='barcelona', limit=1000)),
+        ('opportunities page', lambda: analysis_service.get_investment_opportunities_page(
+            min_score=70, limit=50)),
+        ('property analysis', lambda: analysis_service.analyze_property(sample['id'], sample['source'])),
+        ('investment scores', lambda: ScoringService(db).rescore()),
+    ]
+    
+    print(f"{'case':>20} {'cold (ms)':>12} {'warm (ms)':>12}")
+    for name, func in cases:
+        cold, warm = measure(func)
+        print(f"{name:>20} {cold:>12.2f} {warm:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
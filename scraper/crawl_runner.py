@@ -0,0 +1,160 @@
+"""
+Runner that crawls spiders on one shared Twisted reactor.
+
+A Twisted reactor can only be started once per process. So instead of a
+CrawlerProcess per spider, the reactor is started once, in a background
+thread that lives as long as the process. Spiders are scheduled on it
+through a CrawlerRunner, and spiders started from different threads crawl
+concurrently.
+"""
+
+import logging
+import threading
+from typing import Any, Dict, Optional, Type
+from scrapy import Spider
+from scrapy.crawler import Crawler, CrawlerRunner
+from scrapy.settings import Settings
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import install_reactor, is_reactor_installed
+
+logger = logging.getLogger(__name__)
+
+# Maximum simultaneous requests of each spider
+SPIDER_CONCURRENCY = {
+    'idealista': 8,
+    'fotocasa': 8
+}
+
+# Maximum simultaneous requests of spiders without their own budget
+DEFAULT_SPIDER_CONCURRENCY = 8
+
+
+class CrawlRunner:
+    """Runs spiders on a reactor kept running in a background thread"""
+    
+    def __init__(self, settings: Optional[Settings] = None, concurrency: Optional[Dict[str, int]] = None):
+        """
+        Initialize the crawl runner
+        
+        Args:
+            settings: Scrapy settings (optional, the project settings if not given)
+            concurrency: Maximum simultaneous requests by spider name, on top of
+                SPIDER_CONCURRENCY (optional)
+        """
+        self.settings = settings if settings is not None else get_project_settings()
+        self.concurrency = {**SPIDER_CONCURRENCY, **(concurrency or {})}
+        self._reactor = None
+        self._runner = None
+        self._lock = threading.Lock()
+    
+    def start(self):
+        """Start the reactor in a background thread if it isn't running yet"""
+        with self._lock:
+            if self._reactor is not None:
+                return
+            
+            ready = threading.Event()
+            errors = []
+            thread = threading.Thread(target=self._run_reactor, args=(ready, errors),
+                                      name='crawl-reactor', daemon=True)
+            thread.start()
+            ready.wait()
+            
+            if errors:
+                raise errors[0]
+            logger.info("Crawl reactor started")
+    
+    def stop(self):
+        """Stop the running crawls and the reactor"""
+        with self._lock:
+            if self._reactor is None:
+                return
+            
+            from twisted.internet.threads import blockingCallFromThread
+            blockingCallFromThread(self._reactor, self._runner.stop)
+            self._reactor.callFromThread(self._reactor.stop)
+            logger.info("Crawl reactor stopped")
+    
+    def crawl_spider(self, spider_class: Type[Spider], spider_kwargs: Optional[Dict[str, Any]] = None,
+                     settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Run one spider and wait until it has finished
+        
+        Can be called from several threads at once to crawl spiders concurrently.
+        
+        Args:
+            spider_class: Spider class to run
+            spider_kwargs: Arguments passed to the spider (optional)
+            settings: Settings overriding the runner's for this crawl (optional)
+            
+        Returns:
+            Scrapy stats of the crawl
+            
+        Raises:
+            Exception: If the spider failed to run
+        """
+        self.start()
+        
+        from twisted.internet.threads import blockingCallFromThread
+        crawler = blockingCallFromThread(self._reactor, self._crawl, spider_class, spider_kwargs, settings)
+        return crawler.stats.get_stats()
+    
+    def _run_reactor(self, ready: threading.Event, errors: list):
+        """
+        Install and run the reactor, in the reactor thread
+        
+        Args:
+            ready: Event set once the reactor is running or failed to start
+            errors: List the startup error is added to
+        """
+        try:
+            reactor_path = self.settings.get('TWISTED_REACTOR')
+            if reactor_path and not is_reactor_installed():
+                install_reactor(reactor_path, self.settings.get('ASYNCIO_EVENT_LOOP'))
+            
+            from twisted.internet import reactor
+            self._runner = CrawlerRunner(self.settings)
+            self._reactor = reactor
+        except Exception as e:
+            logger.error(f"Error starting crawl reactor: {str(e)}")
+            errors.append(e)
+            ready.set()
+            return
+        
+        reactor.callWhenRunning(ready.set)
+        reactor.run(installSignalHandlers=False)
+    
+    def _crawl(self, spider_class: Type[Spider], spider_kwargs: Optional[Dict[str, Any]] = None,
+               overrides: Optional[Dict[str, Any]] = None):
+        """
+        Start one spider with its concurrency budget, in the reactor thread
+        
+        Args:
+            spider_class: Spider class to run
+            spider_kwargs: Arguments passed to the spider (optional)
+            overrides: Settings overriding the runner's for this crawl (optional)
+            
+        Returns:
+            Deferred firing with the crawler when the spider has finished
+        """
+        budget = self.concurrency.get(spider_class.name, DEFAULT_SPIDER_CONCURRENCY)
+        settings = self.settings.copy()
+        settings.set('CONCURRENT_REQUESTS', budget, priority='cmdline')
+        settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', budget, priority='cmdline')
+        for name, value in (overrides or {}).items():
+            settings.set(name, value, priority='cmdline')
+        
+        logger.info(f"Starting spider: {spider_class.name} ({budget} concurrent requests)")
+        crawler = Crawler(spider_class, settings)
+        crawling = self._runner.crawl(crawler, **(spider_kwargs or {}))
+        
+        def finished(result):
+            logger.info(f"Finished spider: {spider_class.name}")
+            return crawler
+        
+        def failed(failure):
+            logger.error(f"Error running spider {spider_class.name}: {failure.getErrorMessage()}")
+            return failure
+        
+        crawling.addCallbacks(finished, failed)
+        return crawling
@@ -0,0 +1,266 @@
+"""
+Delta crawling support for the spiders.
+
+Most listings don't change from one night to the next. Before fetching a
+listing's detail page, the spiders compare the price and content of its
+search result card with the ones recorded in the on-disk listing index of
+its city and operation type: listings that haven't changed are only marked
+as seen, with one bulk update for many of them, instead of being fetched and
+parsed again. A fetched listing's card is recorded once its item has gone
+through the item pipelines, so a listing that failed to be stored is fetched
+again on the next crawl.
+"""
+
+import logging
+import math
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from scrapy import signals
+
+# Make the API package importable from the spider processes
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from api.utils.db import get_db_connection
+from .listing_index import ListingIndex, listing_key
+
+logger = logging.getLogger(__name__)
+
+# Days after which an unchanged listing is fetched again, to refresh the
+# details that don't show on its card
+MAX_DETAIL_AGE_DAYS = 7
+
+# Directory holding one listing index per portal, city and operation type
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 'crawl_state', 'listings')
+
+# Number of seen listings marked with one bulk update
+TOUCH_BATCH_SIZE = 1000
+
+# Relative price difference below which a card price matches the stored price
+PRICE_TOLERANCE = 0.005
+
+
+class SeenListings:
+    """Card price and content of the listings of one portal, to skip the ones that haven't changed"""
+    
+    def __init__(self, source: str, db=None, directory: Optional[str] = None):
+        """
+        Initialize the seen listings of a portal
+        
+        Args:
+            source: Portal the listings come from
+            db: Database object (optional, a new connection is opened if needed)
+            directory: Directory holding the listing indexes (optional, the
+                LISTING_INDEX_DIR environment variable or DEFAULT_INDEX_DIR if
+                not given)
+        """
+        self.source = source
+        self.db = db
+        self.directory = directory or os.environ.get('LISTING_INDEX_DIR') or DEFAULT_INDEX_DIR
+        self.indexes: Dict[Tuple[str, str], ListingIndex] = {}
+        self.skipped = 0
+        self._touched: List[str] = []
+    
+    def is_unchanged(self, city: str, operation_type: str, property_id: Optional[str],
+                     price: Optional[float], content: int) -> bool:
+        """
+        Check if a listing is recorded with the price and content shown on its card
+        
+        Unchanged listings are marked as seen, so the caller can skip their
+        detail page.
+        
+        Args:
+            city: City of the search the card was found in
+            operation_type: Operation type of the search
+            property_id: Listing ID extracted from the link
+            price: Price shown on the card
+            content: Hash of the card content, 0 if unknown
+            
+        Returns:
+            True if the listing's detail page doesn't need to be fetched
+        """
+        if property_id is None or price is None:
+            return False
+        
+        entry = self._index(city, operation_type).get(listing_key(self.source, property_id))
+        if entry is None:
+            return False
+        
+        recorded_price, recorded_content, updated = entry
+        if math.isnan(recorded_price) or abs(recorded_price - price) > PRICE_TOLERANCE * recorded_price:
+            return False
+        if recorded_content and content and recorded_content != content:
+            return False
+        if time.time() - updated > MAX_DETAIL_AGE_DAYS * 86400:
+            return False
+        
+        self.skipped += 1
+        self._touched.append(property_id)
+        if len(self._touched) >= TOUCH_BATCH_SIZE:
+            self._touch()
+        return True
+    
+    def record(self, city: str, operation_type: str, property_id: Optional[str],
+               price: Optional[float], content: int):
+        """
+        Record the card of a listing whose detail page has just been fetched
+        
+        Args:
+            city: City of the search the card was found in
+            operation_type: Operation type of the search
+            property_id: Listing ID
+            price: Price shown on the card, or on the detail page if unknown
+            content: Hash of the card content, 0 if unknown
+        """
+        if property_id is None:
+            return
+        
+        price = float(price) if price is not None else math.nan
+        try:
+            self._index(city, operation_type).put(listing_key(self.source, property_id), price, content or 0,
+                                                  time.time())
+        except Exception as e:
+            logger.error(f"Error recording {self.source} listing {property_id}: {str(e)}")
+    
+    def flush(self):
+        """Mark the unchanged listings found since the last flush as seen and write the indexes to disk"""
+        self._touch()
+        for index in self.indexes.values():
+            index.flush()
+    
+    def close(self):
+        """Flush and close the listing indexes"""
+        self._touch()
+        for index in self.indexes.values():
+            index.close()
+        self.indexes = {}
+    
+    def _index(self, city: str, operation_type: str) -> ListingIndex:
+        """
+        Get the listing index of a city and operation type, opening it on first use
+        
+        Args:
+            city: City of the listings
+            operation_type: Operation type of the listings
+            
+        Returns:
+            Open listing index
+        """
+        index = self.indexes.get((city, operation_type))
+        if index is None:
+            index = ListingIndex(os.path.join(self.directory, f"{self.source}-{city}-{operation_type}"))
+            index.open()
+            if not len(index):
+                self._seed(index, city, operation_type)
+            self.indexes[(city, operation_type)] = index
+        return index
+    
+    def _seed(self, index: ListingIndex, city: str, operation_type: str):
+        """
+        Fill an empty index with the price of the stored listings, so the first
+        delta crawl doesn't fetch every listing again
+        
+        Args:
+            index: Empty listing index
+            city: City of the listings
+            operation_type: Operation type of the listings
+        """
+        try:
+            if self.db is None:
+                self.db = get_db_connection()
+            
+            cursor = self.db['properties'].find(
+                {'source': self.source, 'city': city, 'operation_type': operation_type},
+                {'_id': 0, 'id': 1, 'price': 1, 'last_updated': 1}
+            )
+            for doc in cursor:
+                price, last_updated = doc.get('price'), doc.get('last_updated')
+                if doc.get('id') is None or not isinstance(price, (int, float)) or \
+                        not isinstance(last_updated, datetime):
+                    continue
+                index.put(listing_key(self.source, str(doc['id'])), float(price), 0, last_updated.timestamp())
+            
+            index.flush()
+            logger.info(f"Seeded listing index {index.directory} with {len(index)} stored listings")
+        except Exception as e:
+            logger.error(f"Error seeding listing index {index.directory}, fetching every listing: {str(e)}")
+    
+    def _touch(self):
+        """Mark the unchanged listings found since the last call as seen now"""
+        if not self._touched:
+            return
+        
+        touched, self._touched = self._touched, []
+        try:
+            if self.db is None:
+                self.db = get_db_connection()
+            self.db['properties'].update_many(
+                {'source': self.source, 'id': {'$in': touched}},
+                {'$set': {'last_seen': datetime.now()}}
+            )
+        except Exception as e:
+            logger.error(f"Error marking {len(touched)} {self.source} listings as seen: {str(e)}")
+
+
+class DeltaCrawlMixin:
+    """
+    Crawl restriction and delta crawling shared by the portal spiders
+    
+    Spiders using it define search_paths, mapping each operation type to its
+    search path, and _extract_property_id(url), and pass the card of each
+    listing in the 'card' meta key of its detail page request.
+    """
+    
+    def __init__(self, cities=None, operation_types=None, delta=True, *args, **kwargs):
+        """
+        Initialize the spider, optionally restricted to part of the crawl
+        
+        Args:
+            cities: Cities to scrape, as a list or a comma-separated string
+                (optional, all the cities if not given)
+            operation_types: Operation types to scrape, 'sale' and/or 'rent', as a
+                list or a comma-separated string (optional, both if not given)
+            delta: Whether to skip the detail page of listings stored with the
+                price shown on their card (optional, 'false' to fetch every listing)
+        """
+        super().__init__(*args, **kwargs)
+        if cities:
+            self.cities = cities.split(",") if isinstance(cities, str) else list(cities)
+        if isinstance(operation_types, str):
+            operation_types = operation_types.split(",")
+        self.operation_types = [operation_type for operation_type in self.search_paths
+                                if not operation_types or operation_type in operation_types]
+        if isinstance(delta, str):
+            delta = delta.lower() not in ("0", "false", "no")
+        self.seen_listings = SeenListings(self.name) if delta else None
+    
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        """Create the spider and record the card of each listing stored by the item pipelines"""
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        if spider.seen_listings is not None:
+            crawler.signals.connect(spider._record_listing, signal=signals.item_scraped)
+        return spider
+    
+    def closed(self, reason):
+        """Mark the last unchanged listings as seen and close the listing indexes when the spider closes"""
+        if self.seen_listings is not None:
+            self.seen_listings.close()
+            logger.info(f"Skipped {self.seen_listings.skipped} unchanged listings")
+    
+    def _is_unchanged(self, url, city, operation_type, card):
+        """Check if a listing is recorded with the price and content of its card, so its detail page can be skipped"""
+        if self.seen_listings is None or not self.seen_listings.is_unchanged(
+                city, operation_type, self._extract_property_id(url), *card):
+            return False
+        self.crawler.stats.inc_value('delta/skipped_listings')
+        return True
+    
+    def _record_listing(self, item, response, spider):
+        """Record the card of a listing whose item has passed the item pipelines, for the next delta crawl"""
+        price, content = response.meta.get('card', (None, 0))
+        self.seen_listings.record(response.meta.get('city'), response.meta.get('operation_type'), item.get('id'),
+                                  price if price is not None else item.get('price'), content)
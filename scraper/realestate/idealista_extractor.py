@@ -0,0 +1,198 @@
+"""
+Single-pass extraction of the details of an idealista.com listing.
+
+The detail list of a listing page is read once into a DetailList, and the
+property type, floor, elevator, condition, year built, features and energy
+certificate are all extracted from it, with module-level precompiled
+patterns and keyword tables, instead of querying the page again for each
+field.
+"""
+
+import re
+from typing import Any, Dict, List, NamedTuple, Optional
+
+# Keywords of each property type, checked in order on the breadcrumbs and details
+PROPERTY_TYPE_KEYWORDS = (
+    ('piso', 'apartment'),
+    ('casa', 'house'),
+    ('chalet', 'house'),
+    ('ático', 'penthouse'),
+    ('estudio', 'studio'),
+)
+
+# Keywords of each property condition, checked in order on the details
+CONDITION_KEYWORDS = (
+    ('nuevo', 'new'),
+    ('a estrenar', 'new'),
+    ('buen estado', 'good'),
+    ('para reformar', 'needs_renovation'),
+    ('necesita reforma', 'needs_renovation'),
+)
+
+# Floors described by name instead of number, checked in order
+FLOOR_KEYWORDS = (
+    ('bajo', 0),
+    ('sótano', -1),
+    ('entreplanta', 0),
+)
+
+FLOOR_PATTERN = re.compile(r'([0-9]+)[ºª]?\s*planta')
+YEAR_PATTERN = re.compile(r'(\d{4})')
+ENERGY_CERT_PATTERN = re.compile(r'([A-G])')
+NUMBER_CLEANUP_PATTERN = re.compile(r'[€\$£\.a-zA-Z\s]')
+PROPERTY_ID_PATTERN = re.compile(r'/inmueble/(\d+)/')
+ADDRESS_PATTERN = re.compile(r'en\s+([^,]+),\s*([^,]+)')
+POSTAL_CODE_PATTERN = re.compile(r'\b(\d{5})\b')
+LATITUDE_PATTERN = re.compile(r'latitude["\s:]+([0-9.-]+)')
+LONGITUDE_PATTERN = re.compile(r'longitude["\s:]+([0-9.-]+)')
+LATLNG_PATTERN = re.compile(r'google.maps.LatLng\(([0-9.-]+),\s*([0-9.-]+)\)')
+
+FEATURE_SECTIONS = 'div.details-property-feature, div.details-property'
+
+
+class DetailList(NamedTuple):
+    """Text of the detail list of a listing page, read once"""
+    # Items of the div.details-property sections, as on the page
+    items: List[str]
+    # The same items lowercased
+    lowered: List[str]
+    # All the lowercased items joined with spaces
+    text: str
+    # Non-empty items of every detail and feature section, stripped
+    features: List[str]
+    # Lowercased breadcrumb text
+    breadcrumbs: str
+
+
+def parse_detail_list(response) -> DetailList:
+    """
+    Read the detail and feature sections of a listing page
+    
+    Args:
+        response: Listing detail page
+        
+    Returns:
+        Detail list of the page
+    """
+    items = []
+    features = []
+    for section in response.css(FEATURE_SECTIONS):
+        section_items = section.css('li::text').getall()
+        features.extend([item.strip() for item in section_items if item.strip()])
+        if 'details-property' in section.attrib.get('class', '').split():
+            items.extend(section_items)
+    
+    lowered = [item.lower() for item in items]
+    breadcrumbs = ' '.join(response.css('ol.breadcrumb li::text').getall()).lower()
+    return DetailList(items, lowered, ' '.join(lowered), features, breadcrumbs)
+
+
+def extract_details(response) -> Dict[str, Any]:
+    """
+    Extract the details of a listing page in one pass over its detail list
+    
+    Args:
+        response: Listing detail page
+        
+    Returns:
+        Dictionary with property_type, floor, has_elevator, condition,
+        year_built, features and energy_cert
+    """
+    details = parse_detail_list(response)
+    
+    floor_text = None
+    year_built = None
+    energy_text = None
+    for item, lowered in zip(details.items, details.lowered):
+        if floor_text is None and 'planta' in lowered:
+            floor_text = lowered
+        if year_built is None and 'año' in lowered and 'construc' in lowered:
+            match = YEAR_PATTERN.search(item)
+            if match:
+                year_built = int(match.group(1))
+        if energy_text is None and 'energética' in lowered:
+            energy_text = item
+    
+    return {
+        'property_type': _match_keywords(PROPERTY_TYPE_KEYWORDS, 'other', details.breadcrumbs, details.text),
+        'floor': _parse_floor(floor_text),
+        'has_elevator': 'ascensor' in details.text,
+        'condition': _match_keywords(CONDITION_KEYWORDS, 'unknown', details.text),
+        'year_built': year_built,
+        'features': details.features,
+        'energy_cert': _parse_energy_cert(energy_text)
+    }
+
+
+def extract_number(text: Optional[str]) -> Optional[float]:
+    """
+    Extract a number from text, handling currency symbols and separators
+    
+    Args:
+        text: Text holding the number
+        
+    Returns:
+        Number, None if the text doesn't hold one
+    """
+    if not text:
+        return None
+    # Remove currency symbols, dots as thousand separators, and replace comma with dot for decimals
+    clean_text = NUMBER_CLEANUP_PATTERN.sub('', text).replace(',', '.')
+    try:
+        return float(clean_text)
+    except ValueError:
+        return None
+
+
+def _match_keywords(keywords, default: Any, *texts: str) -> Any:
+    """
+    Get the value of the first keyword found in any of the texts
+    
+    Args:
+        keywords: (keyword, value) pairs, in order of precedence
+        default: Value if no keyword is found
+        texts: Texts to search
+        
+    Returns:
+        Value of the first keyword found
+    """
+    for keyword, value in keywords:
+        if any(keyword in text for text in texts):
+            return value
+    return default
+
+
+def _parse_floor(floor_text: Optional[str]) -> Optional[int]:
+    """
+    Parse the floor number from the lowercased floor detail
+    
+    Args:
+        floor_text: Lowercased detail mentioning the floor
+        
+    Returns:
+        Floor number, None if unknown
+    """
+    if not floor_text:
+        return None
+    
+    match = FLOOR_PATTERN.search(floor_text)
+    if match:
+        return int(match.group(1))
+    return _match_keywords(FLOOR_KEYWORDS, None, floor_text)
+
+
+def _parse_energy_cert(energy_text: Optional[str]) -> Optional[str]:
+    """
+    Parse the energy certificate letter from the energy detail
+    
+    Args:
+        energy_text: Detail mentioning the energy certificate
+        
+    Returns:
+        Letter between A and G, None if unknown
+    """
+    if not energy_text:
+        return None
+    
+    match = ENERGY_CERT_PATTERN.search(energy_text.upper())
+    return match.group(1) if match else None
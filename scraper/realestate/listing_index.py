@@ -0,0 +1,455 @@
+"""
+Compact on-disk index of the listings seen by the spiders.
+
+Each listing is identified by a 64-bit hash of its portal and ID, and the
+index keeps its card price, a hash of its card content and the time its
+detail page was last fetched. The index is made of two files:
+
+- listings.log: append-only journal of fixed-size records, each with a
+  checksum. It is the source of truth: a record is complete once its write
+  returns, and a torn record at the end is dropped on the next load.
+- listings.idx: open-addressing hash table with linear probing, memory
+  mapped, with the same fields for the last record of each listing. Its
+  header tells how many journal records it holds, so after a crash only the
+  records appended since are replayed, and it is rebuilt from the journal
+  if it is missing or damaged.
+
+Loading maps the table instead of reading it, so it takes the same few
+milliseconds for a thousand listings or for millions, and lookups read a
+handful of slots.
+"""
+
+import hashlib
+import logging
+import os
+import struct
+import zlib
+from typing import Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LOG_FILE = 'listings.log'
+TABLE_FILE = 'listings.idx'
+
+# Identifies a table file of this format
+MAGIC = 0x314B5453494C5245
+
+# Journal record: listing key, card price, card content hash, detail fetch
+# time as a Unix timestamp, and the CRC32 of the preceding fields
+RECORD_DTYPE = np.dtype([
+    ('key', '<u8'), ('price', '<f8'), ('content_hash', '<u8'), ('updated', '<f8'),
+    ('checksum', '<u4'), ('padding', '<u4')
+])
+CHECKSUM_OFFSET = RECORD_DTYPE.fields['checksum'][1]
+RECORD_FIELDS = struct.Struct('<QdQd')
+RECORD_TRAILER = struct.Struct('<II')
+
+# Table header and slot, an empty slot has key 0
+HEADER_DTYPE = np.dtype([('magic', '<u8'), ('capacity', '<u8'), ('count', '<u8'), ('indexed', '<u8')])
+SLOT_DTYPE = np.dtype([('key', '<u8'), ('price', '<f8'), ('content_hash', '<u8'), ('updated', '<f8')])
+
+# Capacity of a new table, always a power of two
+MIN_CAPACITY = 1024
+
+# Fraction of occupied slots above which the table doubles its capacity
+MAX_LOAD_FACTOR = 0.5
+
+# Journal records per listing above which the journal is compacted when the index is closed
+MAX_RECORDS_PER_LISTING = 4
+
+
+def listing_key(source: str, property_id: str) -> int:
+    """
+    Get the 64-bit key of a listing
+    
+    Args:
+        source: Portal the listing comes from
+        property_id: Listing ID on the portal
+        
+    Returns:
+        Non-zero key of the listing
+    """
+    digest = hashlib.blake2b(f"{source}:{property_id}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+def content_hash(text: str) -> int:
+    """
+    Get the 64-bit hash of a listing's card content
+    
+    Args:
+        text: Card content, normalized by the caller
+        
+    Returns:
+        Non-zero hash of the content
+    """
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+def _checksums(records: np.ndarray) -> np.ndarray:
+    """
+    Compute the checksum of journal records
+    
+    Args:
+        records: Journal records
+        
+    Returns:
+        CRC32 of the fields before the checksum of each record
+    """
+    data = records.view(np.uint8).reshape(len(records), RECORD_DTYPE.itemsize)[:, :CHECKSUM_OFFSET]
+    return np.array([zlib.crc32(row.tobytes()) for row in data], dtype=np.uint32)
+
+
+def _as_slots(entries: np.ndarray) -> np.ndarray:
+    """
+    Copy journal records or slots into a slot array
+    
+    Args:
+        entries: Journal records or slots
+        
+    Returns:
+        Slot array with the same listings
+    """
+    slots = np.zeros(len(entries), dtype=SLOT_DTYPE)
+    for name in SLOT_DTYPE.names:
+        slots[name] = entries[name]
+    return slots
+
+
+def _insert(slots: np.ndarray, entries: np.ndarray):
+    """
+    Insert entries with distinct keys into a hash table, replacing the entries with the same key
+    
+    All the entries probe at once: in each round, the ones reaching a free
+    slot or their own key are placed, one per slot, and the rest move on.
+    
+    Args:
+        slots: Slots of the table, with room for the entries
+        entries: Entries to insert, with the slot fields
+    """
+    mask = len(slots) - 1
+    positions = (entries['key'] & np.uint64(mask)).astype(np.int64)
+    pending = np.arange(len(entries))
+    while pending.size:
+        targets = positions[pending]
+        occupant = slots['key'][targets]
+        placeable = (occupant == 0) | (occupant == entries['key'][pending])
+        
+        candidates = pending[placeable]
+        _, first = np.unique(targets[placeable], return_index=True)
+        placed = candidates[first]
+        slots[positions[placed]] = entries[placed]
+        
+        is_placed = np.zeros(len(entries), dtype=bool)
+        is_placed[placed] = True
+        pending = pending[~is_placed[pending]]
+        positions[pending] = (positions[pending] + 1) & mask
+
+
+class ListingIndex:
+    """Memory-mapped hash index of listings, backed by an append-only journal"""
+    
+    def __init__(self, directory: str):
+        """
+        Initialize the listing index
+        
+        Args:
+            directory: Directory holding the journal and table files
+        """
+        self.directory = directory
+        self.log_path = os.path.join(directory, LOG_FILE)
+        self.table_path = os.path.join(directory, TABLE_FILE)
+        self._log = None
+        self._header = None
+        self._table = None
+        self._slots = None
+        self._keys = None
+    
+    def __len__(self) -> int:
+        """Number of listings in the index"""
+        return int(self._header['count'][0]) if self._header is not None else 0
+    
+    def open(self):
+        """Open the index, replaying the journal records missing from the table"""
+        os.makedirs(self.directory, exist_ok=True)
+        
+        mapped = self._map_table()
+        records = self._valid_records()
+        self._log = open(self.log_path, 'ab')
+        
+        indexed = int(self._header['indexed'][0]) if mapped else 0
+        if not mapped or indexed > records:
+            self._rebuild(records)
+        elif indexed < records:
+            self._insert_records(self._read_records(indexed, records))
+            self._header['indexed'] = records
+        
+        logger.info(f"Opened listing index {self.directory}: {len(self)} listings")
+    
+    def close(self):
+        """Flush the index to disk and close it, compacting the journal if it has grown too much"""
+        if self._log is None:
+            return
+        
+        self.flush()
+        indexed = int(self._header['indexed'][0])
+        if indexed > MAX_RECORDS_PER_LISTING * max(len(self), MIN_CAPACITY):
+            self._compact()
+        
+        self._log.close()
+        self._log = None
+        self._header = None
+        self._table = None
+        self._slots = None
+        self._keys = None
+    
+    def flush(self):
+        """Make the journal and the table durable"""
+        if self._log is None:
+            return
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._table.flush()
+    
+    def get(self, key: int) -> Optional[Tuple[float, int, float]]:
+        """
+        Look up a listing
+        
+        Args:
+            key: Listing key from listing_key
+            
+        Returns:
+            Card price, card content hash and detail fetch timestamp of the
+            listing, None if it isn't in the index
+        """
+        slot = self._find(key)
+        if slot is None:
+            return None
+        entry = self._slots[slot]
+        return float(entry['price']), int(entry['content_hash']), float(entry['updated'])
+    
+    def put(self, key: int, price: float, content: int, updated: float):
+        """
+        Add or update a listing, appending it to the journal first
+        
+        Args:
+            key: Listing key from listing_key
+            price: Card price, NaN if unknown
+            content: Card content hash, 0 if unknown
+            updated: Detail fetch time as a Unix timestamp
+        """
+        fields = RECORD_FIELDS.pack(key, price, content, updated)
+        self._log.write(fields + RECORD_TRAILER.pack(zlib.crc32(fields), 0))
+        self._log.flush()
+        
+        position = self._probe(key)
+        if self._keys[position] == 0:
+            if len(self) + 1 > len(self._keys) * MAX_LOAD_FACTOR:
+                self._grow(len(self) + 1)
+                position = self._probe(key)
+            self._header['count'] += 1
+        
+        self._slots[position] = (key, price, content, updated)
+        self._header['indexed'] += 1
+    
+    def _find(self, key: int) -> Optional[int]:
+        """
+        Find the slot of a listing
+        
+        Args:
+            key: Listing key
+            
+        Returns:
+            Slot index, None if the listing isn't in the table
+        """
+        position = self._probe(key)
+        return position if self._keys[position] != 0 else None
+    
+    def _probe(self, key: int) -> int:
+        """
+        Find the slot holding a listing or, if it isn't in the table, the slot it would take
+        
+        Args:
+            key: Listing key
+            
+        Returns:
+            Slot index
+        """
+        keys = self._keys
+        mask = len(keys) - 1
+        position = key & mask
+        while True:
+            occupant = int(keys[position])
+            if occupant == key or occupant == 0:
+                return position
+            position = (position + 1) & mask
+    
+    def _valid_records(self) -> int:
+        """
+        Count the complete journal records, dropping a torn record at the end
+        
+        Returns:
+            Number of records in the journal
+        """
+        if not os.path.exists(self.log_path):
+            return 0
+        
+        records = os.path.getsize(self.log_path) // RECORD_DTYPE.itemsize
+        indexed = min(int(self._header['indexed'][0]), records) if self._header is not None else 0
+        
+        # Records already in the table were checked when they were indexed
+        tail = self._read_records(indexed, records)
+        invalid = np.nonzero(_checksums(tail) != tail['checksum'])[0]
+        if invalid.size:
+            records = indexed + int(invalid[0])
+            logger.warning(f"Dropping {len(tail) - int(invalid[0])} damaged records of listing index {self.directory}")
+        
+        if os.path.getsize(self.log_path) != records * RECORD_DTYPE.itemsize:
+            os.truncate(self.log_path, records * RECORD_DTYPE.itemsize)
+        
+        return records
+    
+    def _read_records(self, start: int, stop: int) -> np.ndarray:
+        """
+        Read a range of journal records
+        
+        Args:
+            start: Index of the first record
+            stop: Index after the last record
+            
+        Returns:
+            Journal records
+        """
+        if stop <= start:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.fromfile(self.log_path, dtype=RECORD_DTYPE, count=stop - start,
+                           offset=start * RECORD_DTYPE.itemsize)
+    
+    def _map_table(self) -> bool:
+        """
+        Memory-map the table file
+        
+        Returns:
+            True if the table exists and is valid
+        """
+        self._header = None
+        self._table = None
+        self._slots = None
+        self._keys = None
+        if not os.path.exists(self.table_path):
+            return False
+        
+        try:
+            table = np.memmap(self.table_path, dtype=np.uint8, mode='r+')
+            if len(table) < HEADER_DTYPE.itemsize:
+                return False
+            
+            # Plain array views of the mapping skip the memmap overhead on every access
+            header = table[:HEADER_DTYPE.itemsize].view(np.ndarray).view(HEADER_DTYPE)
+            capacity = int(header['capacity'][0])
+            expected = HEADER_DTYPE.itemsize + capacity * SLOT_DTYPE.itemsize
+            if int(header['magic'][0]) != MAGIC or len(table) != expected:
+                return False
+            
+            self._table = table
+            self._header = header
+            self._slots = table[HEADER_DTYPE.itemsize:].view(np.ndarray).view(SLOT_DTYPE)
+            self._keys = self._slots['key']
+            return True
+        except Exception as e:
+            logger.error(f"Error mapping listing index table {self.table_path}: {str(e)}")
+            return False
+    
+    def _rebuild(self, records: int):
+        """
+        Rebuild the table from the journal
+        
+        Args:
+            records: Number of valid records in the journal
+        """
+        journal = self._read_records(0, records)
+        
+        # Keep the last record of each listing
+        _, last = np.unique(journal['key'][::-1], return_index=True)
+        latest = journal[len(journal) - 1 - last]
+        
+        self._create_table(latest, indexed=records)
+        logger.info(f"Rebuilt listing index table {self.table_path} from {records} records")
+    
+    def _create_table(self, entries: np.ndarray, indexed: int, listings: int = 0):
+        """
+        Write a new table holding entries with distinct keys, and map it
+        
+        Args:
+            entries: Entries of the table, with the slot fields
+            indexed: Number of journal records the table holds
+            listings: Number of listings to make room for, if more than the entries
+        """
+        capacity = MIN_CAPACITY
+        while max(len(entries), listings) > capacity * MAX_LOAD_FACTOR:
+            capacity *= 2
+        
+        slots = np.zeros(capacity, dtype=SLOT_DTYPE)
+        _insert(slots, _as_slots(entries))
+        header = np.array([(MAGIC, capacity, len(entries), indexed)], dtype=HEADER_DTYPE)
+        
+        temporary = f"{self.table_path}.tmp"
+        with open(temporary, 'wb') as file:
+            file.write(header.tobytes())
+            file.write(slots.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.table_path)
+        
+        self._map_table()
+    
+    def _insert_records(self, records: np.ndarray):
+        """
+        Insert journal records into the table, growing it if needed
+        
+        Args:
+            records: Journal records, in journal order
+        """
+        _, last = np.unique(records['key'][::-1], return_index=True)
+        entries = _as_slots(records[len(records) - 1 - last])
+        
+        added = sum(1 for key in entries['key'].tolist() if self._find(key) is None)
+        count = len(self) + added
+        if count > len(self._keys) * MAX_LOAD_FACTOR:
+            self._grow(count)
+        
+        _insert(self._slots, entries)
+        self._header['count'] = count
+    
+    def _grow(self, listings: int):
+        """
+        Move the table to a larger one
+        
+        Args:
+            listings: Number of listings to make room for
+        """
+        occupied = self._slots[self._keys != 0]
+        self._create_table(occupied, indexed=int(self._header['indexed'][0]), listings=listings)
+    
+    def _compact(self):
+        """Rewrite the journal with one record per listing"""
+        entries = self._slots[self._keys != 0]
+        records = np.zeros(len(entries), dtype=RECORD_DTYPE)
+        for name in SLOT_DTYPE.names:
+            records[name] = entries[name]
+        records['checksum'] = _checksums(records)
+        
+        self._log.close()
+        temporary = f"{self.log_path}.tmp"
+        with open(temporary, 'wb') as file:
+            file.write(records.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.log_path)
+        self._log = open(self.log_path, 'ab')
+        
+        self._header['indexed'] = len(records)
+        self._table.flush()
+        logger.info(f"Compacted listing index journal {self.log_path} to {len(records)} records")
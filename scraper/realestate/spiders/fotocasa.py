@@ -8,12 +8,14 @@ import logging
 import re
 from datetime import datetime
 from ..items import PropertyItem
+from ..delta import DeltaCrawlMixin
+from ..listing_index import content_hash
 from urllib.parse import urljoin
 
 logger = logging.getLogger(__name__)
 
 
-class FotocasaSpider(scrapy.Spider):
+class FotocasaSpider(DeltaCrawlMixin, scrapy.Spider):
     name = "fotocasa"
     allowed_domains = ["fotocasa.es"]
     
@@ -35,16 +37,20 @@ class FotocasaSpider(scrapy.Spider):
         "alicante",
     ]
     
+    # Search path of each operation type
+    search_paths = {
+        "sale": "venta/viviendas",
+        "rent": "alquiler/viviendas",
+    }
+    
     def start_requests(self):
-        """Generate initial requests for each city"""
+        """Generate initial requests for each city and operation type"""
         for city in self.cities:
-            # Start with for-sale listings
-            sale_url = f"{self.base_url}/venta/viviendas/{city}/"
-            yield scrapy.Request(url=sale_url, callback=self.parse_search_results, meta={'city': city, 'operation_type': 'sale'})
-            
-            # Also get rental listings
-            rent_url = f"{self.base_url}/alquiler/viviendas/{city}/"
-            yield scrapy.Request(url=rent_url, callback=self.parse_search_results, meta={'city': city, 'operation_type': 'rent'})
+            # For-sale listings first, then rental listings
+            for operation_type in self.operation_types:
+                url = f"{self.base_url}/{self.search_paths[operation_type]}/{city}/"
+                yield scrapy.Request(url=url, callback=self.parse_search_results,
+                                     meta={'city': city, 'operation_type': operation_type})
     
     def parse_search_results(self, response):
         """Parse the search results page and follow pagination and property links"""
@@ -53,11 +59,15 @@ class FotocasaSpider(scrapy.Spider):
         
         # Extract property links - Update selectors based on Fotocasa's structure
         property_links = response.css('a.re-CardPackPremium-info::attr(href), a.re-Card-link::attr(href)').getall()
+        cards = self._parse_cards(response)
         
         for link in property_links:
             full_url = urljoin(self.base_url, link)
+            card = cards.get(link, (None, 0))
+            if self._is_unchanged(full_url, city, operation_type, card):
+                continue
             yield scrapy.Request(url=full_url, callback=self.parse_property_details,
-                                meta={'city': city, 'operation_type': operation_type})
+                                meta={'city': city, 'operation_type': operation_type, 'card': card})
         
         # Follow pagination
         next_page = response.css('a.sui-LinkBasic[title="Siguiente"]::attr(href)').get()
@@ -123,6 +133,18 @@ class FotocasaSpider(scrapy.Spider):
             logger.error(f"Error parsing property {response.url}: {str(e)}")
             return None
     
+    def _parse_cards(self, response):
+        """Get the price and a hash of the content of each search result card, by link"""
+        cards = {}
+        for card in response.css('article'):
+            link = card.css('a.re-CardPackPremium-info::attr(href), a.re-Card-link::attr(href)').get()
+            if link:
+                price = self._extract_number(card.css('span.re-CardPrice::text').get())
+                texts = card.css('.re-CardTitle::text, span.re-CardPrice::text, .re-CardFeatures-feature::text').getall()
+                content = ' '.join(' '.join(texts).split())
+                cards[link] = (price, content_hash(content) if content else 0)
+        return cards
+    
     def _extract_property_id(self, url):
         """Extract the property ID from the URL"""
         match = re.search(r'/(\d+)/', url)
@@ -176,7 +198,7 @@ class FotocasaSpider(scrapy.Spider):
         size_text = response.css('ul.re-DetailHeader-features li:contains("m²") span::text').get()
         if size_text:
             return self._extract_number(size_text)
-            
+        
         return None
     
     def _extract_rooms(self, response):
@@ -190,7 +212,7 @@ class FotocasaSpider(scrapy.Spider):
         rooms_text = response.css('ul.re-DetailHeader-features li:contains("hab.") span::text').get()
         if rooms_text:
             return self._extract_number(rooms_text)
-            
+        
         return None
     
     def _extract_bathrooms(self, response):
@@ -204,7 +226,7 @@ class FotocasaSpider(scrapy.Spider):
         bath_text = response.css('ul.re-DetailHeader-features li:contains("baño") span::text').get()
         if bath_text:
             return self._extract_number(bath_text)
-            
+        
         return None
     
     def _extract_floor(self, response):
@@ -263,7 +285,7 @@ class FotocasaSpider(scrapy.Spider):
         year_match = re.search(r'construido en (\d{4})', description.lower())
         if year_match:
             return int(year_match.group(1))
-            
+        
         return None
     
     def _extract_features(self, response):
@@ -350,7 +372,7 @@ class FotocasaSpider(scrapy.Spider):
                     return (lat, lng)
                 except ValueError:
                     pass
-                
+            
             # Try Google Maps format
             maps_match = re.search(r'new\s+google\.maps\.LatLng\(([0-9.-]+),\s*([0-9.-]+)\)', script)
             if maps_match:
@@ -5,15 +5,20 @@ Spider for scraping property data from idealista.com
 import scrapy
 import json
 import logging
-import re
 from datetime import datetime
 from ..items import PropertyItem
+from ..delta import DeltaCrawlMixin
+from ..listing_index import content_hash
+from ..idealista_extractor import (
+    extract_details, extract_number, PROPERTY_ID_PATTERN, ADDRESS_PATTERN, POSTAL_CODE_PATTERN,
+    LATITUDE_PATTERN, LONGITUDE_PATTERN, LATLNG_PATTERN
+)
 from urllib.parse import urljoin
 
 logger = logging.getLogger(__name__)
 
 
-class IdealistaSpider(scrapy.Spider):
+class IdealistaSpider(DeltaCrawlMixin, scrapy.Spider):
     name = "idealista"
     allowed_domains = ["idealista.com"]
     
@@ -35,29 +40,37 @@ class IdealistaSpider(scrapy.Spider):
         "alicante",
     ]
     
+    # Search path of each operation type
+    search_paths = {
+        "sale": "venta-viviendas",
+        "rent": "alquiler-viviendas",
+    }
+    
     def start_requests(self):
-        """Generate initial requests for each city"""
+        """Generate initial requests for each city and operation type"""
         for city in self.cities:
-            # Start with for-sale listings
-            sale_url = f"{self.base_url}/venta-viviendas/{city}/"
-            yield scrapy.Request(url=sale_url, callback=self.parse_search_results, meta={'city': city, 'operation_type': 'sale'})
-            
-            # Also get rental listings
-            rent_url = f"{self.base_url}/alquiler-viviendas/{city}/"
-            yield scrapy.Request(url=rent_url, callback=self.parse_search_results, meta={'city': city, 'operation_type': 'rent'})
+            # For-sale listings first, then rental listings
+            for operation_type in self.operation_types:
+                url = f"{self.base_url}/{self.search_paths[operation_type]}/{city}/"
+                yield scrapy.Request(url=url, callback=self.parse_search_results,
+                                     meta={'city': city, 'operation_type': operation_type})
     
     def parse_search_results(self, response):
         """Parse the search results page and follow pagination and property links"""
         city = response.meta.get('city')
         operation_type = response.meta.get('operation_type')
         
-        # Extract property links
+        # Extract property links and the price and content of their cards
         property_links = response.css('article.item a.item-link::attr(href)').getall()
+        cards = self._parse_cards(response)
         
         for link in property_links:
             full_url = urljoin(self.base_url, link)
+            card = cards.get(link, (None, 0))
+            if self._is_unchanged(full_url, city, operation_type, card):
+                continue
             yield scrapy.Request(url=full_url, callback=self.parse_property_details,
-                                meta={'city': city, 'operation_type': operation_type})
+                                meta={'city': city, 'operation_type': operation_type, 'card': card})
         
         # Follow pagination
         next_page = response.css('a.icon-arrow-right-after::attr(href)').get()
@@ -85,22 +98,25 @@ class IdealistaSpider(scrapy.Spider):
             price_text = response.css('span.info-data-price::text').get('').strip()
             item['price'] = self._extract_number(price_text)
             
+            # Details list, read once for all the fields below
+            details = extract_details(response)
+            
             # Property type
-            item['property_type'] = self._get_property_type(response)
+            item['property_type'] = details['property_type']
             item['operation_type'] = response.meta.get('operation_type')
             
             # Physical characteristics
             item['size'] = self._extract_size(response)
             item['rooms'] = self._extract_rooms(response)
             item['bathrooms'] = self._extract_bathrooms(response)
-            item['floor'] = self._extract_floor(response)
-            item['has_elevator'] = self._has_elevator(response)
-            item['condition'] = self._get_condition(response)
-            item['year_built'] = self._extract_year_built(response)
+            item['floor'] = details['floor']
+            item['has_elevator'] = details['has_elevator']
+            item['condition'] = details['condition']
+            item['year_built'] = details['year_built']
             
             # Features and amenities
-            item['features'] = self._extract_features(response)
-            item['energy_cert'] = self._extract_energy_cert(response)
+            item['features'] = details['features']
+            item['energy_cert'] = details['energy_cert']
             
             # Location data
             location_data = self._extract_location(response)
@@ -124,40 +140,28 @@ class IdealistaSpider(scrapy.Spider):
             logger.error(f"Error parsing property {response.url}: {str(e)}")
             return None
     
+    def _parse_cards(self, response):
+        """Get the price and a hash of the content of each search result card, by link"""
+        cards = {}
+        for card in response.css('article.item'):
+            link = card.css('a.item-link::attr(href)').get()
+            if link:
+                price = self._extract_number(card.css('.item-price::text').get())
+                texts = card.css('a.item-link::text, .item-price::text, .item-detail::text').getall()
+                content = ' '.join(' '.join(texts).split())
+                cards[link] = (price, content_hash(content) if content else 0)
+        return cards
+    
     def _extract_property_id(self, url):
         """Extract the property ID from the URL"""
-        match = re.search(r'/inmueble/(\d+)/', url)
+        match = PROPERTY_ID_PATTERN.search(url)
         if match:
             return match.group(1)
         return None
     
     def _extract_number(self, text):
         """Extract a number from text, handling currency symbols and separators"""
-        if not text:
-            return None
-        # Remove currency symbols, dots as thousand separators, and replace comma with dot for decimals
-        clean_text = re.sub(r'[€\$£\.a-zA-Z\s]', '', text).replace(',', '.')
-        try:
-            return float(clean_text)
-        except ValueError:
-            return None
-    
-    def _get_property_type(self, response):
-        """Determine the property type"""
-        # Look for property type indicators in the breadcrumbs or detail sections
-        breadcrumbs = ' '.join(response.css('ol.breadcrumb li::text').getall()).lower()
-        detail_text = ' '.join(response.css('div.details-property li::text').getall()).lower()
-        
-        if 'piso' in breadcrumbs or 'piso' in detail_text:
-            return 'apartment'
-        elif 'casa' in breadcrumbs or 'casa' in detail_text or 'chalet' in breadcrumbs or 'chalet' in detail_text:
-            return 'house'
-        elif 'ático' in breadcrumbs or 'ático' in detail_text:
-            return 'penthouse'
-        elif 'estudio' in breadcrumbs or 'estudio' in detail_text:
-            return 'studio'
-        else:
-            return 'other'
+        return extract_number(text)
     
     def _extract_size(self, response):
         """Extract the size in square meters"""
@@ -180,88 +184,6 @@ class IdealistaSpider(scrapy.Spider):
             return self._extract_number(bath_text)
         return None
     
-    def _extract_floor(self, response):
-        """Extract the floor number"""
-        floor_text = None
-        # Check various selectors where floor info might be found
-        detail_items = response.css('div.details-property li::text').getall()
-        for item in detail_items:
-            if 'planta' in item.lower():
-                floor_text = item
-                break
-        
-        if floor_text:
-            # Extract floor number
-            match = re.search(r'([0-9]+)[ºª]?\s*planta', floor_text.lower())
-            if match:
-                return int(match.group(1))
-            
-            # Check for specific floor types
-            if 'bajo' in floor_text.lower():
-                return 0
-            elif 'sótano' in floor_text.lower():
-                return -1
-            elif 'entreplanta' in floor_text.lower():
-                return 0
-        
-        return None
-    
-    def _has_elevator(self, response):
-        """Check if the property has an elevator"""
-        detail_items = ' '.join(response.css('div.details-property li::text').getall()).lower()
-        return 'ascensor' in detail_items
-    
-    def _get_condition(self, response):
-        """Determine the condition of the property"""
-        detail_items = ' '.join(response.css('div.details-property li::text').getall()).lower()
-        
-        if 'nuevo' in detail_items or 'a estrenar' in detail_items:
-            return 'new'
-        elif 'buen estado' in detail_items:
-            return 'good'
-        elif 'para reformar' in detail_items or 'necesita reforma' in detail_items:
-            return 'needs_renovation'
-        else:
-            return 'unknown'
-    
-    def _extract_year_built(self, response):
-        """Extract the year the property was built"""
-        detail_items = response.css('div.details-property li::text').getall()
-        for item in detail_items:
-            if 'año' in item.lower() and 'construc' in item.lower():
-                match = re.search(r'(\d{4})', item)
-                if match:
-                    return int(match.group(1))
-        return None
-    
-    def _extract_features(self, response):
-        """Extract all features and amenities"""
-        features = []
-        # Check various sections for features
-        feature_sections = response.css('div.details-property-feature, div.details-property')
-        for section in feature_sections:
-            items = section.css('li::text').getall()
-            features.extend([item.strip() for item in items if item.strip()])
-        
-        return features
-    
-    def _extract_energy_cert(self, response):
-        """Extract energy certification"""
-        # Check for energy certificate information
-        energy_text = None
-        detail_items = response.css('div.details-property li::text').getall()
-        for item in detail_items:
-            if 'energética' in item.lower():
-                energy_text = item
-                break
-        
-        if energy_text:
-            match = re.search(r'([A-G])', energy_text.upper())
-            if match:
-                return match.group(1)
-        
-        return None
-    
     def _extract_location(self, response):
         """Extract location details"""
         location_data = {}
@@ -283,14 +205,14 @@ class IdealistaSpider(scrapy.Spider):
         description = ' '.join(response.css('div.comment p::text').getall()).strip()
         
         # Look for address patterns in the title
-        address_match = re.search(r'en\s+([^,]+),\s*([^,]+)', title)
+        address_match = ADDRESS_PATTERN.search(title)
         if address_match:
             location_data['address'] = address_match.group(1).strip()
             if 'neighborhood' not in location_data:
                 location_data['neighborhood'] = address_match.group(2).strip()
         
         # Look for postal code
-        postal_match = re.search(r'\b(\d{5})\b', description)
+        postal_match = POSTAL_CODE_PATTERN.search(description)
         if postal_match:
             location_data['postal_code'] = postal_match.group(1)
         
@@ -302,8 +224,8 @@ class IdealistaSpider(scrapy.Spider):
         scripts = response.css('script::text').getall()
         for script in scripts:
             # Look for latitude and longitude patterns
-            lat_match = re.search(r'latitude["\s:]+([0-9.-]+)', script)
-            lng_match = re.search(r'longitude["\s:]+([0-9.-]+)', script)
+            lat_match = LATITUDE_PATTERN.search(script)
+            lng_match = LONGITUDE_PATTERN.search(script)
             
             if lat_match and lng_match:
                 try:
@@ -314,7 +236,7 @@ class IdealistaSpider(scrapy.Spider):
                     pass
             
             # Try to find Google Maps coordinates
-            maps_match = re.search(r'google.maps.LatLng\(([0-9.-]+),\s*([0-9.-]+)\)', script)
+            maps_match = LATLNG_PATTERN.search(script)
             if maps_match:
                 try:
                     lat = float(maps_match.group(1))
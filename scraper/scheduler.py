@@ -10,25 +10,120 @@ import time
 from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from scrapy.crawler import CrawlerProcess
-from scrapy.utils.project import get_project_settings
 from realestate.spiders.idealista import IdealistaSpider
 from realestate.spiders.fotocasa import FotocasaSpider
+from sharding import ShardedCrawl, PAGES_STAT
+
+# Make the API package importable for post-scrape jobs
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.services.area_stats_service import AreaStatsService
+from api.services.columnar_service import ColumnarService, ColumnarSnapshot
+from api.services.scoring_service import ScoringService
+from api.utils.data_version import bump_data_version, get_data_version, next_data_generation
+from api.utils.db import get_db_connection, is_fake_db
+from api.utils.geo import sync_locations
 
 logger = logging.getLogger(__name__)
 
+# Spiders run by every scrape
+SPIDERS = [IdealistaSpider, FotocasaSpider]
+
+# Splits every scrape into shards crawled by a pool of worker processes
+sharded_crawl = ShardedCrawl()
+
 
 def run_spider(spider_class):
-    """Run a Scrapy spider using CrawlerProcess"""
+    """Run a Scrapy spider across the crawl workers and wait until it finishes"""
+    run_spiders([spider_class])
+
+
+def run_spiders(spider_classes):
+    """
+    Run Scrapy spiders split into shards across the crawl workers and wait until all of them finish
+    
+    Returns:
+        Merged Scrapy stats of the run (empty if the crawl failed)
+    """
+    try:
+        result = sharded_crawl.crawl(spider_classes)
+        stats = result['stats']
+        logger.info(f"Crawl run {result['run_id']} fetched {stats.get(PAGES_STAT, 0)} pages "
+                    f"and scraped {stats.get('item_scraped_count', 0)} items")
+        if result['missing']:
+            logger.warning(f"Crawl run {result['run_id']} left unfinished shards: {', '.join(result['missing'])}")
+        return stats
+    except Exception as e:
+        logger.error(f"Error running spiders: {str(e)}")
+        return {}
+
+
+def record_data_version():
+    """Record a new data generation so API caches and conditional requests see the new listings"""
+    try:
+        bump_data_version(get_db_connection())
+    except Exception as e:
+        logger.error(f"Error recording data version: {str(e)}")
+
+
+def refresh_locations(since=None):
+    """Set the GeoJSON location of scraped properties from their coordinates"""
+    try:
+        db = get_db_connection()
+        if not is_fake_db(db):
+            sync_locations(db, since=since)
+    except Exception as e:
+        logger.error(f"Error refreshing property locations: {str(e)}")
+
+
+def refresh_investment_scores(since=None):
+    """Re-score the segments with properties updated since the given time"""
     try:
-        logger.info(f"Starting spider: {spider_class.name}")
-        settings = get_project_settings()
-        process = CrawlerProcess(settings)
-        process.crawl(spider_class)
-        process.start()  # This will block until the crawling is finished
-        logger.info(f"Finished spider: {spider_class.name}")
+        logger.info("Refreshing investment scores")
+        ScoringService().rescore(since=since)
     except Exception as e:
-        logger.error(f"Error running spider {spider_class.name}: {str(e)}")
+        logger.error(f"Error refreshing investment scores: {str(e)}")
+
+
+def refresh_area_stats(since=None):
+    """
+    Rebuild precomputed area statistics
+    
+    Returns:
+        Number of area statistics documents written (0 if the rebuild failed or nothing changed)
+    """
+    try:
+        logger.info("Refreshing area statistics")
+        return AreaStatsService().rebuild(since=since)
+    except Exception as e:
+        logger.error(f"Error refreshing area statistics: {str(e)}")
+        return 0
+
+
+def refresh_columnar_snapshot(new_generation=False):
+    """
+    Save the columnar snapshot for the API workers
+    
+    Args:
+        new_generation: Whether to save it for the data generation about to be
+            recorded instead of the current one
+    """
+    try:
+        columnar_service = ColumnarService()
+        if not columnar_service.directory:
+            return
+        
+        db = columnar_service.db
+        generation = next_data_generation(db) if new_generation else get_data_version(db)['generation']
+        manifest = ColumnarSnapshot.read_manifest(columnar_service.directory)
+        if manifest and manifest.get('generation') == generation:
+            logger.info(f"Columnar snapshot of generation {generation} already saved")
+            return
+        
+        logger.info("Refreshing columnar snapshot")
+        columnar_service.rebuild(generation)
+    except Exception as e:
+        logger.error(f"Error refreshing columnar snapshot: {str(e)}")
 
 
 def run_all_spiders():
@@ -37,11 +132,28 @@ def run_all_spiders():
         logger.info("Starting all spiders")
         start_time = datetime.now()
         
-        # Run Idealista spider
-        run_spider(IdealistaSpider)
+        # Crawl every spider, city and operation type across the worker processes
+        stats = run_spiders(SPIDERS)
+        
+        # Index the coordinates of the properties touched by this scrape
+        refresh_locations(since=start_time)
         
-        # Run Fotocasa spider
-        run_spider(FotocasaSpider)
+        # Re-score the segments touched by this scrape
+        refresh_investment_scores(since=start_time)
+        
+        # Refresh statistics for the areas touched by this scrape
+        area_stats_written = refresh_area_stats(since=start_time)
+        
+        # Snapshot the data for the API analytics before recording its
+        # generation, so API workers find it as soon as they see the generation
+        changed = bool(stats.get('item_scraped_count', 0) or area_stats_written)
+        refresh_columnar_snapshot(new_generation=changed)
+        
+        # Record the new data generation once, after every derived collection
+        # is up to date, so API workers never cache a half-refreshed one; an
+        # unchanged generation keeps their caches
+        if changed:
+            record_data_version()
         
         end_time = datetime.now()
         duration = (end_time - start_time).total_seconds() / 60.0
@@ -56,6 +168,9 @@ def start_scheduler():
         logger.info("Initializing scheduler")
         scheduler = BackgroundScheduler()
         
+        # Backfill the location of properties stored before it was indexed
+        refresh_locations()
+        
         # Run spiders daily at 1:00 AM
         scheduler.add_job(
             run_all_spiders,
@@ -83,6 +198,7 @@ def start_scheduler():
         except (KeyboardInterrupt, SystemExit):
             logger.info("Shutting down scheduler")
             scheduler.shutdown()
+            sharded_crawl.stop()
             sys.exit(0)
     except Exception as e:
         logger.error(f"Error starting scheduler: {str(e)}")
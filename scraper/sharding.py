@@ -0,0 +1,476 @@
+"""
+Sharded crawling across a pool of worker processes.
+
+The crawl is split into one shard per spider, city and operation type, so
+the HTML parsing of the listings is spread over several cores instead of
+one. Shards are assigned to the workers from the largest to the smallest,
+each one to the least loaded worker, using the number of pages every shard
+fetched in the last run. Every finished shard leaves a checkpoint, so a run
+interrupted halfway resumes with the shards still missing, and the stats of
+all the shards are merged into the stats of the run. A run that is still
+unfinished after MAX_RUN_AGE_HOURS is abandoned, so a shard failing every
+day doesn't keep the other shards from being crawled again.
+"""
+
+import heapq
+import json
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Type
+from scrapy import Spider
+from crawl_runner import CrawlRunner, SPIDER_CONCURRENCY, DEFAULT_SPIDER_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Directory holding the run state, the shard checkpoints and the Scrapy job directories
+DEFAULT_STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crawl_state')
+
+# Stat counting the pages fetched by a shard, used to balance the next run
+PAGES_STAT = 'response_received_count'
+
+# Stats merged by keeping the highest value instead of the sum
+MAX_STATS = ('elapsed_time_seconds', 'memusage/max', 'memusage/startup')
+
+RUN_FILE = 'run.json'
+
+# Age after which an unfinished run is abandoned instead of resumed, shorter
+# than the day between scheduled scrapes
+MAX_RUN_AGE_HOURS = 20
+
+# Runs the shards assigned to a worker process, one per process
+_worker_runner = None
+
+
+@dataclass(frozen=True)
+class Shard:
+    """Part of the crawl covering one city and operation type of a spider"""
+    spider: str
+    city: str
+    operation_type: str
+    
+    @property
+    def key(self) -> str:
+        """Unique name of the shard, used for its checkpoint and job directory"""
+        return f"{self.spider}-{self.city}-{self.operation_type}"
+
+
+def plan_shards(spider_classes: List[Type[Spider]]) -> List[Shard]:
+    """
+    Split the crawl of the spiders into shards
+    
+    Args:
+        spider_classes: Spider classes to run
+        
+    Returns:
+        One shard for each spider, city and operation type
+    """
+    return [
+        Shard(spider_class.name, city, operation_type)
+        for spider_class in spider_classes
+        for city in spider_class.cities
+        for operation_type in spider_class.search_paths
+    ]
+
+
+def balance_shards(shards: List[Shard], pages: Dict[str, int], workers: int) -> List[List[Shard]]:
+    """
+    Assign shards to workers so that all of them fetch about the same number of pages
+    
+    Shards are taken from the largest to the smallest and each one is given
+    to the worker with the fewest pages so far. Shards without a page count
+    weigh as the average shard.
+    
+    Args:
+        shards: Shards to assign
+        pages: Pages fetched by each shard key in the last run
+        workers: Number of workers
+        
+    Returns:
+        Shards of each worker, largest first, without the workers left idle
+    """
+    known = [pages[shard.key] for shard in shards if shard.key in pages]
+    default = sum(known) / len(known) if known else 1
+    weights = {shard: max(pages.get(shard.key, default), 1) for shard in shards}
+    
+    bins = [[] for _ in range(max(1, min(workers, len(shards))))]
+    loads = [(0, index) for index in range(len(bins))]
+    for shard in sorted(shards, key=lambda shard: (-weights[shard], shard.key)):
+        load, index = heapq.heappop(loads)
+        bins[index].append(shard)
+        heapq.heappush(loads, (load + weights[shard], index))
+    
+    return [assigned for assigned in bins if assigned]
+
+
+def merge_stats(shard_stats: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge the stats of several shards into the stats of the run
+    
+    Counters are added up, except MAX_STATS that keep the highest value, and
+    the run starts with the first shard and finishes with the last one.
+    
+    Args:
+        shard_stats: Stats of each shard
+        
+    Returns:
+        Merged stats, with the number of shards by finish reason
+    """
+    merged = {}
+    for stats in shard_stats:
+        for name, value in stats.items():
+            if name == 'start_time':
+                merged[name] = min(merged.get(name, value), value)
+            elif name == 'finish_time':
+                merged[name] = max(merged.get(name, value), value)
+            elif name == 'finish_reason':
+                reason = f"finish_reason_count/{value}"
+                merged[reason] = merged.get(reason, 0) + 1
+            elif isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            elif name in MAX_STATS:
+                merged[name] = max(merged.get(name, value), value)
+            else:
+                merged[name] = merged.get(name, 0) + value
+    return merged
+
+
+def _serializable_stats(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Keep the stats that can be stored in a checkpoint
+    
+    Args:
+        stats: Scrapy stats of a crawl
+        
+    Returns:
+        Numeric stats and finish reason, with the start and finish times as ISO strings
+    """
+    serializable = {}
+    for name, value in stats.items():
+        if isinstance(value, datetime):
+            serializable[name] = value.isoformat()
+        elif isinstance(value, (int, float, str)) and not isinstance(value, bool):
+            serializable[name] = value
+    return serializable
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    """
+    Write a JSON file atomically, so a crash never leaves it half written
+    
+    Args:
+        path: File to write
+        data: Content of the file
+    """
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(handle, 'w') as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Read a JSON file
+    
+    Args:
+        path: File to read
+        
+    Returns:
+        Content of the file, None if it doesn't exist or can't be read
+    """
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"Error reading {path}: {str(e)}")
+        return None
+
+
+def _crawl_shards(runner: CrawlRunner, spider_classes: Dict[str, Type[Spider]], shards: List[Shard],
+                  run_id: str, state_dir: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Crawl shards on the reactor of the runner, the shards of different spiders concurrently
+    
+    Each spider crawls its shards one after another, within its own
+    concurrency budget, so a process takes as long as its slowest portal
+    instead of the sum of all of them.
+    
+    Args:
+        runner: Crawl runner of the process
+        spider_classes: Spider classes by name
+        shards: Shards to crawl
+        run_id: Identifier of the run the shards belong to
+        state_dir: Directory holding the checkpoints and job directories
+        
+    Returns:
+        Dictionary mapping the key of each finished shard to its checkpoint
+    """
+    by_spider = {}
+    for shard in shards:
+        by_spider.setdefault(shard.spider, []).append(shard)
+    
+    if len(by_spider) == 1:
+        return _crawl_spider_shards(runner, spider_classes, shards, run_id, state_dir)
+    
+    checkpoints = {}
+    # crawl_spider blocks its calling thread until the spider finishes on the shared reactor
+    with ThreadPoolExecutor(max_workers=len(by_spider), thread_name_prefix='crawl') as pool:
+        futures = [
+            pool.submit(_crawl_spider_shards, runner, spider_classes, spider_shards, run_id, state_dir)
+            for spider_shards in by_spider.values()
+        ]
+        for future in as_completed(futures):
+            checkpoints.update(future.result())
+    
+    return checkpoints
+
+
+def _crawl_spider_shards(runner: CrawlRunner, spider_classes: Dict[str, Type[Spider]], shards: List[Shard],
+                         run_id: str, state_dir: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Crawl shards one after another, checkpointing each finished shard
+    
+    Each shard crawls with its own Scrapy job directory, so the requests
+    pending when it is interrupted are resumed by the next attempt. The job
+    directory is deleted once the shard has finished.
+    
+    Args:
+        runner: Crawl runner of the process
+        spider_classes: Spider classes by name
+        shards: Shards to crawl
+        run_id: Identifier of the run the shards belong to
+        state_dir: Directory holding the checkpoints and job directories
+        
+    Returns:
+        Dictionary mapping the key of each finished shard to its checkpoint
+    """
+    checkpoints = {}
+    for shard in shards:
+        job_dir = os.path.join(state_dir, 'jobs', shard.key)
+        try:
+            stats = runner.crawl_spider(
+                spider_classes[shard.spider],
+                spider_kwargs={'cities': [shard.city], 'operation_types': [shard.operation_type]},
+                settings={'JOBDIR': job_dir}
+            )
+        except Exception as e:
+            logger.error(f"Error crawling shard {shard.key}: {str(e)}")
+            continue
+        
+        if stats.get('finish_reason') != 'finished':
+            logger.warning(f"Shard {shard.key} stopped before finishing: {stats.get('finish_reason')}")
+            continue
+        
+        checkpoint = {
+            'run_id': run_id,
+            'shard': shard.key,
+            'pages': stats.get(PAGES_STAT, 0),
+            'stats': _serializable_stats(stats)
+        }
+        _write_json(os.path.join(state_dir, 'shards', f"{shard.key}.json"), checkpoint)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        checkpoints[shard.key] = checkpoint
+        
+        logger.info(f"Finished shard {shard.key}: {checkpoint['pages']} pages")
+    
+    return checkpoints
+
+
+def _run_worker(spider_classes: Dict[str, Type[Spider]], shards: List[Shard], run_id: str,
+                state_dir: str, concurrency: Dict[str, int]) -> Dict[str, Dict[str, Any]]:
+    """
+    Crawl shards in a worker process, on a reactor started once per process
+    
+    Args:
+        spider_classes: Spider classes by name
+        shards: Shards assigned to the worker
+        run_id: Identifier of the run the shards belong to
+        state_dir: Directory holding the checkpoints and job directories
+        concurrency: Maximum simultaneous requests of each spider in this worker
+        
+    Returns:
+        Dictionary mapping the key of each finished shard to its checkpoint
+    """
+    global _worker_runner
+    if _worker_runner is None:
+        _worker_runner = CrawlRunner(concurrency=concurrency)
+    return _crawl_shards(_worker_runner, spider_classes, shards, run_id, state_dir)
+
+
+class ShardedCrawl:
+    """Crawls spiders split into shards across a pool of worker processes"""
+    
+    def __init__(self, workers: Optional[int] = None, state_dir: Optional[str] = None,
+                 max_run_age: Optional[float] = None):
+        """
+        Initialize the sharded crawl
+        
+        Args:
+            workers: Number of worker processes (optional, the SCRAPER_WORKERS
+                environment variable or the number of CPUs if not given). With
+                a single worker the shards are crawled in this process.
+            state_dir: Directory holding the run state and checkpoints (optional,
+                the SCRAPER_STATE_DIR environment variable or DEFAULT_STATE_DIR
+                if not given)
+            max_run_age: Hours after which an unfinished run is started over
+                instead of resumed (optional, the SCRAPER_MAX_RUN_AGE_HOURS
+                environment variable or MAX_RUN_AGE_HOURS if not given)
+        """
+        self.workers = max(1, workers or int(os.environ.get('SCRAPER_WORKERS', 0)) or os.cpu_count() or 1)
+        self.state_dir = state_dir or os.environ.get('SCRAPER_STATE_DIR') or DEFAULT_STATE_DIR
+        self.max_run_age = timedelta(hours=max_run_age or float(os.environ.get('SCRAPER_MAX_RUN_AGE_HOURS', 0))
+                                     or MAX_RUN_AGE_HOURS)
+        self._runner = None
+    
+    def stop(self):
+        """Stop the in-process crawl runner, if it was started"""
+        if self._runner is not None:
+            self._runner.stop()
+    
+    def crawl(self, spider_classes: List[Type[Spider]]) -> Dict[str, Any]:
+        """
+        Crawl the shards of the spiders and wait until all of them have finished
+        
+        If the last run was interrupted less than max_run_age ago, it is
+        resumed instead: the shards it already finished are not crawled again.
+        
+        Args:
+            spider_classes: Spider classes to run
+            
+        Returns:
+            Dictionary with the run identifier, the keys of the shards that
+            didn't finish and the merged stats of the run
+        """
+        os.makedirs(os.path.join(self.state_dir, 'shards'), exist_ok=True)
+        os.makedirs(os.path.join(self.state_dir, 'jobs'), exist_ok=True)
+        
+        run = self._start_run()
+        shards = plan_shards(spider_classes)
+        checkpoints = self._read_checkpoints(shards)
+        
+        finished = {key: checkpoint for key, checkpoint in checkpoints.items()
+                    if checkpoint.get('run_id') == run['run_id']}
+        pending = [shard for shard in shards if shard.key not in finished]
+        if finished:
+            logger.info(f"Resuming crawl run {run['run_id']}: {len(finished)} shards already finished")
+        
+        pages = {key: checkpoint.get('pages', 0) for key, checkpoint in checkpoints.items()}
+        bins = balance_shards(pending, pages, self.workers)
+        classes = {spider_class.name: spider_class for spider_class in spider_classes}
+        
+        logger.info(f"Crawling {len(pending)} shards with {len(bins)} workers")
+        finished.update(self._crawl_bins(classes, bins, run['run_id']))
+        
+        missing = [shard.key for shard in shards if shard.key not in finished]
+        if missing:
+            logger.warning(f"{len(missing)} shards didn't finish and will be resumed by the next run")
+        else:
+            run['finished_at'] = datetime.now().isoformat()
+            _write_json(os.path.join(self.state_dir, RUN_FILE), run)
+        
+        return {
+            'run_id': run['run_id'],
+            'missing': missing,
+            'stats': merge_stats([checkpoint['stats'] for checkpoint in finished.values()])
+        }
+    
+    def _start_run(self) -> Dict[str, Any]:
+        """
+        Get the run to crawl: the last one if it didn't finish and hasn't expired, a new one otherwise
+        
+        The Scrapy job directories left by the shards of an abandoned run are
+        deleted, so the new run doesn't resume their stale requests.
+        
+        Returns:
+            Run state, with its identifier, start time and finish time
+        """
+        path = os.path.join(self.state_dir, RUN_FILE)
+        run = _read_json(path)
+        now = datetime.now()
+        
+        if run and run.get('run_id') and not run.get('finished_at'):
+            try:
+                started_at = datetime.fromisoformat(run['started_at'])
+            except (KeyError, TypeError, ValueError):
+                started_at = None
+            
+            if started_at is not None and now - started_at < self.max_run_age:
+                return run
+            
+            logger.warning(f"Crawl run {run['run_id']} didn't finish within {self.max_run_age}, starting a new run")
+            jobs_dir = os.path.join(self.state_dir, 'jobs')
+            shutil.rmtree(jobs_dir, ignore_errors=True)
+            os.makedirs(jobs_dir, exist_ok=True)
+        
+        run = {'run_id': now.strftime('%Y%m%d%H%M%S%f'), 'started_at': now.isoformat(), 'finished_at': None}
+        _write_json(path, run)
+        
+        return run
+    
+    def _read_checkpoints(self, shards: List[Shard]) -> Dict[str, Dict[str, Any]]:
+        """
+        Read the last checkpoint of each shard
+        
+        Args:
+            shards: Shards of the crawl
+            
+        Returns:
+            Dictionary mapping the key of each shard with a checkpoint to it
+        """
+        checkpoints = {}
+        for shard in shards:
+            checkpoint = _read_json(os.path.join(self.state_dir, 'shards', f"{shard.key}.json"))
+            if checkpoint:
+                checkpoints[shard.key] = checkpoint
+        return checkpoints
+    
+    def _crawl_bins(self, spider_classes: Dict[str, Type[Spider]], bins: List[List[Shard]],
+                    run_id: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Crawl the shards of each worker, in a pool of processes or in this process
+        
+        The concurrency budget of each spider is shared by the workers, so the
+        portals get no more simultaneous requests than with a single process.
+        
+        Args:
+            spider_classes: Spider classes by name
+            bins: Shards of each worker
+            run_id: Identifier of the run
+            
+        Returns:
+            Dictionary mapping the key of each finished shard to its checkpoint
+        """
+        if not bins:
+            return {}
+        
+        if len(bins) == 1:
+            if self._runner is None:
+                self._runner = CrawlRunner()
+            return _crawl_shards(self._runner, spider_classes, bins[0], run_id, self.state_dir)
+        
+        concurrency = {
+            name: max(1, SPIDER_CONCURRENCY.get(name, DEFAULT_SPIDER_CONCURRENCY) // len(bins))
+            for name in spider_classes
+        }
+        
+        finished = {}
+        # Spawned workers start clean instead of inheriting the scheduler threads
+        with ProcessPoolExecutor(max_workers=len(bins), mp_context=get_context('spawn')) as pool:
+            futures = [
+                pool.submit(_run_worker, spider_classes, shards, run_id, self.state_dir, concurrency)
+                for shards in bins
+            ]
+            for future in as_completed(futures):
+                try:
+                    finished.update(future.result())
+                except Exception as e:
+                    logger.error(f"Error in crawl worker: {str(e)}")
+        
+        return finished
@@ -0,0 +1,16 @@
+"""
+Shared test configuration.
+
+The tests run on the in-memory database (MONGODB_URI=memory://), so they
+need no MongoDB server. The scraper modules are imported the way the
+scraper runs them, with scraper/ on the import path.
+"""
+
+import os
+import sys
+
+os.environ['MONGODB_URI'] = 'memory://'
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'scraper'))
@@ -0,0 +1,37 @@
+"""
+Tests for the batch property analysis.
+"""
+
+import pytest
+from api.utils.db import get_db_connection
+from api.services.analysis_service import AnalysisService
+from benchmarks.bench_services import make_documents
+
+
+@pytest.fixture(scope='module')
+def analysis():
+    """Analysis service on the in-memory database, running its lookups in the calling thread"""
+    properties = get_db_connection()['properties']
+    properties.delete_many({})
+    properties.insert_many(make_documents(50))
+    return AnalysisService(max_workers=0, batch_workers=0)
+
+
+def test_batch_analyses_match_single_analyses(analysis):
+    pairs = [(document['id'], document['source']) for document in analysis.collection.find()]
+    
+    analyses = list(analysis.iter_property_analyses(pairs, include_similar=True))
+    
+    assert len(analyses) == 50
+    assert analyses == [analysis.analyze_property(property_id, source) for property_id, source in pairs]
+
+
+def test_batch_analyses_report_missing_properties(analysis):
+    document = analysis.collection.find_one()
+    pairs = [('missing', 'idealista'), (document['id'], document['source'])]
+    
+    missing, found = analysis.iter_property_analyses(pairs)
+    
+    assert missing['property_id'] == 'missing' and 'error' in missing
+    assert found['property']['id'] == document['id']
+    assert 'similar_properties' not in found
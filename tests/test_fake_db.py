@@ -0,0 +1,147 @@
+"""
+Tests for the query evaluation of the in-memory database.
+"""
+
+import pytest
+from datetime import datetime
+from pymongo import UpdateOne, InsertOne, DeleteMany
+from api.utils.fake_db import FakeDB
+
+DOCUMENTS = [
+    {'_id': 1, 'city': 'madrid', 'price': 300000, 'size': 80.0, 'tags': ['terrace', 'lift'],
+     'location': {'district': 'Centro'}, 'price_history': [{'price': 320000}, {'price': 300000}]},
+    {'_id': 2, 'city': 'madrid', 'price': 150000, 'size': 45.5, 'tags': ['lift'],
+     'location': {'district': 'Retiro'}, 'price_history': [{'price': 150000}]},
+    {'_id': 3, 'city': 'barcelona', 'price': 450000, 'size': None, 'tags': [],
+     'location': {'district': 'Eixample'}},
+    {'_id': 4, 'city': 'valencia', 'price': 120000.0, 'tags': ['garden'],
+     'first_detected': datetime(2024, 1, 1)},
+    {'_id': 5, 'city': 'Valencia', 'price': 'unknown'}
+]
+
+
+@pytest.fixture(params=[False, True], ids=['scan', 'indexed'])
+def collection(request):
+    """Collection with the test documents, with and without hash indexes on the queried fields"""
+    collection = FakeDB()['properties']
+    if request.param:
+        for field in ('city', 'price', 'tags', 'location.district'):
+            collection.create_index(field)
+    collection.insert_many([dict(document) for document in DOCUMENTS])
+    return collection
+
+
+def ids(cursor):
+    return sorted(document['_id'] for document in cursor)
+
+
+@pytest.mark.parametrize('query, expected', [
+    ({}, [1, 2, 3, 4, 5]),
+    ({'city': 'madrid'}, [1, 2]),
+    ({'city': {'$ne': 'madrid'}}, [3, 4, 5]),
+    ({'city': {'$in': ['barcelona', 'valencia']}}, [3, 4]),
+    ({'city': {'$nin': ['madrid', 'valencia']}}, [3, 5]),
+    ({'price': {'$gte': 150000, '$lt': 450000}}, [1, 2]),
+    ({'price': {'$gt': 100000}}, [1, 2, 3, 4]),
+    ({'price': 120000}, [4]),
+    ({'size': None}, [3, 4, 5]),
+    ({'size': {'$exists': False}}, [4, 5]),
+    ({'size': {'$exists': True}}, [1, 2, 3]),
+    ({'price': {'$type': 'string'}}, [5]),
+    ({'price': {'$type': 'number'}}, [1, 2, 3, 4]),
+    ({'tags': 'lift'}, [1, 2]),
+    ({'tags': ['lift']}, [2]),
+    ({'tags': []}, [3]),
+    ({'tags': {'$in': ['garden', 'terrace']}}, [1, 4]),
+    ({'location.district': 'Retiro'}, [2]),
+    ({'price_history.price': 320000}, [1]),
+    ({'price_history.price': {'$lt': 310000}}, [1, 2]),
+    ({'city': {'$regex': '^valencia$', '$options': 'i'}}, [4, 5]),
+    ({'price': {'$not': {'$gt': 200000}}}, [2, 4, 5]),
+    ({'$or': [{'city': 'barcelona'}, {'price': {'$lt': 130000}}]}, [3, 4]),
+    ({'$and': [{'city': 'madrid'}, {'price': {'$gt': 200000}}]}, [1]),
+    ({'$nor': [{'city': 'madrid'}, {'tags': 'garden'}]}, [3, 5]),
+    ({'first_detected': {'$gte': datetime(2023, 12, 31)}}, [4])
+])
+def test_find_filters(collection, query, expected):
+    assert ids(collection.find(query)) == expected
+
+
+def test_count_documents_and_distinct(collection):
+    assert collection.count_documents({'city': 'madrid'}) == 2
+    assert collection.count_documents({}, skip=1, limit=2) == 2
+    assert sorted(collection.distinct('city')) == ['Valencia', 'barcelona', 'madrid', 'valencia']
+    assert sorted(collection.distinct('tags', {'city': 'madrid'})) == ['lift', 'terrace']
+
+
+def test_sort_orders_mixed_types_like_mongodb(collection):
+    prices = [document['price'] for document in collection.find({}, {'price': 1}).sort('price', 1)]
+    assert prices == [120000.0, 150000, 300000, 450000, 'unknown']
+
+
+def test_sort_skip_limit(collection):
+    cursor = collection.find({'price': {'$type': 'number'}}).sort([('price', -1)]).skip(1).limit(2)
+    assert [document['_id'] for document in cursor] == [1, 2]
+
+
+def test_projections(collection):
+    assert collection.find_one({'_id': 1}, {'city': 1, 'location.district': 1}) == \
+        {'_id': 1, 'city': 'madrid', 'location': {'district': 'Centro'}}
+    assert collection.find_one({'_id': 2}, {'city': 1, '_id': 0}) == {'city': 'madrid'}
+    assert set(collection.find_one({'_id': 1}, {'tags': 0, 'price_history': 0})) == \
+        {'_id', 'city', 'price', 'size', 'location'}
+
+
+def test_aggregate_group_and_sort(collection):
+    result = collection.aggregate([
+        {'$match': {'price': {'$type': 'number'}}},
+        {'$group': {'_id': '$city', 'count': {'$sum': 1}, 'avg_price': {'$avg': '$price'},
+                    'max_price': {'$max': '$price'}}},
+        {'$sort': {'count': -1, '_id': 1}}
+    ])
+    assert result == [
+        {'_id': 'madrid', 'count': 2, 'avg_price': 225000, 'max_price': 300000},
+        {'_id': 'barcelona', 'count': 1, 'avg_price': 450000, 'max_price': 450000},
+        {'_id': 'valencia', 'count': 1, 'avg_price': 120000, 'max_price': 120000.0}
+    ]
+
+
+def test_aggregate_facet_unwind_count(collection):
+    [result] = collection.aggregate([
+        {'$facet': {
+            'tags': [{'$unwind': '$tags'}, {'$group': {'_id': '$tags', 'n': {'$sum': 1}}}, {'$sort': {'_id': 1}}],
+            'total': [{'$count': 'n'}]
+        }}
+    ])
+    assert result['tags'] == [{'_id': 'garden', 'n': 1}, {'_id': 'lift', 'n': 2}, {'_id': 'terrace', 'n': 1}]
+    assert result['total'] == [{'n': 5}]
+
+
+def test_updates_keep_indexes_current(collection):
+    collection.update_many({'city': 'madrid'}, {'$set': {'city': 'Madrid'}, '$inc': {'price': 1000}})
+    assert ids(collection.find({'city': 'madrid'})) == []
+    assert [document['price'] for document in collection.find({'city': 'Madrid'}).sort('_id', 1)] == \
+        [301000, 151000]
+    
+    collection.update_one({'_id': 3}, {'$unset': {'size': ''}, '$push': {'tags': 'lift'}})
+    assert ids(collection.find({'tags': 'lift'})) == [1, 2, 3]
+    assert ids(collection.find({'size': {'$exists': False}})) == [3, 4, 5]
+    
+    result = collection.update_one({'_id': 6}, {'$set': {'city': 'sevilla'}, '$setOnInsert': {'price': 1}},
+                                   upsert=True)
+    assert result.upserted_id == 6
+    assert collection.find_one({'city': 'sevilla'}) == {'_id': 6, 'city': 'sevilla', 'price': 1}
+
+
+def test_bulk_write(collection):
+    result = collection.bulk_write([
+        InsertOne({'_id': 7, 'city': 'bilbao'}),
+        UpdateOne({'_id': 1}, {'$max': {'price': 310000}}),
+        UpdateOne({'_id': 2}, {'$min': {'price': 160000}}),
+        DeleteMany({'city': {'$in': ['barcelona', 'Valencia']}})
+    ])
+    assert (result.inserted_count, result.matched_count, result.modified_count, result.deleted_count) == \
+        (1, 2, 1, 2)
+    assert collection.find_one({'_id': 1})['price'] == 310000
+    assert collection.find_one({'_id': 2})['price'] == 150000
+    assert ids(collection.find()) == [1, 2, 4, 7]
@@ -0,0 +1,64 @@
+"""
+Tests for the geographic query parameters and the in-process geographic index.
+"""
+
+import numpy as np
+import pytest
+from werkzeug.datastructures import MultiDict
+from api.utils.geo import parse_bbox, parse_geo_params, haversine_km, GeoKDTree
+
+
+def test_parse_bbox():
+    assert parse_bbox('-3.72,40.40,-3.68,40.43') == (-3.72, 40.40, -3.68, 40.43)
+
+
+@pytest.mark.parametrize('text', [
+    '', '1,2,3', 'a,b,c,d',
+    '-190,40,-3,41', '-4,-91,-3,41',
+    '-4,41,-3,40',
+    '-3,40,-4,41',
+    '179,40,-179,41'
+])
+def test_parse_bbox_rejects_invalid_boxes(text):
+    with pytest.raises(ValueError):
+        parse_bbox(text)
+
+
+def test_parse_geo_params():
+    params = parse_geo_params(MultiDict({'lat': '40.42', 'lon': '-3.70', 'radius_km': '2'}))
+    assert params == {'bbox': None, 'near': (40.42, -3.70), 'radius_km': 2.0}
+
+
+@pytest.mark.parametrize('args', [
+    {'lat': '40.42', 'lon': '-3.70'},
+    {'lat': '95', 'lon': '-3.70', 'radius_km': '1'},
+    {'lat': '40.42', 'lon': '-3.70', 'radius_km': '0'}
+])
+def test_parse_geo_params_rejects_invalid_radius_searches(args):
+    with pytest.raises(ValueError):
+        parse_geo_params(MultiDict(args))
+
+
+@pytest.fixture(scope='module')
+def points():
+    random = np.random.default_rng(7)
+    return random.uniform(40.3, 40.5, 1000), random.uniform(-3.8, -3.6, 1000)
+
+
+def test_within_bbox_matches_brute_force(points):
+    latitudes, longitudes = points
+    index = GeoKDTree(latitudes, longitudes, list(range(len(latitudes))))
+    
+    found = sorted(index.within_bbox(-3.75, 40.35, -3.65, 40.42))
+    expected = np.nonzero((longitudes >= -3.75) & (longitudes <= -3.65) &
+                          (latitudes >= 40.35) & (latitudes <= 40.42))[0].tolist()
+    assert found == expected
+
+
+def test_within_radius_matches_brute_force(points):
+    latitudes, longitudes = points
+    index = GeoKDTree(latitudes, longitudes, list(range(len(latitudes))))
+    
+    found = sorted(index.within_radius(40.42, -3.70, 3.0))
+    expected = np.nonzero(haversine_km(40.42, -3.70, latitudes, longitudes) <= 3.0)[0].tolist()
+    assert found == expected
@@ -0,0 +1,75 @@
+"""
+Tests for the index bootstrap and the query plan check of the service queries.
+"""
+
+import pytest
+from api.utils.fake_db import FakeDB
+from api.utils.indexes import (PROPERTY_INDEXES, SERVICE_QUERIES, ensure_indexes, check_query_plans,
+                               explain_query, plan_stages)
+
+
+@pytest.fixture
+def db():
+    db = FakeDB()
+    ensure_indexes(db)
+    return db
+
+
+def index_name(plan):
+    """Name of the index scanned by a plan, None for a collection scan"""
+    while plan.get('stage') != 'IXSCAN':
+        if 'inputStage' not in plan:
+            return None
+        plan = plan['inputStage']
+    return plan['indexName']
+
+
+def test_ensure_indexes_creates_every_index(db):
+    assert ensure_indexes(db) == [index['name'] for index in PROPERTY_INDEXES]
+    assert set(db['properties'].index_information()) == {'_id_'} | {index['name'] for index in PROPERTY_INDEXES}
+
+
+def test_every_service_query_uses_an_index(db):
+    assert check_query_plans(db) == []
+
+
+def test_queries_fall_back_to_collscan_without_indexes():
+    # Only the _id index exists, which serves the sort of get_properties
+    assert check_query_plans(FakeDB()) == [query['name'] for query in SERVICE_QUERIES
+                                           if query['name'] != 'get_properties']
+
+
+def test_missing_index_is_reported():
+    db = FakeDB()
+    for index in PROPERTY_INDEXES:
+        if index['name'] != 'location_2dsphere':
+            db['properties'].create_index(index['keys'], name=index['name'])
+    
+    assert check_query_plans(db) == ['get_properties_in_bbox', 'get_properties_within_radius']
+
+
+@pytest.mark.parametrize('name, expected_index, expected_stages', [
+    ('get_property_by_id', 'id_source', ['FETCH', 'IXSCAN']),
+    ('get_properties', 'city_neighborhood_type_operation_price', ['SORT', 'FETCH', 'IXSCAN']),
+    ('get_properties_in_bbox', 'location_2dsphere', ['FETCH', 'IXSCAN']),
+    ('get_investment_opportunities', 'investment_score_id', ['FETCH', 'IXSCAN']),
+    ('get_investment_opportunities_by_city', 'city_investment_score_id', ['FETCH', 'IXSCAN']),
+    ('area_stats_refresh', 'last_updated', ['FETCH', 'IXSCAN'])
+])
+def test_query_plans(db, name, expected_index, expected_stages):
+    query = next(query for query in SERVICE_QUERIES if query['name'] == name)
+    plan = explain_query(db['properties'], query['filter'], query.get('sort'))
+    
+    assert index_name(plan) == expected_index
+    assert plan_stages(plan) == expected_stages
+
+
+def test_geo_index_needs_a_geo_condition(db):
+    plan = explain_query(db['properties'], {'location': {'$exists': True}})
+    assert plan_stages(plan) == ['FETCH', 'COLLSCAN']
+
+
+def test_reversed_sort_uses_the_index_order(db):
+    plan = explain_query(db['properties'], {}, [('investment_score', 1), ('_id', 1)])
+    assert index_name(plan) == 'investment_score_id'
+    assert 'SORT' not in plan_stages(plan)
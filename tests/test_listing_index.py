@@ -0,0 +1,148 @@
+"""
+Tests for the on-disk listing index and the recovery of its journal and table.
+"""
+
+import math
+import os
+import pytest
+from realestate.listing_index import (ListingIndex, RECORD_DTYPE, MIN_CAPACITY, MAX_RECORDS_PER_LISTING,
+                                      listing_key, content_hash)
+
+
+def key(number):
+    return listing_key('idealista', str(number))
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / 'index')
+
+
+def open_index(directory):
+    index = ListingIndex(directory)
+    index.open()
+    return index
+
+
+def fill(directory, count, start=0):
+    """Write count listings to the index and close it"""
+    index = open_index(directory)
+    for number in range(start, start + count):
+        index.put(key(number), float(number), content_hash(f"card {number}"), 1000.0 + number)
+    index.close()
+
+
+def test_keys_are_non_zero_and_stable():
+    assert key(1) == listing_key('idealista', '1') != 0
+    assert key(1) != listing_key('fotocasa', '1')
+    assert content_hash('card') != content_hash('other card')
+
+
+def test_put_get_and_update(directory):
+    index = open_index(directory)
+    assert index.get(key(1)) is None
+    
+    index.put(key(1), 250000.0, 7, 1000.0)
+    index.put(key(1), 240000.0, 8, 2000.0)
+    index.put(key(2), math.nan, 0, 1500.0)
+    
+    assert len(index) == 2
+    assert index.get(key(1)) == (240000.0, 8, 2000.0)
+    assert math.isnan(index.get(key(2))[0])
+    index.close()
+
+
+def test_reopen_keeps_the_listings(directory):
+    fill(directory, 100)
+    index = open_index(directory)
+    
+    assert len(index) == 100
+    assert index.get(key(42)) == (42.0, content_hash('card 42'), 1042.0)
+    index.close()
+
+
+def test_grows_past_the_initial_capacity(directory):
+    count = MIN_CAPACITY * 2
+    fill(directory, count)
+    index = open_index(directory)
+    
+    assert len(index) == count
+    assert all(index.get(key(number))[0] == float(number) for number in range(0, count, 97))
+    index.close()
+
+
+def test_torn_journal_tail_is_dropped(directory):
+    fill(directory, 10)
+    os.remove(os.path.join(directory, 'listings.idx'))
+    with open(os.path.join(directory, 'listings.log'), 'ab') as journal:
+        journal.write(b'\x01' * (RECORD_DTYPE.itemsize // 2))
+    
+    index = open_index(directory)
+    assert len(index) == 10
+    assert os.path.getsize(index.log_path) == 10 * RECORD_DTYPE.itemsize
+    index.close()
+
+
+def test_damaged_journal_record_drops_it_and_the_rest(directory):
+    fill(directory, 10)
+    os.remove(os.path.join(directory, 'listings.idx'))
+    with open(os.path.join(directory, 'listings.log'), 'r+b') as journal:
+        journal.seek(7 * RECORD_DTYPE.itemsize + 8)
+        journal.write(b'\xff' * 8)
+    
+    index = open_index(directory)
+    assert len(index) == 7
+    assert index.get(key(6)) is not None
+    assert index.get(key(7)) is None
+    index.close()
+
+
+def test_missing_table_is_rebuilt_from_the_journal(directory):
+    fill(directory, 50)
+    os.remove(os.path.join(directory, 'listings.idx'))
+    
+    index = open_index(directory)
+    assert len(index) == 50
+    assert index.get(key(49)) == (49.0, content_hash('card 49'), 1049.0)
+    index.close()
+
+
+def test_damaged_table_is_rebuilt_from_the_journal(directory):
+    fill(directory, 50)
+    with open(os.path.join(directory, 'listings.idx'), 'r+b') as table:
+        table.write(b'\x00' * 8)
+    
+    index = open_index(directory)
+    assert len(index) == 50
+    index.close()
+
+
+def test_records_missing_from_the_table_are_replayed(directory):
+    fill(directory, 20)
+    table_path = os.path.join(directory, 'listings.idx')
+    with open(table_path, 'rb') as table:
+        saved_table = table.read()
+    
+    # Records appended after the table was last written, as after a crash
+    fill(directory, 5, start=20)
+    with open(table_path, 'wb') as table:
+        table.write(saved_table)
+    
+    index = open_index(directory)
+    assert len(index) == 25
+    assert index.get(key(24)) == (24.0, content_hash('card 24'), 1024.0)
+    index.close()
+
+
+def test_journal_is_compacted_on_close(directory):
+    index = open_index(directory)
+    for version in range(MAX_RECORDS_PER_LISTING + 1):
+        for number in range(MIN_CAPACITY):
+            index.put(key(number), float(version), 1, 0.0)
+    index.close()
+    
+    assert os.path.getsize(os.path.join(directory, 'listings.log')) == MIN_CAPACITY * RECORD_DTYPE.itemsize
+    index = open_index(directory)
+    assert len(index) == MIN_CAPACITY
+    assert index.get(key(0))[0] == float(MAX_RECORDS_PER_LISTING)
+    index.close()
@@ -0,0 +1,134 @@
+"""
+Tests for keyset pagination and the page size of the paginated endpoints.
+"""
+
+import pytest
+from bson import ObjectId
+from api.utils.fake_db import FakeDB
+from api.utils.pagination import (MAX_PAGE_SIZE, encode_cursor, decode_cursor, check_page_size,
+                                  keyset_filter, apply_cursor)
+
+SORT = [('price', -1), ('_id', 1)]
+
+
+@pytest.fixture
+def collection():
+    """Collection with repeated prices, so pages split ties on the _id"""
+    collection = FakeDB()['properties']
+    collection.insert_many([{'_id': ObjectId(), 'price': float(price)} for price in [300, 200, 200, 200, 100, 100, 50]])
+    return collection
+
+
+def read_pages(collection, limit):
+    """Read every page of the collection following the continuation tokens"""
+    pages = []
+    token = None
+    while True:
+        documents = list(collection.find(apply_cursor({}, SORT, token)).sort(SORT).limit(limit))
+        if not documents:
+            return pages
+        pages.append(documents)
+        token = encode_cursor(SORT, documents[-1])
+
+
+def test_cursor_round_trip():
+    document = {'_id': ObjectId(), 'price': 250000.0}
+    assert decode_cursor(SORT, encode_cursor(SORT, document)) == [250000.0, document['_id']]
+
+
+@pytest.mark.parametrize('token', ['', 'not a cursor', encode_cursor([('price', -1)], {'price': 1})])
+def test_decode_cursor_rejects_malformed_tokens(token):
+    with pytest.raises(ValueError):
+        decode_cursor(SORT, token)
+
+
+def test_keyset_filter():
+    assert keyset_filter([('price', 1)], [10]) == {'price': {'$gt': 10}}
+    assert keyset_filter(SORT, [10, 'a']) == {'$or': [
+        {'price': {'$lt': 10}},
+        {'price': 10, '_id': {'$gt': 'a'}}
+    ]}
+
+
+def test_apply_cursor_without_token_keeps_the_filter():
+    assert apply_cursor({'city': 'madrid'}, SORT, None) == {'city': 'madrid'}
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 7, 10])
+def test_pages_cover_every_document_once(collection, limit):
+    pages = read_pages(collection, limit)
+    ids = [document['_id'] for page in pages for document in page]
+    expected = [document['_id'] for document in collection.find().sort(SORT)]
+    
+    assert ids == expected
+    assert all(len(page) == limit for page in pages[:-1])
+
+
+@pytest.mark.parametrize('limit', [1, 50, MAX_PAGE_SIZE])
+def test_check_page_size_accepts_limits_in_range(limit):
+    assert check_page_size(limit) == limit
+
+
+@pytest.mark.parametrize('limit', [0, -1, MAX_PAGE_SIZE + 1])
+def test_check_page_size_rejects_limits_out_of_range(limit):
+    with pytest.raises(ValueError):
+        check_page_size(limit)
+
+
+@pytest.mark.parametrize('limit', [None, 0, 1, MAX_PAGE_SIZE + 1])
+def test_check_page_size_streaming_has_no_maximum(limit):
+    assert check_page_size(limit, streaming=True) == limit
+
+
+def test_check_page_size_streaming_rejects_negative_limits():
+    with pytest.raises(ValueError):
+        check_page_size(-1, streaming=True)
+
+
+@pytest.fixture(scope='module')
+def client():
+    """Test client of the Flask app on the in-memory database"""
+    from api.app import app
+    from api.utils.db import get_db_connection
+    
+    properties = get_db_connection()['properties']
+    properties.delete_many({})
+    properties.insert_many([
+        {'id': str(i), 'source': 'idealista', 'city': 'madrid', 'price': 100000.0 + i * 1000,
+         'investment_score': 80.0, 'operation_type': 'sale'}
+        for i in range(12)
+    ])
+    return app.test_client()
+
+
+@pytest.mark.parametrize('url', [
+    '/api/properties?limit=0',
+    '/api/properties?limit=-1',
+    f'/api/properties?limit={MAX_PAGE_SIZE + 1}',
+    '/api/properties?limit=-1&stream=1',
+    '/api/investment/opportunities?limit=0',
+    '/api/investment/opportunities?limit=-1',
+    '/api/properties?cursor=not-a-cursor'
+])
+def test_endpoints_reject_invalid_pages(client, url):
+    response = client.get(url)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_endpoint_pages_follow_the_link_header(client):
+    response = client.get('/api/properties?limit=5')
+    ids = [item['id'] for item in response.get_json()]
+    while 'Link' in response.headers:
+        next_url = response.headers['Link'].split('>')[0].lstrip('<')
+        response = client.get(next_url)
+        ids.extend(item['id'] for item in response.get_json())
+    
+    assert sorted(ids, key=int) == [str(i) for i in range(12)]
+    assert len(set(ids)) == 12
+
+
+def test_endpoint_streams_every_document_with_limit_zero(client):
+    response = client.get('/api/properties?limit=0&stream=1')
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).count('\n') == 12
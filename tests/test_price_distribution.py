@@ -0,0 +1,84 @@
+"""
+Tests for the ranks and quantiles of per-segment price distributions.
+"""
+
+import numpy as np
+import pytest
+from api.utils.fake_db import FakeDB
+from api.utils.price_distribution import PriceDistribution
+from api.services.area_stats_service import AreaStatsService
+
+
+@pytest.fixture
+def distribution():
+    return PriceDistribution(np.array([3000.0, 1000.0, 2000.0, 2000.0, 4000.0]))
+
+
+def test_values_are_sorted(distribution):
+    assert distribution.values.tolist() == [1000.0, 2000.0, 2000.0, 3000.0, 4000.0]
+    assert len(distribution) == 5
+
+
+@pytest.mark.parametrize('value, expected', [
+    (500.0, (0, 0)),
+    (1000.0, (0, 1)),
+    (1500.0, (1, 0)),
+    (2000.0, (1, 2)),
+    (4000.0, (4, 1)),
+    (5000.0, (5, 0))
+])
+def test_rank(distribution, value, expected):
+    assert distribution.rank(value) == expected
+
+
+@pytest.mark.parametrize('value, expected', [
+    (500.0, 0.0),
+    (1000.0, 10.0),
+    (2000.0, 40.0),
+    (2500.0, 60.0),
+    (5000.0, 100.0)
+])
+def test_percentile_counts_ties_as_half_below(distribution, value, expected):
+    assert distribution.percentile(value) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('q', [0, 0.1, 0.25, 0.5, 0.75, 0.9, 1])
+def test_quantile_matches_linear_interpolation(distribution, q):
+    assert distribution.quantile(q) == pytest.approx(np.quantile(distribution.values, q))
+
+
+def test_single_listing():
+    distribution = PriceDistribution(np.array([2500.0]))
+    assert distribution.quantile(0.5) == 2500.0
+    assert distribution.percentile(2500.0) == 50.0
+
+
+def test_summary(distribution):
+    assert distribution.summary() == {
+        'median_price_per_sqm': 2000.0,
+        'q1_price_per_sqm': 2000.0,
+        'q3_price_per_sqm': 3000.0,
+        'iqr_price_per_sqm': 1000.0,
+        'p10_price_per_sqm': 1400.0,
+        'p90_price_per_sqm': pytest.approx(3600.0),
+        'count': 5
+    }
+
+
+def test_area_stats_keep_the_segment_distributions():
+    db = FakeDB()
+    db['properties'].insert_many([
+        {'city': 'madrid', 'neighborhood': neighborhood, 'property_type': 'apartment',
+         'operation_type': 'sale', 'price_per_sqm': price}
+        for neighborhood, price in [('Centro', 3000.0), ('Centro', 1000.0), ('Retiro', 2000.0), ('Retiro', None)]
+    ])
+    service = AreaStatsService(db)
+    service.rebuild()
+    
+    centro = service.get_price_distribution('madrid', 'Centro', 'apartment', 'sale')
+    city = service.get_price_distribution('madrid', None, 'apartment', 'sale')
+    assert centro.values.tolist() == [1000.0, 3000.0]
+    assert city.values.tolist() == [1000.0, 2000.0, 3000.0]
+    # Levels without a property type or operation type are not ranked against
+    assert service.get_price_distribution('madrid', None, None, 'sale') is None
+    assert service.get_price_distribution('madrid', 'Retiro', 'house', 'sale') is None
@@ -0,0 +1,79 @@
+"""
+Tests for the bulk computation of investment scores.
+"""
+
+import numpy as np
+import pytest
+from api.utils.fake_db import FakeDB
+from api.services.scoring_service import ScoringService
+
+
+def listing(number, price_per_sqm, operation_type='sale', neighborhood='Centro', size=100.0, **fields):
+    """Property document with only the fields needed by the price gap component"""
+    return {
+        '_id': number, 'city': 'madrid', 'neighborhood': neighborhood, 'property_type': 'apartment',
+        'operation_type': operation_type, 'size': size, 'price': price_per_sqm * size,
+        'price_per_sqm': price_per_sqm, **fields
+    }
+
+
+@pytest.fixture
+def sales():
+    """Five sales in one segment, averaging 3000 per square meter"""
+    return [listing(number, price) for number, price in enumerate([2000.0, 2500.0, 3000.0, 3500.0, 4000.0])]
+
+
+@pytest.fixture
+def service():
+    return ScoringService(db=FakeDB())
+
+
+def test_price_gap_to_the_segment_average(service, sales):
+    scores = service.compute_scores(sales)
+    assert scores == pytest.approx([100.0, 77.78, 50.0, 22.22, 0.0], abs=0.01)
+
+
+def test_small_segment_falls_back_to_the_city(service, sales):
+    documents = sales + [listing(5, 3000.0, neighborhood='Retiro')]
+    scores = service.compute_scores(documents)
+    
+    # The Retiro listing is compared with the 3000 average of every sale in the city
+    assert scores[5] == pytest.approx(50.0)
+
+
+def test_too_few_listings_get_no_score(service, sales):
+    assert np.isnan(service.compute_scores(sales[:4])).all()
+
+
+def test_listing_without_price_per_sqm_gets_no_score(service, sales):
+    unknown_size = listing(5, 2500.0)
+    del unknown_size['size'], unknown_size['price_per_sqm']
+    documents = sales + [unknown_size]
+    scores = service.compute_scores(documents)
+    
+    assert np.isnan(scores[5])
+    assert np.isfinite(scores[:5]).all()
+
+
+def test_weighted_average_of_the_components(service, sales):
+    rents = [listing(10 + number, 15.0, operation_type='rent') for number in range(5)]
+    subject = listing(20, 3000.0, condition='new', days_listed=90, price_history=[{'price': 375000.0}])
+    scores = service.compute_scores(sales + rents + [subject])
+    
+    # Price gap 0.5, rental yield 6% (0.67), price drop 20% (1), half of the
+    # time on market (0.5) and a new property (1)
+    expected = (0.40 * 0.5 + 0.25 * (0.06 - 0.02) / 0.06 + 0.15 * 1 + 0.10 * 0.5 + 0.10 * 1) * 100
+    assert scores[-1] == pytest.approx(expected, abs=0.01)
+    
+    # Rentals are compared with rentals and have no rental yield
+    assert scores[5:10] == pytest.approx([50.0] * 5)
+
+
+def test_rescore_stores_changed_scores(service, sales):
+    collection = service.db['properties']
+    collection.insert_many(sales)
+    
+    assert service.rescore(cities=['madrid']) == 5
+    assert [document['investment_score'] for document in collection.find().sort('_id', 1)] == \
+        pytest.approx([100.0, 77.78, 50.0, 22.22, 0.0], abs=0.01)
+    assert service.rescore(cities=['madrid']) == 0
@@ -0,0 +1,160 @@
+"""
+Tests for the shard planning, balancing, stats merging and checkpoints of sharded crawls.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+import pytest
+import sharding
+from sharding import Shard, ShardedCrawl, plan_shards, balance_shards, merge_stats, PAGES_STAT, RUN_FILE
+
+
+class IdealistaSpider:
+    name = 'idealista'
+    cities = ['madrid', 'barcelona']
+    search_paths = {'sale': '/venta-viviendas/', 'rent': '/alquiler-viviendas/'}
+
+
+class FotocasaSpider:
+    name = 'fotocasa'
+    cities = ['madrid']
+    search_paths = {'sale': '/comprar/viviendas/'}
+
+
+SPIDERS = [IdealistaSpider, FotocasaSpider]
+
+
+class FakeRunner:
+    """Crawl runner that finishes every shard at once, except the ones told to fail"""
+    
+    failing = set()
+    crawled = []
+    
+    def __init__(self, concurrency=None):
+        self.lock = threading.Lock()
+    
+    def crawl_spider(self, spider_class, spider_kwargs=None, settings=None):
+        shard = Shard(spider_class.name, spider_kwargs['cities'][0], spider_kwargs['operation_types'][0])
+        with self.lock:
+            FakeRunner.crawled.append(shard.key)
+        os.makedirs(settings['JOBDIR'], exist_ok=True)
+        
+        if shard.key in FakeRunner.failing:
+            return {'finish_reason': 'shutdown'}
+        return {'finish_reason': 'finished', PAGES_STAT: 10, 'item_scraped_count': 3,
+                'start_time': datetime(2024, 1, 1, 1, 0), 'finish_time': datetime(2024, 1, 1, 1, 5)}
+    
+    def stop(self):
+        pass
+
+
+@pytest.fixture
+def crawl(tmp_path, monkeypatch):
+    """Sharded crawl in this process with the fake runner"""
+    monkeypatch.setattr(sharding, 'CrawlRunner', FakeRunner)
+    FakeRunner.failing = set()
+    FakeRunner.crawled = []
+    return ShardedCrawl(workers=1, state_dir=str(tmp_path))
+
+
+def test_plan_shards():
+    assert [shard.key for shard in plan_shards(SPIDERS)] == [
+        'idealista-madrid-sale', 'idealista-madrid-rent', 'idealista-barcelona-sale',
+        'idealista-barcelona-rent', 'fotocasa-madrid-sale'
+    ]
+
+
+def test_balance_shards_assigns_the_largest_to_the_least_loaded():
+    shards = [Shard('s', city, 'sale') for city in 'abcdef']
+    pages = {'s-a-sale': 100, 's-b-sale': 60, 's-c-sale': 50, 's-d-sale': 40, 's-e-sale': 30}
+    bins = balance_shards(shards, pages, 2)
+    
+    # f has no page count and weighs as the average shard (56)
+    assert [[shard.city for shard in assigned] for assigned in bins] == [['a', 'c', 'e'], ['b', 'f', 'd']]
+
+
+def test_balance_shards_leaves_no_idle_workers():
+    shards = [Shard('s', city, 'sale') for city in 'ab']
+    assert len(balance_shards(shards, {}, 8)) == 2
+    assert balance_shards([], {}, 4) == []
+
+
+def test_merge_stats():
+    merged = merge_stats([
+        {'item_scraped_count': 3, 'elapsed_time_seconds': 10.0, 'finish_reason': 'finished',
+         'start_time': '2024-01-01T01:00:00', 'finish_time': '2024-01-01T01:05:00', 'log_count/ERROR': 1},
+        {'item_scraped_count': 4, 'elapsed_time_seconds': 30.0, 'finish_reason': 'finished',
+         'start_time': '2024-01-01T00:59:00', 'finish_time': '2024-01-01T01:02:00', 'flag': True},
+        {'item_scraped_count': 1, 'elapsed_time_seconds': 5.0, 'finish_reason': 'shutdown'}
+    ])
+    assert merged == {
+        'item_scraped_count': 8,
+        'elapsed_time_seconds': 30.0,
+        'finish_reason_count/finished': 2,
+        'finish_reason_count/shutdown': 1,
+        'start_time': '2024-01-01T00:59:00',
+        'finish_time': '2024-01-01T01:05:00',
+        'log_count/ERROR': 1
+    }
+
+
+def test_crawl_checkpoints_every_shard(crawl):
+    result = crawl.crawl(SPIDERS)
+    
+    assert result['missing'] == []
+    assert sorted(FakeRunner.crawled) == sorted(shard.key for shard in plan_shards(SPIDERS))
+    assert result['stats']['item_scraped_count'] == 15
+    assert result['stats']['finish_reason_count/finished'] == 5
+    
+    with open(os.path.join(crawl.state_dir, 'shards', 'fotocasa-madrid-sale.json')) as file:
+        checkpoint = json.load(file)
+    assert checkpoint['run_id'] == result['run_id']
+    assert checkpoint['pages'] == 10
+    assert os.listdir(os.path.join(crawl.state_dir, 'jobs')) == []
+
+
+def test_interrupted_run_resumes_the_missing_shards(crawl):
+    FakeRunner.failing = {'idealista-barcelona-rent'}
+    first = crawl.crawl(SPIDERS)
+    assert first['missing'] == ['idealista-barcelona-rent']
+    assert os.listdir(os.path.join(crawl.state_dir, 'jobs')) == ['idealista-barcelona-rent']
+    
+    FakeRunner.failing = set()
+    FakeRunner.crawled = []
+    second = crawl.crawl(SPIDERS)
+    
+    assert second['run_id'] == first['run_id']
+    assert second['missing'] == []
+    assert FakeRunner.crawled == ['idealista-barcelona-rent']
+    assert second['stats']['item_scraped_count'] == 15
+
+
+def test_finished_run_starts_a_new_run(crawl):
+    first = crawl.crawl(SPIDERS)
+    FakeRunner.crawled = []
+    second = crawl.crawl(SPIDERS)
+    
+    assert second['run_id'] != first['run_id']
+    assert len(FakeRunner.crawled) == 5
+
+
+def test_expired_run_is_started_over(crawl):
+    FakeRunner.failing = {'idealista-barcelona-rent'}
+    first = crawl.crawl(SPIDERS)
+    
+    run_path = os.path.join(crawl.state_dir, RUN_FILE)
+    with open(run_path) as file:
+        run = json.load(file)
+    run['started_at'] = (datetime.now() - crawl.max_run_age - timedelta(minutes=1)).isoformat()
+    with open(run_path, 'w') as file:
+        json.dump(run, file)
+    
+    FakeRunner.failing = set()
+    FakeRunner.crawled = []
+    second = crawl.crawl(SPIDERS)
+    
+    assert second['run_id'] != first['run_id']
+    assert len(FakeRunner.crawled) == 5
+    assert second['missing'] == []